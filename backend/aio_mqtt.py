@@ -0,0 +1,222 @@
+"""
+asyncio 原生的 MQTT 3.1.1 订阅客户端：供单事件循环模式（aio_service.py）使用
+
+- 收发都在调用方的事件循环中完成，没有 paho 的网络线程，回调直接在事件循环中执行；
+  不使用 select()，连接数不受 1024 个文件描述符的限制
+- 只实现订阅端用到的部分：CONNECT（用户名密码、clean session）/ SUBSCRIBE / 接收 PUBLISH
+  （QoS 0/1/2，按协议回复确认）/ 定时 PINGREQ / DISCONNECT；断线后每 reconnect_delay 秒重连
+- pause() / resume() 暂停 / 恢复读取：暂停期间不再调用 on_message，未读的报文留在 TCP 缓冲，
+  由流控向 broker 施加背压；PINGREQ 照常发送，连接不会因 keepalive 超时断开
+- 报文编解码与本地 broker 替身（broker.py）共用
+"""
+import time
+import struct
+import asyncio
+
+from broker import (packet, encode_string, read_string, read_packet, CONNECT, CONNACK,
+                    PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP, SUBSCRIBE, SUBACK,
+                    PINGREQ, DISCONNECT)
+from logs import get_logger
+
+log = get_logger("aio_mqtt")
+
+
+class MQTTError(Exception):
+    pass
+
+
+class AsyncMQTTClient:
+    """
+    on_message(topic, payload) 在事件循环中逐条调用，payload 为 bytes；
+    on_connect() / on_disconnect(error) 在连接建立 / 断开时调用
+    """
+
+    def __init__(self, host, port, filters, on_message, username=None, password=None,
+                 client_id="", keepalive=60, reconnect_delay=3.0,
+                 on_connect=None, on_disconnect=None):
+        self.host = host
+        self.port = int(port)
+        self.filters = list(filters)
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.username = username
+        self.password = password
+        self.client_id = client_id
+        self.keepalive = int(keepalive)
+        self.reconnect_delay = float(reconnect_delay)
+
+        self.connected = False
+        self.error = None
+        self._writer = None
+        self._task = None
+        self._stopping = False
+        self._packet_id = 0
+        # pause() 可以嵌套（写队列背压、重建分析状态各自暂停），全部 resume() 后才恢复读取
+        self._pauses = 0
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+
+        self.received = 0
+        self.reconnects = 0
+        self.paused_seconds = 0.0
+        self._paused_at = None
+
+    # ========================
+    # 报文
+    # ========================
+    def _next_id(self):
+        self._packet_id = self._packet_id % 0xFFFF + 1
+        return self._packet_id
+
+    def _connect_packet(self):
+        flags = 0x02    # clean session
+        payload = encode_string(self.client_id)
+        if self.username:
+            flags |= 0x80
+            payload += encode_string(self.username)
+            if self.password:
+                flags |= 0x40
+                payload += encode_string(self.password)
+        body = encode_string("MQTT") + bytes([4, flags]) + struct.pack("!H", self.keepalive)
+        return packet(CONNECT, body + payload)
+
+    def _subscribe_packet(self):
+        body = struct.pack("!H", self._next_id())
+        for topic_filter in self.filters:
+            body += encode_string(topic_filter) + b"\x00"
+        return packet(SUBSCRIBE, body, flags=0x02)
+
+    # ========================
+    # 连接
+    # ========================
+    async def _session(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        self._writer = writer
+        pinger = None
+        try:
+            writer.write(self._connect_packet())
+            await writer.drain()
+            kind, _, body = await asyncio.wait_for(read_packet(reader), self.keepalive or None)
+            if kind != CONNACK or len(body) < 2:
+                raise MQTTError("未收到 CONNACK")
+            if body[1] != 0:
+                raise MQTTError(f"rc={body[1]}")
+            writer.write(self._subscribe_packet())
+            await writer.drain()
+
+            self.connected = True
+            self.error = None
+            if self.on_connect is not None:
+                self.on_connect()
+            if self.keepalive:
+                pinger = asyncio.ensure_future(self._ping(writer))
+
+            while True:
+                kind, flags, body = await read_packet(reader)
+                if not self._resumed.is_set():
+                    # 已读出的这一条等恢复后再处理，其余留在 TCP 缓冲
+                    await self._resumed.wait()
+                if kind == PUBLISH:
+                    qos = flags >> 1 & 0x03
+                    topic, offset = read_string(body, 0)
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                        writer.write(packet(PUBACK if qos == 1 else PUBREC, packet_id))
+                    self.received += 1
+                    self.on_message(topic, body[offset:])
+                elif kind == PUBREL:
+                    writer.write(packet(PUBCOMP, body[:2]))
+                elif kind == SUBACK and 0x80 in body[2:]:
+                    log.warning("部分主题订阅被 broker 拒绝: %s", self.filters)
+                # 读取下一条报文之前等待发送缓冲，避免确认报文无限堆积
+                if writer.transport.get_write_buffer_size():
+                    await writer.drain()
+        finally:
+            if pinger is not None:
+                pinger.cancel()
+            self.connected = False
+            self._writer = None
+            writer.close()
+
+    async def _ping(self, writer):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            writer.write(packet(PINGREQ))
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await self._session()
+            except asyncio.CancelledError:
+                raise
+            except asyncio.IncompleteReadError:
+                self.error = "连接被 broker 关闭"
+            except (OSError, asyncio.TimeoutError, struct.error, UnicodeDecodeError,
+                    MQTTError) as e:
+                self.error = str(e) or type(e).__name__
+            if self._stopping:
+                break
+            if self.on_disconnect is not None:
+                self.on_disconnect(self.error)
+            log.info("MQTT 连接断开（%s），%g 秒后重连", self.error, self.reconnect_delay)
+            await asyncio.sleep(self.reconnect_delay)
+            self.reconnects += 1
+
+    # ========================
+    # 流控
+    # ========================
+    def pause(self):
+        """暂停读取，须在事件循环中调用；返回后直到 resume() 之前不会再调用 on_message"""
+        self._pauses += 1
+        if self._pauses == 1:
+            self._resumed.clear()
+            self._paused_at = time.monotonic()
+
+    def resume(self):
+        if self._pauses == 0:
+            return
+        self._pauses -= 1
+        if self._pauses == 0:
+            self.paused_seconds += time.monotonic() - self._paused_at
+            self._paused_at = None
+            self._resumed.set()
+
+    @property
+    def paused(self):
+        return self._pauses > 0
+
+    # ========================
+    # 生命周期
+    # ========================
+    def start(self):
+        """在当前事件循环中启动连接任务（断线自动重连），须在事件循环中调用"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """发送 DISCONNECT 并关闭连接，不再重连"""
+        self._stopping = True
+        writer = self._writer
+        if writer is not None and not writer.is_closing():
+            writer.write(packet(DISCONNECT))
+            try:
+                await asyncio.wait_for(writer.drain(), 1.0)
+            except (OSError, asyncio.TimeoutError):
+                pass
+            writer.close()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        self.connected = False
+
+    def stats(self):
+        return {"connected": self.connected, "received": self.received,
+                "reconnects": self.reconnects, "error": self.error, "paused": self.paused,
+                "paused_seconds": round(self.paused_seconds, 3)}
@@ -0,0 +1,449 @@
+"""
+单事件循环的订阅服务：MQTT、WebSocket 与 REST API 运行在同一个 asyncio 事件循环中
+
+    python backend/aio_service.py                                  # 内置的 HTTP/1.1 服务器
+    uvicorn aio_service:app --app-dir backend --port 5001         # 或交给任意 ASGI 服务器（需另行安装）
+
+与 subscribe.py 的区别：
+- MQTT 由 aio_mqtt.AsyncMQTTClient 在事件循环中接收，消息直接在事件循环中解码、去重、更新分析状态
+  并推送给 WebSocket 客户端；没有 paho 网络线程、流水线线程，也没有 run_coroutine_threadsafe 跨线程投递
+- 写入存储仍由写线程成批完成。事件循环中放入写队列不等待：写队列超过 WRITER_HIGH_WATER 时暂停读取
+  MQTT（未读的报文留在 TCP 缓冲，由流控向 broker 施加背压），降到 WRITER_LOW_WATER 以下再恢复；
+  仍然放不下的数据计入写线程的 dropped
+- 分析快照、传感器快照与预聚合由定时任务每 ANALYTICS_SNAPSHOT_INTERVAL 秒在线程池中写入；
+  保留期删除数据后需要从存储重建分析状态时，先暂停读取 MQTT，在线程池中落盘并重建后再恢复。
+  事件循环中只剩解码、去重、增量更新内存中的状态与推送
+- 启动时读取存储、重建状态在接受连接之前完成，会阻塞事件循环；停止时的落盘在线程池中执行
+- REST API（/api/connect、/api/status、/api/history、/metrics 等）与 subscribe.py 相同，由 ASGI 应用 app 提供；
+  WebSocket 仍在 WEBSOCKET_PORT 上，客户端无需改动
+- 不使用 select()，连接数不受 1024 个文件描述符的限制（仍受 ulimit -n 限制）
+- 只支持单进程；SUBSCRIBE_WORKERS 大于 1 时使用 subscribe.py
+"""
+import json
+import time
+import signal
+import asyncio
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote
+
+import websockets
+
+from config import Config
+from aio_mqtt import AsyncMQTTClient
+from logs import get_logger
+import metrics
+import subscribe as sub
+
+log = get_logger("aio_service")
+
+# 空闲的 HTTP keep-alive 连接保留的秒数
+KEEPALIVE_TIMEOUT = 75.0
+# 写队列占用超过 WRITER_HIGH_WATER 时暂停读取 MQTT，降到 WRITER_LOW_WATER 以下恢复（占队列长度的比例）
+WRITER_HIGH_WATER = 0.8
+WRITER_LOW_WATER = 0.5
+WRITER_POLL_INTERVAL = 0.01
+
+mqtt_client = None
+ws_server = None
+persist_task = None
+backpressure_task = None
+# 定时保存与断开 / 停止时的落盘不能同时进行
+persist_lock = None
+
+BACKPRESSURE_PAUSES = metrics.counter(
+    "iot_aio_backpressure_pauses_total", "单事件循环模式下因写队列接近满而暂停读取 MQTT 的次数")
+
+
+# ========================
+# MQTT
+# ========================
+def on_message(topic, payload):
+    sub.RECEIVED.inc()
+    sub.decode_stage.call((topic, payload, time.time()))
+    writer = sub.csv_writer
+    if backpressure_task is None and \
+            writer.queue.qsize() >= writer.queue.maxsize * WRITER_HIGH_WATER:
+        start_backpressure()
+
+
+def start_backpressure():
+    global backpressure_task
+    client = mqtt_client
+    if client is None:
+        return
+    # 立即暂停：缓冲中已到达的报文不会等到后台任务开始运行才停止解码
+    client.pause()
+    BACKPRESSURE_PAUSES.inc()
+    log.warning("写队列已有 %d 条，暂停读取 MQTT", sub.csv_writer.queue.qsize())
+    backpressure_task = asyncio.ensure_future(wait_writer(client))
+
+
+async def wait_writer(client):
+    """写队列降到低水位以下后恢复读取 MQTT（start_backpressure 已暂停）"""
+    global backpressure_task
+    queue = sub.csv_writer.queue
+    try:
+        while queue.qsize() > queue.maxsize * WRITER_LOW_WATER:
+            await asyncio.sleep(WRITER_POLL_INTERVAL)
+    finally:
+        client.resume()
+        backpressure_task = None
+    log.info("写队列已降到 %d 条，恢复读取 MQTT", queue.qsize())
+
+
+def on_connect():
+    sub.mqtt_status["connected"] = True
+    sub.mqtt_status["error"] = None
+    log.info("MQTT 连接成功")
+
+
+def on_disconnect(error):
+    sub.mqtt_status["connected"] = False
+    sub.mqtt_status["error"] = error
+
+
+def connect_mqtt():
+    global mqtt_client
+    if mqtt_client is not None:
+        return
+    mqtt_client = AsyncMQTTClient(
+        sub.BROKER, sub.PORT, sub.subscription_filters, on_message,
+        username=sub.USERNAME, password=sub.PASSWORD,
+        on_connect=on_connect, on_disconnect=on_disconnect)
+    mqtt_client.start()
+
+
+def _flush():
+    sub.csv_writer.flush()
+    sub.persist_state(force=True)
+
+
+async def disconnect_mqtt():
+    global mqtt_client, backpressure_task
+    client, mqtt_client = mqtt_client, None
+    if backpressure_task is not None:
+        backpressure_task.cancel()
+        backpressure_task = None
+    if client is not None:
+        await client.stop()
+    sub.mqtt_status["connected"] = False
+    # 等待写线程落盘、写快照是阻塞操作，放到线程池中执行
+    async with persist_lock:
+        await asyncio.to_thread(_flush)
+
+
+# ========================
+# 定时保存
+# ========================
+async def persist_state():
+    """在线程池中保存快照与预聚合；需要重建分析状态时暂停读取 MQTT，重建期间没有并发的解码"""
+    async with persist_lock:
+        if not await asyncio.to_thread(sub.persist_state, False, False):
+            return
+        client = mqtt_client
+        if client is not None:
+            client.pause()
+        try:
+            log.info("存储已删除数据，暂停读取 MQTT 并重建分析状态")
+            await asyncio.to_thread(_flush)
+        finally:
+            if client is not None:
+                client.resume()
+
+
+async def persist_loop():
+    while True:
+        await asyncio.sleep(Config.ANALYTICS_SNAPSHOT_INTERVAL)
+        try:
+            await persist_state()
+        except Exception as e:
+            log.error("定时保存失败: %s", e)
+
+
+# ========================
+# 生命周期
+# ========================
+async def startup():
+    global ws_server, persist_task, persist_lock
+    if Config.SUBSCRIBE_WORKERS > 1:
+        raise RuntimeError("单事件循环模式只支持单进程，SUBSCRIBE_WORKERS 大于 1 时请使用 subscribe.py")
+    sub.use_event_loop(asyncio.get_running_loop())
+    # 读取存储、重建状态是一次性的阻塞操作，在接受连接之前完成
+    sub.restore_state()
+    sub.start_pipeline()
+    persist_lock = asyncio.Lock()
+    persist_task = asyncio.ensure_future(persist_loop())
+    ws_server = await websockets.serve(
+        sub.ws_handler, "0.0.0.0", Config.WEBSOCKET_PORT,
+        compression="deflate" if Config.WS_COMPRESSION else None)
+    log.info("WebSocket 运行于 ws://%s:%s", Config.WEBSOCKET_HOST, Config.WEBSOCKET_PORT)
+    connect_mqtt()
+
+
+async def shutdown():
+    global ws_server, persist_task
+    if persist_task is not None:
+        # 等正在进行的保存完成后再取消：取消只会中断等待，线程池中的写盘仍在继续
+        async with persist_lock:
+            persist_task.cancel()
+        try:
+            await persist_task
+        except asyncio.CancelledError:
+            pass
+        persist_task = None
+    await disconnect_mqtt()
+    if ws_server is not None:
+        ws_server.close()
+        await ws_server.wait_closed()
+        ws_server = None
+    await asyncio.to_thread(sub.stop_pipeline)
+
+
+# ========================
+# REST API（与 subscribe_bp 相同）
+# ========================
+def _default(value):
+    # NumPy 标量等
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+def json_response(body, status=200):
+    return status, "application/json", \
+        json.dumps(body, ensure_ascii=False, default=_default).encode("utf-8")
+
+
+async def api_connect(params):
+    connect_mqtt()
+    return json_response({"msg": "connected", "status": sub.mqtt_status})
+
+
+async def api_disconnect(params):
+    await disconnect_mqtt()
+    return json_response({"msg": "disconnected"})
+
+
+async def api_status(params):
+    return json_response(sub.status())
+
+
+async def api_ws(params):
+    return json_response(sub.ws_hub.stats())
+
+
+async def api_pipeline(params):
+    stats = sub.pipeline_stats()
+    stats["mqtt"] = mqtt_client.stats() if mqtt_client is not None else None
+    return json_response(stats)
+
+
+async def api_history(params):
+    return json_response(*sub.query_history(params))
+
+
+async def api_alerts(params):
+    return json_response(*sub.query_alerts(params))
+
+
+async def api_metrics(params):
+    return 200, metrics.CONTENT_TYPE, metrics.REGISTRY.render().encode("utf-8")
+
+
+ROUTES = {
+    ("POST", "/api/connect"): api_connect,
+    ("POST", "/api/disconnect"): api_disconnect,
+    ("GET", "/api/status"): api_status,
+    ("GET", "/api/ws"): api_ws,
+    ("GET", "/api/pipeline"): api_pipeline,
+    ("GET", "/api/history"): api_history,
+    ("GET", "/api/alerts"): api_alerts,
+    ("GET", "/metrics"): api_metrics,
+}
+PATHS = {path for _, path in ROUTES}
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type, Authorization"),
+]
+
+
+# ========================
+# ASGI 应用
+# ========================
+async def app(scope, receive, send):
+    """ASGI 应用：lifespan 启动 / 停止整个服务（MQTT、WebSocket、存储），http 按 ROUTES 分发"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http":
+        await handle_http(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def handle_http(scope, receive, send):
+    # 接口都不需要请求体，读完丢弃
+    while (await receive()).get("more_body"):
+        pass
+
+    params = {}
+    for key, value in parse_qsl(scope.get("query_string", b"").decode("latin-1"),
+                                keep_blank_values=True):
+        # 与 Flask 的 request.args.get 相同，同名参数取第一个
+        params.setdefault(key, value)
+
+    method, path = scope["method"], scope["path"]
+    if method == "OPTIONS" and path in PATHS:
+        status, content_type, body = 204, None, b""
+    else:
+        handler = ROUTES.get((method, path))
+        if handler is None:
+            status, content_type, body = json_response(
+                {"error": "Method Not Allowed" if path in PATHS else "Not Found"},
+                405 if path in PATHS else 404)
+        else:
+            try:
+                status, content_type, body = await handler(params)
+            except Exception as e:
+                log.error("%s %s 处理失败: %s", method, path, e)
+                status, content_type, body = json_response({"error": str(e)}, 500)
+
+    headers = list(CORS_HEADERS)
+    if content_type:
+        headers.append((b"content-type", content_type.encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+# ========================
+# 内置 HTTP/1.1 服务器（没有安装 ASGI 服务器时使用）
+# ========================
+async def _read_headers(reader):
+    headers = []
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers.append((name.strip().lower().encode("latin-1"),
+                        value.strip().encode("latin-1")))
+
+
+async def _write_response(writer, status, headers, body, keep_alive):
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ""
+    lines = [f"HTTP/1.1 {status} {reason}"]
+    lines += [f"{k.decode('latin-1')}: {v.decode('latin-1')}" for k, v in headers]
+    lines.append(f"content-length: {len(body)}")
+    lines.append("connection: " + ("keep-alive" if keep_alive else "close"))
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+async def _http_connection(asgi_app, reader, writer):
+    server = writer.get_extra_info("sockname")
+    client = writer.get_extra_info("peername")
+    try:
+        while True:
+            try:
+                line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            if not line.strip():
+                break
+            method, target, version = line.decode("latin-1").split()
+            headers = await _read_headers(reader)
+            fields = dict(headers)
+            if b"transfer-encoding" in fields:
+                # 接口都不需要请求体，不支持分块上传
+                await _write_response(writer, 501, [], b"", False)
+                break
+            length = int(fields.get(b"content-length", b"0"))
+            body = await reader.readexactly(length) if length else b""
+            keep_alive = version == "HTTP/1.1" and \
+                fields.get(b"connection", b"").lower() != b"close"
+
+            path, _, query = target.partition("?")
+            scope = {
+                "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"},
+                "http_version": version.partition("/")[2], "method": method.upper(),
+                "scheme": "http", "path": unquote(path), "raw_path": path.encode("latin-1"),
+                "query_string": query.encode("latin-1"), "root_path": "",
+                "headers": headers, "server": server, "client": client
+            }
+            request = {"type": "http.request", "body": body, "more_body": False}
+            response = {"status": 500, "headers": [], "body": []}
+
+            async def receive():
+                nonlocal request
+                message, request = request, {"type": "http.disconnect"}
+                return message
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    response["status"] = message["status"]
+                    response["headers"] = list(message.get("headers", ()))
+                elif message["type"] == "http.response.body":
+                    response["body"].append(message.get("body", b""))
+
+            await asgi_app(scope, receive, send)
+            await _write_response(writer, response["status"], response["headers"],
+                                  b"".join(response["body"]), keep_alive)
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_http(asgi_app, host, port):
+    return await asyncio.start_server(
+        lambda reader, writer: _http_connection(asgi_app, reader, writer), host, port)
+
+
+async def run():
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows 不支持，Ctrl+C 时 asyncio.run 会取消本任务，同样进入 finally
+            pass
+
+    await startup()
+    server = await serve_http(app, Config.SUBSCRIBE_SERVICE_HOST, Config.SUBSCRIBE_SERVICE_PORT)
+    log.info("REST API 运行于 http://%s:%s", Config.SUBSCRIBE_SERVICE_HOST,
+             Config.SUBSCRIBE_SERVICE_PORT)
+    log.info("单事件循环订阅服务已启动，按 Ctrl+C 停止服务")
+    try:
+        await stop.wait()
+    finally:
+        log.info("正在停止服务...")
+        server.close()
+        await shutdown()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,257 @@
+"""
+增量分析状态：订阅端每收到一条数据更新一次，/api/analyze 直接读取快照
+
+- 各指标的计数、均值、M2（Welford 算法）、最小值、最大值
+- 协矩（co-moment）矩阵，用于计算 Pearson 相关系数
+- 最近 ANALYTICS_WINDOW 个点的有序窗口，用于趋势、平滑与预测
+
+与 DataProcessor.process 一致，只统计三个指标都有效的样本；缺少指标的样本只计数，用于缺失率。
+订阅端定期把状态原子写入快照文件，分析服务（另一个进程）读取快照即可，代价与数据量无关。
+除全部数据的状态外，每个传感器还有各自的状态与快照，供按传感器分析使用。
+"""
+import os
+import json
+import time
+import bisect
+import threading
+
+import numpy as np
+
+from config import Config
+from segments import shard_name
+
+METRICS = ("temperature", "humidity", "pressure")
+SNAPSHOT_VERSION = 2
+
+
+def snapshot_path(worker=None):
+    """全部数据的快照；多进程订阅时每个 worker 一份（analytics-w<N>.json），读取时合并"""
+    data_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "data"))
+    path = os.path.join(data_dir, Config.ANALYTICS_SNAPSHOT)
+    if worker is None:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}-w{worker}{ext}"
+
+
+def sensor_snapshot_path(sensor_id):
+    """单个传感器的快照（data/analytics/s_<ID>.json）"""
+    data_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "data"))
+    return os.path.join(data_dir, Config.ANALYTICS_SENSOR_DIR, shard_name(sensor_id) + ".json")
+
+
+class RunningStats:
+    def __init__(self, window=None):
+        self.window = int(window or Config.ANALYTICS_WINDOW)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        k = len(METRICS)
+        self.n = 0
+        # 缺少任一指标（不计入统计）的样本数
+        self.incomplete = 0
+        self.mean = np.zeros(k)
+        # 协矩矩阵，对角线即各指标的 M2
+        self.comoment = np.zeros((k, k))
+        self.min = np.full(k, np.inf)
+        self.max = np.full(k, -np.inf)
+        self.first_ts = None
+        self.last_ts = None
+        self.recent = []
+        # 对应的存储 (id, 代次)，存储删除数据（保留期）后需要重建
+        self.engine = Config.STORAGE_ENGINE
+        self.store_id = None
+        self.generation = 0
+
+    # ========================
+    # 更新
+    # ========================
+    def update(self, sample):
+        """sample: 包含 timestamp 和各指标的字典；缺少任一指标的样本不计入"""
+        try:
+            x = np.array([float(sample.get(m)) for m in METRICS])
+        except (TypeError, ValueError):
+            x = None
+        if x is None or not np.all(np.isfinite(x)):
+            with self._lock:
+                self.incomplete += 1
+            return False
+        ts = str(sample.get("timestamp"))
+
+        with self._lock:
+            self.n += 1
+            delta = x - self.mean
+            self.mean += delta / self.n
+            self.comoment += np.outer(delta, x - self.mean)
+            np.minimum(self.min, x, out=self.min)
+            np.maximum(self.max, x, out=self.max)
+            if self.first_ts is None or ts < self.first_ts:
+                self.first_ts = ts
+            if self.last_ts is None or ts > self.last_ts:
+                self.last_ts = ts
+            self._push_recent(ts, x.tolist())
+        return True
+
+    def _push_recent(self, ts, values):
+        # 窗口按时间排序，迟到的旧数据不会挤掉更新的点
+        if len(self.recent) >= self.window and ts < self.recent[0][0]:
+            return
+        bisect.insort(self.recent, (ts, values))
+        if len(self.recent) > self.window:
+            del self.recent[0]
+
+    def merge_arrays(self, timestamps, values):
+        """
+        批量合并（Chan 并行算法），用于启动时从存储重建。
+        timestamps: ISO 字符串序列；values: shape (n, 3)，按 METRICS 顺序
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(METRICS))
+        mask = np.all(np.isfinite(values), axis=1)
+        values = values[mask]
+        timestamps = np.asarray(timestamps)[mask]
+        m = len(values)
+        if m < len(mask):
+            with self._lock:
+                self.incomplete += len(mask) - m
+        if m == 0:
+            return
+
+        mean_b = values.mean(axis=0)
+        centered = values - mean_b
+        comoment_b = centered.T @ centered
+
+        with self._lock:
+            n = self.n + m
+            delta = mean_b - self.mean
+            self.comoment += comoment_b + np.outer(delta, delta) * self.n * m / n
+            self.mean += delta * m / n
+            self.n = n
+            np.minimum(self.min, values.min(axis=0), out=self.min)
+            np.maximum(self.max, values.max(axis=0), out=self.max)
+
+            ts = [str(t) for t in timestamps]
+            first, last = min(ts), max(ts)
+            if self.first_ts is None or first < self.first_ts:
+                self.first_ts = first
+            if self.last_ts is None or last > self.last_ts:
+                self.last_ts = last
+            order = np.argsort(timestamps, kind="stable")[-self.window:]
+            for i in order:
+                self._push_recent(ts[i], values[i].tolist())
+
+    def merge(self, other):
+        """合并另一份状态（Chan 并行算法），用于汇总多进程订阅时各 worker 的快照"""
+        with self._lock:
+            self.incomplete += other.incomplete
+            if other.n == 0:
+                return
+            n = self.n + other.n
+            delta = other.mean - self.mean
+            self.comoment += other.comoment + np.outer(delta, delta) * self.n * other.n / n
+            self.mean += delta * other.n / n
+            self.n = n
+            np.minimum(self.min, other.min, out=self.min)
+            np.maximum(self.max, other.max, out=self.max)
+            if self.first_ts is None or (other.first_ts is not None and other.first_ts < self.first_ts):
+                self.first_ts = other.first_ts
+            if self.last_ts is None or (other.last_ts is not None and other.last_ts > self.last_ts):
+                self.last_ts = other.last_ts
+            for ts, values in other.recent:
+                self._push_recent(ts, values)
+
+    # ========================
+    # 结果
+    # ========================
+    def stats(self):
+        with self._lock:
+            if self.n == 0:
+                return {}
+            out = {}
+            for i, m in enumerate(METRICS):
+                out[m] = {
+                    "max": float(self.max[i]),
+                    "min": float(self.min[i]),
+                    "avg": round(float(self.mean[i]), 2)
+                }
+            out["current_count"] = self.n
+            return out
+
+    def missing_rate(self):
+        """缺少指标的样本占比（%），与全量计算的 data_quality.missing_rate 一致"""
+        with self._lock:
+            total = self.n + self.incomplete
+            return round(self.incomplete / total * 100, 2) if total > 0 else 0
+
+    def correlation(self):
+        """与 DataFrame.corr().round(2).to_dict() 结构一致；方差为 0 时为 None"""
+        with self._lock:
+            c = self.comoment.copy()
+        std = np.sqrt(np.diag(c))
+        out = {}
+        for j, mj in enumerate(METRICS):
+            col = {}
+            for i, mi in enumerate(METRICS):
+                denom = std[i] * std[j]
+                col[mi] = round(float(c[i, j] / denom), 2) if denom > 0 else None
+            out[mj] = col
+        return out
+
+    # ========================
+    # 快照
+    # ========================
+    def to_dict(self):
+        with self._lock:
+            return {
+                "version": SNAPSHOT_VERSION,
+                "metrics": list(METRICS),
+                "n": self.n,
+                "incomplete": self.incomplete,
+                "mean": self.mean.tolist(),
+                "comoment": self.comoment.tolist(),
+                "min": [v if np.isfinite(v) else None for v in self.min.tolist()],
+                "max": [v if np.isfinite(v) else None for v in self.max.tolist()],
+                "first_ts": self.first_ts,
+                "last_ts": self.last_ts,
+                "recent": [[ts, values] for ts, values in self.recent],
+                "store_id": self.store_id,
+                "generation": self.generation,
+                "engine": self.engine,
+                "saved_at": time.time()
+            }
+
+    @classmethod
+    def from_dict(cls, d, window=None):
+        if not d or d.get("version") != SNAPSHOT_VERSION or \
+                d.get("metrics") != list(METRICS):
+            return None
+        state = cls(window)
+        state.n = int(d["n"])
+        state.incomplete = int(d.get("incomplete", 0))
+        state.mean = np.array(d["mean"], dtype=np.float64)
+        state.comoment = np.array(d["comoment"], dtype=np.float64)
+        state.min = np.array([np.inf if v is None else v for v in d["min"]])
+        state.max = np.array([-np.inf if v is None else v for v in d["max"]])
+        state.first_ts = d.get("first_ts")
+        state.last_ts = d.get("last_ts")
+        state.recent = [(ts, list(values)) for ts, values in d.get("recent", [])]
+        state.engine = d.get("engine")
+        state.store_id = d.get("store_id")
+        state.generation = d.get("generation", 0)
+        return state
+
+    def save(self, path):
+        data = self.to_dict()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+
+def load_snapshot(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,195 @@
+"""
+流式异常检测：每个 (传感器, 指标) 维护 EWMA 均值与方差，每条数据 O(1) 更新
+
+- 预热（ANOMALY_WARMUP 条）之前只学习，不告警；预热期间用累计均值，估计更稳定
+- |z| = |x - 均值| / 标准差 超过 ANOMALY_THRESHOLD 时进入异常状态并产生一条 anomaly 事件，
+  持续异常不重复告警，回到控制限以内时产生一条 recovered 事件
+- 异常值先截断到控制限再参与更新，单个尖峰不会把控制限拉宽
+
+告警事件写入告警日志（内存环形缓冲 + data/alerts.jsonl），并推送给订阅了告警的 WebSocket 客户端。
+"""
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+
+from config import Config
+from logs import get_logger
+
+METRICS = ("temperature", "humidity", "pressure")
+STATES = ("anomaly", "recovered")
+# 标准差下限，避免恒定信号上出现无穷大的 z
+MIN_STD = 1e-9
+
+log = get_logger("anomaly")
+
+
+def log_path(worker=None):
+    """告警日志；多进程订阅时每个 worker 一份（alerts-w<N>.jsonl）"""
+    data_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "data"))
+    path = os.path.join(data_dir, Config.ANOMALY_LOG)
+    if worker is None:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}-w{worker}{ext}"
+
+
+class AnomalyDetector:
+    def __init__(self, alpha=None, threshold=None, warmup=None):
+        self.alpha = float(Config.ANOMALY_ALPHA if alpha is None else alpha)
+        self.threshold = float(Config.ANOMALY_THRESHOLD if threshold is None else threshold)
+        self.warmup = int(Config.ANOMALY_WARMUP if warmup is None else warmup)
+        if not 0 < self.alpha < 1:
+            raise ValueError("ANOMALY_ALPHA 必须在 0 和 1 之间")
+        if self.threshold <= 0:
+            raise ValueError("ANOMALY_THRESHOLD 必须大于 0")
+        self._lock = threading.Lock()
+        # (sensor_id, metric) -> [n, mean, var, 是否处于异常状态]
+        self.state = {}
+        self.samples = 0
+        self.alerts = 0
+
+    def update(self, sample, emit=True):
+        """
+        sample: 包含 timestamp、sensor_id 和各指标的字典。
+        返回本条数据产生的告警事件列表；emit=False 时只学习（启动预热）
+        """
+        sensor_id = str(sample.get("sensor_id") or Config.DEFAULT_SENSOR_ID)
+        events = []
+        with self._lock:
+            self.samples += 1
+            for m in METRICS:
+                try:
+                    x = float(sample.get(m))
+                except (TypeError, ValueError):
+                    continue
+                if not math.isfinite(x):
+                    continue
+
+                key = (sensor_id, m)
+                st = self.state.get(key)
+                if st is None:
+                    self.state[key] = [1, x, 0.0, False]
+                    continue
+                n, mean, var, active = st
+
+                if n >= self.warmup:
+                    std = max(math.sqrt(var), MIN_STD)
+                    z = (x - mean) / std
+                    anomalous = abs(z) > self.threshold
+                    if anomalous != active:
+                        active = anomalous
+                        if emit:
+                            events.append(self._event(sample, sensor_id, m, x, mean, std, z, anomalous))
+                    if anomalous:
+                        # 截断到控制限再更新，尖峰不会污染基线
+                        limit = self.threshold * std
+                        x = mean + (limit if z > 0 else -limit)
+
+                # 预热期间用累计均值（1/n），之后固定 alpha
+                alpha = max(self.alpha, 1.0 / (n + 1))
+                diff = x - mean
+                incr = alpha * diff
+                mean += incr
+                var = (1 - alpha) * (var + diff * incr)
+                st[0], st[1], st[2], st[3] = n + 1, mean, var, active
+            self.alerts += sum(1 for e in events if e["state"] == "anomaly")
+        return events
+
+    def _event(self, sample, sensor_id, metric, value, mean, std, z, anomalous):
+        limit = self.threshold * std
+        return {
+            "type": "alert",
+            "state": "anomaly" if anomalous else "recovered",
+            "timestamp": sample.get("timestamp"),
+            "sensor_id": sensor_id,
+            "metric": metric,
+            "value": value,
+            "mean": round(mean, 4),
+            "std": round(std, 4),
+            "z": round(z, 2),
+            "lower": round(mean - limit, 4),
+            "upper": round(mean + limit, 4),
+            "detected_at": time.time()
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "alpha": self.alpha,
+                "threshold": self.threshold,
+                "warmup": self.warmup,
+                "series": len(self.state),
+                "active": sorted(f"{s}/{m}" for (s, m), st in self.state.items() if st[3]),
+                "samples": self.samples,
+                "alerts": self.alerts
+            }
+
+
+class AlertLog:
+    """最近的告警保存在内存中供查询，同时逐条追加到 JSON Lines 文件，重启后从文件尾部恢复"""
+
+    def __init__(self, path=None, size=None, max_bytes=None):
+        self.path = path
+        self.size = int(size or Config.ANOMALY_LOG_SIZE)
+        self.max_bytes = int(Config.ANOMALY_LOG_MAX_BYTES if max_bytes is None else max_bytes)
+        self.events = deque(maxlen=self.size)
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = deque(f, maxlen=self.size)
+        except OSError:
+            return
+        for line in lines:
+            try:
+                self.events.append(json.loads(line))
+            except ValueError:
+                # 崩溃时可能留下不完整的最后一行
+                continue
+
+    def append(self, event):
+        with self._lock:
+            self.events.append(event)
+            if not self.path:
+                return
+            try:
+                if self.max_bytes and os.path.exists(self.path) and \
+                        os.path.getsize(self.path) >= self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            except OSError as e:
+                log.error("告警日志写入失败: %s", e)
+
+    def extend(self, events):
+        """只放入内存（多进程订阅时协调进程汇总各 worker 的告警，文件由各 worker 写入）"""
+        with self._lock:
+            self.events.extend(events)
+
+    def query(self, limit=50, since=None, sensor_id=None, metric=None, state=None):
+        """最近的 limit 条告警（按时间先后排列），可按时间、传感器、指标和状态过滤"""
+        out = []
+        with self._lock:
+            for event in reversed(self.events):
+                if len(out) >= limit:
+                    break
+                if since is not None and str(event.get("timestamp")) <= since:
+                    continue
+                if sensor_id is not None and event.get("sensor_id") != sensor_id:
+                    continue
+                if metric is not None and event.get("metric") != metric:
+                    continue
+                if state is not None and event.get("state") != state:
+                    continue
+                out.append(event)
+        out.reverse()
+        return out
+
+    def __len__(self):
+        return len(self.events)
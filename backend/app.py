@@ -1,18 +1,90 @@
-from flask import Flask, jsonify
+"""
+发布端与分析服务：create_app() 创建应用
+
+- APP_LAZY_IMPORTS 开启时分析接口（/api/analyze 等）以懒加载视图注册，第一次请求到达时才导入
+  data_address（pandas / NumPy），启动时只导入 Flask 与 paho，/ping、/start 等接口立即可用
+- APP_WARMUP 开启时应用创建后在后台线程导入分析模块、打开存储并算好默认的分析结果，
+  不阻塞启动；预热完成前到达的分析请求照常处理
+- 启动与预热完成的时刻在 /metrics 中暴露为 iot_app_startup_seconds / iot_app_warmup_seconds
+
+    python backend/app.py
+"""
+import time
+
+# 从导入本模块开始计时（不含解释器自身启动）
+STARTED = time.perf_counter()
+
+import threading
+from importlib import import_module
+
+from flask import Flask, Blueprint, jsonify
 from flask_cors import CORS
 from config import Config
 from publish import publish_bp
-from data_address import data_bp
+from metrics import metrics_bp
+from logs import get_logger
+import metrics
+
+log = get_logger("app")
+
+STARTUP_SECONDS = metrics.gauge(
+    "iot_app_startup_seconds", "从导入 app 模块到应用创建完成的用时（秒）")
+WARMUP_SECONDS = metrics.gauge(
+    "iot_app_warmup_seconds", "从导入 app 模块到后台预热（导入分析模块、打开存储、计算默认分析结果）完成的用时（秒）")
+
+# 分析接口：(路径, data_address 中的视图函数)，须与 data_address.data_bp 的路由一致
+DATA_ROUTES = (
+    ("/api/analyze", "analyze_data"),
+    ("/api/sensors", "sensor_registry"),
+    ("/api/series", "series_data"),
+    ("/api/stats", "range_stats"),
+    ("/api/analyze/cache", "analyze_cache_stats"),
+)
+
+
+class LazyView:
+    """第一次调用时才导入 "模块.函数" 形式的视图函数"""
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*",
-     "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"]}})
+    def __init__(self, import_name):
+        self.import_name = import_name
+        self.__name__ = import_name.rpartition(".")[2]
+        self._view = None
 
-app.register_blueprint(publish_bp)
-app.register_blueprint(data_bp)
+    def __call__(self, *args, **kwargs):
+        if self._view is None:
+            module, _, name = self.import_name.rpartition(".")
+            start = time.perf_counter()
+            # import_module 持有导入锁，并发的首批请求只会导入一次
+            self._view = getattr(import_module(module), name)
+            elapsed = time.perf_counter() - start
+            if elapsed > 0.05:
+                log.info("导入 %s 用时 %.2f 秒", module, elapsed)
+        return self._view(*args, **kwargs)
+
+
+def data_blueprint(lazy):
+    if not lazy:
+        from data_address import data_bp
+        return data_bp
+    # 与 data_address.data_bp 同名，端点名（data.analyze_data 等）保持不变
+    bp = Blueprint('data', __name__)
+    for rule, name in DATA_ROUTES:
+        bp.add_url_rule(rule, endpoint=name, view_func=LazyView(f"data_address.{name}"),
+                        methods=["GET"])
+    return bp
+
+
+def warmup():
+    try:
+        import data_address
+        seconds = data_address.warmup()
+    except Exception as e:
+        log.error("后台预热失败: %s", e)
+        return
+    WARMUP_SECONDS.set(time.perf_counter() - STARTED)
+    log.info("后台预热完成，默认分析用时 %.2f 秒", seconds)
 
 
-@app.after_request
 def add_cors_headers(response):
     response.headers["Access-Control-Allow-Origin"] = "*"  # 允许所有来源
     response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
@@ -21,11 +93,34 @@ def add_cors_headers(response):
     return response
 
 
-@app.route('/ping')
 def ping():
     return jsonify({"msg": "backend ok"})
 
 
+def create_app(lazy=None, warmup_in_background=None):
+    """lazy / warmup_in_background 为 None 时取 APP_LAZY_IMPORTS / APP_WARMUP"""
+    lazy = Config.APP_LAZY_IMPORTS if lazy is None else lazy
+    warm = Config.APP_WARMUP if warmup_in_background is None else warmup_in_background
+
+    app = Flask(__name__)
+    CORS(app, resources={r"/*": {"origins": "*",
+         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"]}})
+
+    app.register_blueprint(publish_bp)
+    app.register_blueprint(data_blueprint(lazy))
+    app.register_blueprint(metrics_bp)
+    app.after_request(add_cors_headers)
+    app.add_url_rule('/ping', view_func=ping)
+
+    STARTUP_SECONDS.set(time.perf_counter() - STARTED)
+    if warm:
+        threading.Thread(target=warmup, daemon=True, name="warmup").start()
+    return app
+
+
 if __name__ == '__main__':
+    app = create_app()
+    log.info("服务启动用时 %.3f 秒（分析模块%s）", time.perf_counter() - STARTED,
+             "懒加载" if Config.APP_LAZY_IMPORTS else "已导入")
     app.run(host=Config.PUBLISH_SERVICE_HOST,
-            port=Config.PUBLISH_SERVICE_PORT, debug=True, threaded=True)
+            port=Config.PUBLISH_SERVICE_PORT, debug=Config.APP_DEBUG, threaded=True)
@@ -0,0 +1,706 @@
+"""
+可复现的性能基准：端到端链路与分析接口的微基准
+
+    python backend/bench.py e2e [--messages 5000] [--clients 10] [--sensors 1] [--rate 0] [--workers 1]
+                                [--service thread|async]
+    python backend/bench.py micro [--rows 10k,1M,10M] [--repeat 5]
+    python backend/bench.py startup [--runs 5] [--no-warmup]
+
+e2e：在本进程中启动本地 MQTT broker（broker.LocalBroker），在临时数据目录中启动订阅端子进程，
+用 publish_data（--sensors 大于 1 时为多传感器扇出）发布生成的数据，由 N 个 WebSocket 客户端接收：
+    publish_data → broker → on_message → 存储 → broadcast_ws → 客户端
+报告发布与端到端吞吐（条/秒）、发布到客户端收到的 p50/p99 时延、订阅端 /metrics 中各段时延直方图估计的
+p50/p99，以及订阅端进程的 RSS（多进程订阅时为协调进程与各 worker 之和）。
+--service async 时订阅端为单事件循环服务 aio_service.py。
+
+micro：按固定随机种子生成 10k / 1M / 10M 行的 CSV（缓存在 --data-dir，重复运行直接复用），
+测量 DataProcessor.process（CSV 全量、段存储全量、增量快照）与 /api/history（HistoryRing 预热、查询与 JSON 序列化）。
+
+startup：分别以懒加载（APP_LAZY_IMPORTS=1）和启动时导入分析模块（=0）启动 app.py 子进程，
+测量从启动进程到 /ping 可响应的冷启动时间与此时的 RSS、后台预热完成的时间与 RSS，
+以及预热后第一次 /api/analyze 的耗时；多次运行取中位数。
+
+--json 输出机器可读的结果，便于保存后对比回归。
+"""
+import os
+import re
+import sys
+import csv
+import json
+import time
+import shutil
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SIZES = {"k": 1000, "m": 1000 * 1000}
+BENCH_TOPIC = "iot/bench/environment"
+BENCH_SENSOR = "BENCH_001"
+
+
+# ========================
+# 工具
+# ========================
+def parse_size(text):
+    text = text.strip().lower()
+    if text[-1:] in SIZES:
+        return int(float(text[:-1]) * SIZES[text[-1]])
+    return int(text)
+
+
+def format_size(n):
+    for suffix, unit in (("M", SIZES["m"]), ("k", SIZES["k"])):
+        if n >= unit and n % unit == 0:
+            return f"{n // unit}{suffix}"
+    return str(n)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid="self"):
+    """(当前 RSS, 峰值 RSS)，单位 MB；读取 /proc，非 Linux 返回 (None, None)"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":", 1)
+                    values[key] = int(value.split()[0]) / 1024
+    except OSError:
+        return None, None
+    return values.get("VmRSS"), values.get("VmHWM")
+
+
+def ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def quantiles(values):
+    from inflight import percentile
+    values = sorted(values)
+    return {"p50": ms(percentile(values, 50)), "p99": ms(percentile(values, 99)),
+            "max": ms(values[-1]) if values else None}
+
+
+def timeit(fn, repeat):
+    """先运行一次预热，返回之后 repeat 次的耗时中位数（秒）与该次的返回值"""
+    result = fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], result
+
+
+def use_data_dir(root, **extra):
+    """把存储、快照、预聚合和告警日志指向 root（须在导入 config 之前调用）"""
+    if "config" in sys.modules:
+        raise RuntimeError("必须在导入 config 之前设置数据目录")
+    env = {
+        "STORAGE_DIR": os.path.join(root, "segments"),
+        "ANALYTICS_SNAPSHOT": os.path.join(root, "analytics.json"),
+        "ANALYTICS_SENSOR_DIR": os.path.join(root, "analytics"),
+        "ROLLUP_DIR": os.path.join(root, "rollups"),
+        "ANOMALY_LOG": os.path.join(root, "alerts.jsonl"),
+        "STORAGE_ENGINE": "segments",
+        "LOG_LEVEL": "WARNING"
+    }
+    env.update({k: str(v) for k, v in extra.items()})
+    os.environ.update(env)
+    return env
+
+
+# ========================
+# /metrics 解析
+# ========================
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_metrics(text):
+    """Prometheus 文本 -> [(名称, 标签字典, 值)]"""
+    out = []
+    for line in text.splitlines():
+        match = SAMPLE_RE.match(line)
+        if match:
+            labels = dict(LABEL_RE.findall(match.group(2) or ""))
+            out.append((match.group(1), labels, float(match.group(3))))
+    return out
+
+
+def metric_sum(samples, name, **labels):
+    """同名指标按标签过滤后求和（多进程订阅时汇总各 worker）"""
+    return sum(v for n, l, v in samples
+               if n == name and all(l.get(k) == v2 for k, v2 in labels.items()))
+
+
+def histogram_quantile(samples, name, q):
+    """与 PromQL histogram_quantile 相同：汇总各标签的桶，在命中的桶内线性插值"""
+    buckets = {}
+    for n, labels, value in samples:
+        if n == name + "_bucket":
+            le = float(labels["le"].replace("+Inf", "inf"))
+            buckets[le] = buckets.get(le, 0) + value
+    bounds = sorted(buckets)
+    if not bounds or not buckets[bounds[-1]]:
+        return None
+    rank = q * buckets[bounds[-1]]
+    lower, below = 0.0, 0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float("inf"):
+                return lower
+            if count == below:
+                return bound
+            return lower + (bound - lower) * (rank - below) / (count - below)
+        lower, below = bound, count
+    return lower
+
+
+# ========================
+# e2e：发布 → 订阅 → 存储 → WebSocket
+# ========================
+def generate_rows(n, start=1893456000, step=60):
+    """n 条递增时间戳（默认从 2030-01-01 起每分钟一条）的 (timestamp, 温度, 湿度, 气压)"""
+    import numpy as np
+    from segments import format_ts
+
+    rng = np.random.default_rng(0)
+    ts = format_ts(start + np.arange(n, dtype=np.int64) * step)
+    t = np.arange(n)
+    temperature = np.round(20 + 5 * np.sin(t / 720) + rng.normal(0, 0.3, n), 2)
+    humidity = np.round(60 + 10 * np.cos(t / 900) + rng.normal(0, 1, n), 2)
+    pressure = np.round(1010 + rng.normal(0, 0.5, n), 2)
+    return [(str(a), float(b), float(c), float(d))
+            for a, b, c, d in zip(ts, temperature, humidity, pressure)]
+
+
+class WSClients:
+    """N 个 WebSocket 客户端在同一个事件循环中接收逐条推送，记录每条数据的到达时间"""
+
+    def __init__(self, port, clients):
+        self.port = port
+        self.clients = clients
+        self.arrivals = [dict() for _ in range(clients)]
+        self.connected = threading.Event()
+        self._stop = None
+        self._loop = None
+        self._thread = None
+
+    def received(self):
+        return [len(a) for a in self.arrivals]
+
+    async def _client(self, i, ready):
+        import websockets
+        arrivals = self.arrivals[i]
+        async with websockets.connect(f"ws://127.0.0.1:{self.port}", max_queue=None) as ws:
+            ready.append(i)
+            if len(ready) == self.clients:
+                self.connected.set()
+            while True:
+                message = await ws.recv()
+                now = time.time()
+                try:
+                    data = json.loads(message)
+                except ValueError:
+                    continue
+                if "timestamp" in data:
+                    arrivals[(data.get("sensor_id"), data["timestamp"])] = now
+
+    async def _main(self):
+        self._stop = asyncio.Event()
+        ready = []
+        tasks = [asyncio.ensure_future(self._client(i, ready)) for i in range(self.clients)]
+        await self._stop.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def start(self, timeout=10):
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._main())
+
+        self._thread = threading.Thread(target=run, daemon=True, name="bench-ws")
+        self._thread.start()
+        return self.connected.wait(timeout)
+
+    def stop(self):
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        if self._thread is not None:
+            self._thread.join(5)
+
+
+def http_get(port, path, parse=True):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=10) as r:
+        body = r.read().decode("utf-8")
+    return json.loads(body) if parse else body
+
+
+SERVICES = {"thread": "subscribe.py", "async": "aio_service.py"}
+
+
+def start_subscriber(env, rest_port, log_path, timeout=120, service="thread"):
+    """在临时数据目录中启动订阅端子进程，等到 MQTT 连接成功"""
+    log = open(log_path, "w", encoding="utf-8")
+    proc = subprocess.Popen([sys.executable, SERVICES[service]], cwd=BASE_DIR,
+                            env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"订阅端启动失败，见 {log_path}")
+        try:
+            if http_get(rest_port, "/api/status")["connected"]:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"订阅端 {timeout} 秒内未连接 MQTT，见 {log_path}")
+
+
+def stop_subscriber(proc, timeout=20):
+    # 与 Ctrl+C 相同：处理完队列中的数据后退出
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def subscriber_rss(proc, rest_port):
+    pids = [proc.pid]
+    try:
+        pipeline = http_get(rest_port, "/api/pipeline")
+        pids += [p for p in pipeline.get("coordinator", {}).get("pids", []) if p]
+    except OSError:
+        pass
+    current, peak = 0.0, 0.0
+    for pid in pids:
+        rss, hwm = rss_mb(pid)
+        if rss is None:
+            return None
+        current += rss
+        peak += hwm
+    return {"processes": len(pids), "rss_mb": round(current, 1), "peak_rss_mb": round(peak, 1)}
+
+
+def run_e2e(args):
+    root = tempfile.mkdtemp(prefix="iot-bench-")
+    mqtt_port, ws_port, rest_port = free_port(), free_port(), free_port()
+    env = use_data_dir(root, MQTT_BROKER="127.0.0.1", MQTT_PORT=mqtt_port, MQTT_TOPIC=BENCH_TOPIC,
+                       WEBSOCKET_PORT=ws_port, SUBSCRIBE_SERVICE_PORT=rest_port,
+                       SUBSCRIBE_WORKERS=args.workers)
+
+    from config import Config
+    from broker import LocalBroker
+    import publish
+    import publish_common
+    import fanout
+
+    broker = LocalBroker(port=mqtt_port)
+    broker.start()
+    proc = None
+    clients = None
+    try:
+        started = time.monotonic()
+        proc = start_subscriber(env, rest_port, os.path.join(root, "subscribe.log"),
+                                service=args.service)
+        startup = time.monotonic() - started
+
+        clients = WSClients(ws_port, args.clients)
+        if not clients.start():
+            raise RuntimeError("WebSocket 客户端连接超时")
+
+        # 记录每条消息的发送时刻，客户端收到后按 (传感器, 时间戳) 对应
+        sent = {}
+        build_message = publish.build_message
+
+        def recording_build_message(*a, **kw):
+            msg = build_message(*a, **kw)
+            sent[(msg.get("sensor_id") or Config.DEFAULT_SENSOR_ID, msg["timestamp"])] = msg["sent_at"]
+            return msg
+
+        rows = generate_rows(max(1, args.messages // args.sensors))
+        # 单传感器发布与扇出 worker 分别通过 publish 与 publish_common 引用
+        publish.build_message = publish_common.build_message = recording_build_message
+        publish.load_series = lambda source=None: rows
+
+        replay = {"mode": "rate", "rate": args.rate} if args.rate > 0 else {"mode": "max"}
+        qos_options = publish.parse_qos_options({"qos": args.qos})
+        if args.sensors > 1:
+            run = fanout.FanoutRun(sensors=args.sensors, connections=args.connections,
+                                   executor="thread", jitter=0, replay_params=replay,
+                                   qos_options=qos_options)
+            target = lambda: publish.publish_fanout(run)
+        else:
+            scheduler = publish.parse_replay_options(replay)
+            target = lambda: publish.publish_data(scheduler, qos_options)
+        publisher = threading.Thread(target=target, name="bench-publisher")
+        publisher.start()
+
+        # 等待所有客户端收齐，或 --idle 秒内没有新数据
+        expected = len(rows) * args.sensors
+        last, last_change = None, time.monotonic()
+        while True:
+            time.sleep(0.2)
+            received = clients.received()
+            if min(received) >= expected and not publisher.is_alive():
+                break
+            if received != last:
+                last, last_change = received, time.monotonic()
+            elif time.monotonic() - last_change > args.idle and not publisher.is_alive():
+                break
+        publisher.join()
+
+        # 等写线程把已接收的数据落盘，落盘时延才完整
+        deadline = time.monotonic() + 10
+        while True:
+            samples = parse_metrics(http_get(rest_port, "/metrics", parse=False))
+            if metric_sum(samples, "iot_storage_written_total") >= \
+                    metric_sum(samples, "iot_ingest_messages_total", result="accepted") or \
+                    time.monotonic() > deadline:
+                break
+            time.sleep(0.2)
+        memory = subscriber_rss(proc, rest_port)
+    finally:
+        if clients is not None:
+            clients.stop()
+        if proc is not None:
+            stop_subscriber(proc)
+        broker.stop()
+
+    sent_times = sorted(sent.values())
+    latencies = [arrival - sent[key] for a in clients.arrivals for key, arrival in a.items()
+                 if key in sent]
+    last_arrival = max((t for a in clients.arrivals for t in a.values()), default=None)
+    publish_elapsed = sent_times[-1] - sent_times[0] if len(sent_times) > 1 else None
+    e2e_elapsed = last_arrival - sent_times[0] if sent_times and last_arrival else None
+
+    def rate(n, elapsed):
+        return round(n / elapsed, 1) if elapsed else None
+
+    def hist(name):
+        return {"p50": ms(histogram_quantile(samples, name, 0.5)),
+                "p99": ms(histogram_quantile(samples, name, 0.99))}
+
+    result = {
+        "config": {"messages": len(sent), "clients": args.clients, "sensors": args.sensors,
+                   "workers": args.workers, "qos": args.qos, "rate": args.rate or "max",
+                   "service": args.service},
+        "subscriber_startup_s": round(startup, 3),
+        "published": len(sent),
+        "accepted": int(metric_sum(samples, "iot_ingest_messages_total", result="accepted")),
+        "stored": int(metric_sum(samples, "iot_storage_written_total")),
+        "ws_received_min": min(clients.received()),
+        "publish_rate": rate(len(sent), publish_elapsed),
+        "e2e_rate": rate(len(sent), e2e_elapsed),
+        "latency_ms": {
+            "publish_to_client": quantiles(latencies),
+            "publish_to_receive": hist("iot_publish_receive_latency_seconds"),
+            "receive_to_storage": hist("iot_storage_commit_latency_seconds"),
+            "receive_to_ws_send": hist("iot_ws_send_latency_seconds")
+        },
+        "subscriber_memory": memory,
+        "bench_peak_rss_mb": rss_mb()[1]
+    }
+    if args.keep:
+        result["data_dir"] = root
+    else:
+        shutil.rmtree(root, ignore_errors=True)
+    return result
+
+
+def print_e2e(result):
+    c = result["config"]
+    print(f"e2e: messages={c['messages']} clients={c['clients']} sensors={c['sensors']} "
+          f"workers={c['workers']} qos={c['qos']} rate={c['rate']} service={c['service']}")
+    print(f"  订阅端启动: {result['subscriber_startup_s']} s")
+    print(f"  发布 / 接收 / 落盘: {result['published']} / {result['accepted']} / {result['stored']}，"
+          f"每个客户端至少收到 {result['ws_received_min']}")
+    print(f"  发布吞吐: {result['publish_rate']} 条/秒")
+    print(f"  端到端吞吐: {result['e2e_rate']} 条/秒")
+    for name, label in (("publish_to_client", "发布 → 客户端收到"),
+                        ("publish_to_receive", "发布 → 订阅端收到*"),
+                        ("receive_to_storage", "收到 → 落盘*"),
+                        ("receive_to_ws_send", "收到 → WebSocket 发送*")):
+        q = result["latency_ms"][name]
+        print(f"  {label}: p50 {q['p50']} ms, p99 {q['p99']} ms")
+    print("  （* 由订阅端 /metrics 直方图估计）")
+    memory = result["subscriber_memory"]
+    if memory:
+        print(f"  订阅端 RSS: {memory['rss_mb']} MB（峰值 {memory['peak_rss_mb']} MB，"
+              f"{memory['processes']} 个进程）")
+    if result.get("data_dir"):
+        print(f"  数据目录已保留: {result['data_dir']}")
+
+
+# ========================
+# micro：DataProcessor.process 与 /api/history
+# ========================
+CSV_FIELDS = ["timestamp", "topic", "sensor_id", "temperature", "humidity", "pressure", "raw"]
+
+
+def generate_csv(path, n, chunk=500000):
+    """与订阅端 CSV 相同的列；每秒一条，raw 列留空以控制文件大小"""
+    import numpy as np
+    from segments import format_ts
+
+    rng = np.random.default_rng(n)
+    start = 1577836800  # 2020-01-01
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        for lo in range(0, n, chunk):
+            hi = min(n, lo + chunk)
+            t = np.arange(lo, hi)
+            ts = format_ts(start + t)
+            temperature = np.round(20 + 5 * np.sin(t / 43200) + rng.normal(0, 0.3, hi - lo), 2)
+            humidity = np.round(60 + 10 * np.cos(t / 86400) + rng.normal(0, 1, hi - lo), 2)
+            pressure = np.round(1010 + rng.normal(0, 0.5, hi - lo), 2)
+            writer.writerows(zip(ts, [BENCH_TOPIC] * (hi - lo), [BENCH_SENSOR] * (hi - lo),
+                                 temperature, humidity, pressure, [""] * (hi - lo)))
+    os.replace(tmp, path)
+
+
+def prepare_dataset(data_dir, n):
+    """生成 CSV，并导入段存储、写好增量快照；已生成过的直接复用"""
+    from segments import ShardedStore, migrate_csv, format_ts, METRICS
+    from analytics import RunningStats
+    import numpy as np
+
+    root = os.path.join(data_dir, f"rows-{format_size(n)}")
+    os.makedirs(root, exist_ok=True)
+    csv_path = os.path.join(root, "sensor_data.csv")
+    snapshot = os.path.join(root, "analytics.json")
+    timings = {}
+
+    if not os.path.exists(csv_path):
+        start = time.perf_counter()
+        generate_csv(csv_path, n)
+        timings["generate_csv_s"] = round(time.perf_counter() - start, 3)
+
+    store = ShardedStore(os.path.join(root, "segments"))
+    if not store.count():
+        start = time.perf_counter()
+        migrate_csv(csv_path, store, batch_size=100000)
+        store.close()
+        timings["import_segments_s"] = round(time.perf_counter() - start, 3)
+
+    if not os.path.exists(snapshot):
+        state = RunningStats()
+        state.store_id, state.generation = store.identity()
+        data, _ = store.read(metrics=METRICS)
+        state.merge_arrays(format_ts(data["ts"]), np.column_stack([data[m] for m in METRICS]))
+        state.save(snapshot)
+    return csv_path, store, snapshot, timings
+
+
+def run_micro(args):
+    data_dir = os.path.abspath(args.data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+    use_data_dir(os.path.join(data_dir, "runtime"), ROLLUPS=0, ANALYZE_CACHE=0)
+
+    from data_address import DataProcessor
+    from forecast import parse_forecast_options
+    from history import HistoryRing
+    from flask import json as flask_json
+
+    results = []
+    for n in [parse_size(s) for s in args.rows.split(",") if s.strip()]:
+        csv_path, store, snapshot, timings = prepare_dataset(data_dir, n)
+        options = parse_forecast_options({})
+        entry = {"rows": n, "csv_mb": round(os.path.getsize(csv_path) / 2 ** 20, 1), **timings}
+
+        cases = (("process_full_csv", DataProcessor(csv_path, snapshot=snapshot), "full"),
+                 ("process_full_segments", DataProcessor(csv_path, store, snapshot=snapshot), "full"),
+                 ("process_incremental", DataProcessor(csv_path, store, snapshot=snapshot), None))
+        for name, processor, mode in cases:
+            seconds, result = timeit(lambda: processor.process(mode, options), args.repeat)
+            entry[name + "_ms"] = ms(seconds)
+            entry[name + "_records"] = result["data_quality"]["total_records"]
+        store.close()
+
+        ring = HistoryRing()
+        entry["history_warm_csv_ms"] = ms(timeit(lambda: ring.warm(csv_path), args.repeat)[0])
+        entry["history_warm_segments_ms"] = ms(timeit(
+            lambda: ring.load(store.tail(ring.size)), args.repeat)[0])
+        store.close()
+        for limit in (50, 1000, ring.size):
+            # 与 /api/history 相同：查询后序列化为 JSON
+            entry[f"history_query_{limit}_ms"] = ms(timeit(
+                lambda: flask_json.dumps(ring.query(limit)), args.repeat * 20)[0])
+        entry["peak_rss_mb"] = rss_mb()[1]
+        results.append(entry)
+        if not args.json:
+            print_micro(entry)
+    return results
+
+
+def print_micro(entry):
+    print(f"rows={format_size(entry['rows'])} csv={entry['csv_mb']} MB")
+    for key in ("generate_csv_s", "import_segments_s"):
+        if key in entry:
+            print(f"  {key[:-2]:<32} {entry[key]:12.3f} s")
+    for key, value in entry.items():
+        if key.endswith("_ms"):
+            print(f"  {key[:-3]:<32} {value:12.3f} ms")
+    print(f"  {'peak_rss':<32} {entry['peak_rss_mb']:12.1f} MB")
+
+
+# ========================
+# startup：app.py 冷启动与预热
+# ========================
+def wait_http(port, path, timeout, proc):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("app.py 启动失败")
+        try:
+            return http_get(port, path, parse=False)
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError(f"app.py {timeout} 秒内未响应 {path}")
+
+
+def process_rss(proc):
+    rss = rss_mb(proc.pid)[0]
+    return round(rss, 1) if rss is not None else None
+
+
+def startup_once(lazy, warmup, log_path, timeout=60):
+    port = free_port()
+    env = {**os.environ, "PUBLISH_SERVICE_HOST": "127.0.0.1", "PUBLISH_SERVICE_PORT": str(port),
+           "APP_LAZY_IMPORTS": "1" if lazy else "0", "APP_WARMUP": "1" if warmup else "0",
+           "APP_DEBUG": "0"}
+    with open(log_path, "a", encoding="utf-8") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "app.py"], cwd=BASE_DIR, env=env,
+                                stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_http(port, "/ping", timeout, proc)
+        run = {"ready_ms": ms(time.perf_counter() - start), "ready_rss_mb": process_rss(proc)}
+        samples = parse_metrics(http_get(port, "/metrics", parse=False))
+        run["startup_gauge_ms"] = ms(metric_sum(samples, "iot_app_startup_seconds"))
+        if warmup:
+            deadline = time.monotonic() + timeout
+            while not metric_sum(samples, "iot_app_warmup_seconds"):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"app.py {timeout} 秒内未完成预热")
+                time.sleep(0.01)
+                samples = parse_metrics(http_get(port, "/metrics", parse=False))
+            run["warm_ms"] = ms(time.perf_counter() - start)
+            run["warm_rss_mb"] = process_rss(proc)
+        first = time.perf_counter()
+        http_get(port, "/api/analyze", parse=False)
+        run["first_analyze_ms"] = ms(time.perf_counter() - first)
+        run["rss_mb"] = process_rss(proc)
+        return run
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def run_startup(args):
+    root = tempfile.mkdtemp(prefix="iot-bench-startup-")
+    use_data_dir(root)
+    results = []
+    try:
+        for lazy in (True, False):
+            runs = [startup_once(lazy, not args.no_warmup, os.path.join(root, "app.log"))
+                    for _ in range(args.runs)]
+            entry = {"lazy_imports": lazy, "warmup": not args.no_warmup, "runs": args.runs}
+            for key in runs[0]:
+                values = sorted(r[key] for r in runs if r.get(key) is not None)
+                entry[key] = values[len(values) // 2] if values else None
+            results.append(entry)
+            if not args.json:
+                print_startup(entry)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def print_startup(entry):
+    print(f"APP_LAZY_IMPORTS={int(entry['lazy_imports'])} APP_WARMUP={int(entry['warmup'])}"
+          f"（{entry['runs']} 次运行的中位数）")
+    print(f"  /ping 可响应: {entry['ready_ms']} ms（app 模块内计时 {entry['startup_gauge_ms']} ms），"
+          f"RSS {entry['ready_rss_mb']} MB")
+    if entry.get("warm_ms") is not None:
+        print(f"  预热完成: {entry['warm_ms']} ms，RSS {entry['warm_rss_mb']} MB")
+    print(f"  第一次 /api/analyze: {entry['first_analyze_ms']} ms，之后 RSS {entry['rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IoT 系统性能基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    e2e = sub.add_parser("e2e", help="发布 → 订阅 → 存储 → WebSocket 端到端基准")
+    e2e.add_argument("--messages", type=int, default=5000)
+    e2e.add_argument("--clients", type=int, default=10, help="WebSocket 客户端数")
+    e2e.add_argument("--sensors", type=int, default=1, help="大于 1 时使用多传感器扇出发布")
+    e2e.add_argument("--connections", type=int, default=4, help="扇出发布的 MQTT 连接数")
+    e2e.add_argument("--rate", type=float, default=0, help="发布速率（条/秒），0 为不限速")
+    e2e.add_argument("--qos", type=int, default=0)
+    e2e.add_argument("--workers", type=int, default=1, help="订阅端 SUBSCRIBE_WORKERS")
+    e2e.add_argument("--service", choices=sorted(SERVICES), default="thread",
+                     help="订阅端：thread 为 subscribe.py，async 为单事件循环的 aio_service.py")
+    e2e.add_argument("--idle", type=float, default=5.0, help="客户端多久没有收到新数据视为结束（秒）")
+    e2e.add_argument("--keep", action="store_true", help="保留临时数据目录与订阅端日志")
+    e2e.add_argument("--json", action="store_true")
+
+    micro = sub.add_parser("micro", help="DataProcessor.process 与 /api/history 微基准")
+    micro.add_argument("--rows", default="10k,1M,10M", help="逗号分隔的行数，如 10k,1M,10M")
+    micro.add_argument("--repeat", type=int, default=5)
+    micro.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "iot-bench"),
+                       help="生成数据的缓存目录")
+    micro.add_argument("--json", action="store_true")
+
+    startup = sub.add_parser("startup", help="app.py 冷启动、预热与导入内存")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--no-warmup", action="store_true", help="关闭后台预热（APP_WARMUP=0）")
+    startup.add_argument("--json", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "e2e":
+        if args.sensors < 1 or args.clients < 1 or args.messages < 1:
+            parser.error("messages / clients / sensors 必须大于 0")
+        if args.service == "async" and args.workers > 1:
+            parser.error("--service async 只支持单进程（--workers 1）")
+        result = run_e2e(args)
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        else:
+            print_e2e(result)
+    elif args.command == "startup":
+        results = run_startup(args)
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        results = run_micro(args)
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+预测基准：向量化 forecast 模块 与 原来逐指标 sklearn LinearRegression 的对比
+
+    python backend/bench_forecast.py [--window 30] [--horizon 5] [--repeat 2000]
+
+未安装 scikit-learn 时只测试 forecast 模块。
+"""
+import sys
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+from forecast import MODELS, forecast
+
+
+def sklearn_path(Y, horizon):
+    """原 DataProcessor.predict_series 的做法：每个指标单独建模拟合"""
+    from sklearn.linear_model import LinearRegression
+
+    out = []
+    X = np.arange(len(Y)).reshape(-1, 1)
+    future_X = np.arange(len(Y), len(Y) + horizon).reshape(-1, 1)
+    for i in range(Y.shape[1]):
+        model = LinearRegression()
+        model.fit(X, Y[:, i])
+        out.append((model.predict(X), model.predict(future_X)))
+    return out
+
+
+def timeit(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def import_time(module):
+    """在新进程中测量导入耗时（秒）"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--window", type=int, default=30)
+    parser.add_argument("--horizon", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    t = np.arange(args.window)
+    Y = np.column_stack([
+        5 + 0.1 * t + rng.normal(0, 1, args.window),
+        80 - 0.2 * t + rng.normal(0, 3, args.window),
+        1010 + np.sin(t / 3) + rng.normal(0, 0.5, args.window)
+    ])
+
+    print(f"window={args.window} horizon={args.horizon} metrics={Y.shape[1]}")
+    for model in MODELS:
+        us = timeit(lambda: forecast(Y, model, args.horizon), args.repeat)
+        print(f"  forecast[{model:<12}] {us:10.1f} us/次")
+
+    try:
+        import sklearn  # noqa: F401
+    except ImportError:
+        print("  未安装 scikit-learn，跳过对比")
+    else:
+        us = timeit(lambda: sklearn_path(Y, args.horizon), max(1, args.repeat // 10))
+        print(f"  sklearn LinearRegression {us:10.1f} us/次")
+        fitted, future = forecast(Y, "linear", args.horizon)
+        ref = sklearn_path(Y, args.horizon)
+        diff = max(max(np.abs(fitted[:, i] - f).max(), np.abs(future[:, i] - p).max())
+                   for i, (f, p) in enumerate(ref))
+        print(f"  linear 与 sklearn 最大差异 {diff:.2e}")
+
+    for module in ("forecast", "sklearn.linear_model"):
+        seconds = import_time(module)
+        if seconds is not None:
+            print(f"  import {module:<22} {seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
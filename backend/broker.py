@@ -0,0 +1,250 @@
+"""
+本地 MQTT broker 替身：用于在没有外部 broker 时联调和测试订阅端（包括多进程共享订阅）
+
+只实现订阅端与发布端用到的 MQTT 3.1.1 子集：
+- CONNECT / PUBLISH（QoS 0/1/2 均可接收，统一按 QoS 0 投递）/ SUBSCRIBE / UNSUBSCRIBE /
+  PINGREQ / DISCONNECT；不支持保留消息、遗嘱消息和持久会话，不校验用户名密码
+- 共享订阅 $share/<组>/<过滤器>：同一组内每条消息只投递给一个成员（轮询）
+
+    python broker.py [端口]          默认监听 127.0.0.1:1883
+    MQTT_BROKER=127.0.0.1 python subscribe.py
+
+也可以在进程内启动：LocalBroker(port=0).start() 返回实际监听的端口
+"""
+import sys
+import uuid
+import struct
+import asyncio
+import threading
+
+from topics import match
+
+SHARE_PREFIX = "$share/"
+# 单个连接的发送缓冲超过该值时等待对端读取
+HIGH_WATER = 1 << 20
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def encode_length(n):
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+
+def packet(kind, body=b"", flags=0):
+    return bytes([kind << 4 | flags]) + encode_length(len(body)) + body
+
+
+def encode_string(value):
+    data = value.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+
+
+def read_string(data, offset):
+    size = struct.unpack_from("!H", data, offset)[0]
+    offset += 2
+    return data[offset:offset + size].decode("utf-8"), offset + size
+
+
+async def read_packet(reader):
+    header = (await reader.readexactly(1))[0]
+    length, shift = 0, 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    body = await reader.readexactly(length) if length else b""
+    return header >> 4, header & 0x0F, body
+
+
+class _Session:
+    __slots__ = ("client_id", "writer", "filters")
+
+    def __init__(self, writer):
+        self.client_id = None
+        self.writer = writer
+        self.filters = set()
+
+
+class LocalBroker:
+    def __init__(self, host="127.0.0.1", port=1883):
+        self.host = host
+        self.port = int(port)
+        self.sessions = {}
+        # 普通订阅：过滤器 -> {会话}；共享订阅：(组, 过滤器) -> [会话]
+        self.subscriptions = {}
+        self.shared = {}
+        self._turns = {}
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+        self.received = 0
+        self.delivered = 0
+
+    # ========================
+    # 路由
+    # ========================
+    def _subscribe(self, session, topic_filter):
+        session.filters.add(topic_filter)
+        if topic_filter.startswith(SHARE_PREFIX):
+            group, _, real = topic_filter[len(SHARE_PREFIX):].partition("/")
+            members = self.shared.setdefault((group, real), [])
+            if session not in members:
+                members.append(session)
+        else:
+            self.subscriptions.setdefault(topic_filter, set()).add(session)
+
+    def _unsubscribe(self, session, topic_filter):
+        session.filters.discard(topic_filter)
+        if topic_filter.startswith(SHARE_PREFIX):
+            group, _, real = topic_filter[len(SHARE_PREFIX):].partition("/")
+            members = self.shared.get((group, real), [])
+            if session in members:
+                members.remove(session)
+            if not members:
+                self.shared.pop((group, real), None)
+        else:
+            members = self.subscriptions.get(topic_filter, set())
+            members.discard(session)
+            if not members:
+                self.subscriptions.pop(topic_filter, None)
+
+    def _targets(self, topic):
+        targets = set()
+        for topic_filter, members in self.subscriptions.items():
+            if match(topic_filter, topic)[0]:
+                targets.update(members)
+        for (group, topic_filter), members in self.shared.items():
+            if members and match(topic_filter, topic)[0]:
+                # 组内轮询，每条消息只给一个成员
+                turn = self._turns.get((group, topic_filter), 0)
+                targets.add(members[turn % len(members)])
+                self._turns[(group, topic_filter)] = turn + 1
+        return targets
+
+    async def _route(self, topic, payload):
+        self.received += 1
+        message = packet(PUBLISH, encode_string(topic) + payload)
+        for session in self._targets(topic):
+            writer = session.writer
+            if writer.is_closing():
+                continue
+            writer.write(message)
+            self.delivered += 1
+            if writer.transport.get_write_buffer_size() > HIGH_WATER:
+                await writer.drain()
+
+    # ========================
+    # 连接
+    # ========================
+    async def _handle(self, reader, writer):
+        session = _Session(writer)
+        try:
+            while True:
+                kind, flags, body = await read_packet(reader)
+                if kind == CONNECT:
+                    _, offset = read_string(body, 0)
+                    offset += 4     # 协议级别、连接标志、keepalive
+                    client_id, _ = read_string(body, offset)
+                    session.client_id = client_id or "local-" + uuid.uuid4().hex[:12]
+                    old = self.sessions.get(session.client_id)
+                    if old is not None:
+                        old.writer.close()
+                    self.sessions[session.client_id] = session
+                    writer.write(packet(CONNACK, b"\x00\x00"))
+                elif kind == PUBLISH:
+                    qos = flags >> 1 & 0x03
+                    topic, offset = read_string(body, 0)
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                        writer.write(packet(PUBACK if qos == 1 else PUBREC, packet_id))
+                    await self._route(topic, body[offset:])
+                elif kind == PUBREL:
+                    writer.write(packet(PUBCOMP, body[:2]))
+                elif kind == SUBSCRIBE:
+                    offset, granted = 2, bytearray()
+                    while offset < len(body):
+                        topic_filter, offset = read_string(body, offset)
+                        offset += 1
+                        self._subscribe(session, topic_filter)
+                        granted.append(0)
+                    writer.write(packet(SUBACK, body[:2] + bytes(granted)))
+                elif kind == UNSUBSCRIBE:
+                    offset = 2
+                    while offset < len(body):
+                        topic_filter, offset = read_string(body, offset)
+                        self._unsubscribe(session, topic_filter)
+                    writer.write(packet(UNSUBACK, body[:2]))
+                elif kind == PINGREQ:
+                    writer.write(packet(PINGRESP))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, struct.error, UnicodeDecodeError):
+            pass
+        finally:
+            for topic_filter in list(session.filters):
+                self._unsubscribe(session, topic_filter)
+            if self.sessions.get(session.client_id) is session:
+                del self.sessions[session.client_id]
+            writer.close()
+
+    # ========================
+    # 生命周期
+    # ========================
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self):
+        """在后台线程中运行，返回实际监听的端口（port=0 时由系统分配）"""
+        def run():
+            try:
+                asyncio.run(self.serve())
+            except asyncio.CancelledError:
+                pass
+
+        self._thread = threading.Thread(target=run, daemon=True, name="local-broker")
+        self._thread.start()
+        self._ready.wait(5)
+        return self.port
+
+    def stop(self):
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def stats(self):
+        return {
+            "clients": len(self.sessions),
+            "subscriptions": sum(len(m) for m in self.subscriptions.values()),
+            "shared_groups": {f"{g}/{f}": len(m) for (g, f), m in self.shared.items()},
+            "received": self.received,
+            "delivered": self.delivered
+        }
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1883
+    broker = LocalBroker(port=port)
+    print(f"本地 MQTT broker 运行于 {broker.host}:{port}，按 Ctrl+C 停止")
+    try:
+        asyncio.run(broker.serve())
+    except KeyboardInterrupt:
+        pass
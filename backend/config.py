@@ -9,14 +9,167 @@ class Config:
     MQTT_USERNAME = os.environ.get('MQTT_USERNAME', 'admin')
     MQTT_PASSWORD = os.environ.get('MQTT_PASSWORD', 'Aaa123456')
     MQTT_TOPIC = os.environ.get('MQTT_TOPIC', 'iot/area1/environment')
+    # 订阅的主题模式（逗号分隔）：+ 匹配任意一级，{sensor_id} 匹配一级并作为传感器 ID；
+    # 为空时订阅 MQTT_TOPIC 及其下一级 MQTT_TOPIC/{sensor_id}（扇出发布的主题）
+    MQTT_TOPICS = os.environ.get('MQTT_TOPICS', '')
+
+    # 发布回放配置（mode: rate / speedup / max）
+    PUBLISH_MODE = os.environ.get('PUBLISH_MODE', 'rate')
+    PUBLISH_RATE = float(os.environ.get('PUBLISH_RATE', 1.0))
+    PUBLISH_SPEEDUP = float(os.environ.get('PUBLISH_SPEEDUP', 60.0))
+
+    # 发布 QoS 配置（QoS 1 时使用在途窗口 + PUBACK 确认）
+    PUBLISH_QOS = int(os.environ.get('PUBLISH_QOS', 0))
+    PUBLISH_INFLIGHT_WINDOW = int(os.environ.get('PUBLISH_INFLIGHT_WINDOW', 100))
+    PUBLISH_ACK_TIMEOUT = float(os.environ.get('PUBLISH_ACK_TIMEOUT', 5.0))
+    PUBLISH_MAX_RETRIES = int(os.environ.get('PUBLISH_MAX_RETRIES', 3))
+
+    # 多传感器扇出配置（executor: thread / process）
+    FANOUT_SENSORS = int(os.environ.get('FANOUT_SENSORS', 10))
+    FANOUT_CONNECTIONS = int(os.environ.get('FANOUT_CONNECTIONS', 4))
+    FANOUT_EXECUTOR = os.environ.get('FANOUT_EXECUTOR', 'thread')
+    FANOUT_OFFSET = float(os.environ.get('FANOUT_OFFSET', 0))
+    FANOUT_JITTER = float(os.environ.get('FANOUT_JITTER', 0))
+    FANOUT_SENSOR_PREFIX = os.environ.get('FANOUT_SENSOR_PREFIX', 'ENV_SENSOR_')
+    FANOUT_TOPIC_TEMPLATE = os.environ.get(
+        'FANOUT_TOPIC_TEMPLATE', '{topic}/{sensor_id}')
 
     # Flask 服务配置
     PUBLISH_SERVICE_HOST = os.environ.get('PUBLISH_SERVICE_HOST', '0.0.0.0')
     PUBLISH_SERVICE_PORT = int(os.environ.get('PUBLISH_SERVICE_PORT', 5000))
+    # 分析接口依赖的 pandas / NumPy 等到第一次请求时才导入，服务启动后即可响应 /ping
+    APP_LAZY_IMPORTS = os.environ.get('APP_LAZY_IMPORTS', '1') == '1'
+    # 启动后在后台导入分析模块、打开存储并算好默认的分析结果
+    APP_WARMUP = os.environ.get('APP_WARMUP', '1') == '1'
+    # Flask 调试模式（自动重载会再启动一个进程，仅用于开发）
+    APP_DEBUG = os.environ.get('APP_DEBUG', '0') == '1'
+
+    # 订阅端 REST 服务配置
+    SUBSCRIBE_SERVICE_HOST = os.environ.get('SUBSCRIBE_SERVICE_HOST', '0.0.0.0')
+    SUBSCRIBE_SERVICE_PORT = int(os.environ.get('SUBSCRIBE_SERVICE_PORT', 5001))
+    # 多进程订阅：worker 进程数（大于 1 时启用），各 worker 通过共享订阅 $share/<组>/ 分摊消息
+    SUBSCRIBE_WORKERS = int(os.environ.get('SUBSCRIBE_WORKERS', 1))
+    MQTT_SHARED_GROUP = os.environ.get('MQTT_SHARED_GROUP', 'iot-subscribers')
+    # worker 间转发与上报协调进程时每批的最大条数、最长攒批时间（秒）与队列长度（批）
+    SUBSCRIBE_WORKER_BATCH = int(os.environ.get('SUBSCRIBE_WORKER_BATCH', 500))
+    SUBSCRIBE_WORKER_FLUSH_INTERVAL = float(os.environ.get('SUBSCRIBE_WORKER_FLUSH_INTERVAL', 0.02))
+    SUBSCRIBE_WORKER_QUEUE_SIZE = int(os.environ.get('SUBSCRIBE_WORKER_QUEUE_SIZE', 1000))
 
     # WebSocket 配置
     WEBSOCKET_HOST = os.environ.get('WEBSOCKET_HOST', '0.0.0.0')
     WEBSOCKET_PORT = int(os.environ.get('WEBSOCKET_PORT', 8080))
+    # 每个连接的发送队列长度与溢出策略（drop_oldest / disconnect）
+    WS_CLIENT_QUEUE_SIZE = int(os.environ.get('WS_CLIENT_QUEUE_SIZE', 1000))
+    WS_OVERFLOW_POLICY = os.environ.get('WS_OVERFLOW_POLICY', 'drop_oldest')
+    # 订阅客户端的默认/最大帧率，以及每帧最多合并的样本数
+    WS_DEFAULT_FPS = float(os.environ.get('WS_DEFAULT_FPS', 10))
+    WS_MAX_FPS = float(os.environ.get('WS_MAX_FPS', 60))
+    WS_MAX_BATCH = int(os.environ.get('WS_MAX_BATCH', 1000))
+    # 是否启用 permessage-deflate 压缩
+    WS_COMPRESSION = os.environ.get('WS_COMPRESSION', '1') == '1'
+
+    # 消息中未携带 sensor_id 时使用的默认传感器
+    DEFAULT_SENSOR_ID = os.environ.get('DEFAULT_SENSOR_ID', 'ENV_SENSOR_001')
+
+    # 订阅端批量写入配置（fsync: always / interval / never）
+    WRITER_BATCH_SIZE = int(os.environ.get('WRITER_BATCH_SIZE', 500))
+    WRITER_FLUSH_INTERVAL = float(os.environ.get('WRITER_FLUSH_INTERVAL', 0.5))
+    WRITER_QUEUE_SIZE = int(os.environ.get('WRITER_QUEUE_SIZE', 100000))
+    WRITER_PUT_TIMEOUT = float(os.environ.get('WRITER_PUT_TIMEOUT', 1.0))
+    WRITER_FSYNC = os.environ.get('WRITER_FSYNC', 'interval')
+    WRITER_FSYNC_INTERVAL = float(os.environ.get('WRITER_FSYNC_INTERVAL', 1.0))
+
+    # 订阅端存储引擎（engine: segments / csv；partition: hour / day）
+    STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'segments')
+    STORAGE_DIR = os.environ.get('STORAGE_DIR', 'segments')
+    STORAGE_PARTITION = os.environ.get('STORAGE_PARTITION', 'hour')
+    # 保留天数（0 表示永久保留），以及多少小时前的小时段合并为按天的段
+    STORAGE_RETENTION_DAYS = float(os.environ.get('STORAGE_RETENTION_DAYS', 0))
+    STORAGE_COMPACT_AFTER_HOURS = float(os.environ.get('STORAGE_COMPACT_AFTER_HOURS', 24))
+    STORAGE_MAINTENANCE_INTERVAL = float(os.environ.get('STORAGE_MAINTENANCE_INTERVAL', 60))
+    # 同时保持文件句柄的传感器分片数上限
+    STORAGE_MAX_OPEN_SHARDS = int(os.environ.get('STORAGE_MAX_OPEN_SHARDS', 64))
+
+    # 增量分析：订阅端维护的快照文件（相对数据目录）与写入间隔
+    ANALYTICS_INCREMENTAL = os.environ.get('ANALYTICS_INCREMENTAL', '1') == '1'
+    ANALYTICS_SNAPSHOT = os.environ.get('ANALYTICS_SNAPSHOT', 'analytics.json')
+    ANALYTICS_SNAPSHOT_INTERVAL = float(os.environ.get('ANALYTICS_SNAPSHOT_INTERVAL', 1.0))
+    # 每个传感器各自的快照目录（相对数据目录）与写入间隔
+    ANALYTICS_SENSOR_DIR = os.environ.get('ANALYTICS_SENSOR_DIR', 'analytics')
+    ANALYTICS_SENSOR_SNAPSHOT_INTERVAL = float(os.environ.get('ANALYTICS_SENSOR_SNAPSHOT_INTERVAL', 5))
+    # 快照保留的最近点数（预测 window 的上限）
+    ANALYTICS_WINDOW = int(os.environ.get('ANALYTICS_WINDOW', 120))
+
+    # 预测（model: linear / ewma / holt / holt_winters）
+    FORECAST_MODEL = os.environ.get('FORECAST_MODEL', 'linear')
+    FORECAST_HORIZON = int(os.environ.get('FORECAST_HORIZON', 5))
+    FORECAST_MAX_HORIZON = int(os.environ.get('FORECAST_MAX_HORIZON', 100))
+    FORECAST_WINDOW = int(os.environ.get('FORECAST_WINDOW', 30))
+    FORECAST_ALPHA = float(os.environ.get('FORECAST_ALPHA', 0.5))
+    FORECAST_BETA = float(os.environ.get('FORECAST_BETA', 0.3))
+    FORECAST_GAMMA = float(os.environ.get('FORECAST_GAMMA', 0.3))
+    # Holt-Winters 季节周期（点数）
+    FORECAST_SEASON = int(os.environ.get('FORECAST_SEASON', 6))
+
+    # /api/analyze 结果缓存（按数据版本失效，支持 ETag）
+    ANALYZE_CACHE = os.environ.get('ANALYZE_CACHE', '1') == '1'
+    ANALYZE_CACHE_ENTRIES = int(os.environ.get('ANALYZE_CACHE_ENTRIES', 256))
+
+    # /api/series 降采样（method: lttb / minmax）
+    SERIES_METHOD = os.environ.get('SERIES_METHOD', 'lttb')
+    SERIES_DEFAULT_POINTS = int(os.environ.get('SERIES_DEFAULT_POINTS', 1000))
+    SERIES_MAX_POINTS = int(os.environ.get('SERIES_MAX_POINTS', 10000))
+
+    # 预聚合（1m / 1h / 1d），目录相对数据目录
+    ROLLUPS = os.environ.get('ROLLUPS', '1') == '1'
+    ROLLUP_DIR = os.environ.get('ROLLUP_DIR', 'rollups')
+    # 压实前允许追加的行数下限（同时不少于已压实的行数）
+    ROLLUP_COMPACT_MIN_ROWS = int(os.environ.get('ROLLUP_COMPACT_MIN_ROWS', 10000))
+
+    # 流式异常检测（EWMA 控制限），告警日志相对数据目录
+    ANOMALY_DETECTION = os.environ.get('ANOMALY_DETECTION', '1') == '1'
+    ANOMALY_ALPHA = float(os.environ.get('ANOMALY_ALPHA', 0.05))
+    ANOMALY_THRESHOLD = float(os.environ.get('ANOMALY_THRESHOLD', 4.0))
+    ANOMALY_WARMUP = int(os.environ.get('ANOMALY_WARMUP', 30))
+    ANOMALY_LOG = os.environ.get('ANOMALY_LOG', 'alerts.jsonl')
+    ANOMALY_LOG_SIZE = int(os.environ.get('ANOMALY_LOG_SIZE', 1000))
+    ANOMALY_LOG_MAX_BYTES = int(os.environ.get('ANOMALY_LOG_MAX_BYTES', 10 * 1024 * 1024))
+
+    # 订阅端处理流水线（policy: block / drop_newest / drop_oldest）
+    PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 10000))
+    PIPELINE_PUT_TIMEOUT = float(os.environ.get('PIPELINE_PUT_TIMEOUT', 0.1))
+    PIPELINE_DROP_POLICY = os.environ.get('PIPELINE_DROP_POLICY', 'drop_newest')
+    PIPELINE_BROADCAST_POLICY = os.environ.get('PIPELINE_BROADCAST_POLICY', 'drop_oldest')
+
+    # 订阅端按 (传感器, 时间戳) 丢弃重复数据
+    INGEST_DEDUP = os.environ.get('INGEST_DEDUP', '1') == '1'
+
+    # 最近数据环形缓冲
+    HISTORY_RING_SIZE = int(os.environ.get('HISTORY_RING_SIZE', 10000))
+    HISTORY_DEFAULT_LIMIT = int(os.environ.get('HISTORY_DEFAULT_LIMIT', 50))
 
     # 数据目录
     DATA_DIR = os.environ.get('DATA_DIR', '../data')
+
+    # 发布端源数据列式缓存（相对数据目录）
+    SOURCE_CACHE = os.environ.get('SOURCE_CACHE', '1') == '1'
+    SOURCE_CACHE_DIR = os.environ.get('SOURCE_CACHE_DIR', '.cache')
+
+    # 发布端数据源（source: cache / stream / csv / txt）
+    PUBLISH_SOURCE = os.environ.get('PUBLISH_SOURCE', 'cache')
+    SOURCE_TEMPERATURE_FILE = os.environ.get('SOURCE_TEMPERATURE_FILE', 'temperature.txt')
+    SOURCE_HUMIDITY_FILE = os.environ.get('SOURCE_HUMIDITY_FILE', 'humidity.txt')
+    SOURCE_PRESSURE_FILE = os.environ.get('SOURCE_PRESSURE_FILE', 'pressure.txt')
+    # 源文件格式（json / ndjson / csv），留空则按扩展名判断
+    SOURCE_FORMAT = os.environ.get('SOURCE_FORMAT', '')
+    # 流式读取时的重排窗口，需覆盖源文件中时间戳的最大乱序距离
+    SOURCE_REORDER_WINDOW = int(os.environ.get('SOURCE_REORDER_WINDOW', 10000))
+
+    # 日志（DEBUG / INFO / WARNING / ERROR）；同一处日志每 LOG_RATE_INTERVAL 秒最多输出 LOG_RATE_BURST 条
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_RATE_BURST = int(os.environ.get('LOG_RATE_BURST', 10))
+    LOG_RATE_INTERVAL = float(os.environ.get('LOG_RATE_INTERVAL', 10.0))
+
+    # /metrics 时延直方图的桶上限（秒，逗号分隔）
+    METRICS_BUCKETS = os.environ.get(
+        'METRICS_BUCKETS', '0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10')
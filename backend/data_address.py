@@ -1,60 +1,485 @@
 import pandas as pd
 import numpy as np
 import os
-from sklearn.linear_model import LinearRegression
-from flask import Flask, jsonify, Blueprint
+import time
+import threading
+from flask import Flask, jsonify, Blueprint, request, Response
 from flask_cors import CORS
 from config import Config
+from segments import open_store, format_ts, to_epoch_seconds, worker_ids
+from analytics import RunningStats, load_snapshot, snapshot_path, sensor_snapshot_path
+from result_cache import ResultCache
+from forecast import forecast, parse_forecast_options
+from downsample import METHODS, downsample, select
+from rollups import RollupStore, RollupGroup, TIERS, TIER_SECONDS, choose_tier, cover, \
+    default_root as rollups_root
+from logs import get_logger
+import metrics
 
 data_bp = Blueprint('data', __name__)
 
+log = get_logger("data_address")
+PROCESS_DURATION = metrics.histogram(
+    "iot_analysis_duration_seconds", "DataProcessor.process 耗时（mode: incremental / full）", ("mode",))
+
 
 class DataProcessor:
-    def __init__(self, csv_path):
+    def __init__(self, csv_path, store=None, snapshot=None, rollups=None):
         self.csv_path = csv_path
+        # 按传感器分片的段存储（订阅端写入）；为空时回退到读取 CSV
+        self.store = store
+        # 订阅端维护的 1m / 1h / 1d 预聚合
+        self.rollups = rollups
+        self._rollup_group = None
+        # 订阅端维护的增量分析快照
+        self.snapshot_path = snapshot or snapshot_path()
         # 系统支持的指标维度
         self.metrics = ["temperature", "humidity", "pressure"]
         # 传感器元信息（实际项目可从数据库读取）
-        self.sensor_info = {
-            "sensor_id": "ENV_SENSOR_001",
-            "location": "同济大学嘉定校区-济事楼416",
-            "device_type": "环境监测传感器",
-            "install_date": "2024-09-01"
+        self.sensor_meta = {
+            "ENV_SENSOR_001": {
+                "location": "同济大学嘉定校区-济事楼416",
+                "device_type": "环境监测传感器",
+                "install_date": "2024-09-01"
+            }
         }
 
-    def predict_series(self, df, column, points=5):
+    def sensor_info(self, sensor_id=None):
+        sensor_id = sensor_id or Config.DEFAULT_SENSOR_ID
+        return {"sensor_id": sensor_id, **self.sensor_meta.get(sensor_id, {})}
+
+    def sensors(self):
         """
-        对单个时间序列做线性回归拟合与简单预测 
+        传感器注册表：每个传感器的行数、时间范围、最近上报时间与主题。
+        没有段存储时从 CSV 统计（旧 CSV 没有 sensor_id 列，全部属于默认传感器）
         """
-        if column not in df.columns:
-            return [], []
+        if self.store is not None and self.store.count():
+            out = []
+            for sensor_id, entry in self.store.registry().items():
+                out.append({
+                    **self.sensor_info(sensor_id),
+                    "rows": entry.get("rows", 0),
+                    "first_ts": format_ts(entry["min_ts"]).item() if entry.get("rows") else None,
+                    "last_ts": format_ts(entry["max_ts"]).item() if entry.get("rows") else None,
+                    "first_seen": entry.get("first_seen"),
+                    "last_seen": entry.get("last_seen"),
+                    "topic": entry.get("topic")
+                })
+            return out
 
-        y = df[column].values
-        if len(y) < 2:
-            return [], []
+        if not os.path.exists(self.csv_path):
+            return []
+        df = pd.read_csv(self.csv_path)
+        if "sensor_id" not in df.columns:
+            df["sensor_id"] = Config.DEFAULT_SENSOR_ID
+        df["sensor_id"] = df["sensor_id"].fillna(Config.DEFAULT_SENSOR_ID)
+        out = []
+        for sensor_id, group in df.groupby("sensor_id", sort=False):
+            out.append({
+                **self.sensor_info(sensor_id),
+                "rows": len(group),
+                "first_ts": str(group["timestamp"].min()),
+                "last_ts": str(group["timestamp"].max())
+            })
+        return out
+
+    def has_sensor(self, sensor_id):
+        if self.store is not None:
+            registry = self.store.registry()
+            if any(entry.get("rows") for entry in registry.values()):
+                return sensor_id in registry
+        return any(s["sensor_id"] == sensor_id for s in self.sensors())
+
+    def predict(self, df, columns, options):
+        """
+        所有指标一次拟合（向量化），返回 {指标: (拟合值, 预测值)}
+        """
+        columns = [c for c in columns if c in df.columns]
+        if not columns or len(df) < 2:
+            return {c: ([], []) for c in columns}
 
-        X = np.arange(len(y)).reshape(-1, 1)
+        fitted, future = forecast(df[columns].to_numpy(dtype=np.float64),
+                                  options["model"], options["horizon"])
+        return {c: (fitted[:, i].tolist(), future[:, i].tolist())
+                for i, c in enumerate(columns)}
 
-        model = LinearRegression()
-        model.fit(X, y)
+    def load_frame(self, start=None, end=None, sensor_id=None):
+        """
+        从段存储读取（按时间排序），段存储为空时返回 None；
+        指定 sensor_id 时只读取该传感器的分片
+        """
+        if self.store is None or not self.store.count():
+            return None
+        data, sensors = self.store.read(start, end, sensor_id, metrics=self.metrics)
+        frame = {"timestamp": format_ts(data["ts"])}
+        if sensors:
+            frame["sensor_id"] = np.asarray(sensors, dtype=object)[data["sensor"]]
+        for m in self.metrics:
+            frame[m] = data[m]
+        return pd.DataFrame(frame)
+
+    def trend(self, plot_df, available_metrics, options):
+        """
+        最近 window 个点的滑动平均与预测，返回 (分析结果, 图表标签)；
+        会给 plot_df 增加 *_smooth 与 timestamp_fmt 列
+        """
+        # ----------------------------------------------------
+        # 趋势分析（滑动平均）
+        # ----------------------------------------------------
+        for m in available_metrics:
+            plot_df[f"{m}_smooth"] = plot_df[m].rolling(
+                window=5, min_periods=1
+            ).mean()
 
-        fitted = model.predict(X).tolist()
-        future_X = np.arange(len(y), len(y) + points).reshape(-1, 1)
-        future = model.predict(future_X).tolist()
+        # ----------------------------------------------------
+        # 预测（linear / ewma / holt / holt_winters）
+        # ----------------------------------------------------
+        analysis_result = {}
+        predictions = self.predict(plot_df, available_metrics, options)
 
-        return fitted, future
+        for m in available_metrics:
+            fitted, predicted = predictions[m]
+            analysis_result[m] = {
+                "raw": plot_df[m].tolist(),
+                "smooth": plot_df[f"{m}_smooth"].tolist(),
+                "fitted": fitted,
+                "predict": predicted
+            }
 
-    def process(self):
         # ----------------------------------------------------
-        # CSV 文件检查
+        # 时间格式处理
         # ----------------------------------------------------
+        if "timestamp" in plot_df.columns:
+            plot_df["timestamp"] = pd.to_datetime(
+                plot_df["timestamp"],
+                errors="coerce"
+            )
+
+            # 转成更短、更适合图表的格式
+            plot_df["timestamp_fmt"] = plot_df["timestamp"].dt.strftime(
+                "%m-%d %H:%M")
+        else:
+            plot_df["timestamp_fmt"] = list(range(len(plot_df)))
+
+        return analysis_result, plot_df["timestamp_fmt"].tolist()
+
+    def load_range(self, start=None, end=None, sensor_id=None, metrics=None):
+        """
+        读取 [start, end]（整数 Unix 秒，end 这一秒内带小数的时间戳也包含在内）范围内的数据，
+        返回按时间排序的 {"ts": Unix 秒数组（float64）, 指标: 数组}；段存储只读取相关的段
+        """
+        metrics = list(metrics or self.metrics)
+        upper = None if end is None else float(np.nextafter(end + 1, -np.inf))
+        if self.store is not None and self.store.count():
+            data, _ = self.store.read(start, upper, sensor_id, metrics)
+            return data
+
         if not os.path.exists(self.csv_path):
-            return {"error": "Wait for data... CSV file not found."}
+            return {"ts": np.empty(0, np.float64), **{m: np.empty(0) for m in metrics}}
+        df = pd.read_csv(self.csv_path)
+        ts = pd.to_datetime(df["timestamp"], errors="coerce")
+        df["ts"] = (ts - pd.Timestamp(0)) / pd.Timedelta(seconds=1)
+        df = df.dropna(subset=["ts"])
+        if start is not None:
+            df = df[df["ts"] >= start]
+        if upper is not None:
+            df = df[df["ts"] <= upper]
+        if sensor_id is not None:
+            # 旧 CSV 没有 sensor_id 列，全部属于默认传感器
+            sensors = df["sensor_id"] if "sensor_id" in df.columns else \
+                pd.Series(Config.DEFAULT_SENSOR_ID, index=df.index)
+            df = df[sensors == sensor_id]
+        df = df.sort_values("ts", kind="stable")
+        out = {"ts": df["ts"].to_numpy(dtype=np.float64)}
+        for m in metrics:
+            out[m] = pd.to_numeric(df[m], errors="coerce").to_numpy(dtype=np.float64) \
+                if m in df.columns else np.full(len(df), np.nan)
+        return out
+
+    def workers(self):
+        """订阅端各 worker 的编号（单进程为 [None]），决定读取哪些快照与预聚合"""
+        return worker_ids(self.store.workers()) if self.store is not None else [None]
+
+    def rollup_reader(self):
+        """单进程订阅时即预聚合本身，多进程时为合并各 worker 预聚合的读取器"""
+        workers = self.workers()
+        if self.rollups is None or workers == [None]:
+            return self.rollups
+        group = self._rollup_group
+        if group is None or group.workers != workers:
+            group = self._rollup_group = RollupGroup(self.rollups.root, workers)
+        return group
+
+    def rollup_bounds(self):
+        """预聚合覆盖的时间范围 [lo, hi)，没有预聚合时返回 None"""
+        if self.rollups is None:
+            return None
+        days = self.rollup_reader().read("1d")
+        if not len(days["bucket"]):
+            return None
+        return int(days["bucket"][0]), int(days["bucket"][-1]) + TIER_SECONDS["1d"]
+
+    def pick_tier(self, start, end, max_points):
+        """自动选择满足分辨率的最粗预聚合粒度，None 表示使用原始数据"""
+        bounds = self.rollup_bounds()
+        if bounds is None:
+            return None
+        lo = bounds[0] if start is None else start
+        hi = bounds[1] if end is None else end + 1
+        return choose_tier(lo, hi, max_points)
+
+    def series(self, start=None, end=None, max_points=None, method=None,
+               sensor_id=None, metrics=None, tier="auto"):
+        """
+        时间范围查询并降采样，每个指标最多返回 max_points 个点。
+        tier 为 auto 时按分辨率自动选择预聚合粒度（1m / 1h / 1d），也可指定 raw 或某个粒度
+        """
+        metrics = list(metrics or self.metrics)
+        max_points = max_points or Config.SERIES_DEFAULT_POINTS
+        method = method or Config.SERIES_METHOD
+        if tier == "auto":
+            tier = self.pick_tier(start, end, max_points) or "raw"
+        if tier != "raw" and self.rollups is None:
+            tier = "raw"
+
+        result = {}
+        if tier == "raw":
+            data = self.load_range(start, end, sensor_id, metrics)
+            total = len(data["ts"])
+            for m in metrics:
+                x, y = downsample(data["ts"], data[m], max_points, method)
+                result[m] = {
+                    "timestamps": format_ts(x).tolist(),
+                    "values": y.tolist()
+                }
+        else:
+            seconds = TIER_SECONDS[tier]
+            lo = None if start is None else start - start % seconds
+            hi = None if end is None else end + 1
+            data = self.rollup_reader().read(tier, lo, hi, sensor_id)
+            x = data["bucket"]
+            total = 0
+            for m in metrics:
+                count = data[f"{m}_count"]
+                total = max(total, int(count.sum()))
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    mean = np.where(count > 0, data[f"{m}_sum"] / count, np.nan)
+                index = select(x, mean, max_points, method)
+                result[m] = {
+                    "timestamps": format_ts(x[index]).tolist(),
+                    "values": mean[index].round(4).tolist(),
+                    "min": data[f"{m}_min"][index].tolist(),
+                    "max": data[f"{m}_max"][index].tolist(),
+                    "count": count[index].tolist()
+                }
+
+        return {
+            "start": format_ts(start).item() if start is not None else None,
+            "end": format_ts(end).item() if end is not None else None,
+            "sensor_id": sensor_id,
+            "tier": tier,
+            "method": method,
+            "max_points": max_points,
+            "total_points": int(total),
+            "series": result
+        }
 
+    def range_stats(self, start=None, end=None, sensor_id=None):
+        """
+        时间范围内各指标的 count / min / max / avg。
+        范围中间用粗粒度预聚合，两端依次用更细的粒度，不足 1 分钟的边角才读原始数据
+        """
+        bounds = self.rollup_bounds()
+        if bounds is None:
+            pieces = [("raw", start, None if end is None else end + 1)]
+        else:
+            lo = bounds[0] if start is None else start
+            hi = bounds[1] if end is None else end + 1
+            pieces = cover(lo, hi)
+
+        acc = {m: [0, 0.0, np.inf, -np.inf] for m in self.metrics}
+        plan = {}
+        for name, a, b in pieces:
+            if name == "raw":
+                data = self.load_range(a, None if b is None else b - 1, sensor_id)
+                for m in self.metrics:
+                    v = data[m][~np.isnan(data[m])]
+                    if len(v):
+                        acc[m][0] += len(v)
+                        acc[m][1] += float(v.sum())
+                        acc[m][2] = min(acc[m][2], float(v.min()))
+                        acc[m][3] = max(acc[m][3], float(v.max()))
+                rows = len(data["ts"])
+            else:
+                data = self.rollup_reader().read(name, a, b, sensor_id)
+                for m in self.metrics:
+                    count = data[f"{m}_count"]
+                    if count.sum():
+                        has = count > 0
+                        acc[m][0] += int(count.sum())
+                        acc[m][1] += float(data[f"{m}_sum"].sum())
+                        acc[m][2] = min(acc[m][2], float(data[f"{m}_min"][has].min()))
+                        acc[m][3] = max(acc[m][3], float(data[f"{m}_max"][has].max()))
+                rows = len(data["bucket"])
+            plan[name] = plan.get(name, 0) + rows
+
+        stats = {}
+        for m, (count, total, low, high) in acc.items():
+            stats[m] = {
+                "count": count,
+                "min": low if count else None,
+                "max": high if count else None,
+                "avg": round(total / count, 2) if count else None
+            }
+        return {
+            "start": format_ts(start).item() if start is not None else None,
+            "end": format_ts(end).item() if end is not None else None,
+            "sensor_id": sensor_id,
+            "stats": stats,
+            # 每种粒度读取的行数（raw 为原始数据行数）
+            "plan": plan
+        }
+
+    def data_version(self, mode=None, sensor_id=None):
+        """
+        当前数据版本：参与计算的文件的 (路径, mtime_ns, 大小)。
+        订阅端写入新数据或更新快照后版本随之变化；指定 sensor_id 时只看该传感器的快照和分片
+        """
+        paths = []
+        if mode != "full" and Config.ANALYTICS_INCREMENTAL:
+            paths.extend([sensor_snapshot_path(sensor_id)] if sensor_id
+                         else self.snapshot_paths())
+        if self.store is not None:
+            paths.extend([self.store.shard_index_path(sensor_id)] if sensor_id
+                         else self.store.registry_paths())
+        if self.rollups is not None:
+            paths.extend(self.rollup_reader().index_paths())
+        paths.append(self.csv_path)
+
+        version = [mode]
+        for path in paths:
+            try:
+                st = os.stat(path)
+                version.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                version.append((path, None, None))
+        return tuple(version)
+
+    def process(self, mode=None, options=None, sensor_id=None):
+        """
+        mode="full" 时强制全量重算，否则优先使用订阅端维护的增量分析快照；
+        options 为 parse_forecast_options 的结果（预测模型、步数与窗口）；
+        指定 sensor_id 时只分析该传感器（快照与分片都只读该传感器的）
+        """
+        options = options or parse_forecast_options({})
+        start = time.perf_counter()
+        if mode != "full" and Config.ANALYTICS_INCREMENTAL:
+            result = self.process_incremental(options, sensor_id)
+            if result is not None:
+                PROCESS_DURATION.observe(time.perf_counter() - start, mode="incremental")
+                return result
+        result = self.process_full(options, sensor_id)
+        PROCESS_DURATION.observe(time.perf_counter() - start, mode="full")
+        return result
+
+    def snapshot_paths(self):
+        """全部数据的分析快照；多进程订阅时每个 worker 一份"""
+        workers = self.workers()
+        if workers == [None]:
+            return [self.snapshot_path]
+        return [snapshot_path(w) for w in workers]
+
+    def load_state(self, sensor_id=None):
+        """
+        读取增量分析状态，多进程订阅时合并各 worker 的快照；
+        任一快照缺失或与对应的存储（注册表 / 分片）不一致时返回 None
+        """
+        if sensor_id:
+            paths = [sensor_snapshot_path(sensor_id)]
+            identities = [self.store.shard_identity(sensor_id)] if self.store is not None else [None]
+        else:
+            paths = self.snapshot_paths()
+            identities = self.store.identities() if self.store is not None else [None]
+
+        merged = None
+        for path, identity in zip(paths, identities):
+            state = RunningStats.from_dict(load_snapshot(path))
+            if state is None or state.engine != Config.STORAGE_ENGINE:
+                return None
+            if identity is not None and identity != (state.store_id, state.generation):
+                return None
+            if merged is None:
+                merged = state
+            else:
+                merged.merge(state)
+        return merged
+
+    def process_incremental(self, options, sensor_id=None):
+        """
+        从增量分析快照生成结果，代价与数据总量无关；
+        快照不存在或与当前存储不一致时返回 None，由调用方回退到全量计算
+        """
+        state = self.load_state(sensor_id)
+        if state is None or state.n < 2:
+            return None
+
+        available_metrics = list(self.metrics)
+        stats = state.stats()
+
+        plot_df = pd.DataFrame(
+            [[ts] + values for ts, values in state.recent[-options["window"]:]],
+            columns=["timestamp"] + available_metrics)
+        analysis_result, labels = self.trend(plot_df, available_metrics, options)
+
+        time_range = {}
+        start = pd.to_datetime(state.first_ts, errors="coerce")
+        end = pd.to_datetime(state.last_ts, errors="coerce")
+        if not pd.isna(start) and not pd.isna(end):
+            time_range = {
+                "start": start.strftime("%Y-%m-%d %H:%M:%S"),
+                "end": end.strftime("%Y-%m-%d %H:%M:%S"),
+                "duration_hours": round((end - start).total_seconds() / 3600, 2)
+            }
+
+        return {
+            "stats": stats,
+            "data": analysis_result,
+            "labels": labels,
+            "correlation": state.correlation(),
+            "available_metrics": available_metrics,
+            "sensor_info": self.sensor_info(sensor_id),
+            "time_range": time_range,
+            "forecast": options,
+            "data_quality": {
+                "total_records": state.n + state.incomplete,
+                "analyzed_records": len(plot_df),
+                "missing_rate": state.missing_rate()
+            }
+        }
+
+    def process_full(self, options, sensor_id=None):
+        # ----------------------------------------------------
+        # 读取数据：优先段存储，否则读取 CSV 文件
+        # ----------------------------------------------------
         try:
-            df = pd.read_csv(self.csv_path)
+            df = self.load_frame(sensor_id=sensor_id)
         except Exception as e:
-            return {"error": f"Read CSV failed: {str(e)}"}
+            return {"error": f"Read segments failed: {str(e)}"}
+
+        if df is None:
+            if not os.path.exists(self.csv_path):
+                return {"error": "Wait for data... CSV file not found."}
+
+            try:
+                df = pd.read_csv(self.csv_path)
+            except Exception as e:
+                return {"error": f"Read CSV failed: {str(e)}"}
+
+            if sensor_id is not None:
+                sensors = df["sensor_id"].fillna(Config.DEFAULT_SENSOR_ID) \
+                    if "sensor_id" in df.columns else \
+                    pd.Series(Config.DEFAULT_SENSOR_ID, index=df.index)
+                df = df[sensors == sensor_id]
 
         if df.empty or len(df) < 2:
             return {"error": "Need more data points for analysis."}
@@ -70,6 +495,8 @@ class DataProcessor:
         for m in available_metrics:
             df[m] = pd.to_numeric(df[m], errors="coerce")
 
+        # 缺少指标的样本不参与分析，只计入缺失率
+        total_records = len(df)
         df = df.dropna(subset=available_metrics)
 
         if df.empty:
@@ -89,28 +516,10 @@ class DataProcessor:
         stats["current_count"] = len(df)
 
         # ----------------------------------------------------
-        # 趋势分析（最近 30 个点，滑动平均）
+        # 趋势分析与预测（最近 window 个点）
         # ----------------------------------------------------
-        plot_df = df.tail(30).copy()
-
-        for m in available_metrics:
-            plot_df[f"{m}_smooth"] = plot_df[m].rolling(
-                window=5, min_periods=1
-            ).mean()
-
-        # ----------------------------------------------------
-        # 简单预测（线性回归）
-        # ----------------------------------------------------
-        analysis_result = {}
-
-        for m in available_metrics:
-            fitted, predicted = self.predict_series(plot_df, m)
-            analysis_result[m] = {
-                "raw": plot_df[m].tolist(),
-                "smooth": plot_df[f"{m}_smooth"].tolist(),
-                "fitted": fitted,
-                "predict": predicted
-            }
+        plot_df = df.tail(options["window"]).copy()
+        analysis_result, labels = self.trend(plot_df, available_metrics, options)
 
         # ----------------------------------------------------
         # 相关性分析（至少两个维度才有意义）
@@ -125,29 +534,16 @@ class DataProcessor:
             )
 
         # ----------------------------------------------------
-        # 时间格式处理与时间范围统计
+        # 时间范围统计（使用全量数据）
         # ----------------------------------------------------
         time_range = {}
-        if "timestamp" in plot_df.columns:
-            plot_df["timestamp"] = pd.to_datetime(
-                plot_df["timestamp"],
-                errors="coerce"
-            )
-
-            # 转成更短、更适合图表的格式
-            plot_df["timestamp_fmt"] = plot_df["timestamp"].dt.strftime(
-                "%m-%d %H:%M")
-
-            # 计算时间范围（使用全量数据）
-            if "timestamp" in df.columns and not df["timestamp"].isna().all():
-                df_time = pd.to_datetime(df["timestamp"], errors="coerce")
-                time_range = {
-                    "start": df_time.min().strftime("%Y-%m-%d %H:%M:%S"),
-                    "end": df_time.max().strftime("%Y-%m-%d %H:%M:%S"),
-                    "duration_hours": round((df_time.max() - df_time.min()).total_seconds() / 3600, 2)
-                }
-        else:
-            plot_df["timestamp_fmt"] = list(range(len(plot_df)))
+        if "timestamp" in df.columns and not df["timestamp"].isna().all():
+            df_time = pd.to_datetime(df["timestamp"], errors="coerce")
+            time_range = {
+                "start": df_time.min().strftime("%Y-%m-%d %H:%M:%S"),
+                "end": df_time.max().strftime("%Y-%m-%d %H:%M:%S"),
+                "duration_hours": round((df_time.max() - df_time.min()).total_seconds() / 3600, 2)
+            }
 
         # ----------------------------------------------------
         # 返回统一结构，直接给前端
@@ -155,15 +551,16 @@ class DataProcessor:
         return {
             "stats": stats,
             "data": analysis_result,
-            "labels": plot_df["timestamp_fmt"].tolist(),
+            "labels": labels,
             "correlation": correlation,
             "available_metrics": available_metrics,
-            "sensor_info": self.sensor_info,
+            "sensor_info": self.sensor_info(sensor_id),
             "time_range": time_range,
+            "forecast": options,
             "data_quality": {
-                "total_records": len(df),
+                "total_records": total_records,
                 "analyzed_records": len(plot_df),
-                "missing_rate": round((1 - len(df.dropna()) / len(df)) * 100, 2) if len(df) > 0 else 0
+                "missing_rate": round((1 - len(df) / total_records) * 100, 2)
             }
         }
 
@@ -173,14 +570,199 @@ DATA_DIR = os.path.normpath(os.path.join(BASE_DIR, "..", "data"))
 os.makedirs(DATA_DIR, exist_ok=True)
 CSV_PATH = os.path.join(DATA_DIR, "sensor_data.csv")
 
-processor = DataProcessor(CSV_PATH)
+# 第一次请求（或后台预热）时才打开段存储与预聚合，导入本模块不读磁盘
+_processor = None
+_processor_lock = threading.Lock()
+
+
+def get_processor():
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                _processor = DataProcessor(
+                    CSV_PATH,
+                    open_store() if Config.STORAGE_ENGINE == "segments" else None,
+                    rollups=RollupStore(rollups_root()) if Config.ROLLUPS else None)
+    return _processor
+
+
+# 按数据版本缓存分析结果，轮询时数据未变化直接返回缓存或 304
+analyze_cache = ResultCache(Config.ANALYZE_CACHE_ENTRIES)
+
+
+def cached_response(key, version, compute):
+    """按数据版本缓存结果，支持 ETag / If-None-Match"""
+    entry, source = analyze_cache.get(key, version, compute)
+
+    if entry.status == 200 and request.if_none_match.contains(entry.etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, status=entry.status,
+                            mimetype="application/json")
+    if entry.status == 200:
+        response.set_etag(entry.etag)
+    # 浏览器每次都带 If-None-Match 回源校验
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Cache"] = source
+    return response
+
+
+def _compute_analysis(mode, options, sensor_id=None):
+    try:
+        # 未知传感器的 404 与分析结果一样按数据版本缓存，命中缓存时不再读取注册表
+        if sensor_id is not None and not get_processor().has_sensor(sensor_id):
+            return {"error": f"未知传感器: {sensor_id}"}, 404
+        return get_processor().process(mode, options, sensor_id), 200
+    except Exception as e:
+        log.error("分析服务错误: %s", e)
+        return {"error": f"分析服务错误: {str(e)}"}, 500
+
+
+def analysis_key(mode, options, sensor_id=None):
+    return ("analyze", mode, sensor_id) + tuple(sorted(options.items()))
 
 
 @data_bp.route("/api/analyze", methods=["GET"])
 def analyze_data():
+    mode = request.args.get("mode")
     try:
-        result = processor.process()
-        return jsonify(result)
+        options = parse_forecast_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    sensor_id = request.args.get("sensor_id") or None
+
+    if not Config.ANALYZE_CACHE:
+        result, status = _compute_analysis(mode, options, sensor_id)
+        return jsonify(result), status
+
+    return cached_response(analysis_key(mode, options, sensor_id),
+                           get_processor().data_version(mode, sensor_id),
+                           lambda: _compute_analysis(mode, options, sensor_id))
+
+
+@data_bp.route("/api/sensors", methods=["GET"])
+def sensor_registry():
+    try:
+        sensors = get_processor().sensors()
+    except Exception as e:
+        log.error("传感器注册表读取错误: %s", e)
+        return jsonify({"error": f"传感器注册表读取错误: {str(e)}"}), 500
+    return jsonify({"count": len(sensors), "sensors": sensors})
+
+
+def parse_series_options(params):
+    """解析 /api/series 的查询参数，非法时抛出 ValueError"""
+    options = {}
+    for name in ("start", "end"):
+        value = params.get(name)
+        if value:
+            seconds = to_epoch_seconds([value])[0]
+            if seconds is None:
+                raise ValueError(f"{name} 必须是 ISO 时间，如 2014-02-13T06:00:00")
+            options[name] = seconds
+        else:
+            options[name] = None
+    if options["start"] is not None and options["end"] is not None and \
+            options["start"] > options["end"]:
+        raise ValueError("start 不能晚于 end")
+
+    try:
+        max_points = int(params.get("max_points", Config.SERIES_DEFAULT_POINTS))
+    except (TypeError, ValueError):
+        raise ValueError("max_points 必须是整数")
+    if not 3 <= max_points <= Config.SERIES_MAX_POINTS:
+        raise ValueError(f"max_points 必须在 3 到 {Config.SERIES_MAX_POINTS} 之间")
+    options["max_points"] = max_points
+
+    method = params.get("method") or Config.SERIES_METHOD
+    if method not in METHODS:
+        raise ValueError(f"method 必须是 {', '.join(METHODS)} 之一")
+    options["method"] = method
+
+    processor = get_processor()
+    metrics = params.get("metrics")
+    if metrics:
+        metrics = [m.strip() for m in metrics.split(",") if m.strip()]
+        unknown = [m for m in metrics if m not in processor.metrics]
+        if unknown:
+            raise ValueError(f"未知指标: {', '.join(unknown)}")
+    options["metrics"] = tuple(metrics or processor.metrics)
+    options["sensor_id"] = params.get("sensor_id") or None
+
+    tier = params.get("tier") or "auto"
+    tiers = ("auto", "raw") + tuple(name for name, _ in TIERS)
+    if tier not in tiers:
+        raise ValueError(f"tier 必须是 {', '.join(tiers)} 之一")
+    options["tier"] = tier
+    return options
+
+
+def _compute_series(options):
+    try:
+        return get_processor().series(**options), 200
     except Exception as e:
-        print(f"分析服务错误: {str(e)}")
-        return jsonify({"error": f"分析服务错误: {str(e)}"}), 500
+        log.error("序列查询错误: %s", e)
+        return {"error": f"序列查询错误: {str(e)}"}, 500
+
+
+@data_bp.route("/api/series", methods=["GET"])
+def series_data():
+    try:
+        options = parse_series_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not Config.ANALYZE_CACHE:
+        result, status = _compute_series(options)
+        return jsonify(result), status
+
+    key = ("series",) + tuple(sorted(options.items()))
+    return cached_response(key, get_processor().data_version("full"),
+                           lambda: _compute_series(options))
+
+
+def _compute_range_stats(options):
+    try:
+        return get_processor().range_stats(**options), 200
+    except Exception as e:
+        log.error("统计查询错误: %s", e)
+        return {"error": f"统计查询错误: {str(e)}"}, 500
+
+
+@data_bp.route("/api/stats", methods=["GET"])
+def range_stats():
+    try:
+        parsed = parse_series_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    options = {k: parsed[k] for k in ("start", "end", "sensor_id")}
+
+    if not Config.ANALYZE_CACHE:
+        result, status = _compute_range_stats(options)
+        return jsonify(result), status
+
+    key = ("stats",) + tuple(sorted(options.items()))
+    return cached_response(key, get_processor().data_version("full"),
+                           lambda: _compute_range_stats(options))
+
+
+@data_bp.route("/api/analyze/cache", methods=["GET"])
+def analyze_cache_stats():
+    return jsonify(analyze_cache.stats())
+
+
+def warmup():
+    """
+    后台预热：打开存储并按前端默认请求（GET /api/analyze）算好分析结果放进缓存，
+    第一个真实请求直接命中；返回用时（秒）
+    """
+    start = time.perf_counter()
+    processor = get_processor()
+    if Config.ANALYZE_CACHE:
+        options = parse_forecast_options({})
+        analyze_cache.get(analysis_key(None, options), processor.data_version(None),
+                          lambda: _compute_analysis(None, options))
+    else:
+        _compute_analysis(None, parse_forecast_options({}))
+    return time.perf_counter() - start
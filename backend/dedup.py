@@ -0,0 +1,141 @@
+"""
+按传感器的时间戳索引：订阅端据此丢弃重复数据（发布端每次 /start 都会从头回放同一序列）
+
+- 每个传感器一个有序的 int64 数组（Unix 微秒，见 dedup_key，每条 8 字节）加一个存放最近新增时间戳的小集合；
+  查询先查集合，再在有序数组上二分查找，集合变大后合并进有序数组
+- 同一秒内的不同读数时间戳不同，不会被当作重复
+- 同时记录每个传感器的最新时间戳，用于统计迟到（乱序）的数据
+- 登记的数据最终没有写入存储时用 discard 撤销，之后的重发不会被当作重复
+"""
+import threading
+
+import numpy as np
+
+from config import Config
+
+# 新增集合达到有序数组的 1/MERGE_RATIO（且不少于 MERGE_MIN）时合并
+MERGE_MIN = 4096
+MERGE_RATIO = 16
+
+# 索引键的精度：微秒
+KEY_SCALE = 1000000
+
+
+def dedup_key(seconds):
+    """Unix 秒（可带小数）转为索引键"""
+    return int(round(seconds * KEY_SCALE))
+
+
+def dedup_keys(seconds):
+    """批量版本的 dedup_key（从段存储的 ts 列重建索引），与逐条计算的结果相同"""
+    return np.round(np.asarray(seconds, dtype=np.float64) * KEY_SCALE).astype(np.int64)
+
+
+class _SensorIndex:
+    __slots__ = ("sorted", "recent", "latest")
+
+    def __init__(self):
+        self.sorted = np.empty(0, dtype=np.int64)
+        self.recent = set()
+        self.latest = None
+
+    def __contains__(self, ts):
+        if ts in self.recent:
+            return True
+        i = np.searchsorted(self.sorted, ts)
+        return i < len(self.sorted) and self.sorted[i] == ts
+
+    def discard(self, ts):
+        if ts in self.recent:
+            self.recent.discard(ts)
+            return True
+        i = np.searchsorted(self.sorted, ts)
+        if i < len(self.sorted) and self.sorted[i] == ts:
+            self.sorted = np.delete(self.sorted, i)
+            return True
+        return False
+
+    def merge(self):
+        if self.recent:
+            recent = np.fromiter(self.recent, np.int64, len(self.recent))
+            self.sorted = np.union1d(self.sorted, recent)
+            self.recent = set()
+
+    def __len__(self):
+        return len(self.sorted) + len(self.recent)
+
+
+class TimestampIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sensors = {}
+        self.accepted = 0
+        self.duplicates = 0
+        self.late = 0
+        self.discarded = 0
+
+    def _get(self, sensor_id):
+        sensor_id = str(sensor_id or Config.DEFAULT_SENSOR_ID)
+        index = self.sensors.get(sensor_id)
+        if index is None:
+            index = self.sensors[sensor_id] = _SensorIndex()
+        return index
+
+    def add(self, sensor_id, ts):
+        """
+        登记一条数据，返回 "new" / "late" / "duplicate"。
+        late 表示时间戳早于该传感器已收到的最新数据（乱序到达），但不是重复
+        """
+        with self._lock:
+            index = self._get(sensor_id)
+            if ts in index:
+                self.duplicates += 1
+                return "duplicate"
+            index.recent.add(ts)
+            if len(index.recent) >= max(MERGE_MIN, len(index.sorted) // MERGE_RATIO):
+                index.merge()
+            self.accepted += 1
+            if index.latest is not None and ts < index.latest:
+                self.late += 1
+                return "late"
+            index.latest = ts
+            return "new"
+
+    def discard(self, sensor_id, ts):
+        """撤销一条已登记的数据（写入存储失败时调用），返回是否存在"""
+        with self._lock:
+            index = self.sensors.get(str(sensor_id or Config.DEFAULT_SENSOR_ID))
+            if index is None or not index.discard(ts):
+                return False
+            self.discarded += 1
+            return True
+
+    def load(self, sensor_ids, timestamps):
+        """用已有数据（启动时从存储读取）建立索引；sensor_ids 与 timestamps（索引键）等长"""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        sensor_ids = np.asarray(sensor_ids, dtype=object)
+        with self._lock:
+            for sensor_id in set(sensor_ids.tolist()):
+                index = self._get(sensor_id)
+                ts = timestamps[sensor_ids == sensor_id]
+                index.merge()
+                index.sorted = np.union1d(index.sorted, ts)
+                if len(index.sorted):
+                    latest = int(index.sorted[-1])
+                    index.latest = latest if index.latest is None else max(index.latest, latest)
+        return len(timestamps)
+
+    def clear(self):
+        with self._lock:
+            self.sensors = {}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sensors": len(self.sensors),
+                "timestamps": sum(len(i) for i in self.sensors.values()),
+                "accepted": self.accepted,
+                "duplicates": self.duplicates,
+                "late": self.late,
+                "discarded": self.discarded
+            }
@@ -0,0 +1,75 @@
+"""
+图表降采样：把任意长度的序列压缩到最多 max_points 个点
+
+- lttb:   Largest-Triangle-Three-Buckets，保留视觉形状
+- minmax: 每个桶保留最小值和最大值（按时间先后），不会漏掉尖峰
+"""
+import numpy as np
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb(x, y, n):
+    """返回选中点的下标；x 需升序"""
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        return np.linspace(0, size - 1, max(n, 1)).astype(np.int64)
+
+    x = x.astype(np.float64)
+    # 首尾两点固定，中间 size-2 个点分成 n-2 个桶
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    selected = np.empty(n, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 下一个桶的平均点（最后一个桶的下一个点是末点）
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (size - 1, size)
+        avg_x = x[nlo:nhi].mean()
+        avg_y = y[nlo:nhi].mean()
+
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - avg_x) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (avg_y - ay))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(x, y, n):
+    """返回选中点的下标：n // 2 个桶，每桶取最小值和最大值"""
+    size = len(x)
+    buckets = max(1, n // 2)
+    if size <= n:
+        return np.arange(size)
+
+    edges = np.linspace(0, size, buckets + 1).astype(int)
+    out = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        seg = y[lo:hi]
+        i, j = lo + int(np.argmin(seg)), lo + int(np.argmax(seg))
+        out.extend((i, j) if i <= j else (j, i))
+    return np.unique(np.asarray(out, dtype=np.int64))
+
+
+def select(x, y, n, method="lttb"):
+    """返回降采样后保留的点在原数组中的下标；y 中的 NaN 不会被选中"""
+    if method not in METHODS:
+        raise ValueError(f"method 必须是 {', '.join(METHODS)} 之一")
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= n:
+        return valid
+    xv, yv = x[valid], y[valid]
+    index = lttb(xv, yv, n) if method == "lttb" else minmax(xv, yv, n)
+    return valid[index]
+
+
+def downsample(x, y, n, method="lttb"):
+    """x, y 为等长数组（x 升序），返回 (x', y')；y 中的 NaN 会先去掉"""
+    index = select(x, y, n, method)
+    return x[index], y[index]
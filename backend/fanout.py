@@ -0,0 +1,292 @@
+"""
+多传感器扇出负载生成：用同一份源数据模拟 N 个虚拟传感器
+
+- 每个传感器有独立的 sensor_id、主题后缀、时间偏移与抖动
+- 传感器按轮询方式分配到若干个 MQTT 连接，每个连接由线程池或进程池中的一个 worker 驱动
+- 进程池模式下各 worker 拥有独立的 GIL，计数通过共享内存汇总
+- 线程池模式下各 worker 共享同一份解析结果；流式数据源先解析一次，不会每个连接各读一遍源文件
+"""
+import os
+import json
+import time
+import random
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import paho.mqtt.client as mqtt
+from config import Config
+from replay import parse_replay_options
+from inflight import InflightWindow
+from logs import get_logger
+import publish_common
+from publish_common import PUBLISHED, late_count, series_length
+
+log = get_logger("fanout")
+
+EXECUTORS = ("thread", "process")
+# 连接后等待握手完成的时间（秒），不计入发布耗时
+CONNECT_WAIT = 2
+
+# 进程池 worker 通过 initializer 继承的共享对象
+_shared_counts = None
+_shared_started = None
+_shared_stop = None
+
+
+def _init_process_worker(counts, started, stop_event):
+    global _shared_counts, _shared_started, _shared_stop
+    _shared_counts = counts
+    _shared_started = started
+    _shared_stop = stop_event
+
+
+def _process_worker(worker_id, sensors, source, replay_params, qos_options):
+    """进程池 worker 各自读取数据源，返回 (发送失败数, 迟到数据条数)"""
+    rows = publish_common.load_series(source)
+    failed = fanout_worker(worker_id, sensors, rows, replay_params, qos_options,
+                           _shared_counts, _shared_started, _shared_stop)
+    return failed, late_count(rows)
+
+
+def fanout_worker(worker_id, sensors, rows, replay_params, qos_options,
+                  counts, started, stop_event):
+    """
+    单个连接上的发布循环，返回发送失败数
+    sensors: [(序号, sensor_id, topic, 时间偏移秒, 抖动秒), ...]
+    started: 各 worker 连接完成、开始发布的时刻（Unix 秒），用于统计发布耗时
+    """
+    scheduler = parse_replay_options(replay_params)
+    rng = random.Random(worker_id)
+
+    client = publish_common.create_client(f"fanout-{os.getpid()}-{worker_id}")
+    window = None
+    if qos_options["qos"] == 1:
+        window = InflightWindow(client,
+                                window=qos_options["window"],
+                                timeout=qos_options["ack_timeout"])
+        client.on_publish = window.on_publish
+
+    client.connect(Config.MQTT_BROKER, Config.MQTT_PORT, 60)
+    client.loop_start()
+    time.sleep(CONNECT_WAIT)
+    started[worker_id] = time.time()
+
+    failed = 0
+    try:
+        for ts, temperature, humidity, pressure in rows:
+            base = datetime.fromisoformat(ts)
+            for index, sensor_id, topic, offset, jitter in sensors:
+                if stop_event.is_set() or not scheduler.wait(ts, stop_event):
+                    return failed
+
+                shift = offset + (rng.uniform(-jitter, jitter) if jitter else 0)
+                sensor_ts = (base + timedelta(seconds=shift)).isoformat()
+                payload = json.dumps(publish_common.build_message(
+                    sensor_ts, temperature, humidity, pressure, sensor_id))
+
+                if window is not None:
+                    sent = window.publish(topic, payload, stop_event)
+                else:
+                    sent = client.publish(topic, payload, qos=0).rc \
+                        == mqtt.MQTT_ERR_SUCCESS
+
+                if sent:
+                    # 每个传感器只归属一个 worker，计数无需加锁
+                    counts[index] += 1
+                    scheduler.mark_sent()
+                    PUBLISHED.inc(result="sent")
+                else:
+                    failed += 1
+                    PUBLISHED.inc(result="failed")
+
+        if window is not None and not window.drain(stop_event=stop_event):
+            failed += window.stats()["inflight"]
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+    return failed
+
+
+class FanoutRun:
+    def __init__(self, sensors=None, connections=None, executor=None,
+                 offset=None, jitter=None, replay_params=None, qos_options=None,
+                 source=None):
+        self.num_sensors = int(sensors or Config.FANOUT_SENSORS)
+        self.connections = min(int(connections or Config.FANOUT_CONNECTIONS),
+                               self.num_sensors)
+        self.executor = executor or Config.FANOUT_EXECUTOR
+        self.offset = float(offset if offset is not None else Config.FANOUT_OFFSET)
+        self.jitter = float(jitter if jitter is not None else Config.FANOUT_JITTER)
+        self.replay_params = dict(replay_params or {})
+        self.qos_options = qos_options
+        self.source = source
+
+        if self.num_sensors <= 0 or self.connections <= 0:
+            raise ValueError("sensors 和 connections 必须大于 0")
+        if self.executor not in EXECUTORS:
+            raise ValueError(f"executor 必须是 {', '.join(EXECUTORS)} 之一")
+        if self.jitter < 0:
+            raise ValueError("jitter 不能为负数")
+
+        # 总速率平均分给各个连接
+        if "rate" in self.replay_params:
+            self.replay_params["rate"] = \
+                float(self.replay_params["rate"]) / self.connections
+        elif self.replay_params.get("mode", Config.PUBLISH_MODE) == "rate":
+            self.replay_params["rate"] = Config.PUBLISH_RATE / self.connections
+        # 提前校验回放参数，避免在 worker 中才报错
+        parse_replay_options(self.replay_params)
+
+        self.sensors = []
+        for i in range(self.num_sensors):
+            sensor_id = f"{Config.FANOUT_SENSOR_PREFIX}{i + 1:03d}"
+            topic = Config.FANOUT_TOPIC_TEMPLATE.format(
+                topic=Config.MQTT_TOPIC, sensor_id=sensor_id)
+            self.sensors.append((i, sensor_id, topic, i * self.offset, self.jitter))
+
+        if self.executor == "process":
+            # spawn 避免在多线程的 Flask 进程中 fork
+            self._ctx = multiprocessing.get_context("spawn")
+            self.counts = self._ctx.RawArray("q", self.num_sensors)
+            self.started = self._ctx.RawArray("d", self.connections)
+            self.stop_event = self._ctx.Event()
+        else:
+            self._ctx = None
+            self.counts = [0] * self.num_sensors
+            self.started = [0.0] * self.connections
+            self.stop_event = threading.Event()
+
+        self.finished_at = None
+        # 流式数据源在重排窗口内丢弃的迟到数据条数
+        self.late = 0
+
+    def _assignments(self):
+        groups = [[] for _ in range(self.connections)]
+        for sensor in self.sensors:
+            groups[sensor[0] % self.connections].append(sensor)
+        return groups
+
+    def run(self, rows):
+        """阻塞执行直到全部 worker 结束，返回错误信息列表"""
+        groups = self._assignments()
+
+        if self.executor == "process":
+            pool = ProcessPoolExecutor(
+                max_workers=self.connections, mp_context=self._ctx,
+                initializer=_init_process_worker,
+                initargs=(self.counts, self.started, self.stop_event))
+            futures = [pool.submit(_process_worker, i, group, self.source,
+                                   self.replay_params, self.qos_options)
+                       for i, group in enumerate(groups)]
+        else:
+            if series_length(rows) is None:
+                # 流式序列每次迭代都重新解析源文件（并重置迟到计数），解析一次供各线程共享
+                parsed = list(rows)
+                self.late = late_count(rows)
+                rows = parsed
+            pool = ThreadPoolExecutor(max_workers=self.connections,
+                                      thread_name_prefix="fanout")
+            futures = [pool.submit(fanout_worker, i, group, rows,
+                                   self.replay_params, self.qos_options,
+                                   self.counts, self.started, self.stop_event)
+                       for i, group in enumerate(groups)]
+
+        errors = []
+        failed = 0
+        with pool:
+            for i, future in enumerate(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(f"worker {i}: {e}")
+                    continue
+                if self.executor == "process":
+                    # 各进程读取的是同一份数据源，迟到条数相同
+                    result, late = result
+                    self.late = max(self.late, late)
+                failed += result
+
+        if failed:
+            errors.append(f"{failed} 条消息发送失败")
+        self.finished_at = time.time()
+        return errors
+
+    def stop(self):
+        self.stop_event.set()
+
+    def total_count(self):
+        return sum(self.counts)
+
+    def started_at(self):
+        """最早完成连接的 worker 开始发布的时刻，尚未开始时为 None"""
+        started = [t for t in self.started if t > 0]
+        return min(started) if started else None
+
+    def stats(self):
+        # 耗时从开始发布算起，不含建立连接的等待
+        started_at = self.started_at()
+        if started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = max((self.finished_at or time.time()) - started_at, 0.0)
+
+        def _rate(n):
+            return round(n / elapsed, 2) if elapsed > 0 else 0.0
+
+        counts = list(self.counts)
+        per_sensor = {
+            sensor_id: {"topic": topic, "count": counts[i], "rate": _rate(counts[i])}
+            for i, sensor_id, topic, _, _ in self.sensors
+        }
+        total = sum(counts)
+
+        return {
+            "sensors": self.num_sensors,
+            "connections": self.connections,
+            "executor": self.executor,
+            "elapsed": round(elapsed, 2),
+            "aggregate": {"count": total, "rate": _rate(total)},
+            "per_sensor": per_sensor
+        }
+
+
+def parse_fanout_options(params, qos_options, source=None):
+    """
+    sensors > 1 时返回 FanoutRun，否则返回 None（沿用单传感器发布）
+    """
+    params = params or {}
+    try:
+        sensors = int(params.get("sensors", 1))
+        connections = params.get("connections")
+        connections = int(connections) if connections not in (None, "") else None
+    except (TypeError, ValueError):
+        raise ValueError("sensors / connections 必须是整数")
+
+    if sensors <= 1:
+        return None
+
+    def _number(key):
+        value = params.get(key)
+        if value in (None, ""):
+            return None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} 必须是数字")
+
+    replay_params = {k: params[k] for k in ("mode", "rate", "speedup", "burst")
+                     if params.get(k) not in (None, "")}
+
+    return FanoutRun(
+        sensors=sensors,
+        connections=connections,
+        executor=params.get("executor"),
+        offset=_number("offset"),
+        jitter=_number("jitter"),
+        replay_params=replay_params,
+        qos_options=qos_options,
+        source=source
+    )
@@ -0,0 +1,131 @@
+"""
+向量化预测：一次拟合所有指标（每个指标一列），不依赖 scikit-learn
+
+模型：
+- linear:       最小二乘直线（闭式解）
+- ewma:         指数加权移动平均，预测值为最后的平滑水平
+- holt:         Holt 线性趋势（水平 + 趋势）
+- holt_winters: 加性季节 Holt-Winters，数据不足两个周期时退化为 holt
+
+所有函数的输入 Y 形如 (n, k)，返回 (fitted, future)，形状分别为 (n, k) 与 (horizon, k)
+"""
+import numpy as np
+
+from config import Config
+
+MODELS = ("linear", "ewma", "holt", "holt_winters")
+
+
+def linear(Y, horizon):
+    n = len(Y)
+    x = np.arange(n, dtype=np.float64)
+    xm = x.mean()
+    dx = x - xm
+    ym = Y.mean(axis=0)
+    slope = dx @ (Y - ym) / (dx @ dx)
+    intercept = ym - slope * xm
+
+    future_x = np.arange(n, n + horizon, dtype=np.float64)
+    fitted = intercept + np.outer(x, slope)
+    future = intercept + np.outer(future_x, slope)
+    return fitted, future
+
+
+def ewma(Y, horizon, alpha=None):
+    alpha = Config.FORECAST_ALPHA if alpha is None else alpha
+    fitted = np.empty_like(Y)
+    level = Y[0].copy()
+    for t in range(len(Y)):
+        level = alpha * Y[t] + (1 - alpha) * level
+        fitted[t] = level
+    future = np.repeat(level[None, :], horizon, axis=0)
+    return fitted, future
+
+
+def holt(Y, horizon, alpha=None, beta=None):
+    alpha = Config.FORECAST_ALPHA if alpha is None else alpha
+    beta = Config.FORECAST_BETA if beta is None else beta
+    fitted = np.empty_like(Y)
+    level = Y[0].copy()
+    trend = Y[1] - Y[0]
+    fitted[0] = Y[0]
+    for t in range(1, len(Y)):
+        # 一步预测作为拟合值
+        fitted[t] = level + trend
+        prev = level
+        level = alpha * Y[t] + (1 - alpha) * (level + trend)
+        trend = beta * (level - prev) + (1 - beta) * trend
+    steps = np.arange(1, horizon + 1, dtype=np.float64)
+    future = level + np.outer(steps, trend)
+    return fitted, future
+
+
+def holt_winters(Y, horizon, season=None, alpha=None, beta=None, gamma=None):
+    season = int(Config.FORECAST_SEASON if season is None else season)
+    if season < 2 or len(Y) < 2 * season:
+        return holt(Y, horizon, alpha, beta)
+    alpha = Config.FORECAST_ALPHA if alpha is None else alpha
+    beta = Config.FORECAST_BETA if beta is None else beta
+    gamma = Config.FORECAST_GAMMA if gamma is None else gamma
+
+    # 用前两个周期初始化水平、趋势和季节分量
+    first = Y[:season].mean(axis=0)
+    second = Y[season:2 * season].mean(axis=0)
+    trend = (second - first) / season
+    # 第一个周期的均值对应周期中点，去掉趋势后剩下的是季节分量
+    offsets = np.arange(season, dtype=np.float64) - (season - 1) / 2
+    baseline = first + np.outer(offsets, trend)
+    seasonal = Y[:season] - baseline
+    level = baseline[-1].copy()
+
+    fitted = np.empty_like(Y)
+    fitted[:season] = Y[:season]
+    for t in range(season, len(Y)):
+        s = seasonal[t % season]
+        fitted[t] = level + trend + s
+        prev = level
+        level = alpha * (Y[t] - s) + (1 - alpha) * (level + trend)
+        trend = beta * (level - prev) + (1 - beta) * trend
+        seasonal[t % season] = gamma * (Y[t] - level) + (1 - gamma) * s
+
+    n = len(Y)
+    steps = np.arange(1, horizon + 1)
+    future = level + np.outer(steps.astype(np.float64), trend) + \
+        seasonal[(n + steps - 1) % season]
+    return fitted, future
+
+
+def forecast(Y, model=None, horizon=None):
+    """Y: (n, k) 数组，每列一个指标；NaN 不允许"""
+    model = model or Config.FORECAST_MODEL
+    if model not in MODELS:
+        raise ValueError(f"model 必须是 {', '.join(MODELS)} 之一")
+    horizon = int(Config.FORECAST_HORIZON if horizon is None else horizon)
+
+    Y = np.asarray(Y, dtype=np.float64)
+    if Y.ndim == 1:
+        Y = Y[:, None]
+    if len(Y) < 2:
+        k = Y.shape[1]
+        return np.empty((0, k)), np.empty((0, k))
+
+    fn = {"linear": linear, "ewma": ewma, "holt": holt,
+          "holt_winters": holt_winters}[model]
+    return fn(Y, horizon)
+
+
+def parse_forecast_options(params):
+    """从查询参数解析 model / horizon / window，非法时抛出 ValueError"""
+    model = params.get("model") or Config.FORECAST_MODEL
+    if model not in MODELS:
+        raise ValueError(f"model 必须是 {', '.join(MODELS)} 之一")
+    try:
+        horizon = int(params.get("horizon", Config.FORECAST_HORIZON))
+        window = int(params.get("window", Config.FORECAST_WINDOW))
+    except (TypeError, ValueError):
+        raise ValueError("horizon 和 window 必须是整数")
+    if not 1 <= horizon <= Config.FORECAST_MAX_HORIZON:
+        raise ValueError(f"horizon 必须在 1 到 {Config.FORECAST_MAX_HORIZON} 之间")
+    if not 2 <= window <= Config.ANALYTICS_WINDOW:
+        raise ValueError(f"window 必须在 2 到 {Config.ANALYTICS_WINDOW} 之间")
+    return {"model": model, "horizon": horizon, "window": window}
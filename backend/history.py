@@ -0,0 +1,118 @@
+"""
+订阅端最近数据的内存环形缓冲
+
+- 固定容量，新数据进入时自动挤掉最旧的数据
+- 启动时只读取存储尾部（CSV 文件尾部或最新的段）预热，不扫描全部数据
+- 查询从最新一端向前取，代价与返回条数成正比
+- 迟到的数据插入到对应位置，缓冲始终按时间有序
+"""
+import os
+import csv
+import io
+import threading
+from collections import deque
+
+from config import Config
+
+NUMERIC_FIELDS = ("temperature", "humidity", "pressure")
+TAIL_BLOCK = 64 * 1024
+
+
+def _normalize(row):
+    for m in NUMERIC_FIELDS:
+        value = row.get(m)
+        if value not in (None, ""):
+            try:
+                row[m] = float(value)
+            except (TypeError, ValueError):
+                pass
+    return row
+
+
+def read_csv_tail(path, n):
+    """从文件末尾向前按块读取，返回最后 n 行数据（不含表头）"""
+    with open(path, "rb") as f:
+        header = f.readline().decode("utf-8").strip()
+        if not header:
+            return []
+        fields = next(csv.reader([header]))
+        header_end = f.tell()
+
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        # 多读一行，因为第一行可能被块边界截断
+        while pos > header_end and data.count(b"\n") <= n:
+            step = min(TAIL_BLOCK, pos - header_end)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+
+    lines = data.decode("utf-8", errors="ignore").splitlines()
+    if pos > header_end:
+        lines = lines[1:]
+    lines = [line for line in lines if line.strip()][-n:]
+
+    reader = csv.DictReader(io.StringIO("\n".join(lines)), fieldnames=fields)
+    return [_normalize(row) for row in reader]
+
+
+class HistoryRing:
+    def __init__(self, size=None):
+        self.size = int(size or Config.HISTORY_RING_SIZE)
+        self.rows = deque(maxlen=self.size)
+        self._lock = threading.Lock()
+
+    def warm(self, path):
+        if not os.path.exists(path):
+            return 0
+        return self.load(read_csv_tail(path, self.size))
+
+    def load(self, rows):
+        """用已有数据预热（如段存储的尾部）"""
+        rows = rows[-self.size:]
+        with self._lock:
+            # 预热数据排在已接收的实时数据之前
+            live = list(self.rows)
+            self.rows.clear()
+            self.rows.extend(rows)
+            self.rows.extend(live)
+        return len(rows)
+
+    def append(self, row):
+        """按时间戳插入：迟到的数据从尾部向前找到位置，缓冲始终按时间有序"""
+        ts = str(row.get("timestamp"))
+        with self._lock:
+            rows = self.rows
+            if not rows or str(rows[-1].get("timestamp")) <= ts:
+                rows.append(row)
+                return
+            i = len(rows)
+            while i > 0 and str(rows[i - 1].get("timestamp")) > ts:
+                i -= 1
+            if len(rows) == rows.maxlen:
+                if i == 0:
+                    # 比缓冲中所有数据都旧
+                    return
+                rows.popleft()
+                i -= 1
+            rows.insert(i, row)
+
+    def query(self, limit=50, since=None):
+        """
+        返回最近的 limit 条数据（按时间先后排列）；
+        指定 since 时只返回时间戳晚于 since 的数据
+        """
+        out = []
+        with self._lock:
+            for row in reversed(self.rows):
+                if len(out) >= limit:
+                    break
+                if since is not None and str(row.get("timestamp")) <= since:
+                    break
+                out.append(row)
+        out.reverse()
+        return out
+
+    def __len__(self):
+        return len(self.rows)
@@ -0,0 +1,204 @@
+"""
+QoS 1 流水线发布：维护一个有上限的在途（未确认）消息窗口
+
+- publish() 在窗口已满时阻塞，直到有 PUBACK 腾出位置
+- on_publish 回调根据 mid 确认消息并记录确认时延
+- 超时未确认的消息会重新发布，超过重试次数后计为失败
+- 重新发布会换一个新 mid，旧 mid 仍在 paho 内部在途；旧 mid 记为已退役，
+  迟到的 PUBACK 直接丢弃，不会误确认之后复用该 mid（mid 在 65535 后回绕）的新消息
+"""
+import time
+import threading
+from collections import deque
+
+import paho.mqtt.client as mqtt
+from config import Config
+
+
+def percentile(sorted_values, p):
+    """对已排序列表取百分位（最近秩法）"""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1,
+                   int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+class InflightWindow:
+    def __init__(self, client, window=None, timeout=None, max_retries=None):
+        self.client = client
+        self.window = int(window or Config.PUBLISH_INFLIGHT_WINDOW)
+        self.timeout = float(timeout or Config.PUBLISH_ACK_TIMEOUT)
+        self.max_retries = int(
+            max_retries if max_retries is not None else Config.PUBLISH_MAX_RETRIES)
+
+        # mid -> [topic, payload, 首次发送时刻, 本次发送时刻, 已发送次数]
+        self.pending = {}
+        # PUBACK 可能先于 publish() 登记 mid 到达，先暂存：mid -> 到达时刻
+        self._early_acks = {}
+        # 超时重发或放弃的旧 mid：mid -> 退役时刻，其迟到的 PUBACK 丢弃
+        self._retired = {}
+        self._cond = threading.Condition()
+
+        self.acked = 0
+        self.retried = 0
+        self.failed = 0
+        self.stale_acks = 0
+        self.latencies = deque(maxlen=10000)
+        self._last_check = time.monotonic()
+
+        # paho 自身的在途上限与窗口保持一致
+        client.max_inflight_messages_set(self.window)
+
+    # ========================
+    # 发送与确认
+    # ========================
+    def _send(self, topic, payload):
+        result = self.client.publish(topic, payload, qos=1)
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            return None
+        return result.mid
+
+    def _register(self, mid, entry):
+        # 调用方需持有 self._cond
+        # mid 已被新消息复用，旧消息的确认无法再与新消息区分，不再按退役处理
+        self._retired.pop(mid, None)
+        if self._early_acks.pop(mid, None) is not None:
+            self._ack(entry)
+        else:
+            self.pending[mid] = entry
+
+    def _ack(self, entry):
+        self.acked += 1
+        self.latencies.append(time.monotonic() - entry[3])
+        self._cond.notify_all()
+
+    def publish(self, topic, payload, stop_event=None):
+        """
+        发布一条 QoS 1 消息；窗口满时等待
+        返回 False 表示发送失败或在等待期间收到停止请求
+        """
+        # 窗口未满时也定期扫描一次超时消息
+        if time.monotonic() - self._last_check >= min(1.0, self.timeout):
+            self.check_timeouts()
+
+        while True:
+            with self._cond:
+                if len(self.pending) < self.window:
+                    break
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                self._cond.wait(0.1)
+            self.check_timeouts()
+
+        mid = self._send(topic, payload)
+        if mid is None:
+            return False
+
+        now = time.monotonic()
+        with self._cond:
+            self._register(mid, [topic, payload, now, now, 1])
+        return True
+
+    def on_publish(self, client, userdata, mid, *args):
+        with self._cond:
+            entry = self.pending.pop(mid, None)
+            if entry is None:
+                if self._retired.pop(mid, None) is not None:
+                    self.stale_acks += 1
+                else:
+                    self._early_acks[mid] = time.monotonic()
+                return
+            self._ack(entry)
+
+    # ========================
+    # 超时重试
+    # ========================
+    def check_timeouts(self):
+        """
+        重新发布超时未确认的消息
+        注意 paho 会在持有内部锁时调用 on_publish，
+        因此 client.publish 不能在持有 self._cond 时调用，否则会互相等待
+        """
+        now = time.monotonic()
+        self._last_check = now
+        with self._cond:
+            expired = [mid for mid, entry in self.pending.items()
+                       if now - entry[3] >= self.timeout]
+            retry = []
+            for mid in expired:
+                entry = self.pending.pop(mid)
+                self._retired[mid] = now
+                if entry[4] > self.max_retries:
+                    self.failed += 1
+                else:
+                    retry.append(entry)
+            if expired:
+                self._cond.notify_all()
+            self._prune(now)
+
+        for entry in retry:
+            new_mid = self._send(entry[0], entry[1])
+            with self._cond:
+                if new_mid is None:
+                    self.failed += 1
+                    continue
+                self.retried += 1
+                entry[3] = time.monotonic()
+                entry[4] += 1
+                self._register(new_mid, entry)
+
+    def _prune(self, now):
+        # 调用方需持有 self._cond
+        # 先到的 PUBACK 正常只比登记早几微秒，超过一个超时周期仍未登记的不会再被认领；
+        # 退役 mid 保留到 paho 自身也不会再收到其确认为止
+        early_ttl = self.timeout
+        retired_ttl = self.timeout * (self.max_retries + 2)
+        for mid in [m for m, t in self._early_acks.items() if now - t >= early_ttl]:
+            del self._early_acks[mid]
+        for mid in [m for m, t in self._retired.items() if now - t >= retired_ttl]:
+            del self._retired[mid]
+
+    def drain(self, timeout=None, stop_event=None):
+        """等待所有在途消息确认（或最终失败），返回是否全部处理完毕"""
+        if timeout is None:
+            timeout = self.timeout * (self.max_retries + 1)
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            with self._cond:
+                if not self.pending:
+                    return True
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                self._cond.wait(0.1)
+            self.check_timeouts()
+
+        with self._cond:
+            return not self.pending
+
+    # ========================
+    # 状态
+    # ========================
+    def stats(self):
+        with self._cond:
+            samples = sorted(self.latencies)
+            inflight = len(self.pending)
+
+        def _ms(p):
+            v = percentile(samples, p)
+            return round(v * 1000, 2) if v is not None else None
+
+        return {
+            "window": self.window,
+            "inflight": inflight,
+            "acked": self.acked,
+            "retried": self.retried,
+            "failed": self.failed,
+            "stale_acks": self.stale_acks,
+            "ack_latency_ms": {
+                "p50": _ms(50),
+                "p90": _ms(90),
+                "p99": _ms(99)
+            }
+        }
@@ -0,0 +1,75 @@
+"""
+分级、限流的日志
+
+- 各模块用 get_logger("<模块名>") 取得 iot.<模块名> 日志器，级别由 LOG_LEVEL 控制
+- 同一处调用（日志器 + 文件 + 行号）每 LOG_RATE_INTERVAL 秒最多输出 LOG_RATE_BURST 条，
+  超出的丢弃并计数，下一个时间窗口的第一条日志附带被丢弃的条数；
+  热路径上的异常（如持续收到无效消息）不会刷屏，也不会拖慢处理线程
+- 多进程订阅时日志带进程名（subscribe-worker-<N>），便于区分各 worker
+"""
+import time
+import logging
+import threading
+
+from config import Config
+
+ROOT = "iot"
+FORMAT = "%(asctime)s %(levelname)s [%(processName)s] %(name)s: %(message)s"
+
+_configured = False
+_setup_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst=None, interval=None):
+        super().__init__()
+        self.burst = int(Config.LOG_RATE_BURST if burst is None else burst)
+        self.interval = float(Config.LOG_RATE_INTERVAL if interval is None else interval)
+        self._lock = threading.Lock()
+        # (日志器, 文件, 行号) -> [窗口开始时间, 窗口内条数, 被丢弃条数]
+        self._windows = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                dropped = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                dropped = 0
+            else:
+                window[2] += 1
+                self.suppressed += 1
+                return False
+        if dropped:
+            record.msg = f"{record.getMessage()}（上一个 {self.interval:g} 秒窗口内有 {dropped} 条同类日志被限流）"
+            record.args = None
+        return True
+
+
+def setup(level=None):
+    """配置 iot 日志器（只配置一次）；不影响 werkzeug 等第三方日志"""
+    global _configured
+    with _setup_lock:
+        if _configured:
+            return
+        root = logging.getLogger(ROOT)
+        root.setLevel((level or Config.LOG_LEVEL).upper())
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(FORMAT))
+        # 过滤器放在 handler 上，子日志器的记录都经过限流
+        handler.addFilter(RateLimitFilter())
+        root.addHandler(handler)
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(name):
+    setup()
+    return logging.getLogger(f"{ROOT}.{name}")
@@ -0,0 +1,199 @@
+"""
+运行指标：计数器、仪表与时延直方图，以 Prometheus 文本格式暴露在 /metrics
+
+- 各模块在导入时向 REGISTRY 注册自己的指标，热路径上只做一次加锁累加
+- 已有的统计（流水线、写线程、WebSocket 等的 stats()）通过 collector 回调在抓取时读取，不重复计数
+- 多进程订阅时各 worker 定期把 snapshot() 上报给协调进程，协调进程输出时加上 worker 标签
+"""
+import math
+import bisect
+import threading
+
+from flask import Blueprint, Response
+
+from config import Config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def default_buckets():
+    return tuple(sorted(float(b) for b in Config.METRICS_BUCKETS.split(",") if b.strip()))
+
+
+def _key(names, labels):
+    if set(labels) != set(names):
+        raise ValueError(f"标签必须是 {', '.join(names) or '（无）'}")
+    return tuple(str(labels[n]) for n in names)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def family(self):
+        return {"name": self.name, "type": self.kind, "help": self.help,
+                "samples": self.samples()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _key(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, k)), v) for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = _key(self.labels, labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=None):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets or default_buckets())
+
+    def observe(self, value, **labels):
+        key = _key(self.labels, labels)
+        # 每个桶只记落入该桶的次数，输出时再累加；最后一格为 +Inf
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = [(k, list(c), s, n) for k, (c, s, n) in self._values.items()]
+        for key, counts, total, count in items:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                out.append((self.name + "_bucket", {**labels, "le": _format(bound)}, cumulative))
+            out.append((self.name + "_sum", labels, total))
+            out.append((self.name + "_count", labels, count))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+        self._sources = []
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"指标 {name} 已注册为 {metric.kind}")
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=None):
+        return self._register(Histogram, name, help, labels, buckets)
+
+    def collector(self, fn):
+        """
+        抓取时调用 fn()，返回 [(名称, 类型, 说明, [(标签字典, 值), ...]), ...]；
+        用于把已有的累计统计转成指标
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def source(self, fn):
+        """抓取时调用 fn()，返回 [(其他进程的 snapshot(), 附加标签字典), ...]，合并到输出中"""
+        self._sources.append(fn)
+        return fn
+
+    def snapshot(self):
+        """本进程全部指标，可以 pickle 后发给其他进程"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        families = [m.family() for m in metrics]
+        for fn in self._collectors:
+            for name, kind, help, samples in fn() or ():
+                families.append({"name": name, "type": kind, "help": help,
+                                 "samples": [(name, labels, value) for labels, value in samples]})
+        return families
+
+    def render(self):
+        merged = {}
+        sources = [(self.snapshot(), {})]
+        for fn in self._sources:
+            sources.extend(fn() or ())
+        for families, extra in sources:
+            for family in families:
+                target = merged.setdefault(family["name"], {**family, "samples": []})
+                target["samples"].extend((name, {**labels, **extra}, value)
+                                         for name, labels, value in family["samples"])
+        lines = []
+        for family in merged.values():
+            lines.append(f"# HELP {family['name']} {_escape(family['help'], False)}")
+            lines.append(f"# TYPE {family['name']} {family['type']}")
+            for name, labels, value in family["samples"]:
+                lines.append(f"{name}{_format_labels(labels)} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value, quote=True):
+    value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quote else value
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format(value):
+    if value is None:
+        return "NaN"
+    value = float(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+collector = REGISTRY.collector
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,187 @@
+"""
+订阅端处理流水线：各阶段之间用有界队列连接，每个阶段有独立的工作线程
+
+队列满时的处理策略：
+- block:       生产者等待（最多 put_timeout 秒），超时后丢弃新数据
+- drop_newest: 直接丢弃新到的数据
+- drop_oldest: 丢弃队列中最旧的一条，为新数据腾出位置
+
+每个阶段统计 received / processed / dropped / errors 以及排队时延（lag）；
+单事件循环模式（aio_service.py）下用 call() 在事件循环中直接处理，不启动工作线程
+"""
+import time
+import queue
+import threading
+
+from config import Config
+from logs import get_logger
+
+DROP_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+_STOP = object()
+
+log = get_logger("pipeline")
+
+
+class Stage:
+    def __init__(self, name, handler, queue_size=None, policy=None,
+                 workers=1, put_timeout=None):
+        self.name = name
+        self.handler = handler
+        self.policy = policy or Config.PIPELINE_DROP_POLICY
+        if self.policy not in DROP_POLICIES:
+            raise ValueError(f"丢弃策略必须是 {', '.join(DROP_POLICIES)} 之一")
+        self.workers = int(workers)
+        self.put_timeout = float(put_timeout if put_timeout is not None
+                                 else Config.PIPELINE_PUT_TIMEOUT)
+
+        self.queue = queue.Queue(maxsize=int(queue_size or Config.PIPELINE_QUEUE_SIZE))
+        self._put_lock = threading.Lock()
+        self._threads = []
+        # 保护工作线程列表与各项统计（多个生产者 / 工作线程同时更新）
+        self._lock = threading.Lock()
+
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_avg = 0.0
+
+    # ========================
+    # 生命周期
+    # ========================
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                t = threading.Thread(target=self._run, daemon=True,
+                                     name=f"stage-{self.name}-{i}")
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout=5.0):
+        """处理完队列中已有的数据后停止"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self.queue.put(_STOP)
+        for t in threads:
+            t.join(timeout)
+
+    def drain(self, timeout=5.0):
+        """等待队列中已有的数据处理完毕"""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self.queue.unfinished_tasks
+
+    # ========================
+    # 生产者接口
+    # ========================
+    def submit(self, item):
+        with self._lock:
+            self.received += 1
+        entry = (time.monotonic(), item)
+
+        if self.policy == "block":
+            try:
+                self.queue.put(entry, timeout=self.put_timeout)
+                return True
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                return False
+
+        try:
+            self.queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            pass
+
+        if self.policy == "drop_newest":
+            with self._lock:
+                self.dropped += 1
+            return False
+
+        # drop_oldest：弹出最旧的一条再放入，加锁避免多个生产者交错
+        with self._put_lock:
+            while True:
+                try:
+                    self.queue.put_nowait(entry)
+                    return True
+                except queue.Full:
+                    try:
+                        oldest = self.queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    self.queue.task_done()
+                    if oldest is _STOP:
+                        # 已在停止：放回停止标记，丢弃新数据
+                        self.queue.put(_STOP)
+                        with self._lock:
+                            self.dropped += 1
+                        return False
+                    with self._lock:
+                        self.dropped += 1
+
+    # ========================
+    # 工作线程
+    # ========================
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is _STOP:
+                self.queue.task_done()
+                return
+
+            enqueued_at, item = entry
+            lag = time.monotonic() - enqueued_at
+            with self._lock:
+                self.lag_last = lag
+                self.lag_max = max(self.lag_max, lag)
+                self.lag_avg = lag if self.processed == 0 else \
+                    0.9 * self.lag_avg + 0.1 * lag
+
+            self._handle(item)
+            self.queue.task_done()
+
+    def _handle(self, item):
+        try:
+            self.handler(item)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                self.last_error = str(e)
+            log.warning("%s 阶段处理失败: %s", self.name, e)
+        with self._lock:
+            self.processed += 1
+
+    def call(self, item):
+        """不经过队列，在调用方线程中直接处理（单事件循环模式），统计与排队处理相同"""
+        with self._lock:
+            self.received += 1
+        self._handle(item)
+
+    # ========================
+    # 状态
+    # ========================
+    def stats(self):
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "received": self.received,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "last_error": self.last_error,
+                "lag_ms": {
+                    "last": round(self.lag_last * 1000, 3),
+                    "avg": round(self.lag_avg * 1000, 3),
+                    "max": round(self.lag_max * 1000, 3)
+                }
+            }
@@ -1,15 +1,24 @@
-import os
 import json
 import time
 import threading
-from flask import Flask, jsonify, Blueprint
+from flask import Flask, jsonify, Blueprint, request
 import paho.mqtt.client as mqtt
 from flask_cors import CORS
 from config import Config
+from replay import parse_replay_options
+from inflight import InflightWindow
+from logs import get_logger
+from publish_common import (PUBLISHED, load_series, late_count, series_length,
+                            build_message, create_client)
+import fanout
 stop_event = threading.Event()
 
 publish_bp = Blueprint('publish', __name__)
 
+PUBLISH_SOURCES = ("cache", "stream", "csv", "txt")
+
+log = get_logger("publish")
+
 # =========================
 # Flask
 # =========================
@@ -17,132 +26,186 @@ publish_status = {
     "running": False,
     "count": 0,
     "total": 0,
-    "error": None
+    "error": None,
+    "qos": 0,
+    "replay": None,
+    "ack": None,
+    "fanout": None,
+    # 流式数据源重排窗口内无法排入、被丢弃的迟到数据条数
+    "late": 0
 }
 
 publish_thread = None
+replay_scheduler = None
+inflight_window = None
+fanout_run = None
 
 
 # =========================
-# MQTT 回调
+# 发布函数（原逻辑封装）
 # =========================
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        print("MQTT 连接成功")
-    else:
-        print("MQTT 连接失败，rc =", rc)
+def parse_qos_options(params):
+    """
+    解析 /start 中的 QoS 参数：qos、window（在途窗口）、ack_timeout（秒）
+    """
+    params = params or {}
+    try:
+        qos = int(params.get("qos", Config.PUBLISH_QOS))
+        window = int(params.get("window", Config.PUBLISH_INFLIGHT_WINDOW))
+        ack_timeout = float(params.get("ack_timeout", Config.PUBLISH_ACK_TIMEOUT))
+    except (TypeError, ValueError):
+        raise ValueError("qos / window / ack_timeout 必须是数字")
 
+    if qos not in (0, 1):
+        raise ValueError("qos 只支持 0 或 1")
+    if window <= 0 or ack_timeout <= 0:
+        raise ValueError("window 和 ack_timeout 必须大于 0")
 
-def on_disconnect(client, userdata, rc):
-    print("MQTT 连接断开，rc =", rc)
+    return {"qos": qos, "window": window, "ack_timeout": ack_timeout}
 
 
-# =========================
-# 读取 txt 数据
-# =========================
-def load_txt_data(filename):
-    data = {}
-    with open(filename, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line or not line.startswith("{"):
-                continue
-            try:
-                obj = json.loads(line)
-                for k, v in obj.items():
-                    try:
-                        data[k] = float(v)
-                    except:
-                        pass
-            except:
-                pass
-    return data
 
+def publish_data(scheduler=None, qos_options=None, source=None):
+    global publish_status, replay_scheduler, inflight_window, fanout_run
 
-# =========================
-# 发布函数（原逻辑封装）
-# =========================
-def publish_data():
-    global publish_status
+    if scheduler is None:
+        scheduler = parse_replay_options(None)
+    if qos_options is None:
+        qos_options = parse_qos_options(None)
+    replay_scheduler = scheduler
+    inflight_window = None
+    fanout_run = None
+    publish_status["qos"] = qos_options["qos"]
+    publish_status["ack"] = None
+    publish_status["fanout"] = None
+    publish_status["late"] = 0
+    rows = None
 
     try:
         # ⭐ 清除停止标志
         stop_event.clear()
 
-        # === 计算路径（标准写法）===
-        DATA_DIR = os.path.join(os.path.dirname(__file__), "../data")
-
-        temperature = load_txt_data(os.path.join(DATA_DIR, "temperature.txt"))
-        humidity = load_txt_data(os.path.join(DATA_DIR, "humidity.txt"))
-        pressure = load_txt_data(os.path.join(DATA_DIR, "pressure.txt"))
-
-        timestamps = sorted(
-            set(temperature.keys()) &
-            set(humidity.keys()) &
-            set(pressure.keys())
-        )
+        rows = load_series(source)
 
-        publish_status["total"] = len(timestamps)
+        publish_status["total"] = series_length(rows)
         publish_status["count"] = 0
         publish_status["running"] = True
         publish_status["error"] = None
 
-        print("可发布数据条数:", len(timestamps))
+        log.info("可发布数据条数: %s", publish_status["total"])
 
         # MQTT 参数
         BROKER_IP = Config.MQTT_BROKER
         PORT = Config.MQTT_PORT
-        USERNAME = Config.MQTT_USERNAME
-        PASSWORD = Config.MQTT_PASSWORD
         TOPIC = Config.MQTT_TOPIC
 
-        client = mqtt.Client()
-        client.username_pw_set(USERNAME, PASSWORD)
-        client.on_connect = on_connect
-        client.on_disconnect = on_disconnect
+        client = create_client()
 
-        print("正在连接 MQTT 服务器...")
+        # QoS 1：通过 on_publish 跟踪 PUBACK，保持有上限的在途窗口
+        window = None
+        if qos_options["qos"] == 1:
+            window = InflightWindow(client,
+                                    window=qos_options["window"],
+                                    timeout=qos_options["ack_timeout"])
+            client.on_publish = window.on_publish
+            inflight_window = window
+
+        log.info("正在连接 MQTT 服务器...")
         client.connect(BROKER_IP, PORT, 60)
 
         client.loop_start()
         time.sleep(2)
 
-        print("开始发布数据...")
+        log.info("开始发布数据...")
 
-        for ts in timestamps:
-            # ⭐ 检测是否请求停止
-            if stop_event.is_set():
-                print("发布被手动停止")
+        for ts, temperature, humidity, pressure in rows:
+            # ⭐ 检测是否请求停止（调度等待期间也可被打断）
+            if stop_event.is_set() or not scheduler.wait(ts, stop_event):
+                log.info("发布被手动停止")
                 break
 
-            msg = {
-                "timestamp": ts,
-                "temperature": temperature[ts],
-                "humidity": humidity[ts],
-                "pressure": pressure[ts],
-                "temp_unit": "C",
-                "humidity_unit": "RH%",
-                "pressure_unit": "hPa"
-            }
+            msg = build_message(ts, temperature, humidity, pressure)
 
-            result = client.publish(TOPIC, json.dumps(msg), qos=0)
+            if window is not None:
+                sent = window.publish(TOPIC, json.dumps(msg), stop_event)
+            else:
+                result = client.publish(TOPIC, json.dumps(msg), qos=0)
+                sent = result.rc == mqtt.MQTT_ERR_SUCCESS
 
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            if sent:
                 publish_status["count"] += 1
-                print("已发送:", msg)
+                scheduler.mark_sent()
+                PUBLISHED.inc(result="sent")
+                log.debug("已发送: %s", msg)
             else:
                 publish_status["error"] = f"消息发送失败, ts={ts}"
-                print("发送失败")
+                PUBLISHED.inc(result="failed")
+                log.warning("发送失败, ts=%s", ts)
 
-            time.sleep(1)
+        # 断开前等待在途消息确认，避免丢失尾部消息
+        if window is not None and not window.drain(stop_event=stop_event):
+            publish_status["error"] = f"{window.stats()['inflight']} 条消息未收到确认"
 
         client.loop_stop()
         client.disconnect()
-        print("发布结束，连接已断开")
+        log.info("发布结束，连接已断开")
+
+    except Exception as e:
+        publish_status["error"] = str(e)
+        log.error("发布失败: %s", e)
+
+    late = late_count(rows)
+    if late:
+        publish_status["late"] = late
+        log.warning("重排窗口内有 %d 条迟到数据被丢弃，可增大 SOURCE_REORDER_WINDOW", late)
+    scheduler.finish()
+    publish_status["running"] = False
+
+
+def publish_fanout(run):
+    """
+    多传感器模式：由 FanoutRun 把 N 个虚拟传感器分摊到多个 MQTT 连接上并发发布
+    """
+    global publish_status, replay_scheduler, inflight_window, fanout_run
+
+    fanout_run = run
+    replay_scheduler = None
+    inflight_window = None
+    publish_status["qos"] = run.qos_options["qos"]
+    publish_status["replay"] = None
+    publish_status["ack"] = None
+    publish_status["late"] = 0
+
+    try:
+        stop_event.clear()
+
+        rows = load_series(run.source)
+
+        total = series_length(rows)
+        publish_status["total"] = total * len(run.sensors) if total is not None else None
+        publish_status["count"] = 0
+        publish_status["running"] = True
+        publish_status["error"] = None
+
+        log.info("多传感器模式: %d 个传感器, %d 个连接", len(run.sensors), run.connections)
+
+        errors = run.run(rows)
+        if errors:
+            publish_status["error"] = "; ".join(errors)
+
+        publish_status["count"] = run.total_count()
+        if run.executor == "process":
+            # 线程池模式由 fanout_worker 逐条计数
+            PUBLISHED.inc(run.total_count(), result="sent")
+        log.info("多传感器发布结束")
 
     except Exception as e:
         publish_status["error"] = str(e)
+        log.error("多传感器发布失败: %s", e)
 
+    if run.late:
+        publish_status["late"] = run.late
+        log.warning("重排窗口内有 %d 条迟到数据被丢弃，可增大 SOURCE_REORDER_WINDOW", run.late)
     publish_status["running"] = False
 
 
@@ -156,7 +219,25 @@ def start():
     if publish_status["running"]:
         return jsonify({"msg": "already started"}), 400
 
-    publish_thread = threading.Thread(target=publish_data)
+    # 回放参数既可以放在 JSON body 中，也可以放在 query string 中
+    params = dict(request.args)
+    params.update(request.get_json(silent=True) or {})
+    source = params.get("source") or Config.PUBLISH_SOURCE
+    if source not in PUBLISH_SOURCES:
+        return jsonify({"msg": f"source 必须是 {', '.join(PUBLISH_SOURCES)} 之一"}), 400
+
+    try:
+        scheduler = parse_replay_options(params)
+        qos_options = parse_qos_options(params)
+        run = fanout.parse_fanout_options(params, qos_options, source)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    if run is not None:
+        publish_thread = threading.Thread(target=publish_fanout, args=(run,))
+    else:
+        publish_thread = threading.Thread(target=publish_data,
+                                          args=(scheduler, qos_options, source))
     publish_thread.start()
 
     return jsonify({"msg": "started"})
@@ -164,6 +245,14 @@ def start():
 
 @publish_bp.route("/status", methods=["GET"])
 def status():
+    if replay_scheduler is not None:
+        publish_status["replay"] = replay_scheduler.stats()
+    if inflight_window is not None:
+        publish_status["ack"] = inflight_window.stats()
+    if fanout_run is not None:
+        publish_status["fanout"] = fanout_run.stats()
+        if publish_status["running"]:
+            publish_status["count"] = fanout_run.total_count()
     return jsonify(publish_status)
 
 
@@ -173,4 +262,6 @@ def stop():
         return jsonify({"msg": "not running"}), 400
 
     stop_event.set()
+    if fanout_run is not None:
+        fanout_run.stop()
     return jsonify({"msg": "stopped"})
@@ -0,0 +1,162 @@
+"""
+发布端公共函数：数据序列的读取、消息构造与 MQTT 客户端
+
+单传感器发布（publish.py）与多传感器扇出（fanout.py）共用；进程池模式的 worker
+只导入本模块，不会连带导入 Flask 蓝图
+"""
+import os
+import json
+import time
+
+import paho.mqtt.client as mqtt
+from config import Config
+from sources import stream_metric_files, stream_combined_csv
+from logs import get_logger
+import metrics
+
+log = get_logger("publish")
+# 多传感器进程池模式下各进程的计数在一轮发布结束时汇总
+PUBLISHED = metrics.counter("iot_publish_messages_total", "发布端发送的消息数", ("result",))
+
+# =========================
+# MQTT 回调
+# =========================
+def on_connect(client, userdata, flags, rc):
+    if rc == 0:
+        log.info("MQTT 连接成功")
+    else:
+        log.warning("MQTT 连接失败，rc = %s", rc)
+
+
+def on_disconnect(client, userdata, rc):
+    log.info("MQTT 连接断开，rc = %s", rc)
+
+
+# =========================
+# 读取 txt 数据
+# =========================
+def load_txt_data(filename):
+    data = {}
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or not line.startswith("{"):
+                continue
+            try:
+                obj = json.loads(line)
+                for k, v in obj.items():
+                    try:
+                        data[k] = float(v)
+                    except:
+                        pass
+            except:
+                pass
+    return data
+
+
+def load_series_from_txt():
+    """
+    读取三个指标文件，按共同时间戳对齐并排序
+    返回 [(timestamp, temperature, humidity, pressure), ...]
+    """
+    temperature = load_txt_data(source_path(Config.SOURCE_TEMPERATURE_FILE))
+    humidity = load_txt_data(source_path(Config.SOURCE_HUMIDITY_FILE))
+    pressure = load_txt_data(source_path(Config.SOURCE_PRESSURE_FILE))
+
+    timestamps = sorted(
+        set(temperature.keys()) &
+        set(humidity.keys()) &
+        set(pressure.keys())
+    )
+
+    return [(ts, temperature[ts], humidity[ts], pressure[ts])
+            for ts in timestamps]
+
+
+def source_path(name):
+    DATA_DIR = os.path.join(os.path.dirname(__file__), "../data")
+    return os.path.join(DATA_DIR, name)
+
+
+def stream_series(exact=False):
+    """
+    三个指标文件的流式归并，边读边发，不整体加载
+    exact=True 时每个指标整体排序，不受重排窗口限制
+    """
+    return stream_metric_files(
+        source_path(Config.SOURCE_TEMPERATURE_FILE),
+        source_path(Config.SOURCE_HUMIDITY_FILE),
+        source_path(Config.SOURCE_PRESSURE_FILE),
+        fmt=Config.SOURCE_FORMAT or None,
+        exact=exact
+    )
+
+
+def load_series(source=None):
+    """
+    返回可迭代的对齐序列，source 可选：
+    - cache:  列式缓存（默认），源文件未变化则无需重新解析
+    - stream: 直接流式读取三个指标文件
+    - csv:    按文件顺序回放订阅端写出的 sensor_data.csv
+    - txt:    原始的整体加载方式
+    """
+    source = source or Config.PUBLISH_SOURCE
+
+    if source == "stream":
+        return stream_series()
+    if source == "csv":
+        return stream_combined_csv(source_path("sensor_data.csv"))
+    if source == "txt" or not Config.SOURCE_CACHE:
+        return load_series_from_txt()
+
+    sources = [source_path(Config.SOURCE_TEMPERATURE_FILE),
+               source_path(Config.SOURCE_HUMIDITY_FILE),
+               source_path(Config.SOURCE_PRESSURE_FILE)]
+    cache_dir = source_path(os.path.join(Config.SOURCE_CACHE_DIR, "series"))
+
+    # 列式缓存依赖 NumPy，开始发布时才导入，不拖慢服务启动
+    from source_cache import load_cached_series
+
+    # 编译缓存时同样走流式归并，内存只与结果列大小有关；
+    # 重排窗口不足以排好源数据时改为整体排序，缓存不会丢数据
+    return load_cached_series(cache_dir, sources, stream_series,
+                              lambda: stream_series(exact=True))
+
+
+def late_count(rows):
+    """流式序列在重排窗口内丢弃的迟到数据条数，其他序列为 0"""
+    stats = getattr(rows, "stats", None) or {}
+    return stats.get("late", 0)
+
+
+def series_length(rows):
+    """流式序列无法预知长度，返回 None"""
+    try:
+        return len(rows)
+    except TypeError:
+        return None
+
+
+def build_message(ts, temperature, humidity, pressure, sensor_id=None):
+    # sent_at 为发送时刻（Unix 秒），订阅端据此统计发布到接收的时延
+    msg = {
+        "timestamp": ts,
+        "temperature": temperature,
+        "humidity": humidity,
+        "pressure": pressure,
+        "temp_unit": "C",
+        "humidity_unit": "RH%",
+        "pressure_unit": "hPa",
+        "sent_at": time.time()
+    }
+    if sensor_id is not None:
+        msg["sensor_id"] = sensor_id
+    return msg
+
+
+def create_client(client_id=""):
+    client = mqtt.Client(client_id=client_id)
+    client.username_pw_set(Config.MQTT_USERNAME, Config.MQTT_PASSWORD)
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    return client
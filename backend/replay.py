@@ -0,0 +1,173 @@
+"""
+发布端回放调度：控制消息发送节奏
+
+支持三种模式：
+- rate:    按固定速率（条/秒）发送，使用令牌桶平滑节奏
+- speedup: 按原始时间戳间隔回放，并按倍数加速
+- max:     不做任何等待，尽可能快地发送
+"""
+import time
+import threading
+from collections import deque
+from datetime import datetime
+
+from config import Config
+
+REPLAY_MODES = ("rate", "speedup", "max")
+
+
+class TokenBucket:
+    """
+    令牌桶：以 rate 的速度补充令牌，最多累积 capacity 个。
+    每发送一条消息取走一个令牌，没有令牌时等待。
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.tokens = 1.0
+        self.last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self, stop_event=None):
+        """取一个令牌；等待期间若 stop_event 被设置则返回 False"""
+        while True:
+            self._refill()
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+
+            wait = (1.0 - self.tokens) / self.rate
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+class ReplayScheduler:
+    """
+    回放调度器：publish_data 在每条消息发送前调用 wait(ts)，
+    同时负责统计实际达到的发送速率
+    """
+
+    def __init__(self, mode="rate", rate=None, speedup=None, burst=None):
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"mode 必须是 {', '.join(REPLAY_MODES)} 之一")
+
+        self.mode = mode
+        self.rate = float(rate if rate is not None else Config.PUBLISH_RATE)
+        self.speedup = float(
+            speedup if speedup is not None else Config.PUBLISH_SPEEDUP)
+
+        if mode == "rate" and self.rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        if mode == "speedup" and self.speedup <= 0:
+            raise ValueError("speedup 必须大于 0")
+
+        self.bucket = TokenBucket(self.rate, burst) if mode == "rate" else None
+
+        self._lock = threading.Lock()
+        self._start = None
+        # 发布结束的时刻，之后 elapsed 不再增长
+        self._end = None
+        self._first_ts = None
+        self._sent = 0
+        self._window = deque()  # 最近 1 秒内的发送时刻，用于计算瞬时速率
+
+    @staticmethod
+    def _ts_seconds(ts):
+        if isinstance(ts, (int, float)):
+            return float(ts)
+        return datetime.fromisoformat(str(ts)).timestamp()
+
+    def wait(self, ts=None, stop_event=None):
+        """
+        阻塞到下一条消息应当发送的时刻
+        返回 False 表示等待期间收到了停止请求
+        """
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now
+
+        if self.mode == "rate":
+            return self.bucket.acquire(stop_event)
+
+        if self.mode == "speedup" and ts is not None:
+            ts_sec = self._ts_seconds(ts)
+            if self._first_ts is None:
+                self._first_ts = ts_sec
+
+            # 按绝对时间对齐，避免逐条 sleep 累积误差
+            due = self._start + (ts_sec - self._first_ts) / self.speedup
+            delay = due - now
+            if delay > 0:
+                if stop_event is not None:
+                    return not stop_event.wait(delay)
+                time.sleep(delay)
+
+        return True
+
+    def _prune(self, now):
+        cutoff = now - 1.0
+        # 窗口内的时刻是单调递增的，只需从头部丢弃
+        while self._window and self._window[0] < cutoff:
+            self._window.popleft()
+
+    def mark_sent(self):
+        now = time.monotonic()
+        with self._lock:
+            self._sent += 1
+            self._window.append(now)
+            self._prune(now)
+
+    def finish(self):
+        """发布结束（完成、停止或出错）时调用，冻结 elapsed 与平均速率"""
+        with self._lock:
+            if self._end is None:
+                self._end = time.monotonic()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            # 停止发送后瞬时速率随窗口过期归零
+            self._prune(now)
+            end = self._end if self._end is not None else now
+            elapsed = end - self._start if self._start else 0.0
+            return {
+                "mode": self.mode,
+                "target_rate": self.rate if self.mode == "rate" else None,
+                "speedup": self.speedup if self.mode == "speedup" else None,
+                "actual_rate": round(self._sent / elapsed, 2) if elapsed > 0 else 0.0,
+                "current_rate": len(self._window),
+                "elapsed": round(elapsed, 2)
+            }
+
+
+def parse_replay_options(params):
+    """
+    从 /start 请求参数中解析回放配置，非法参数抛出 ValueError
+    """
+    params = params or {}
+    mode = params.get("mode", Config.PUBLISH_MODE)
+
+    def _number(key):
+        value = params.get(key)
+        if value is None or value == "":
+            return None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} 必须是数字")
+
+    return ReplayScheduler(
+        mode=mode,
+        rate=_number("rate"),
+        speedup=_number("speedup"),
+        burst=_number("burst")
+    )
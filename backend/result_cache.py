@@ -0,0 +1,92 @@
+"""
+按数据版本缓存计算结果，并合并并发的相同请求（single-flight）
+
+- 版本未变时直接返回缓存的结果（已序列化的 JSON 和 ETag）；ETag 由 (key, 版本) 计算，
+  同一数据版本下不同查询参数的结果 ETag 不同，不会互相校验成 304
+- 每个 key 只保留最新版本，key 的数量超过上限时淘汰最久未用的
+- 同一 key、同一版本的并发请求只计算一次，其余请求等待这次计算的结果
+"""
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class CachedResult:
+    def __init__(self, key, version, body, status=200):
+        self.version = version
+        self.body = body
+        self.status = status
+        self.etag = hashlib.sha1(repr((key, version)).encode()).hexdigest()[:20]
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResultCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def get(self, key, version, compute):
+        """
+        返回 (CachedResult, 来源)，来源为 hit / miss / shared。
+        compute() 返回 (结果对象, HTTP 状态码)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, "hit"
+
+            flight = self._flights.get((key, version))
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[(key, version)] = flight
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, "shared"
+
+        try:
+            result, status = compute()
+            entry = CachedResult(key, version, json.dumps(result, ensure_ascii=False), status)
+            flight.result = entry
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return entry, "miss"
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop((key, version), None)
+            flight.done.set()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared
+        }
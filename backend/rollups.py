@@ -0,0 +1,483 @@
+"""
+预聚合（rollup）：1 分钟 / 1 小时 / 1 天三个粒度，每个桶记录各指标的 count、sum、min、max、last
+
+data/rollups/
+    index.json              传感器编号表与各粒度的行数
+    1m/ 1h/ 1d/             每列一个二进制文件：bucket、sensor，以及每个指标的
+                            count / sum / min / max / last / last_ts
+    w0/ w1/ ...             多进程订阅时每个 worker 一套（只含归属该 worker 的传感器），读取时合并
+
+- 订阅端每收到一条数据只更新内存中的部分聚合，按间隔把这段时间内变化过的桶追加到文件；
+  同一个桶可能对应多行（迟到的数据也一样），读取时合并
+- 追加的行多到一定程度后压实：合并重复的桶，并按 bucket 排序，
+  之后范围查询对有序部分二分查找，只扫描压实后新追加的行
+- 查询按需要的分辨率自动选择最粗的可用粒度
+"""
+import os
+import json
+import math
+import time
+import shutil
+import threading
+
+import numpy as np
+
+from config import Config
+
+METRICS = ("temperature", "humidity", "pressure")
+TIERS = (("1m", 60), ("1h", 3600), ("1d", 86400))
+TIER_SECONDS = dict(TIERS)
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+
+# 每个指标的聚合字段
+AGG_FIELDS = (("count", np.int64), ("sum", np.float64), ("min", np.float64),
+              ("max", np.float64), ("last", np.float64), ("last_ts", np.int64))
+COLUMNS = {"bucket": np.int64, "sensor": np.uint16}
+for _m in METRICS:
+    for _f, _dtype in AGG_FIELDS:
+        COLUMNS[f"{_m}_{_f}"] = _dtype
+SUFFIX = {np.int64: "i8", np.uint16: "u2", np.float64: "f8"}
+# 传感器编号为 uint16
+MAX_SENSORS = 0xFFFF
+
+# 部分聚合在内存中的布局：每个指标 6 个值
+_EMPTY = [0, 0.0, math.inf, -math.inf, math.nan, -1 << 62]
+
+
+def column_file(name):
+    return f"{name}.{SUFFIX[COLUMNS[name]]}"
+
+
+def choose_tier(start, end, max_points):
+    """
+    满足分辨率 (end - start) / max_points 的最粗粒度；
+    范围太短（需要比 1 分钟更细）时返回 None，表示使用原始数据
+    """
+    if start is None or end is None:
+        return TIERS[-1][0]
+    resolution = (end - start) / max(1, max_points)
+    chosen = None
+    for name, seconds in TIERS:
+        if seconds <= resolution:
+            chosen = name
+    return chosen
+
+
+def cover(lo, hi, tiers=None):
+    """
+    把半开区间 [lo, hi) 拆成对齐到各粒度桶边界的片段：
+    中间尽量用粗粒度，两端依次用更细的粒度，剩余不足 1 分钟的部分用原始数据。
+    返回 [(粒度名或 "raw", 起, 止), ...]
+    """
+    tiers = list(reversed(TIERS)) if tiers is None else tiers
+    if lo >= hi:
+        return []
+    if not tiers:
+        return [("raw", lo, hi)]
+    name, seconds = tiers[0]
+    a = -(-lo // seconds) * seconds
+    b = hi // seconds * seconds
+    if a >= b:
+        return cover(lo, hi, tiers[1:])
+    return cover(lo, a, tiers[1:]) + [(name, a, b)] + cover(b, hi, tiers[1:])
+
+
+class RollupStore:
+    def __init__(self, root, compact_min_rows=None):
+        self.root = root
+        self.compact_min_rows = int(compact_min_rows or Config.ROLLUP_COMPACT_MIN_ROWS)
+        self.index = None
+        self.sensor_ids = {}
+        self.pending = {name: {} for name, _ in TIERS}
+        # _lock 保护内存中的索引与待写桶，update 在解码线程（单事件循环模式下在事件循环中）；
+        # _io_lock 串行化写文件，flush 在其他线程写盘时 update 不必等待磁盘 I/O。先取 _io_lock 再取 _lock
+        self._lock = threading.RLock()
+        self._io_lock = threading.RLock()
+
+        self.updates = 0
+        self.flushed_rows = 0
+        self.compactions = 0
+
+    # ========================
+    # 索引
+    # ========================
+    def index_path(self):
+        return os.path.join(self.root, INDEX_FILE)
+
+    def index_paths(self):
+        return [self.index_path()]
+
+    def _read_index(self):
+        try:
+            with open(self.index_path(), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+        if not index or index.get("version") != INDEX_VERSION:
+            index = {"version": INDEX_VERSION, "sensors": [], "source_id": None,
+                     "tiers": {name: {"rows": 0, "sorted_rows": 0} for name, _ in TIERS}}
+        return index
+
+    def _save_index(self):
+        with self._lock:
+            text = json.dumps(self.index, ensure_ascii=False)
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.index_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self.index_path())
+
+    def _load(self):
+        if self.index is None:
+            self.index = self._read_index()
+            self.sensor_ids = {s: i for i, s in enumerate(self.index["sensors"])}
+            self._repair()
+
+    def _repair(self):
+        """截掉列文件中超出索引行数的部分（上次追加中途退出留下的）"""
+        for name, tier in self.index["tiers"].items():
+            for col, dtype in COLUMNS.items():
+                path = os.path.join(self.root, name, column_file(col))
+                size = tier["rows"] * np.dtype(dtype).itemsize
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    with open(path, "r+b") as f:
+                        f.truncate(size)
+
+    def source_id(self):
+        with self._lock:
+            self._load()
+            return self.index.get("source_id")
+
+    def reset(self, source_id=None):
+        """清空所有粒度（重建前调用）"""
+        with self._io_lock, self._lock:
+            for name, _ in TIERS:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                self.pending[name].clear()
+            self.index = {"version": INDEX_VERSION, "sensors": [], "source_id": source_id,
+                          "tiers": {name: {"rows": 0, "sorted_rows": 0} for name, _ in TIERS}}
+            self.sensor_ids = {}
+            self._save_index()
+
+    def _sensor_index(self, sensor_id):
+        sensor_id = str(sensor_id or Config.DEFAULT_SENSOR_ID)
+        index = self.sensor_ids.get(sensor_id)
+        if index is None:
+            index = len(self.index["sensors"])
+            if index >= MAX_SENSORS:
+                raise ValueError(f"传感器数量超过上限 {MAX_SENSORS}")
+            self.index["sensors"].append(sensor_id)
+            self.sensor_ids[sensor_id] = index
+        return index
+
+    # ========================
+    # 写入（订阅端）
+    # ========================
+    def update(self, ts, sensor_id, values):
+        """ts: Unix 秒；values: 按 METRICS 顺序的数值（None/NaN 表示缺失）"""
+        with self._lock:
+            self._load()
+            sensor = self._sensor_index(sensor_id)
+            for name, seconds in TIERS:
+                key = (sensor, ts - ts % seconds)
+                acc = self.pending[name].get(key)
+                if acc is None:
+                    acc = _EMPTY * len(METRICS)
+                    self.pending[name][key] = acc
+                for i, v in enumerate(values):
+                    if v is None or v != v:
+                        continue
+                    o = i * 6
+                    acc[o] += 1
+                    acc[o + 1] += v
+                    if v < acc[o + 2]:
+                        acc[o + 2] = v
+                    if v > acc[o + 3]:
+                        acc[o + 3] = v
+                    if ts >= acc[o + 5]:
+                        acc[o + 4] = v
+                        acc[o + 5] = ts
+            self.updates += 1
+
+    def ingest_arrays(self, ts, sensors, values):
+        """
+        批量导入（启动时从存储重建）：ts 为 Unix 秒数组，sensors 为传感器 ID 数组，
+        values 形如 (n, 3)。每个粒度按桶聚合后直接追加
+        """
+        ts = np.asarray(ts, dtype=np.int64)
+        if not len(ts):
+            return
+        with self._io_lock, self._lock:
+            self._load()
+            codes = np.fromiter((self._sensor_index(s) for s in sensors), np.uint16, len(ts))
+            values = np.asarray(values, dtype=np.float64).reshape(len(ts), len(METRICS))
+            for name, seconds in TIERS:
+                raw = {"bucket": ts - ts % seconds, "sensor": codes}
+                for i, m in enumerate(METRICS):
+                    v = values[:, i]
+                    ok = ~np.isnan(v)
+                    raw[f"{m}_count"] = ok.astype(np.int64)
+                    raw[f"{m}_sum"] = np.where(ok, v, 0.0)
+                    raw[f"{m}_min"] = np.where(ok, v, np.inf)
+                    raw[f"{m}_max"] = np.where(ok, v, -np.inf)
+                    raw[f"{m}_last"] = v
+                    raw[f"{m}_last_ts"] = np.where(ok, ts, _EMPTY[5])
+                self._append(name, merge_rows(raw, by_sensor=True))
+            self._save_index()
+
+    def _append(self, name, columns):
+        rows = len(columns["bucket"])
+        if not rows:
+            return
+        folder = os.path.join(self.root, name)
+        os.makedirs(folder, exist_ok=True)
+        for col, dtype in COLUMNS.items():
+            with open(os.path.join(folder, column_file(col)), "ab") as f:
+                f.write(np.asarray(columns[col], dtype=dtype).tobytes())
+        # 列文件写完后读取方才能看到新行
+        with self._lock:
+            self.index["tiers"][name]["rows"] += rows
+        self.flushed_rows += rows
+
+    def flush(self):
+        """
+        把内存中变化过的桶追加到文件，必要时压实。
+        只在取出待写的桶时持有 _lock，之后的桶由 update 重新累计（读取时与文件中的同一桶合并）
+        """
+        with self._io_lock:
+            with self._lock:
+                self._load()
+                if not any(self.pending.values()):
+                    return 0
+                taken = {}
+                for name, _ in TIERS:
+                    taken[name], self.pending[name] = self.pending[name], {}
+            total = 0
+            for name, _ in TIERS:
+                pending = taken.pop(name)
+                if not pending:
+                    continue
+                keys = list(pending)
+                accs = np.array([pending[k] for k in keys], dtype=np.float64)
+                columns = {
+                    "bucket": np.fromiter((k[1] for k in keys), np.int64, len(keys)),
+                    "sensor": np.fromiter((k[0] for k in keys), np.uint16, len(keys))
+                }
+                for i, m in enumerate(METRICS):
+                    for j, (field, _) in enumerate(AGG_FIELDS):
+                        columns[f"{m}_{field}"] = accs[:, i * 6 + j]
+                try:
+                    self._append(name, columns)
+                except OSError:
+                    # 这一粒度与尚未写入的粒度放回待写，下次 flush 重试
+                    taken[name] = pending
+                    self._restore(taken)
+                    raise
+                total += len(keys)
+            # 列文件写完后再更新索引
+            self._save_index()
+
+            for name, _ in TIERS:
+                with self._lock:
+                    tier = dict(self.index["tiers"][name])
+                if tier["rows"] - tier["sorted_rows"] >= max(self.compact_min_rows,
+                                                              tier["sorted_rows"]):
+                    self.compact(name)
+            return total
+
+    def _restore(self, taken):
+        with self._lock:
+            for name, buckets in taken.items():
+                pending = self.pending[name]
+                for key, acc in buckets.items():
+                    newer = pending.get(key)
+                    if newer is not None:
+                        for o in range(0, len(acc), 6):
+                            acc[o] += newer[o]
+                            acc[o + 1] += newer[o + 1]
+                            acc[o + 2] = min(acc[o + 2], newer[o + 2])
+                            acc[o + 3] = max(acc[o + 3], newer[o + 3])
+                            if newer[o + 5] >= acc[o + 5]:
+                                acc[o + 4], acc[o + 5] = newer[o + 4], newer[o + 5]
+                    pending[key] = acc
+
+    def compact(self, name):
+        """合并重复的桶并按 bucket 排序，整体替换该粒度的目录"""
+        with self._io_lock:
+            with self._lock:
+                self._load()
+                tier = dict(self.index["tiers"][name])
+            data = merge_rows(self._read_tier(name, tier), by_sensor=True)
+
+            folder = os.path.join(self.root, name)
+            tmp = folder + ".tmp"
+            old = folder + ".old"
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            for col, dtype in COLUMNS.items():
+                np.asarray(data[col], dtype=dtype).tofile(os.path.join(tmp, column_file(col)))
+            shutil.rmtree(old, ignore_errors=True)
+            if os.path.exists(folder):
+                os.rename(folder, old)
+            os.rename(tmp, folder)
+            shutil.rmtree(old, ignore_errors=True)
+
+            rows = len(data["bucket"])
+            with self._lock:
+                self.index["tiers"][name] = {"rows": rows, "sorted_rows": rows}
+            self._save_index()
+            self.compactions += 1
+
+    # ========================
+    # 读取
+    # ========================
+    def _read_tier(self, name, tier, start=None, end=None):
+        """读取一个粒度中 bucket 落在 [start, end) 的行（未合并）"""
+        folder = os.path.join(self.root, name)
+        rows, sorted_rows = tier["rows"], tier["sorted_rows"]
+        if rows == 0:
+            return {col: np.empty(0, dtype) for col, dtype in COLUMNS.items()}
+
+        # 有序部分二分查找，新追加的部分整体扫描
+        lo, hi = 0, sorted_rows
+        if sorted_rows:
+            buckets = np.memmap(os.path.join(folder, column_file("bucket")),
+                                dtype=np.int64, mode="r", shape=(sorted_rows,))
+            if start is not None:
+                lo = int(np.searchsorted(buckets, start, side="left"))
+            if end is not None:
+                hi = int(np.searchsorted(buckets, end, side="left"))
+            del buckets
+
+        out = {}
+        for col, dtype in COLUMNS.items():
+            path = os.path.join(folder, column_file(col))
+            size = np.dtype(dtype).itemsize
+            with open(path, "rb") as f:
+                f.seek(lo * size)
+                head = np.fromfile(f, dtype=dtype, count=max(0, hi - lo))
+                f.seek(sorted_rows * size)
+                tail = np.fromfile(f, dtype=dtype, count=rows - sorted_rows)
+            out[col] = (head, tail)
+
+        tail_bucket = out["bucket"][1]
+        mask = np.ones(len(tail_bucket), dtype=bool)
+        if start is not None:
+            mask &= tail_bucket >= start
+        if end is not None:
+            mask &= tail_bucket < end
+        return {col: np.concatenate([head, tail[mask]])
+                for col, (head, tail) in out.items()}
+
+    def read(self, name, start=None, end=None, sensor_id=None):
+        """
+        读取某粒度 bucket 在 [start, end) 内的聚合，按 bucket 排序；
+        未指定传感器时同一时间桶内的所有传感器合并为一行
+        """
+        for attempt in range(3):
+            with self._lock:
+                index = self.index if self.index is not None else self._read_index()
+                tier = dict(index["tiers"][name])
+                sensors = list(index["sensors"])
+            try:
+                data = self._read_tier(name, tier, start, end)
+                break
+            except FileNotFoundError:
+                # 读取期间被压实替换，重新读取索引后重试
+                if attempt == 2:
+                    raise
+                time.sleep(0.05)
+        if sensor_id is not None:
+            code = sensors.index(sensor_id) if sensor_id in sensors else -1
+            mask = data["sensor"] == code
+            data = {col: values[mask] for col, values in data.items()}
+        return merge_rows(data, by_sensor=sensor_id is not None)
+
+    def stats(self):
+        with self._lock:
+            index = self.index if self.index is not None else self._read_index()
+            pending = {name: len(p) for name, p in self.pending.items()}
+            return {
+                "tiers": {name: dict(index["tiers"][name], pending=pending[name])
+                          for name, _ in TIERS},
+                "sensors": len(index["sensors"]),
+                "updates": self.updates,
+                "flushed_rows": self.flushed_rows,
+                "compactions": self.compactions
+            }
+
+
+class RollupGroup:
+    """多进程订阅时各 worker 的预聚合；各 worker 的传感器互不重叠，读取时按时间桶合并"""
+
+    def __init__(self, root, workers):
+        self.workers = list(workers)
+        self.stores = [RollupStore(default_root(w, root)) for w in self.workers]
+
+    def index_paths(self):
+        return [store.index_path() for store in self.stores]
+
+    def read(self, name, start=None, end=None, sensor_id=None):
+        parts = [store.read(name, start, end, sensor_id) for store in self.stores]
+        data = {col: np.concatenate([p[col] for p in parts]) for col in COLUMNS}
+        # 各 worker 的传感器编号互不相关，合并前统一置 0
+        data["sensor"] = np.zeros(len(data["bucket"]), dtype=np.uint16)
+        return merge_rows(data, by_sensor=False)
+
+    def stats(self):
+        return {f"w{w}": store.stats() for w, store in zip(self.workers, self.stores)}
+
+
+def merge_rows(data, by_sensor=True):
+    """合并同一个桶（by_sensor 时为同一传感器的同一个桶）的多行部分聚合"""
+    bucket = data["bucket"]
+    if not len(bucket):
+        return {col: np.asarray(data[col], dtype=dtype)[:0] for col, dtype in COLUMNS.items()}
+
+    sensor = data["sensor"].astype(np.int64)
+    key = bucket * 65536 + sensor if by_sensor else bucket
+    order = np.argsort(key, kind="stable")
+    sorted_key = key[order]
+    starts = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]])
+    ends = np.r_[starts[1:], len(sorted_key)] - 1
+
+    out = {"bucket": bucket[order][starts],
+           "sensor": data["sensor"][order][starts] if by_sensor
+           else np.zeros(len(starts), dtype=np.uint16)}
+    for m in METRICS:
+        out[f"{m}_count"] = np.add.reduceat(data[f"{m}_count"][order], starts)
+        out[f"{m}_sum"] = np.add.reduceat(data[f"{m}_sum"][order], starts)
+        out[f"{m}_min"] = np.minimum.reduceat(data[f"{m}_min"][order], starts)
+        out[f"{m}_max"] = np.maximum.reduceat(data[f"{m}_max"][order], starts)
+        # 每组中 last_ts 最大的一行给出 last
+        last_ts = data[f"{m}_last_ts"]
+        order_m = np.lexsort((last_ts, key))
+        out[f"{m}_last"] = data[f"{m}_last"][order_m][ends]
+        out[f"{m}_last_ts"] = last_ts[order_m][ends]
+    return out
+
+
+def summarize(data):
+    """把若干桶汇总成各指标的 count / min / max / avg"""
+    out = {}
+    for m in METRICS:
+        count = int(data[f"{m}_count"].sum()) if len(data["bucket"]) else 0
+        if count:
+            out[m] = {
+                "count": count,
+                "min": float(data[f"{m}_min"].min()),
+                "max": float(data[f"{m}_max"].max()),
+                "avg": round(float(data[f"{m}_sum"].sum() / count), 2)
+            }
+        else:
+            out[m] = {"count": 0, "min": None, "max": None, "avg": None}
+    return out
+
+
+def default_root(worker=None, root=None):
+    """预聚合目录；worker 为多进程订阅时的进程编号（子目录 w<N>/）"""
+    if root is None:
+        data_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "data"))
+        root = os.path.join(data_dir, Config.ROLLUP_DIR)
+    return root if worker is None else os.path.join(root, f"w{worker}")
@@ -0,0 +1,1119 @@
+"""
+按时间分区的列式存储
+
+data/segments/
+    registry.json              传感器注册表：每个传感器的分片目录、行数、时间范围、最近上报时间与主题
+    registry-w<N>.json         多进程订阅时每个 worker 一份注册表，只记录归属该 worker 的传感器
+    workers.json               订阅端当前的 worker 数，读取端据此选择要合并的注册表
+    sensors/s_<传感器 ID>/     每个传感器一个分片（一个 SegmentStore）：
+        index.json             段索引：每段的时间范围、行数、是否有序，以及传感器编号表
+        2014021306/            按小时分区的段（压实后合并为按天的段，如 20140213/）
+            ts.f8              Unix 秒（float64，保留收到的小数部分；版本 1 的段为整数秒 ts.i8）
+            sensor.u2          传感器序号（uint16，对应 index.json 中的 sensors）
+            temperature.f8 ... 每个指标一列（float64，缺失为 NaN）
+
+- 按传感器查询只读取该传感器的分片，与其他传感器的数据量无关；
+  未分片的旧段存储在订阅端首次启动时自动拆分
+
+- 写入只追加列文件，列文件写完后再更新索引；读取只读索引中记录的行数，
+  因此读到的永远是完整的行，写线程崩溃留下的半行会在下次打开时截掉
+- 段内始终按时间有序：每批先排序再追加，迟到的数据与所在段归并后整体替换该段，读取时无需排序
+- 范围查询先用索引中的 min/max 时间跳过无关的段
+- 压实：把较早的小时段按天合并，并按时间排序；保留期：删除过旧的段
+  （保留期以库中最新数据的时间为准，回放历史数据时不会被误删）
+- 迁移：python segments.py migrate 把已有的 sensor_data.csv 一次性导入（去掉重复的时间戳）；
+  python segments.py dedup 清理已导入的重复数据
+"""
+import os
+import sys
+import csv
+import json
+import math
+import time
+import uuid
+import zlib
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import numpy as np
+
+from config import Config
+from dedup import TimestampIndex, KEY_SCALE, dedup_key
+from logs import get_logger
+
+METRICS = ("temperature", "humidity", "pressure")
+PARTITIONS = ("hour", "day")
+INDEX_FILE = "index.json"
+# 版本 2：ts 列为 float64 秒；版本 1 的段（ts.i8，整数秒）照常读取，写入前整段转换
+INDEX_VERSION = 2
+REGISTRY_VERSION = 1
+
+COLUMNS = {"ts": np.float64, "sensor": np.uint16}
+COLUMNS.update({m: np.float64 for m in METRICS})
+SUFFIX = {np.int64: "i8", np.uint16: "u2", np.float64: "f8"}
+# 传感器序号为 uint16，超出上限的新传感器不再写入
+MAX_SENSORS = 0xFFFF
+
+# 有效的时间范围（Unix 秒）：1970-01-01 至 2100-01-01（UTC），超出范围的时间戳视为无效
+EPOCH_MIN = 0
+EPOCH_MAX = 4102444800
+
+log = get_logger("segments")
+
+
+def column_file(name):
+    return f"{name}.{SUFFIX[COLUMNS[name]]}"
+
+
+def segment_column(seg, name):
+    """段中某列的 (文件名, dtype)；版本 1 留下的段 ts 为整数秒"""
+    if name == "ts" and seg.get("ts_i8"):
+        return "ts.i8", np.int64
+    return column_file(name), COLUMNS[name]
+
+
+def parse_epoch(value):
+    """
+    单个时间戳转为 Unix 秒（float，保留小数部分）；空值、无法解析或超出有效范围的为 None
+    - 数字或数字字符串按 Unix 秒处理
+    - ISO 时间：带时区偏移的换算为 UTC，不带时区的按 UTC 处理
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        seconds = float(value)
+    else:
+        text = str(value).strip()
+        if not text:
+            return None
+        try:
+            seconds = float(text)
+        except ValueError:
+            try:
+                dt = datetime.fromisoformat(text)
+            except ValueError:
+                return None
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            seconds = dt.timestamp()
+    # NaN 与 inf 也在这里排除
+    if not EPOCH_MIN <= seconds < EPOCH_MAX:
+        return None
+    return seconds
+
+
+def to_epoch_seconds(values):
+    """
+    时间戳批量转为整数 Unix 秒（小数部分向下取整，用于查询参数与按秒分桶的预聚合）；
+    无效的为 None，规则见 parse_epoch
+    """
+    out = []
+    for v in values:
+        seconds = parse_epoch(v)
+        out.append(None if seconds is None else math.floor(seconds))
+    return out
+
+
+def iso_timestamp(seconds):
+    """Unix 秒转为不带时区的 UTC ISO 时间，有小数部分时保留到微秒"""
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def format_ts(seconds):
+    """Unix 秒转为不带时区的 UTC ISO 时间；与 iso_timestamp 一致，有小数部分时保留到微秒"""
+    seconds = np.asarray(seconds)
+    if seconds.dtype.kind in "iu":
+        return np.datetime_as_string(seconds.astype("datetime64[s]"), unit="s")
+    micros = np.round(seconds * 1000000).astype(np.int64)
+    whole = np.datetime_as_string((micros // 1000000).astype("datetime64[s]"), unit="s")
+    fraction = micros % 1000000 != 0
+    if not fraction.any():
+        return whole
+    return np.where(fraction, np.datetime_as_string(micros.astype("datetime64[us]"), unit="us"),
+                    whole)
+
+
+def partition_key(seconds, partition):
+    fmt = "%Y%m%d%H" if partition == "hour" else "%Y%m%d"
+    return time.strftime(fmt, time.gmtime(seconds))
+
+
+def _float(value):
+    if value is None or value == "":
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class SegmentStore:
+    def __init__(self, root, partition=None, retention_days=None,
+                 compact_after_hours=None, maintenance_interval=None):
+        self.root = root
+        self.partition = partition or Config.STORAGE_PARTITION
+        if self.partition not in PARTITIONS:
+            raise ValueError(f"分区粒度必须是 {', '.join(PARTITIONS)} 之一")
+        self.retention = float(Config.STORAGE_RETENTION_DAYS if retention_days is None
+                               else retention_days) * 86400
+        self.compact_after = float(Config.STORAGE_COMPACT_AFTER_HOURS
+                                   if compact_after_hours is None
+                                   else compact_after_hours) * 3600
+        self.maintenance_interval = float(Config.STORAGE_MAINTENANCE_INTERVAL
+                                          if maintenance_interval is None
+                                          else maintenance_interval)
+
+        self.index = None
+        self.sensor_ids = {}
+        self._files = {}
+        self._dirty = set()
+        self._last_maintenance = time.monotonic()
+        # 写入、压实只在写线程中进行；锁用于同一进程内的读者
+        self._lock = threading.RLock()
+
+        self.written = 0
+        self.merged = 0
+        self.compactions = 0
+        self.expired = 0
+
+    # ========================
+    # 索引
+    # ========================
+    def index_path(self):
+        return os.path.join(self.root, INDEX_FILE)
+
+    def _read_index(self):
+        try:
+            with open(self.index_path(), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+        if index and index.get("version") == 1:
+            # 版本 1 的段 ts 为整数秒，标记后照常读取
+            for seg in index.get("segments", {}).values():
+                seg["ts_i8"] = True
+            index["version"] = INDEX_VERSION
+        if not index or index.get("version") != INDEX_VERSION:
+            index = {"version": INDEX_VERSION, "sensors": [], "segments": {}}
+        return index
+
+    def _save_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.index_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path())
+
+    def _load(self):
+        if self.index is not None:
+            return
+        self.index = self._read_index()
+        # id 标识这份存储，generation 在删除数据（保留期）后递增，
+        # 供增量分析等派生状态判断是否仍与存储一致
+        self.index.setdefault("id", uuid.uuid4().hex)
+        self.index.setdefault("generation", 0)
+        self.sensor_ids = {s: i for i, s in enumerate(self.index["sensors"])}
+        self._repair()
+
+    def _repair(self):
+        """截掉列文件中超出索引行数的部分（上次写入中途退出留下的）"""
+        for key, seg in self.index["segments"].items():
+            for name in COLUMNS:
+                filename, dtype = segment_column(seg, name)
+                path = os.path.join(self.root, key, filename)
+                size = seg["rows"] * np.dtype(dtype).itemsize
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    with open(path, "r+b") as f:
+                        f.truncate(size)
+
+    def segments(self):
+        """当前索引中的段（供读者使用，每次重新读取以看到其他进程的写入）"""
+        with self._lock:
+            if self.index is not None:
+                return dict(self.index["segments"]), list(self.index["sensors"])
+        index = self._read_index()
+        return index["segments"], index["sensors"]
+
+    def identity(self):
+        """(存储 id, 代次)"""
+        with self._lock:
+            index = self.index if self.index is not None else self._read_index()
+            return index.get("id"), index.get("generation", 0)
+
+    # ========================
+    # 写入（由 BatchWriter 的写线程调用）
+    # ========================
+    def _sensor_index(self, sensor_id):
+        sensor_id = str(sensor_id or Config.DEFAULT_SENSOR_ID)
+        index = self.sensor_ids.get(sensor_id)
+        if index is None:
+            index = len(self.index["sensors"])
+            if index >= MAX_SENSORS:
+                raise ValueError(f"传感器数量超过上限 {MAX_SENSORS}")
+            self.index["sensors"].append(sensor_id)
+            self.sensor_ids[sensor_id] = index
+        return index
+
+    def _segment_for(self, seconds):
+        # 已压实为按天的段时，新数据直接追加到该天的段中
+        day = partition_key(seconds, "day")
+        if self.partition == "day" or day in self.index["segments"]:
+            return day, "day"
+        return partition_key(seconds, "hour"), "hour"
+
+    def _handle(self, key, name):
+        handle = self._files.get((key, name))
+        if handle is None:
+            os.makedirs(os.path.join(self.root, key), exist_ok=True)
+            handle = open(os.path.join(self.root, key, column_file(name)), "ab")
+            self._files[(key, name)] = handle
+        return handle
+
+    def write(self, rows):
+        """追加一批数据：rows 为包含 timestamp、sensor_id 和各指标的字典"""
+        with self._lock:
+            self._load()
+            seconds = [parse_epoch(r.get("timestamp")) for r in rows]
+
+            groups = {}
+            for ts, row in zip(seconds, rows):
+                if ts is None:
+                    continue
+                key, span = self._segment_for(ts)
+                groups.setdefault((key, span), []).append((ts, row))
+
+            for (key, span), items in groups.items():
+                items.sort(key=lambda item: item[0])
+                columns = {
+                    "ts": np.fromiter((ts for ts, _ in items), np.float64, len(items)),
+                    "sensor": np.fromiter((self._sensor_index(r.get("sensor_id"))
+                                           for _, r in items), np.uint16, len(items))
+                }
+                for m in METRICS:
+                    columns[m] = np.fromiter((_float(r.get(m)) for _, r in items),
+                                             np.float64, len(items))
+
+                seg = self.index["segments"].get(key)
+                if seg is not None and seg.get("ts_i8"):
+                    # 版本 1 的段先整段转为 float64 的 ts，再追加
+                    seg = self._upgrade_segment(key, seg)
+                ts = columns["ts"]
+                if seg is not None and seg["rows"] and ts[0] < seg["max_ts"]:
+                    # 迟到的数据：与段内已有数据归并，保持段内有序
+                    self._merge_into(key, seg, columns)
+                    self.written += len(ts)
+                    continue
+
+                for name, values in columns.items():
+                    self._handle(key, name).write(values.tobytes())
+                    self._dirty.add(key)
+                if seg is None:
+                    seg = {"span": span, "rows": 0, "min_ts": float(ts[0]),
+                           "max_ts": float(ts[0]), "sorted": True}
+                    self.index["segments"][key] = seg
+                seg["rows"] += len(ts)
+                seg["min_ts"] = min(seg["min_ts"], float(ts.min()))
+                seg["max_ts"] = max(seg["max_ts"], float(ts.max()))
+                self.written += len(ts)
+
+            # 列文件写完后再更新索引，读者只会看到完整的行
+            for handle in self._files.values():
+                handle.flush()
+            self._save_index()
+
+            # 只为本批写到的段保留文件句柄（实时数据通常只写最新的段）
+            active = {key for key, _ in groups}
+            for key, name in list(self._files):
+                if key not in active:
+                    self._close_handle(key, name)
+
+        if time.monotonic() - self._last_maintenance >= self.maintenance_interval:
+            self.maintain()
+
+    def _upgrade_segment(self, key, seg):
+        for name in COLUMNS:
+            if (key, name) in self._files:
+                self._close_handle(key, name)
+        if not seg["rows"]:
+            self._drop_segment(key)
+            return None
+        self._replace_segment(key, seg["span"], self._read_segment(key, seg, list(COLUMNS)))
+        return self.index["segments"][key]
+
+    def _merge_into(self, key, seg, columns):
+        """把一批有序的迟到数据插入到段中对应的位置，整段写入临时目录后替换"""
+        for name in COLUMNS:
+            if (key, name) in self._files:
+                self._close_handle(key, name)
+        old = self._read_segment(key, seg, list(COLUMNS))
+        # 时间相同的行排在已有数据之后，与追加的顺序一致
+        pos = np.searchsorted(old["ts"], columns["ts"], side="right")
+        data = {name: np.insert(old[name], pos, columns[name]) for name in COLUMNS}
+        self._replace_segment(key, seg["span"], data)
+        self.merged += len(columns["ts"])
+
+    def _close_handle(self, key, name, sync=True):
+        handle = self._files.pop((key, name))
+        if sync and key in self._dirty:
+            os.fsync(handle.fileno())
+        handle.close()
+        if not any(k == key for k, _ in self._files):
+            self._dirty.discard(key)
+
+    def sync(self):
+        with self._lock:
+            for key, name in list(self._files):
+                if key in self._dirty:
+                    os.fsync(self._files[(key, name)].fileno())
+            self._dirty.clear()
+
+    def close(self, sync=True):
+        with self._lock:
+            if sync:
+                for handle in self._files.values():
+                    handle.flush()
+                    os.fsync(handle.fileno())
+            for handle in self._files.values():
+                handle.close()
+            self._files.clear()
+            self._dirty.clear()
+
+    # ========================
+    # 读取
+    # ========================
+    def _read_segment(self, key, seg, names):
+        out = {}
+        for name in names:
+            filename, dtype = segment_column(seg, name)
+            path = os.path.join(self.root, key, filename)
+            out[name] = np.fromfile(path, dtype=dtype, count=seg["rows"])
+            if dtype != COLUMNS[name]:
+                out[name] = out[name].astype(COLUMNS[name])
+        if not seg["sorted"]:
+            order = np.argsort(out["ts"], kind="stable")
+            out = {name: values[order] for name, values in out.items()}
+        return out
+
+    def read(self, start=None, end=None, sensor_id=None, metrics=METRICS):
+        """
+        读取 [start, end] 范围内的数据（Unix 秒，含两端），按时间排序。
+        返回 {"ts": ..., "sensor": ..., 指标: ...} 以及传感器编号表
+        """
+        names = ["ts", "sensor"] + list(metrics)
+        # 读取期间段可能被压实替换，重新读取索引后重试
+        for attempt in range(3):
+            segments, sensors = self.segments()
+            keys = sorted(k for k, seg in segments.items()
+                          if seg["rows"] and
+                          (start is None or seg["max_ts"] >= start) and
+                          (end is None or seg["min_ts"] <= end))
+            try:
+                parts = [self._read_segment(k, segments[k], names) for k in keys]
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+                time.sleep(0.05)
+
+        if not parts:
+            return {name: np.empty(0, COLUMNS[name]) for name in names}, sensors
+
+        data = {name: np.concatenate([p[name] for p in parts]) for name in names}
+        # 段之间按 key 排序即按时间排序；按天合并的段可能与小时段重叠，需要整体排序
+        ts = data["ts"]
+        if len(ts) > 1 and not np.all(ts[1:] >= ts[:-1]):
+            order = np.argsort(ts, kind="stable")
+            data = {name: values[order] for name, values in data.items()}
+
+        mask = None
+        if start is not None:
+            mask = data["ts"] >= start
+        if end is not None:
+            mask = (data["ts"] <= end) if mask is None else mask & (data["ts"] <= end)
+        if sensor_id is not None:
+            code = sensors.index(sensor_id) if sensor_id in sensors else -1
+            sel = data["sensor"] == code
+            mask = sel if mask is None else mask & sel
+        if mask is not None:
+            data = {name: values[mask] for name, values in data.items()}
+        return data, sensors
+
+    def tail_columns(self, n):
+        """最近的 n 条数据（列形式），返回 (data, sensors)"""
+        segments, sensors = self.segments()
+        parts, total = [], 0
+        for key in sorted(segments, reverse=True):
+            if total >= n:
+                break
+            seg = segments[key]
+            if not seg["rows"]:
+                continue
+            parts.append(self._read_segment(key, seg, list(COLUMNS)))
+            total += seg["rows"]
+        if not parts:
+            return {name: np.empty(0, COLUMNS[name]) for name in COLUMNS}, sensors
+        parts.reverse()
+        return {name: np.concatenate([p[name] for p in parts])[-n:] for name in COLUMNS}, sensors
+
+    def tail(self, n):
+        """最近的 n 条数据，格式与 CSV 行一致（供历史缓冲预热）"""
+        data, sensors = self.tail_columns(n)
+        return rows_from_columns(data, sensors)
+
+    def count(self):
+        segments, _ = self.segments()
+        return sum(seg["rows"] for seg in segments.values())
+
+    def summary(self):
+        """行数与时间范围"""
+        segments, _ = self.segments()
+        live = [seg for seg in segments.values() if seg["rows"]]
+        return {
+            "rows": sum(seg["rows"] for seg in live),
+            "min_ts": min((seg["min_ts"] for seg in live), default=None),
+            "max_ts": max((seg["max_ts"] for seg in live), default=None)
+        }
+
+    # ========================
+    # 压实与保留期
+    # ========================
+    def _replace_segment(self, key, span, data):
+        """写入临时目录后整体替换，读者要么看到旧段要么看到新段"""
+        tmp = os.path.join(self.root, f".{key}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, values in data.items():
+            values.astype(COLUMNS[name]).tofile(os.path.join(tmp, column_file(name)))
+        final = os.path.join(self.root, key)
+        old = os.path.join(self.root, f".{key}.old")
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(final):
+            os.rename(final, old)
+        os.rename(tmp, final)
+        shutil.rmtree(old, ignore_errors=True)
+
+        ts = data["ts"]
+        self.index["segments"][key] = {
+            "span": span, "rows": int(len(ts)),
+            "min_ts": float(ts.min()), "max_ts": float(ts.max()), "sorted": True
+        }
+
+    def _drop_segment(self, key):
+        self.index["segments"].pop(key, None)
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+    def compact(self):
+        """把早于 compact_after 的小时段按天合并，并对乱序的旧段排序"""
+        with self._lock:
+            self._load()
+            segments = self.index["segments"]
+            if not segments:
+                return 0
+            latest = max(seg["max_ts"] for seg in segments.values())
+            cutoff = latest - self.compact_after
+
+            days = {}
+            for key, seg in segments.items():
+                if seg["max_ts"] < cutoff and (seg["span"] == "hour" or not seg["sorted"]):
+                    days.setdefault(key[:8], []).append(key)
+            if not days:
+                return 0
+
+            # 合并前关闭相关段的文件句柄
+            for key, name in list(self._files):
+                if key[:8] in days:
+                    self._close_handle(key, name, sync=False)
+
+            names = list(COLUMNS)
+            for day, keys in days.items():
+                keys = sorted(set(keys) | ({day} if day in segments else set()))
+                parts = [self._read_segment(k, segments[k], names) for k in keys]
+                data = {name: np.concatenate([p[name] for p in parts]) for name in names}
+                order = np.argsort(data["ts"], kind="stable")
+                data = {name: values[order] for name, values in data.items()}
+                self._replace_segment(day, "day", data)
+                for key in keys:
+                    if key != day:
+                        self._drop_segment(key)
+                self._save_index()
+                self.compactions += 1
+            return len(days)
+
+    def expire(self):
+        """删除整段早于保留期的数据"""
+        if self.retention <= 0:
+            return 0
+        with self._lock:
+            self._load()
+            segments = self.index["segments"]
+            if not segments:
+                return 0
+            cutoff = max(seg["max_ts"] for seg in segments.values()) - self.retention
+            expired = [k for k, seg in segments.items() if seg["max_ts"] < cutoff]
+            for key in expired:
+                for name in COLUMNS:
+                    if (key, name) in self._files:
+                        self._close_handle(key, name, sync=False)
+                self._drop_segment(key)
+            if expired:
+                self.index["generation"] += 1
+                self._save_index()
+                self.expired += len(expired)
+            return len(expired)
+
+    def dedup(self):
+        """
+        删除同一传感器、同一时间戳的重复行（保留最早写入的一行）。
+        删除后存储换一个新的 id，增量分析、预聚合等派生状态会据此从存储重建
+        """
+        with self._lock:
+            self._load()
+            for key, name in list(self._files):
+                self._close_handle(key, name)
+            removed = 0
+            for key, seg in sorted(self.index["segments"].items()):
+                if not seg["rows"]:
+                    continue
+                data = self._read_segment(key, seg, list(COLUMNS))
+                # 段内按时间有序（稳定排序），同一时间戳的行中第一个即最早写入的；
+                # 时间戳按去重索引的精度（微秒）比较
+                keys = np.column_stack([np.round(data["ts"] * KEY_SCALE).astype(np.int64),
+                                        data["sensor"].astype(np.int64)])
+                _, first = np.unique(keys, axis=0, return_index=True)
+                if len(first) == seg["rows"]:
+                    continue
+                keep = np.sort(first)
+                removed += seg["rows"] - len(keep)
+                self._replace_segment(key, seg["span"],
+                                      {name: values[keep] for name, values in data.items()})
+            if removed:
+                self.index["id"] = uuid.uuid4().hex
+                self.index["generation"] = 0
+                self._save_index()
+            return removed
+
+    def maintain(self):
+        self._last_maintenance = time.monotonic()
+        try:
+            self.expire()
+            self.compact()
+        except Exception as e:
+            log.error("段存储维护失败: %s", e)
+
+    # ========================
+    # 状态
+    # ========================
+    def stats(self):
+        segments, sensors = self.segments()
+        return {
+            "engine": "segments",
+            "partition": self.partition,
+            "segments": len(segments),
+            "rows": sum(seg["rows"] for seg in segments.values()),
+            "sensors": len(sensors),
+            "min_ts": min((seg["min_ts"] for seg in segments.values()), default=None),
+            "max_ts": max((seg["max_ts"] for seg in segments.values()), default=None),
+            "merged_late_rows": self.merged,
+            "compactions": self.compactions,
+            "expired_segments": self.expired
+        }
+
+
+# ========================
+# 按传感器分片
+# ========================
+REGISTRY_FILE = "registry.json"
+WORKERS_FILE = "workers.json"
+SHARDS_DIR = "sensors"
+LEGACY_DIR = ".legacy"
+
+
+def shard_name(sensor_id):
+    """传感器 ID 转为安全的目录名（ID 来自主题或消息内容，不能直接用作路径）"""
+    return "s_" + quote(str(sensor_id), safe="")
+
+
+def partition(sensor_id, workers):
+    """传感器归属的 worker 编号：稳定哈希，与进程和 PYTHONHASHSEED 无关"""
+    return zlib.crc32(str(sensor_id).encode("utf-8")) % max(1, int(workers))
+
+
+def worker_ids(workers):
+    """各 worker 的编号；单进程订阅时为 [None]"""
+    return [None] if workers <= 1 else list(range(workers))
+
+
+def registry_file(worker=None):
+    return REGISTRY_FILE if worker is None else f"registry-w{worker}.json"
+
+
+class ShardedStore:
+    """
+    每个传感器一个 SegmentStore 分片（sensors/s_<ID>/），registry.json 记录各传感器的
+    分片、行数、时间范围、最近上报时间和主题。按 sensor_id 查询只读取该传感器的分片。
+
+    多进程订阅时 worker 参数为该进程的编号：它只写归属自己的传感器（partition），
+    注册表写在 registry-w<N>.json；读取端按 workers.json 合并各 worker 的注册表
+    """
+
+    def __init__(self, root, max_open_shards=None, worker=None, workers=1, **shard_options):
+        self.root = root
+        self.max_open = int(max_open_shards or Config.STORAGE_MAX_OPEN_SHARDS)
+        self.worker = worker
+        self.num_workers = int(workers) if worker is not None else 1
+        self.shard_options = shard_options
+        self.index = None
+        # 持有文件句柄的分片（最近写入的排在后面），打开新分片前先关闭最久未写的，
+        # 同时打开的分片数不超过 max_open；其余分片用时临时创建，不缓存
+        self._open = OrderedDict()
+        # 已关闭分片的上次维护时刻，重新打开时沿用，维护周期不因换出而重新计时
+        self._maintained = {}
+        self._lock = threading.RLock()
+        self.written = 0
+        self.rejected = 0
+
+    # ========================
+    # 注册表
+    # ========================
+    def index_path(self):
+        return os.path.join(self.root, registry_file(self.worker))
+
+    def owns(self, sensor_id):
+        """该传感器是否由本进程写入（单进程时总是）"""
+        return self.worker is None or partition(sensor_id, self.num_workers) == self.worker
+
+    def workers(self):
+        """订阅端的 worker 数：写入端为自身配置，读取端读取 workers.json（不存在时为 1）"""
+        if self.worker is not None:
+            return self.num_workers
+        try:
+            with open(os.path.join(self.root, WORKERS_FILE), "r", encoding="utf-8") as f:
+                return max(1, int(json.load(f)["workers"]))
+        except (OSError, ValueError, KeyError, TypeError):
+            return 1
+
+    def set_workers(self, workers):
+        """订阅端启动时记录 worker 数"""
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, WORKERS_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"workers": int(workers), "updated_at": time.time()}, f)
+        os.replace(path + ".tmp", path)
+
+    def registry_paths(self):
+        """组成当前数据的注册表：写入端为自己的一份，读取端为各 worker 的（单进程为 registry.json）"""
+        if self.index is not None:
+            return [self.index_path()]
+        return [os.path.join(self.root, registry_file(w)) for w in worker_ids(self.workers())]
+
+    def _read_index(self, path=None):
+        try:
+            with open(path or self.index_path(), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+        if not index or index.get("version") != REGISTRY_VERSION:
+            index = {"version": REGISTRY_VERSION, "sensors": {}}
+        return index
+
+    def _save_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.index_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path())
+
+    def _registry_files(self):
+        """目录中已有的所有注册表（单进程的与各 worker 的）"""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        return [os.path.join(self.root, name) for name in sorted(names)
+                if name == REGISTRY_FILE or
+                (name.startswith("registry-w") and name.endswith(".json"))]
+
+    def _load(self):
+        if self.index is not None:
+            return
+        existing = self._registry_files()
+        self.index = self._read_index()
+        self.index.setdefault("id", uuid.uuid4().hex)
+        self.index.setdefault("generation", 0)
+        if not existing:
+            self._migrate_legacy()
+        elif self._adopt(existing):
+            self._save_index()
+
+    def _adopt(self, paths):
+        """
+        worker 数变化后整理注册表：去掉不再归属本进程的传感器，并从其他注册表中接管归属本进程、
+        且最近上报时间比自己记录的更新的传感器。有变化时换新的存储 id（分析状态与预聚合随之重建）
+        """
+        sensors = self.index["sensors"]
+        changed = False
+        for sensor_id in [sid for sid in sensors if not self.owns(sid)]:
+            del sensors[sensor_id]
+            changed = True
+        for path in paths:
+            if path == self.index_path():
+                continue
+            for sensor_id, entry in self._read_index(path)["sensors"].items():
+                if not self.owns(sensor_id):
+                    continue
+                own = sensors.get(sensor_id)
+                if own is None or entry.get("last_seen", 0) > own.get("last_seen", 0):
+                    entry = dict(entry)
+                    entry.update(self.shard(sensor_id).summary())
+                    sensors[sensor_id] = entry
+                    changed = True
+        if changed:
+            self.index["id"] = uuid.uuid4().hex
+            self.index["generation"] = 0
+        return changed
+
+    def open(self):
+        """写入端（订阅端）启动时调用：载入注册表，必要时拆分未分片的旧段存储"""
+        with self._lock:
+            self._load()
+        return self
+
+    def _migrate_legacy(self):
+        """把未分片的旧段存储（根目录下的 index.json）按传感器拆分到各分片，旧文件移到 .legacy/"""
+        if not os.path.exists(os.path.join(self.root, INDEX_FILE)):
+            return 0
+        legacy = SegmentStore(self.root)
+        legacy._load()
+        data, sensors = legacy.read()
+        if len(data["ts"]):
+            self.write(rows_from_columns(data, sensors))
+        self.close()
+        if legacy.index.get("migrated_from"):
+            self.index["migrated_from"] = legacy.index["migrated_from"]
+        self._save_index()
+
+        moved = os.path.join(self.root, LEGACY_DIR)
+        os.makedirs(moved, exist_ok=True)
+        for key in list(legacy.index["segments"]) + [INDEX_FILE]:
+            path = os.path.join(self.root, key)
+            if os.path.exists(path):
+                os.rename(path, os.path.join(moved, key))
+        log.info("已把旧段存储的 %d 条数据按传感器分片，旧文件移到 %s", len(data["ts"]), moved)
+        return len(data["ts"])
+
+    def registry(self):
+        """
+        {sensor_id: 注册信息}（读者每次重新读取以看到订阅端的写入）。
+        多进程订阅时合并各 worker 的注册表，同一传感器以最近上报的记录为准
+        """
+        with self._lock:
+            if self.index is not None:
+                return {sid: dict(entry) for sid, entry in self.index["sensors"].items()}
+        paths = self.registry_paths()
+        if len(paths) == 1:
+            return self._read_index(paths[0])["sensors"]
+        merged = {}
+        for path in paths:
+            for sensor_id, entry in self._read_index(path)["sensors"].items():
+                if sensor_id not in merged or \
+                        entry.get("last_seen", 0) > merged[sensor_id].get("last_seen", 0):
+                    merged[sensor_id] = entry
+        return merged
+
+    def identity(self):
+        """(存储 id, 代次)；任一分片删除数据（保留期）后代次递增"""
+        with self._lock:
+            index = self.index if self.index is not None else self._read_index()
+            return index.get("id"), index.get("generation", 0)
+
+    def identities(self):
+        """各注册表的 (存储 id, 代次)，顺序与 registry_paths 一致"""
+        out = []
+        for path in self.registry_paths():
+            index = self._read_index(path)
+            out.append((index.get("id"), index.get("generation", 0)))
+        return out
+
+    def shard(self, sensor_id):
+        """已打开（写入端）的分片，或新建一个只在本次使用的分片对象"""
+        sensor_id = str(sensor_id)
+        with self._lock:
+            shard = self._open.get(sensor_id)
+            if shard is not None:
+                return shard
+            shard = SegmentStore(os.path.join(self.root, SHARDS_DIR, shard_name(sensor_id)),
+                                 **self.shard_options)
+            last = self._maintained.get(sensor_id)
+            if last is not None:
+                shard._last_maintenance = last
+            return shard
+
+    def _close_shard(self, sensor_id, shard, sync=True):
+        self._maintained[sensor_id] = shard._last_maintenance
+        shard.close(sync)
+
+    def shard_identity(self, sensor_id):
+        return self.shard(sensor_id).identity()
+
+    def shard_index_path(self, sensor_id):
+        return self.shard(sensor_id).index_path()
+
+    # ========================
+    # 写入（由 BatchWriter 的写线程调用）
+    # ========================
+    def write(self, rows):
+        """按 sensor_id 分组后写入各自的分片"""
+        with self._lock:
+            self._load()
+            groups = {}
+            for row in rows:
+                sensor_id = str(row.get("sensor_id") or Config.DEFAULT_SENSOR_ID)
+                groups.setdefault(sensor_id, []).append(row)
+
+            now = time.time()
+            for sensor_id, group in groups.items():
+                entry = self.index["sensors"].get(sensor_id)
+                if entry is None and len(self.index["sensors"]) >= MAX_SENSORS:
+                    if not self.rejected:
+                        log.error("传感器数量已达上限 %d，新传感器的数据不再写入", MAX_SENSORS)
+                    self.rejected += len(group)
+                    continue
+
+                shard = self._open.pop(sensor_id, None)
+                if shard is None:
+                    # 先关闭最久未写的分片再打开下一个，一批涉及大量传感器时句柄数也不超过上限
+                    while len(self._open) >= self.max_open:
+                        self._close_shard(*self._open.popitem(last=False))
+                    shard = self.shard(sensor_id)
+                self._open[sensor_id] = shard
+                generation = shard.identity()[1]
+                shard.write(group)
+
+                if entry is None:
+                    entry = {"shard": shard_name(sensor_id), "first_seen": now}
+                    self.index["sensors"][sensor_id] = entry
+                entry.update(shard.summary())
+                entry["last_seen"] = now
+                topic = group[-1].get("topic")
+                if topic:
+                    entry["topic"] = topic
+                if shard.identity()[1] != generation:
+                    self.index["generation"] += 1
+                self.written += len(group)
+            self._save_index()
+
+    def sync(self):
+        with self._lock:
+            for shard in self._open.values():
+                shard.sync()
+
+    def close(self, sync=True):
+        with self._lock:
+            for sensor_id, shard in self._open.items():
+                self._close_shard(sensor_id, shard, sync)
+            self._open.clear()
+
+    # ========================
+    # 读取
+    # ========================
+    def read(self, start=None, end=None, sensor_id=None, metrics=METRICS):
+        """
+        与 SegmentStore.read 相同；sensor 列为 registry 中的传感器序号。
+        指定 sensor_id 时只读取该传感器的分片
+        """
+        registry = self.registry()
+        sensors = list(registry)
+        names = ["ts", "sensor"] + list(metrics)
+        if sensor_id is not None:
+            targets = [sensor_id] if sensor_id in registry else []
+        else:
+            targets = [sid for sid, entry in registry.items()
+                       if entry.get("rows") and
+                       (start is None or entry["max_ts"] >= start) and
+                       (end is None or entry["min_ts"] <= end)]
+
+        codes = {sid: i for i, sid in enumerate(sensors)}
+        parts = []
+        for sid in targets:
+            data, _ = self.shard(sid).read(start, end, None, metrics)
+            data["sensor"] = np.full(len(data["ts"]), codes[sid], dtype=np.uint16)
+            parts.append(data)
+        if not parts:
+            return {name: np.empty(0, COLUMNS[name]) for name in names}, sensors
+        if len(parts) == 1:
+            return parts[0], sensors
+
+        data = {name: np.concatenate([p[name] for p in parts]) for name in names}
+        # 各分片内已有序，稳定排序只需合并这些有序段
+        order = np.argsort(data["ts"], kind="stable")
+        return {name: values[order] for name, values in data.items()}, sensors
+
+    def tail(self, n):
+        """所有传感器中最近的 n 条数据；按各分片的最新时间从新到旧读取，够 n 条且后面的分片更旧时停止"""
+        registry = self.registry()
+        sensors = list(registry)
+        candidates = sorted(((entry["max_ts"], sid) for sid, entry in registry.items()
+                             if entry.get("rows")), reverse=True)
+        codes = {sid: i for i, sid in enumerate(sensors)}
+        parts, total, threshold = [], 0, None
+        for max_ts, sid in candidates:
+            if threshold is not None and max_ts < threshold:
+                break
+            data, _ = self.shard(sid).tail_columns(n)
+            data["sensor"] = np.full(len(data["ts"]), codes[sid], dtype=np.uint16)
+            parts.append(data)
+            total += len(data["ts"])
+            if total >= n:
+                ts = np.concatenate([p["ts"] for p in parts])
+                threshold = np.partition(ts, total - n)[total - n]
+        if not parts:
+            return []
+        data = {name: np.concatenate([p[name] for p in parts]) for name in COLUMNS}
+        order = np.argsort(data["ts"], kind="stable")[-n:]
+        return rows_from_columns({name: values[order] for name, values in data.items()}, sensors)
+
+    def count(self):
+        return sum(entry.get("rows", 0) for entry in self.registry().values())
+
+    # ========================
+    # 维护（命令行）
+    # ========================
+    def _each_shard(self, fn):
+        with self._lock:
+            self._load()
+            self.close()
+            total = 0
+            for sensor_id, entry in self.index["sensors"].items():
+                shard = self.shard(sensor_id)
+                total += fn(shard)
+                entry.update(shard.summary())
+            return total
+
+    def compact(self):
+        return self._each_shard(lambda shard: shard.compact())
+
+    def expire(self):
+        expired = self._each_shard(lambda shard: shard.expire())
+        if expired:
+            self.index["generation"] += 1
+            self._save_index()
+        return expired
+
+    def dedup(self):
+        removed = self._each_shard(lambda shard: shard.dedup())
+        if removed:
+            self.index["id"] = uuid.uuid4().hex
+            self.index["generation"] = 0
+            self._save_index()
+        return removed
+
+    def stats(self):
+        registry = self.registry()
+        return {
+            "engine": "segments",
+            "sharded": True,
+            "sensors": len(registry),
+            "rows": sum(entry.get("rows", 0) for entry in registry.values()),
+            "min_ts": min((e["min_ts"] for e in registry.values() if e.get("rows")), default=None),
+            "max_ts": max((e["max_ts"] for e in registry.values() if e.get("rows")), default=None),
+            "open_shards": len(self._open),
+            "written": self.written,
+            "rejected": self.rejected
+        }
+
+
+def rows_from_columns(data, sensors):
+    """列数据转为 CSV 风格的行（字典列表）"""
+    timestamps = format_ts(data["ts"]).tolist()
+    sensor_codes = data["sensor"].tolist()
+    columns = [data[m].tolist() for m in METRICS]
+    rows = []
+    for i, ts in enumerate(timestamps):
+        row = {"timestamp": ts, "sensor_id": sensors[sensor_codes[i]]}
+        for m, values in zip(METRICS, columns):
+            v = values[i]
+            row[m] = None if v != v else v
+        rows.append(row)
+    return rows
+
+
+def default_root():
+    data_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "data"))
+    return os.path.join(data_dir, Config.STORAGE_DIR)
+
+
+def open_store(root=None, worker=None, workers=1):
+    """订阅端与分析服务使用的存储：按传感器分片的段存储；worker 为多进程订阅时的进程编号"""
+    return ShardedStore(root or default_root(), worker=worker, workers=workers)
+
+
+# ========================
+# CSV 迁移
+# ========================
+def migrate_csv(csv_path, store, batch_size=10000):
+    """
+    把 sensor_data.csv 一次性导入段存储；已导入过同一文件时跳过。
+    同一传感器、同一时间戳的重复行（发布端多次回放留下的）只导入第一条
+    """
+    if not os.path.exists(csv_path):
+        return 0
+    st = os.stat(csv_path)
+    source = {"path": os.path.abspath(csv_path), "size": st.st_size,
+              "mtime_ns": st.st_mtime_ns}
+    with store._lock:
+        store._load()
+        if store.index.get("migrated_from") == source:
+            return 0
+
+    seen = TimestampIndex()
+    count, invalid, batch = 0, 0, []
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            if row.get("raw") and not row.get("sensor_id"):
+                try:
+                    row["sensor_id"] = json.loads(row["raw"]).get("sensor_id")
+                except (ValueError, AttributeError):
+                    pass
+            seconds = parse_epoch(row.get("timestamp"))
+            if seconds is None:
+                # 空的、无法解析或超出有效范围的时间戳不导入，避免写出异常的分区
+                invalid += 1
+                continue
+            if seen.add(row.get("sensor_id"), dedup_key(seconds)) == "duplicate":
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                store.write(batch)
+                count += len(batch)
+                batch = []
+    if batch:
+        store.write(batch)
+        count += len(batch)
+
+    with store._lock:
+        store.index["migrated_from"] = source
+        store._save_index()
+    # 导入的批次跨越大量段，写完即关闭文件句柄（fsync 后关闭），实时写入时按需重新打开
+    store.close()
+    if invalid:
+        log.warning("%s 中有 %d 行时间戳无效，未导入", csv_path, invalid)
+    return count
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    store = open_store()
+    if command == "migrate":
+        data_dir = os.path.dirname(default_root())
+        path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(data_dir, "sensor_data.csv")
+        print(f"已导入 {migrate_csv(path, store)} 条: {path}")
+    elif command == "dedup":
+        print(f"已删除 {store.dedup()} 条重复数据")
+    elif command == "compact":
+        print(f"已过期 {store.expire()} 段，已压实 {store.compact()} 天")
+    else:
+        print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+    store.close()
@@ -0,0 +1,170 @@
+"""
+发布端源数据列式缓存
+
+把三个 txt 文件对齐后的 (timestamp, temperature, humidity, pressure) 序列
+编译成 NumPy 列文件（.npy），之后以内存映射方式按块读取：
+- 源文件的 mtime / size 写入 manifest.json，任一变化即重新编译
+- 时间戳原样保存源文件中的字符串（UTF-8 字节列 + 每行的起止偏移），回放的时间戳与源文件逐字相同，
+  不受精度、时区偏移或格式的影响
+- 流式编译时若重排窗口内有迟到数据被丢弃，不使用这份不完整的结果，改为整体排序重新编译
+"""
+import os
+import json
+import shutil
+from itertools import islice
+
+import numpy as np
+from logs import get_logger
+
+log = get_logger("source_cache")
+
+# 版本 2：时间戳由 datetime64[s] 改为原始字符串
+CACHE_VERSION = 2
+COLUMNS = ("timestamp", "temperature", "humidity", "pressure")
+VALUE_COLUMNS = COLUMNS[1:]
+# 时间戳字符串：timestamp_bytes 为拼接的 UTF-8 字节，第 i 行为 [offsets[i], offsets[i + 1])
+TIMESTAMP_FILES = ("timestamp_offsets", "timestamp_bytes")
+CHUNK_SIZE = 4096
+
+
+def source_signature(paths):
+    """源文件指纹：任一文件的修改时间或大小变化都会使缓存失效"""
+    sig = {}
+    for path in paths:
+        st = os.stat(path)
+        sig[os.path.basename(path)] = [st.st_mtime_ns, st.st_size]
+    return sig
+
+
+class CachedSeries:
+    """
+    内存映射的列式序列，可直接替代 [(ts, t, h, p), ...] 列表使用：
+    支持 len() 和按行迭代，迭代时按块转换，避免一次性生成全部 Python 对象
+    """
+
+    def __init__(self, cache_dir):
+        self.columns = {
+            name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r")
+            for name in VALUE_COLUMNS + TIMESTAMP_FILES
+        }
+
+    def __len__(self):
+        return len(self.columns["timestamp_offsets"]) - 1
+
+    def timestamps(self, start, end):
+        """第 [start, end) 行的时间戳字符串"""
+        bounds = self.columns["timestamp_offsets"][start:end + 1].tolist()
+        if len(bounds) < 2:
+            return []
+        base = bounds[0]
+        blob = self.columns["timestamp_bytes"][base:bounds[-1]].tobytes()
+        if blob.isascii():
+            # 常见情况：ASCII 时间戳，整块解码一次，字节偏移即字符偏移
+            text = blob.decode("ascii")
+            return [text[a - base:b - base] for a, b in zip(bounds, bounds[1:])]
+        return [blob[a - base:b - base].decode("utf-8") for a, b in zip(bounds, bounds[1:])]
+
+    def __iter__(self):
+        t_col = self.columns["temperature"]
+        h_col = self.columns["humidity"]
+        p_col = self.columns["pressure"]
+
+        for start in range(0, len(self), CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, len(self))
+            yield from zip(self.timestamps(start, end),
+                           t_col[start:end].tolist(),
+                           h_col[start:end].tolist(),
+                           p_col[start:end].tolist())
+
+
+def _late_count(rows):
+    stats = getattr(rows, "stats", None) or {}
+    return stats.get("late", 0)
+
+
+def _write_cache(cache_dir, rows, signature):
+    """
+    rows 可以是列表、生成器或 StreamingSeries；
+    StreamingSeries 迭代结束后若有迟到数据被丢弃，放弃本次结果，返回丢弃条数（否则返回 0）
+    """
+    tmp_dir = f"{cache_dir}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # 按块把行转换为列，rows 可以是列表也可以是生成器
+    chunks = {name: [] for name in VALUE_COLUMNS + ("timestamp_lengths", "timestamp_bytes")}
+    n = 0
+    it = iter(rows)
+    while True:
+        block = list(islice(it, CHUNK_SIZE))
+        if not block:
+            break
+        n += len(block)
+        ts, t, h, p = zip(*block)
+        encoded = [str(value).encode("utf-8") for value in ts]
+        chunks["timestamp_lengths"].append(np.fromiter(map(len, encoded), np.int64, len(encoded)))
+        chunks["timestamp_bytes"].append(np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        chunks["temperature"].append(np.array(t, dtype=np.float64))
+        chunks["humidity"].append(np.array(h, dtype=np.float64))
+        chunks["pressure"].append(np.array(p, dtype=np.float64))
+
+    def concat(name, dtype):
+        parts = chunks[name]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    arrays = {name: concat(name, np.float64) for name in VALUE_COLUMNS}
+    arrays["timestamp_bytes"] = concat("timestamp_bytes", np.uint8)
+    arrays["timestamp_offsets"] = np.concatenate(
+        [[0], np.cumsum(concat("timestamp_lengths", np.int64))]).astype(np.int64)
+
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), arr)
+
+    late = _late_count(rows)
+    if late:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return late
+
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, "sources": signature,
+                   "rows": n}, f)
+
+    # 整个目录替换，保证读者看到的是完整的一组列文件和 manifest
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        # 其他进程抢先完成了编译，使用对方的结果即可
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return 0
+
+
+def load_cached_series(cache_dir, source_paths, compile_fn, exact_fn=None):
+    """
+    返回源数据对应的 CachedSeries；缓存缺失或过期时调用 compile_fn() 重新编译
+    compile_fn 返回按时间排序的 (ts, t, h, p) 序列（列表、迭代器或 StreamingSeries）；
+    StreamingSeries 有迟到数据被丢弃时改用 exact_fn() 的结果重新编译，
+    未提供 exact_fn 则抛出 ValueError，不会静默使用丢了数据的缓存
+    """
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    signature = source_signature(source_paths)
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == CACHE_VERSION and \
+                manifest.get("sources") == signature:
+            return CachedSeries(cache_dir)
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+    late = _write_cache(cache_dir, compile_fn(), signature)
+    if late:
+        if exact_fn is None:
+            raise ValueError(f"重排窗口内有 {late} 条迟到数据被丢弃，缓存未写入")
+        log.warning("流式编译时重排窗口内有 %d 条迟到数据被丢弃，改为整体排序重新编译缓存", late)
+        late = _write_cache(cache_dir, exact_fn(), signature)
+        if late:
+            raise ValueError(f"整体排序后仍有 {late} 条迟到数据，缓存未写入")
+    return CachedSeries(cache_dir)
@@ -0,0 +1,237 @@
+"""
+流式数据源：在不整体加载文件的前提下迭代大体量的传感器导出数据
+
+支持的格式：
+- json:    一个或多个 {timestamp: value} 对象，可以是单行的超大对象，也可以每行一个
+- ndjson:  每行 {"timestamp": ..., "value": ...}（或以指标名作为值字段）
+- csv:     每个指标一个 timestamp,value 文件
+- 合并 CSV：订阅端写出的 sensor_data.csv，每行已包含三个指标
+
+单指标流先经过有界重排缓冲得到按时间戳有序的序列，再把三个指标流按时间戳归并对齐，
+内存占用只与读块大小和重排窗口有关，与文件大小无关。
+重排窗口不足时迟到的数据会被丢弃并计数（StreamingSeries.stats["late"]）；
+exact=True 时改为整体排序，不丢数据，内存与单个指标的数据量成正比。
+"""
+import os
+import re
+import csv
+import json
+import heapq
+
+from config import Config
+
+READ_CHUNK = 64 * 1024
+
+# 扁平 JSON 对象中的 "key": value 对；值为字符串或数字
+_PAIR_RE = re.compile(
+    r'"((?:[^"\\]|\\.)*)"\s*:\s*("(?:[^"\\]|\\.)*"|-?[0-9][0-9.eE+-]*)')
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# =========================
+# 单指标流
+# =========================
+def iter_json_pairs(path):
+    """
+    逐块扫描 JSON 文本，产出 (timestamp, value)；
+    单行的超大对象也只会占用一个读块大小的内存
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        while True:
+            chunk = f.read(READ_CHUNK)
+            buf += chunk
+            end = 0
+            for m in _PAIR_RE.finditer(buf):
+                # 最后一个匹配可能被块边界截断，留到下一轮
+                if chunk and m.end() == len(buf):
+                    break
+                key, raw = m.group(1, 2)
+                value = _to_float(raw.strip('"') if raw[0] == '"' else raw)
+                if value is not None:
+                    if "\\" in key:
+                        key = json.loads(f'"{key}"')
+                    yield key, value
+                end = m.end()
+            if not chunk:
+                return
+            buf = buf[end:]
+            # 没有匹配的长前缀（例如空白或分隔符）只需保留尾部
+            if len(buf) > READ_CHUNK:
+                buf = buf[-READ_CHUNK:]
+
+
+def iter_ndjson_pairs(path, metric=None):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith("{"):
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                continue
+            ts = obj.get("timestamp")
+            value = _to_float(obj.get("value", obj.get(metric)))
+            if ts is not None and value is not None:
+                yield str(ts), value
+
+
+def iter_csv_pairs(path, metric=None):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            ts = row.get("timestamp")
+            value = _to_float(row.get("value", row.get(metric)))
+            if ts and value is not None:
+                yield ts, value
+
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".ndjson", ".jsonl"):
+        return "ndjson"
+    return "json"
+
+
+def iter_metric(path, metric=None, fmt=None):
+    fmt = fmt or detect_format(path)
+    if fmt == "csv":
+        return iter_csv_pairs(path, metric)
+    if fmt == "ndjson":
+        return iter_ndjson_pairs(path, metric)
+    return iter_json_pairs(path)
+
+
+# =========================
+# 排序与对齐
+# =========================
+def reorder(pairs, window=None, stats=None):
+    """
+    有界重排：最多缓存 window 条，按时间戳依次输出
+    比已输出时间戳更早的迟到数据无法再排入，计入 stats["late"] 后丢弃；
+    相同时间戳保留最后一次出现的值，与原先 dict 覆盖的语义一致
+    """
+    window = window or Config.SOURCE_REORDER_WINDOW
+    heap = []
+    seq = 0
+    last_ts = None
+    pending = None
+
+    def _emit(item):
+        nonlocal last_ts, pending
+        ts, _, value = item
+        if last_ts is not None and ts < last_ts:
+            if stats is not None:
+                stats["late"] = stats.get("late", 0) + 1
+            return None
+        last_ts = ts
+        if pending is not None and pending[0] == ts:
+            pending = (ts, value)
+            return None
+        out, pending = pending, (ts, value)
+        return out
+
+    for ts, value in pairs:
+        # seq 保证同一时间戳按出现顺序出堆
+        heapq.heappush(heap, (ts, seq, value))
+        seq += 1
+        if len(heap) > window:
+            out = _emit(heapq.heappop(heap))
+            if out is not None:
+                yield out
+
+    while heap:
+        out = _emit(heapq.heappop(heap))
+        if out is not None:
+            yield out
+    if pending is not None:
+        yield pending
+
+
+def sort_metric(pairs):
+    """整体排序：不受重排窗口限制，相同时间戳保留最后一次出现的值"""
+    data = {}
+    for ts, value in pairs:
+        data[ts] = value
+    return iter(sorted(data.items()))
+
+
+def merge_metrics(*streams):
+    """
+    对多个按时间戳有序的 (ts, value) 流做归并连接，
+    只输出所有流都存在的时间戳：(ts, v1, v2, ...)
+    """
+    iters = [iter(s) for s in streams]
+    heads = []
+    for it in iters:
+        head = next(it, None)
+        if head is None:
+            return
+        heads.append(head)
+
+    while True:
+        target = max(h[0] for h in heads)
+        for i, it in enumerate(iters):
+            while heads[i][0] < target:
+                heads[i] = next(it, None)
+                if heads[i] is None:
+                    return
+
+        if all(h[0] == target for h in heads):
+            yield (target,) + tuple(h[1] for h in heads)
+            for i, it in enumerate(iters):
+                heads[i] = next(it, None)
+                if heads[i] is None:
+                    return
+
+
+def iter_combined_csv(path):
+    """按文件顺序回放 sensor_data.csv 这样已包含三个指标的 CSV"""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            values = [_to_float(row.get(m))
+                      for m in ("temperature", "humidity", "pressure")]
+            if row.get("timestamp") and None not in values:
+                yield (row["timestamp"],) + tuple(values)
+
+
+class StreamingSeries:
+    """
+    可重复迭代的流式序列，每次迭代重新打开文件；不支持 len()
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.stats = {}
+
+    def __iter__(self):
+        self.stats = {}
+        return self.factory(self.stats)
+
+
+def stream_metric_files(temperature, humidity, pressure, fmt=None, window=None,
+                        exact=False):
+    def _order(pairs, stats):
+        return sort_metric(pairs) if exact else reorder(pairs, window, stats)
+
+    def _factory(stats):
+        return merge_metrics(
+            _order(iter_metric(temperature, "temperature", fmt), stats),
+            _order(iter_metric(humidity, "humidity", fmt), stats),
+            _order(iter_metric(pressure, "pressure", fmt), stats)
+        )
+    return StreamingSeries(_factory)
+
+
+def stream_combined_csv(path):
+    return StreamingSeries(lambda stats: iter_combined_csv(path))
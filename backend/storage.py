@@ -0,0 +1,283 @@
+"""
+订阅端写后（write-behind）批量存储
+
+MQTT 回调线程只负责把数据放入有界队列，由独立的写线程按批写入存储
+（CsvSink 或 segments.SegmentStore）：
+- 凑满 batch_size 条或距上次写入超过 flush_interval 秒即提交一批
+- 文件句柄常驻，不再每条消息打开/关闭一次
+- fsync 策略：always（每批都 fsync）/ interval（按间隔 fsync）/ never（交给操作系统）
+- 提交时带上接收时间的数据，写入成功后记录从接收到落盘的时延（/metrics）
+- 一批写入失败时整批丢弃，丢弃的条数计入 lost 并记录日志
+  （失败的批次可能已部分写入，重试会产生重复行，因此不重试）；
+  写入失败或队列满丢弃的数据交给 on_lost(datas) 回调，订阅端据此撤销去重登记
+"""
+import os
+import csv
+import time
+import queue
+import threading
+from collections import deque
+
+from config import Config
+from inflight import percentile
+from logs import get_logger
+import metrics
+
+log = get_logger("storage")
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+_FLUSH = object()
+_STOP = object()
+
+COMMIT_LATENCY = metrics.histogram(
+    "iot_storage_commit_latency_seconds", "订阅端从收到消息到写入存储的时延")
+
+
+class CsvSink:
+    """追加写入单个 CSV 文件，文件句柄常驻"""
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = fields
+        self._file = None
+        self._writer = None
+
+    def _open(self):
+        if self._file is not None:
+            return
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        self._file = open(self.path, "a", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fields,
+                                      extrasaction="ignore")
+        if not exists:
+            self._writer.writeheader()
+
+    def write(self, rows):
+        try:
+            self._open()
+            self._writer.writerows(rows)
+            self._file.flush()
+        except Exception:
+            # 出错后关闭句柄，下一批重新打开
+            self.close(sync=False)
+            raise
+
+    def sync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def close(self, sync=True):
+        if self._file is None:
+            return
+        try:
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def stats(self):
+        return {"engine": "csv", "path": self.path}
+
+
+class BatchWriter:
+    def __init__(self, sink, to_row=None, batch_size=None,
+                 flush_interval=None, fsync_policy=None, queue_size=None, on_lost=None):
+        self.sink = sink
+        self.to_row = to_row or (lambda data: data)
+        self.on_lost = on_lost
+        self.batch_size = int(batch_size or Config.WRITER_BATCH_SIZE)
+        self.flush_interval = float(flush_interval or Config.WRITER_FLUSH_INTERVAL)
+        self.fsync_policy = fsync_policy or Config.WRITER_FSYNC
+        if self.fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync 策略必须是 {', '.join(FSYNC_POLICIES)} 之一")
+
+        self.queue = queue.Queue(maxsize=int(queue_size or Config.WRITER_QUEUE_SIZE))
+        self._thread = None
+        self._lock = threading.Lock()
+        # 计数会被 MQTT 回调线程与写线程同时更新
+        self._stats_lock = threading.Lock()
+        self._last_fsync = time.monotonic()
+
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.lost = 0
+        self.errors = 0
+        self.last_error = None
+        self.flush_latencies = deque(maxlen=1000)
+
+    # ========================
+    # 生命周期
+    # ========================
+    def start(self):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name="storage-writer")
+            self._thread.start()
+
+    def flush(self, timeout=5.0):
+        """等待队列中已有的数据全部写入磁盘"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self.queue.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """写完剩余数据后停止写线程并关闭文件"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None or not thread.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put((_STOP, done))
+        done.wait(timeout)
+        thread.join(timeout)
+
+    # ========================
+    # 生产者接口
+    # ========================
+    def submit(self, data, timeout=None, received_at=None):
+        """
+        放入一条数据；队列满时最多等待 timeout 秒，仍无空位则丢弃并计数。
+        received_at 为收到该数据的时间（time.time()），用于统计接收到落盘的时延
+        """
+        try:
+            self.queue.put((data, received_at), timeout=Config.WRITER_PUT_TIMEOUT
+                           if timeout is None else timeout)
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            self._lost([data])
+            return False
+
+    # ========================
+    # 写线程
+    # ========================
+    def _lost(self, datas):
+        if self.on_lost is None:
+            return
+        try:
+            self.on_lost(datas)
+        except Exception as e:
+            log.error("on_lost 回调失败: %s", e)
+
+    def _error(self, e):
+        with self._stats_lock:
+            self.errors += 1
+            self.last_error = str(e)
+
+    def _close_sink(self):
+        try:
+            self.sink.close(sync=self.fsync_policy != "never")
+        except Exception as e:
+            self._error(e)
+
+    def _commit(self, batch):
+        if not batch:
+            return
+        start = time.monotonic()
+        try:
+            self.sink.write([self.to_row(data) for data, _ in batch])
+
+            now = time.monotonic()
+            if self.fsync_policy == "always" or (
+                    self.fsync_policy == "interval" and
+                    now - self._last_fsync >= Config.WRITER_FSYNC_INTERVAL):
+                self.sink.sync()
+                self._last_fsync = now
+        except Exception as e:
+            with self._stats_lock:
+                self.errors += 1
+                self.last_error = str(e)
+                self.lost += len(batch)
+                lost = self.lost
+            log.error("写入 %d 条数据失败，已丢弃（累计 %d 条）: %s", len(batch), lost, e)
+            self._lost([data for data, _ in batch])
+            return
+        finally:
+            self.flush_latencies.append(time.monotonic() - start)
+
+        with self._stats_lock:
+            self.written += len(batch)
+            self.batches += 1
+        committed_at = time.time()
+        for _, received_at in batch:
+            if received_at is not None:
+                COMMIT_LATENCY.observe(committed_at - received_at)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is None:
+                    self._commit(batch)
+                    batch, deadline = [], None
+                    continue
+
+                if item[0] is _FLUSH or item[0] is _STOP:
+                    marker, done = item
+                    self._commit(batch)
+                    batch, deadline = [], None
+                    if marker is _STOP:
+                        self._close_sink()
+                        done.set()
+                        return
+                    if self.fsync_policy != "never":
+                        try:
+                            self.sink.sync()
+                        except Exception as e:
+                            self._error(e)
+                    done.set()
+                    continue
+
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) >= self.batch_size:
+                    self._commit(batch)
+                    batch, deadline = [], None
+        finally:
+            self._close_sink()
+
+    # ========================
+    # 状态
+    # ========================
+    def stats(self):
+        samples = sorted(self.flush_latencies)
+
+        def _ms(p):
+            v = percentile(samples, p)
+            return round(v * 1000, 3) if v is not None else None
+
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "lost": self.lost,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "fsync": self.fsync_policy,
+            "flush_latency_ms": {"p50": _ms(50), "p99": _ms(99)},
+            "sink": self.sink.stats()
+        }
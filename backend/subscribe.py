@@ -1,18 +1,39 @@
 import os
 import json
 import csv
+import math
 import threading
 import time
 import asyncio
-from typing import Set
+import atexit
+import queue
+import signal
+import multiprocessing
 
-from flask import Flask, jsonify, Blueprint
+import numpy as np
+from flask import Flask, jsonify, Blueprint, request
 from flask_cors import CORS
 import paho.mqtt.client as mqtt
 import websockets
 from config import Config
+from storage import BatchWriter, CsvSink
+from segments import (open_store, migrate_csv, format_ts, to_epoch_seconds, parse_epoch,
+                      iso_timestamp, partition)
+from rollups import RollupStore, default_root as rollups_root
+from pipeline import Stage
+from dedup import TimestampIndex, dedup_key, dedup_keys
+from history import HistoryRing
+from analytics import RunningStats, snapshot_path, sensor_snapshot_path
+from topics import TopicRouter
+from anomaly import AnomalyDetector, AlertLog, STATES as ALERT_STATES, log_path
+from ws_fanout import WSHub
+from workers import Outbox, WorkerPool
+from logs import get_logger
+from metrics import metrics_bp
+import metrics
 
 subscribe_bp = Blueprint('subscribe', __name__)
+log = get_logger("subscribe")
 
 # ========================
 # Path config
@@ -23,13 +44,17 @@ os.makedirs(DATA_DIR, exist_ok=True)
 CSV_PATH = os.path.join(DATA_DIR, "sensor_data.csv")
 
 CSV_FIELDS = ["timestamp", "temperature", "humidity", "pressure", "raw"]
+# segments：按时间分区的列式段存储；csv：沿用单个 sensor_data.csv
+STORAGE_ENGINE = Config.STORAGE_ENGINE
 
 # ========================
 # MQTT config
 # ========================
 BROKER = Config.MQTT_BROKER
 PORT = Config.MQTT_PORT
-TOPIC = Config.MQTT_TOPIC
+# 主题模式：支持通配符，传感器 ID 取自消息或主题
+topic_router = TopicRouter()
+subscription_filters = topic_router.filters()
 USERNAME = Config.MQTT_USERNAME
 PASSWORD = Config.MQTT_PASSWORD
 
@@ -44,16 +69,34 @@ mqtt_status = {
     "connected": False,
     "broker": BROKER,
     "port": PORT,
-    "topic": TOPIC,
+    "topics": subscription_filters,
     "error": None
 }
 
+# ========================
+# Multi-process state
+# ========================
+# 多进程订阅时本进程的 worker 编号（单进程与协调进程为 None）
+worker_id = None
+num_workers = 1
+# worker：转发给其他 worker 的发件箱（按 worker 编号，自己的位置为 None）与发给协调进程的发件箱
+forward_outboxes = []
+event_outbox = None
+# 协调进程：worker 进程组，以及各 worker 最近上报的状态
+worker_pool = None
+worker_stats = {}
+# 各 worker 最近上报的指标快照，/metrics 输出时加上 worker 标签
+worker_metrics = {}
+WORKER_STATS_INTERVAL = 1.0
+
 # ========================
 # WebSocket state
 # ========================
 ws_loop: asyncio.AbstractEventLoop | None = None
-ws_clients: Set[websockets.WebSocketServerProtocol] = set()
-ws_lock = threading.Lock()
+# 单事件循环模式（aio_service.py）：MQTT、WebSocket 与 REST 共用 ws_loop，消息在其中直接解码与推送
+single_loop = False
+# 每个连接一个有界发送队列，慢客户端不会拖慢其他客户端
+ws_hub = WSHub()
 
 # ========================
 # CSV helpers
@@ -67,16 +110,278 @@ def ensure_csv():
             writer.writeheader()
 
 
-def append_csv(data: dict):
-    with open(CSV_PATH, "a", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
-        writer.writerow({
-            "timestamp": data.get("timestamp"),
-            "temperature": data.get("temperature"),
-            "humidity": data.get("humidity"),
-            "pressure": data.get("pressure"),
-            "raw": json.dumps(data, ensure_ascii=False)
-        })
+def to_csv_row(data: dict, topic=None):
+    return {
+        "timestamp": data.get("timestamp"),
+        "topic": topic,
+        "sensor_id": data.get("sensor_id") or Config.DEFAULT_SENSOR_ID,
+        "temperature": data.get("temperature"),
+        "humidity": data.get("humidity"),
+        "pressure": data.get("pressure"),
+        "raw": json.dumps(data, ensure_ascii=False)
+    }
+
+
+# 最近数据的内存环形缓冲，/api/history 直接从这里读取
+history = HistoryRing()
+
+def forget_rows(rows):
+    """写入失败或写队列满而丢弃的数据从去重索引中撤销，重发时不会被当作重复"""
+    if seen_timestamps is None:
+        return
+    for row in rows:
+        seconds = parse_epoch(row.get("timestamp"))
+        if seconds is not None:
+            seen_timestamps.discard(row.get("sensor_id"), dedup_key(seconds))
+
+
+# 写后批量存储：回调线程只入队，由写线程成批写入段存储（按传感器分片，或 CSV）
+segment_store = open_store() if STORAGE_ENGINE == "segments" else None
+csv_writer = BatchWriter(segment_store or CsvSink(CSV_PATH, CSV_FIELDS), on_lost=forget_rows)
+
+
+def warm_history():
+    """段存储为空时先导入已有的 sensor_data.csv（只导入一次），再用存储尾部预热"""
+    if segment_store is None:
+        return history.warm(CSV_PATH)
+    segment_store.open()
+    # CSV 导入由单进程或协调进程在启动 worker 之前完成
+    migrated = migrate_csv(CSV_PATH, segment_store) \
+        if worker_id is None and not segment_store.count() else 0
+    if migrated:
+        log.info("已从 %s 导入 %d 条到段存储", CSV_PATH, migrated)
+    return history.load(segment_store.tail(history.size))
+
+
+# 按传感器的时间戳索引，丢弃重复数据（发布端每次 /start 都会回放同一序列）；
+# 键为微秒，段存储保存完整精度的时间戳，重启后重建的键与实时计算的一致
+seen_timestamps = TimestampIndex() if Config.INGEST_DEDUP else None
+
+
+def build_dedup_index():
+    """启动时从存储读取已有的 (传感器, 时间戳)，只读取这两列"""
+    if seen_timestamps is None:
+        return 0
+    seen_timestamps.clear()
+    if segment_store is not None:
+        data, sensors = segment_store.read(metrics=())
+        return seen_timestamps.load(np.asarray(sensors, dtype=object)[data["sensor"]],
+                                    dedup_keys(data["ts"]))
+    if not os.path.exists(CSV_PATH):
+        return 0
+    sensor_ids, timestamps = [], []
+    with open(CSV_PATH, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            seconds = parse_epoch(row.get("timestamp"))
+            if seconds is not None:
+                sensor_ids.append(row.get("sensor_id") or Config.DEFAULT_SENSOR_ID)
+                timestamps.append(dedup_key(seconds))
+    return seen_timestamps.load(sensor_ids, timestamps)
+
+
+def append_csv(data: dict, topic=None, received_at=None):
+    csv_writer.start()
+    row = to_csv_row(data, topic)
+    # 单事件循环模式下不能在事件循环中等待写队列：队列满时立即丢弃（计入 dropped，撤销去重登记），
+    # 背压由 aio_service 在写队列接近满时暂停读取 MQTT 施加
+    csv_writer.submit(row, received_at=received_at, timeout=0 if single_loop else None)
+    return row
+
+# ========================
+# Incremental analytics
+# ========================
+# 每条数据增量更新，定期写快照供 /api/analyze（另一个进程）读取
+analytics_state = RunningStats()
+ANALYTICS_PATH = snapshot_path()
+_analytics_saved_at = 0.0
+# 每个传感器各自的分析状态，有变化的定期写入 data/analytics/
+sensor_states = {}
+_dirty_sensors = set()
+_sensors_saved_at = 0.0
+
+
+def sensor_state(sensor_id):
+    state = sensor_states.get(sensor_id)
+    if state is None:
+        state = sensor_states[sensor_id] = RunningStats()
+    return state
+
+
+def rebuild_sensor(sensor_id):
+    """只读取该传感器的分片重建其分析状态，返回读取的数据"""
+    state = RunningStats()
+    state.store_id, state.generation = segment_store.shard_identity(sensor_id)
+    data, _ = segment_store.read(sensor_id=sensor_id, metrics=METRICS)
+    if len(data["ts"]):
+        state.merge_arrays(format_ts(data["ts"]),
+                           np.column_stack([data[m] for m in METRICS]))
+    sensor_states[sensor_id] = state
+    _dirty_sensors.add(sensor_id)
+    return data
+
+
+def rebuild_analytics():
+    """启动时（或存储删除数据后）从存储重建一次分析状态（全部数据及每个传感器）"""
+    analytics_state.reset()
+    sensor_states.clear()
+    if segment_store is not None:
+        analytics_state.store_id, analytics_state.generation = segment_store.identity()
+        # 逐个分片读取，全部数据的状态由各传感器的数据合并得到
+        for sensor_id in segment_store.registry():
+            data = rebuild_sensor(sensor_id)
+            if len(data["ts"]):
+                analytics_state.merge_arrays(
+                    format_ts(data["ts"]),
+                    np.column_stack([data[m] for m in METRICS]))
+    elif os.path.exists(CSV_PATH):
+        with open(CSV_PATH, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                analytics_state.update(row)
+                sensor_id = row.get("sensor_id") or Config.DEFAULT_SENSOR_ID
+                sensor_state(sensor_id).update(row)
+                _dirty_sensors.add(sensor_id)
+    return analytics_state.n
+
+
+def save_sensor_states(rebuild=True):
+    """
+    写入有变化的传感器快照；分片已变化（新建、保留期删除）的传感器先重建。
+    rebuild=False 时跳过这些传感器（仍标记为有变化），返回是否有需要重建的传感器
+    """
+    # 逐个取出：单事件循环模式下本函数在线程池中执行，事件循环仍在登记新的变化
+    dirty = []
+    while _dirty_sensors:
+        dirty.append(_dirty_sensors.pop())
+    stale = []
+    if segment_store is not None:
+        stale = [sid for sid in dirty if segment_store.shard_identity(sid) !=
+                 (sensor_states[sid].store_id, sensor_states[sid].generation)]
+        if stale and not rebuild:
+            _dirty_sensors.update(stale)
+            dirty = [sid for sid in dirty if sid not in set(stale)]
+        elif stale:
+            csv_writer.flush()
+            for sensor_id in stale:
+                rebuild_sensor(sensor_id)
+            _dirty_sensors.difference_update(stale)
+            stale = []
+    for sensor_id in dirty:
+        try:
+            sensor_states[sensor_id].save(sensor_snapshot_path(sensor_id))
+        except OSError as e:
+            log.error("传感器 %s 分析快照写入失败: %s", sensor_id, e)
+    return bool(stale)
+
+
+# ========================
+# Rollups
+# ========================
+# 1m / 1h / 1d 预聚合，与分析快照同一节奏把变化过的桶追加到文件
+rollup_store = RollupStore(rollups_root()) if Config.ROLLUPS else None
+
+
+def rollup_source():
+    if segment_store is not None:
+        return segment_store.identity()[0]
+    return "csv:" + CSV_PATH
+
+
+def rebuild_rollups():
+    """
+    预聚合对应的存储变化（首次启动、存储被替换）时从存储重建；
+    否则沿用已有的预聚合，保留期删除的原始数据在预聚合中仍然保留
+    """
+    if rollup_store is None:
+        return 0
+    source = rollup_source()
+    if source is not None and rollup_store.source_id() == source:
+        return 0
+    rollup_store.reset(source)
+    count = 0
+    if segment_store is not None:
+        data, sensors = segment_store.read(metrics=METRICS)
+        if len(data["ts"]):
+            rollup_store.ingest_arrays(
+                data["ts"], np.asarray(sensors, dtype=object)[data["sensor"]],
+                np.column_stack([data[m] for m in METRICS]))
+            count = len(data["ts"])
+    elif os.path.exists(CSV_PATH):
+        with open(CSV_PATH, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                ts = to_epoch_seconds([row.get("timestamp")])[0]
+                if ts is not None:
+                    rollup_store.update(ts, row.get("sensor_id"),
+                                        [_to_float(row.get(m)) for m in METRICS])
+                    count += 1
+        rollup_store.flush()
+    return count
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def persist_state(force=False, rebuild=True):
+    """
+    定期保存分析快照（全部数据与各传感器）并把预聚合写入文件。
+    重建分析状态时不能有并发的解码：单事件循环模式在线程池中以 rebuild=False 调用，
+    需要重建时返回 True，由调用方暂停读取 MQTT 后再以 rebuild=True 调用
+    """
+    global _analytics_saved_at, _sensors_saved_at
+    now = time.monotonic()
+    if not force and now - _analytics_saved_at < Config.ANALYTICS_SNAPSHOT_INTERVAL:
+        return False
+    if segment_store is not None and \
+            segment_store.identity() != (analytics_state.store_id, analytics_state.generation):
+        if not rebuild:
+            return True
+        # 保留期删除了旧数据，等已接收的数据落盘后重建
+        csv_writer.flush()
+        rebuild_analytics()
+    _analytics_saved_at = now
+    try:
+        analytics_state.save(ANALYTICS_PATH)
+    except OSError as e:
+        log.error("分析快照写入失败: %s", e)
+    stale = False
+    if force or now - _sensors_saved_at >= Config.ANALYTICS_SENSOR_SNAPSHOT_INTERVAL:
+        _sensors_saved_at = now
+        stale = save_sensor_states(rebuild)
+    if rollup_store is not None:
+        try:
+            rollup_store.flush()
+        except OSError as e:
+            log.error("预聚合写入失败: %s", e)
+    return stale
+
+# ========================
+# Anomaly detection
+# ========================
+# 每个 (传感器, 指标) 的 EWMA 控制限，每条数据 O(1) 更新；告警写入日志并推送给 WebSocket
+anomaly_detector = AnomalyDetector() if Config.ANOMALY_DETECTION else None
+alert_log = AlertLog(log_path())
+
+
+def warm_anomaly():
+    """用历史缓冲中的最近数据预热控制限（只学习不告警），不扫描全部历史"""
+    if anomaly_detector is None:
+        return 0
+    rows = history.query(len(history))
+    for row in rows:
+        anomaly_detector.update(row, emit=False)
+    return len(rows)
+
+
+def detect_anomalies(payload):
+    for event in anomaly_detector.update(payload):
+        log.info("异常告警: %s %s %s value=%s z=%s", event["sensor_id"], event["metric"],
+                 event["state"], event["value"], event["z"])
+        ALERTS.inc(state=event["state"])
+        alert_log.append(event)
+        submit_broadcast(("alert", event))
 
 # ========================
 # WebSocket logic
@@ -84,26 +389,31 @@ def append_csv(data: dict):
 
 
 async def ws_handler(websocket):
-    with ws_lock:
-        ws_clients.add(websocket)
+    ws_hub.register(websocket)
     try:
-        async for _ in websocket:
-            pass
+        # 客户端可发送订阅消息，选择指标、传感器和最大帧率
+        async for message in websocket:
+            ws_hub.handle_message(websocket, message)
+    except websockets.ConnectionClosed:
+        pass
     finally:
-        with ws_lock:
-            ws_clients.discard(websocket)
+        ws_hub.unregister(websocket)
 
 
-async def broadcast_ws(data: dict):
-    message = json.dumps(data, ensure_ascii=False)
-    with ws_lock:
-        clients = list(ws_clients)
+async def broadcast_ws(data: dict, received_at=None):
+    # 入队后立即返回，不等待任何客户端发送完成
+    ws_hub.publish(data, received_at)
+
+
+async def alert_ws(event: dict):
+    ws_hub.alert(event)
 
-    for ws in clients:
-        try:
-            await ws.send(message)
-        except:
-            pass
+
+def use_event_loop(loop):
+    """切换到单事件循环模式，须在 start_pipeline 之前、在 loop 所在线程中调用"""
+    global ws_loop, single_loop
+    ws_loop = loop
+    single_loop = True
 
 
 def start_ws_server():
@@ -115,18 +425,20 @@ def start_ws_server():
         async def start_server():
             # 使用 0.0.0.0 以允许外部连接
             try:
-                server = await websockets.serve(ws_handler, "0.0.0.0", Config.WEBSOCKET_PORT)
-                print(
-                    f"WebSocket 运行于 ws://{Config.WEBSOCKET_HOST}:{Config.WEBSOCKET_PORT}")
+                # permessage-deflate 由 WS_COMPRESSION 控制，客户端支持时自动协商
+                server = await websockets.serve(
+                    ws_handler, "0.0.0.0", Config.WEBSOCKET_PORT,
+                    compression="deflate" if Config.WS_COMPRESSION else None)
+                log.info("WebSocket 运行于 ws://%s:%s", Config.WEBSOCKET_HOST, Config.WEBSOCKET_PORT)
                 await server.wait_closed()
             except OSError as e:
                 if e.errno == 10048:  # 端口已被使用
-                    print(f"端口 {Config.WEBSOCKET_PORT} 已被占用，无法启动WebSocket服务器")
+                    log.error("端口 %s 已被占用，无法启动WebSocket服务器", Config.WEBSOCKET_PORT)
                     import asyncio
                     await asyncio.sleep(5)  # 等待5秒后退出
                     return  # 不再重试，避免无限递归
                 else:
-                    print(f"WebSocket服务器启动失败: {e}")
+                    log.error("WebSocket服务器启动失败: %s", e)
 
         ws_loop.run_until_complete(start_server())
         ws_loop.run_forever()
@@ -140,21 +452,22 @@ def start_ws_server():
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         mqtt_status["connected"] = True
-        print("MQTT 连接成功")
-        client.subscribe(TOPIC)
+        log.info("MQTT 连接成功")
+        client.subscribe([(f, 0) for f in subscription_filters])
     else:
         mqtt_status["error"] = f"rc={rc}"
+        log.warning("MQTT 连接失败，rc = %s", rc)
 
 
 def on_disconnect(client, userdata, rc):
     mqtt_status["connected"] = False
-    print("MQTT 断开连接")
+    log.info("MQTT 断开连接")
 
     if not user_requested_disconnect:
         def reconnect():
             while True:
                 try:
-                    print("尝试重连 MQTT...")
+                    log.info("尝试重连 MQTT...")
                     client.reconnect()
                     return
                 except:
@@ -163,18 +476,210 @@ def on_disconnect(client, userdata, rc):
 
 
 def on_message(client, userdata, msg):
+    # 网络线程只负责入队，解码、存储和推送都在流水线线程中完成
+    RECEIVED.inc()
+    decode_stage.submit((msg.topic, msg.payload, time.time()))
+
+
+# ========================
+# Ingest pipeline
+# ========================
+METRICS = ["temperature", "humidity", "pressure"]
+
+RECEIVED = metrics.counter("iot_mqtt_messages_received_total", "订阅端从 MQTT 收到的消息数")
+INGESTED = metrics.counter(
+    "iot_ingest_messages_total",
+    "订阅端解码后的消息数（result: accepted / duplicate / forwarded）", ("result",))
+PUBLISH_LATENCY = metrics.histogram(
+    "iot_publish_receive_latency_seconds", "从发布端发送（消息中的 sent_at）到订阅端收到的时延")
+ALERTS = metrics.counter("iot_alerts_total", "异常检测产生的告警事件数", ("state",))
+
+
+def observe_publish_latency(payload, received_at):
+    """取出发布端的发送时刻 sent_at 统计时延；sent_at 不写入存储"""
+    sent_at = payload.pop("sent_at", None)
     try:
-        payload = json.loads(msg.payload.decode())
-        append_csv(payload)
-        print("收到 MQTT 数据:", payload)
-
-        if ws_loop:
-            asyncio.run_coroutine_threadsafe(
-                broadcast_ws(payload),
-                ws_loop
-            )
-    except Exception as e:
-        print("消息处理失败:", e)
+        sent_at = float(sent_at)
+    except (TypeError, ValueError):
+        return
+    # 两端时钟不同步时可能为负，按 0 计
+    PUBLISH_LATENCY.observe(max(0.0, received_at - sent_at))
+
+
+def decode_message(item):
+    topic, raw, received_at = item
+    if isinstance(raw, dict):
+        # 其他 worker 转发来的数据，已解码并确定了 sensor_id
+        payload = raw
+    else:
+        payload = json.loads(raw.decode())
+
+        if not isinstance(payload, dict) or not payload.get("timestamp"):
+            raise ValueError(f"无效消息（缺少 timestamp）: {topic}")
+        seconds = parse_epoch(payload["timestamp"])
+        if seconds is None:
+            raise ValueError(f"无效消息（timestamp 无法解析或超出范围）: {topic}")
+        # Unix 秒与带时区偏移的时间统一为不带时区的 UTC ISO 时间，存储与分析按同一格式解析
+        payload["timestamp"] = iso_timestamp(seconds)
+        for m in METRICS:
+            if m in payload and payload[m] is not None:
+                payload[m] = float(payload[m])
+
+        payload["sensor_id"] = topic_router.sensor_id(topic, payload)
+        observe_publish_latency(payload, received_at)
+        if worker_id is not None:
+            owner = partition(payload["sensor_id"], num_workers)
+            if owner != worker_id:
+                # 传感器只由所属 worker 写入与分析
+                forward_outboxes[owner].put((topic, payload, received_at))
+                INGESTED.inc(result="forwarded")
+                return
+    seconds = parse_epoch(payload["timestamp"])
+    ts = math.floor(seconds)
+    # 按完整精度的时间戳去重：同一秒内的不同读数不算重复；
+    # 先登记再写入，写入失败时由 forget_rows 撤销
+    if seen_timestamps is not None and \
+            seen_timestamps.add(payload.get("sensor_id"), dedup_key(seconds)) == "duplicate":
+        # 重复数据不存储、不参与分析，也不再推送
+        INGESTED.inc(result="duplicate")
+        return
+
+    INGESTED.inc(result="accepted")
+    log.debug("收到 MQTT 数据: %s", payload)
+
+    # 扇出：存储与 WebSocket 推送各自排队，互不阻塞
+    # 存储与历史缓冲共用同一行数据，只序列化一次
+    history.append(append_csv(payload, topic, received_at))
+    analytics_state.update(payload)
+    sensor_state(payload["sensor_id"]).update(payload)
+    _dirty_sensors.add(payload["sensor_id"])
+    if rollup_store is not None:
+        rollup_store.update(ts, payload.get("sensor_id"),
+                            [_to_float(payload.get(m)) for m in METRICS])
+    submit_broadcast(("sample", payload, topic, received_at))
+    if anomaly_detector is not None:
+        detect_anomalies(payload)
+    if not single_loop:
+        # 单事件循环模式下由 aio_service 的定时任务在线程池中保存
+        persist_state()
+
+
+def submit_broadcast(item):
+    if single_loop:
+        # 已在事件循环中，直接推送
+        broadcast_stage.call(item)
+    else:
+        broadcast_stage.submit(item)
+
+
+def dispatch_broadcast(item):
+    if event_outbox is not None:
+        # worker 不直接推送，交给协调进程统一推送
+        event_outbox.put(item)
+        return
+    if single_loop:
+        publish_batch([item])
+        return
+    kind, data = item[0], item[1]
+    if ws_loop:
+        asyncio.run_coroutine_threadsafe(
+            alert_ws(data) if kind == "alert" else broadcast_ws(data, item[3]),
+            ws_loop
+        )
+
+
+decode_stage = Stage("decode", decode_message)
+broadcast_stage = Stage("broadcast", dispatch_broadcast,
+                        policy=Config.PIPELINE_BROADCAST_POLICY)
+
+
+_pipeline_started = False
+
+
+def start_pipeline():
+    global _pipeline_started
+    _pipeline_started = True
+    csv_writer.start()
+    if not single_loop:
+        broadcast_stage.start()
+        decode_stage.start()
+
+
+def stop_pipeline():
+    # 没有启动过流水线的进程（协调进程、初始化前的 worker）不写快照
+    if not _pipeline_started:
+        return
+    # 按上游到下游的顺序停止，保证已接收的数据都能落盘
+    decode_stage.stop()
+    broadcast_stage.stop()
+    csv_writer.close()
+    persist_state(force=True)
+
+
+def pipeline_stats():
+    if worker_pool is not None:
+        return {"coordinator": worker_pool.stats(),
+                "workers": {str(w): worker_stats[w] for w in sorted(worker_stats)}}
+    stats = {
+        "decode": decode_stage.stats(),
+        "storage": csv_writer.stats(),
+        "broadcast": broadcast_stage.stats(),
+        "dedup": seen_timestamps.stats() if seen_timestamps is not None else None,
+        "rollups": rollup_store.stats() if rollup_store is not None else None,
+        "anomaly": anomaly_detector.stats() if anomaly_detector is not None else None
+    }
+    if worker_id is not None:
+        stats["worker"] = {
+            "id": worker_id,
+            "forward": {str(i): o.stats() for i, o in enumerate(forward_outboxes) if o},
+            "events": event_outbox.stats()
+        }
+    return stats
+
+
+# 进程退出时处理完队列中剩余的数据
+atexit.register(stop_pipeline)
+
+
+@metrics.collector
+def collect_metrics():
+    """把流水线、写线程与 WebSocket 的累计统计转为 /metrics 指标"""
+    families = [("iot_mqtt_connected", "gauge", "MQTT 是否已连接",
+                 [({}, int(bool(mqtt_status["connected"])))])]
+    # 协调进程不处理消息，流水线与存储指标由各 worker 上报
+    if worker_pool is None:
+        stages = {"decode": decode_stage.stats(), "broadcast": broadcast_stage.stats()}
+        for field, help in (("received", "流水线阶段收到的条数"),
+                            ("processed", "流水线阶段处理的条数"),
+                            ("dropped", "流水线阶段因队列满丢弃的条数"),
+                            ("errors", "流水线阶段处理失败的条数（含无效消息）")):
+            families.append((f"iot_pipeline_{field}_total", "counter", help,
+                             [({"stage": name}, st[field]) for name, st in stages.items()]))
+        families.append(("iot_pipeline_queue_depth", "gauge", "流水线阶段队列中的条数",
+                         [({"stage": name}, st["queue_depth"]) for name, st in stages.items()]))
+        writer = csv_writer.stats()
+        families += [
+            ("iot_storage_written_total", "counter", "写入存储的条数", [({}, writer["written"])]),
+            ("iot_storage_dropped_total", "counter", "写队列满丢弃的条数", [({}, writer["dropped"])]),
+            ("iot_storage_lost_total", "counter", "写入存储失败而丢弃的条数", [({}, writer["lost"])]),
+            ("iot_storage_errors_total", "counter", "写入存储失败的批次数", [({}, writer["errors"])]),
+            ("iot_storage_queue_depth", "gauge", "写队列中的条数", [({}, writer["queue_depth"])])
+        ]
+    # worker 不直接推送 WebSocket
+    if worker_id is None:
+        ws = ws_hub.stats()
+        families += [
+            ("iot_ws_clients", "gauge", "WebSocket 连接数", [({}, ws["clients"])]),
+            ("iot_ws_frames_total", "counter", "WebSocket 广播的帧数", [({}, ws["frames"])]),
+            ("iot_ws_sent_total", "counter", "发给各 WebSocket 客户端的帧数", [({}, ws["sent"])]),
+            ("iot_ws_dropped_total", "counter", "慢客户端丢弃的帧数", [({}, ws["dropped"])])
+        ]
+    return families
+
+
+@metrics.REGISTRY.source
+def worker_metric_sources():
+    return [(worker_metrics[w], {"worker": str(w)}) for w in sorted(worker_metrics)]
 
 # ========================
 # MQTT control
@@ -184,6 +689,10 @@ def on_message(client, userdata, msg):
 def connect_mqtt():
     global mqtt_client, user_requested_disconnect
 
+    if worker_pool is not None:
+        worker_pool.command("connect")
+        return
+
     with mqtt_lock:
         if mqtt_client:
             return
@@ -196,6 +705,8 @@ def connect_mqtt():
         client.on_disconnect = on_disconnect
         client.on_message = on_message
 
+        start_pipeline()
+
         client.connect(BROKER, PORT, 60)
         client.loop_start()
 
@@ -205,6 +716,10 @@ def connect_mqtt():
 def disconnect_mqtt():
     global mqtt_client, user_requested_disconnect
 
+    if worker_pool is not None:
+        worker_pool.command("disconnect")
+        return
+
     with mqtt_lock:
         if mqtt_client:
             user_requested_disconnect = True
@@ -212,8 +727,150 @@ def disconnect_mqtt():
             mqtt_client.disconnect()
             mqtt_client = None
 
+    # 断开后把已接收但尚未处理、落盘的数据处理完
+    decode_stage.drain()
+    csv_writer.flush()
+    persist_state(force=True)
+
+
+# ========================
+# Multi-process mode
+# ========================
+def configure_worker(worker, workers, inboxes, events):
+    """
+    在 worker 进程中切换到该 worker 自己的注册表、分析快照、预聚合与告警日志，
+    订阅改为共享订阅，并建立转发给其他 worker 与上报协调进程的发件箱
+    """
+    global worker_id, num_workers, segment_store, csv_writer, ANALYTICS_PATH, \
+        rollup_store, alert_log, subscription_filters, forward_outboxes, event_outbox
+    worker_id, num_workers = worker, workers
+    segment_store = open_store(worker=worker, workers=workers)
+    csv_writer = BatchWriter(segment_store, on_lost=forget_rows)
+    ANALYTICS_PATH = snapshot_path(worker)
+    rollup_store = RollupStore(rollups_root(worker)) if Config.ROLLUPS else None
+    alert_log = AlertLog(log_path(worker))
+    subscription_filters = topic_router.filters(Config.MQTT_SHARED_GROUP)
+    mqtt_status["topics"] = subscription_filters
+
+    forward_outboxes = [Outbox(inbox, kind="messages") if i != worker else None
+                        for i, inbox in enumerate(inboxes)]
+    event_outbox = Outbox(events)
+    for outbox in forward_outboxes + [event_outbox]:
+        if outbox is not None:
+            outbox.start()
+
+
+def run_worker(worker, workers, inboxes, events):
+    """worker 进程入口（spawn）：从自己的分片预热后连接 MQTT，处理收件箱直到收到 stop"""
+    # Ctrl+C 由协调进程统一处理，按顺序通知各 worker 停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_worker(worker, workers, inboxes, events)
+    log.info("历史缓冲已预热 %d 条", warm_history())
+    log.info("去重索引已载入 %d 条", build_dedup_index())
+    log.info("分析状态已从存储重建 %d 条", rebuild_analytics())
+    log.info("预聚合已从存储重建 %d 条", rebuild_rollups())
+    log.info("异常检测已用最近 %d 条数据预热", warm_anomaly())
+    persist_state(force=True)
+    connect_mqtt()
 
+    inbox = inboxes[worker]
+    parent = multiprocessing.parent_process()
+    reported = 0.0
+    while parent is None or parent.is_alive():
+        try:
+            kind, data = inbox.get(timeout=WORKER_STATS_INTERVAL)
+        except queue.Empty:
+            kind, data = None, None
+        if kind == "messages":
+            for item in data:
+                decode_stage.submit(item)
+        elif kind == "connect":
+            connect_mqtt()
+        elif kind == "disconnect":
+            disconnect_mqtt()
+        elif kind == "stop":
+            break
+
+        now = time.monotonic()
+        if now - reported >= WORKER_STATS_INTERVAL:
+            reported = now
+            event_outbox.put(("stats", worker, {"mqtt": dict(mqtt_status),
+                                                "pipeline": pipeline_stats()},
+                              metrics.REGISTRY.snapshot()))
 
+    disconnect_mqtt()
+    stop_pipeline()
+    for outbox in forward_outboxes + [event_outbox]:
+        if outbox is not None:
+            outbox.flush()
+
+
+def restore_state():
+    """单进程启动：只读取存储尾部预热最近数据，重建去重索引、分析状态、预聚合与异常检测"""
+    log.info("历史缓冲已预热 %d 条", warm_history())
+    if segment_store is not None:
+        segment_store.set_workers(1)
+    log.info("去重索引已载入 %d 条", build_dedup_index())
+    log.info("分析状态已从存储重建 %d 条", rebuild_analytics())
+    log.info("预聚合已从存储重建 %d 条", rebuild_rollups())
+    log.info("异常检测已用最近 %d 条数据预热", warm_anomaly())
+    persist_state(force=True)
+
+
+def publish_batch(items):
+    """在 WebSocket 事件循环中推送一批数据与告警"""
+    for item in items:
+        if item[0] == "alert":
+            ws_hub.alert(item[1])
+        else:
+            ws_hub.publish(item[1], item[3])
+
+
+def handle_worker_events(batch):
+    """协调进程：worker 上报的数据写入历史缓冲、告警写入告警日志，整批交给 WebSocket 线程推送"""
+    out = []
+    for item in batch:
+        kind = item[0]
+        if kind == "sample":
+            history.append(to_csv_row(item[1], item[2]))
+            out.append(item)
+        elif kind == "alert":
+            alert_log.append(item[1])
+            out.append(item)
+        elif kind == "stats":
+            worker_stats[item[1]] = item[2]
+            worker_metrics[item[1]] = item[3]
+            mqtt_status["connected"] = len(worker_stats) == worker_pool.workers and \
+                all(s["mqtt"]["connected"] for s in worker_stats.values())
+    if out and ws_loop:
+        ws_loop.call_soon_threadsafe(publish_batch, out)
+
+
+def start_coordinator(workers):
+    """
+    多进程订阅的协调进程：先准备存储（导入 CSV、拆分旧存储），再启动 worker；
+    自身不处理 MQTT 消息，只负责 WebSocket 推送、历史缓冲、告警汇总与 REST API
+    """
+    global worker_pool, alert_log
+    if segment_store is None:
+        raise ValueError("多进程订阅需要 STORAGE_ENGINE=segments")
+    log.info("历史缓冲已预热 %d 条", warm_history())
+    segment_store.close()
+    segment_store.set_workers(workers)
+
+    # 告警日志由各 worker 分别写入，协调进程合并后只保存在内存中
+    events = list(alert_log.events)
+    for worker in range(workers):
+        events.extend(AlertLog(log_path(worker)).events)
+    alert_log = AlertLog(None)
+    alert_log.extend(sorted(events, key=lambda e: e.get("detected_at") or 0))
+
+    mqtt_status["topics"] = topic_router.filters(Config.MQTT_SHARED_GROUP)
+    mqtt_status["workers"] = workers
+    worker_pool = WorkerPool(workers, run_worker)
+    worker_pool.consume(handle_worker_events)
+    worker_pool.start()
+    log.info("已启动 %d 个订阅 worker（共享订阅组 %s）", workers, Config.MQTT_SHARED_GROUP)
 
 
 # ========================
@@ -231,36 +888,95 @@ def api_disconnect():
     return jsonify({"msg": "disconnected"})
 
 
+def status():
+    return {**mqtt_status, "pipeline": pipeline_stats()}
+
+
 @subscribe_bp.route("/api/status", methods=["GET"])
 def api_status():
-    return jsonify(mqtt_status)
+    return jsonify(status())
+
+
+@subscribe_bp.route("/api/ws", methods=["GET"])
+def api_ws():
+    return jsonify(ws_hub.stats())
+
+
+@subscribe_bp.route("/api/pipeline", methods=["GET"])
+def api_pipeline():
+    return jsonify(pipeline_stats())
+
+
+def query_history(params):
+    """/api/history：params 为查询参数（映射），返回 (结果, 状态码)；单事件循环模式共用"""
+    try:
+        limit = int(params.get("limit", Config.HISTORY_DEFAULT_LIMIT))
+    except ValueError:
+        return {"error": "limit 必须是整数"}, 400
+    if limit <= 0:
+        return {"error": "limit 必须大于 0"}, 400
+
+    since = params.get("since") or None
+    return history.query(min(limit, history.size), since), 200
+
+
+def query_alerts(params):
+    """/api/alerts：同 query_history"""
+    try:
+        limit = int(params.get("limit", Config.HISTORY_DEFAULT_LIMIT))
+    except ValueError:
+        return {"error": "limit 必须是整数"}, 400
+    if limit <= 0:
+        return {"error": "limit 必须大于 0"}, 400
+    state = params.get("state") or None
+    if state is not None and state not in ALERT_STATES:
+        return {"error": f"state 必须是 {', '.join(ALERT_STATES)} 之一"}, 400
+
+    return alert_log.query(
+        min(limit, alert_log.size),
+        since=params.get("since") or None,
+        sensor_id=params.get("sensor_id") or None,
+        metric=params.get("metric") or None,
+        state=state), 200
 
 
 @subscribe_bp.route("/api/history", methods=["GET"])
 def api_history():
-    data = []
-    if os.path.exists(CSV_PATH):
-        with open(CSV_PATH, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                data.append(row)
-    return jsonify(data[-50:])
+    body, code = query_history(request.args)
+    return jsonify(body), code
+
+
+@subscribe_bp.route("/api/alerts", methods=["GET"])
+def api_alerts():
+    body, code = query_alerts(request.args)
+    return jsonify(body), code
 
 
 if __name__ == '__main__':
+    if Config.SUBSCRIBE_WORKERS > 1:
+        # 多进程：worker 各自预热并连接 MQTT，本进程做协调
+        start_coordinator(Config.SUBSCRIBE_WORKERS)
+    else:
+        restore_state()
     # 启动WebSocket服务器线程
     start_ws_server()
     # 自动开启MQTT订阅
     connect_mqtt()
 
-    print(f"WebSocket服务运行在端口 {Config.WEBSOCKET_PORT}")
-    print("MQTT订阅服务已启动")
-    print("按 Ctrl+C 停止服务")
-    
-    # 保持主线程运行
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("\n正在停止服务...")
+    log.info("WebSocket服务运行在端口 %s", Config.WEBSOCKET_PORT)
+    log.info("MQTT订阅服务已启动，按 Ctrl+C 停止服务")
+
+    # 订阅端 REST API（状态、历史数据等），阻塞主线程直到 Ctrl+C
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(subscribe_bp)
+    app.register_blueprint(metrics_bp)
+    app.run(host=Config.SUBSCRIBE_SERVICE_HOST,
+            port=Config.SUBSCRIBE_SERVICE_PORT, threaded=True)
+
+    log.info("正在停止服务...")
+    if worker_pool is not None:
+        worker_pool.stop()
+    else:
         disconnect_mqtt()
+        stop_pipeline()
@@ -0,0 +1,9 @@
+"""
+后端单元测试：python -m pytest backend/tests
+
+后端模块以 backend/ 为根目录相互导入（from config import Config），这里把它加入 sys.path
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,118 @@
+import csv
+
+import numpy as np
+import pytest
+
+from analytics import METRICS, RunningStats
+from data_address import DataProcessor
+from forecast import parse_forecast_options
+
+
+def _samples(size=200, seed=3):
+    rng = np.random.default_rng(seed)
+    base = rng.normal(size=size)
+    values = np.column_stack([
+        20 + 2 * base + rng.normal(scale=0.5, size=size),
+        60 - 5 * base + rng.normal(scale=2.0, size=size),
+        1013 + rng.normal(scale=1.5, size=size),
+    ])
+    timestamps = [f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}" for i in range(size)]
+    return timestamps, values
+
+
+def _row(ts, values):
+    return {"timestamp": ts, **dict(zip(METRICS, values))}
+
+
+def _check_against_numpy(state, values):
+    stats = state.stats()
+    assert stats["current_count"] == len(values)
+    for i, m in enumerate(METRICS):
+        assert stats[m]["avg"] == round(float(values[:, i].mean()), 2)
+        assert stats[m]["min"] == values[:, i].min()
+        assert stats[m]["max"] == values[:, i].max()
+    # 对角线为 M2，除以 n - 1 即样本方差
+    np.testing.assert_allclose(np.diag(state.comoment) / (state.n - 1),
+                               values.var(axis=0, ddof=1), rtol=1e-9)
+    corr = np.corrcoef(values, rowvar=False)
+    out = state.correlation()
+    for j, mj in enumerate(METRICS):
+        for i, mi in enumerate(METRICS):
+            assert out[mj][mi] == pytest.approx(corr[i, j], abs=0.005 + 1e-9)
+
+
+def test_update_matches_numpy():
+    timestamps, values = _samples()
+    state = RunningStats()
+    for ts, x in zip(timestamps, values):
+        assert state.update(_row(ts, x))
+    _check_against_numpy(state, values)
+    assert state.first_ts == timestamps[0] and state.last_ts == timestamps[-1]
+
+
+def test_merge_arrays_matches_numpy():
+    timestamps, values = _samples()
+    state = RunningStats()
+    state.merge_arrays(timestamps[:50], values[:50])
+    state.merge_arrays(timestamps[50:], values[50:])
+    _check_against_numpy(state, values)
+
+
+def test_merge_and_snapshot_round_trip():
+    timestamps, values = _samples()
+    left, right = RunningStats(window=10), RunningStats(window=10)
+    for ts, x in zip(timestamps[:120], values[:120]):
+        left.update(_row(ts, x))
+    for ts, x in zip(timestamps[120:], values[120:]):
+        right.update(_row(ts, x))
+    right.update({"timestamp": timestamps[-1], "temperature": 1.0})
+
+    merged = RunningStats.from_dict(left.to_dict(), window=10)
+    merged.merge(RunningStats.from_dict(right.to_dict(), window=10))
+    _check_against_numpy(merged, values)
+    assert merged.incomplete == 1
+    # 窗口为合并后最近的 10 个点
+    assert [ts for ts, _ in merged.recent] == timestamps[-10:]
+    assert merged.first_ts == timestamps[0] and merged.last_ts == timestamps[-1]
+
+
+def test_snapshot_with_other_version_is_ignored():
+    data = RunningStats().to_dict()
+    data["version"] = 1
+    assert RunningStats.from_dict(data) is None
+
+
+def test_incomplete_samples_are_counted():
+    state = RunningStats()
+    assert state.missing_rate() == 0
+    state.update({"timestamp": "t1", "temperature": 1, "humidity": 2, "pressure": 3})
+    assert not state.update({"timestamp": "t2", "temperature": 1, "humidity": ""})
+    assert not state.update({"timestamp": "t3", "temperature": "nan", "humidity": 2, "pressure": 3})
+    state.merge_arrays(["t4", "t5"], [[1, 2, 3], [1, np.nan, 3]])
+    assert state.n == 2 and state.incomplete == 3
+    assert state.missing_rate() == 60.0
+
+
+def test_incremental_missing_rate_matches_full(tmp_path):
+    timestamps, values = _samples(20)
+    rows = [_row(ts, x) for ts, x in zip(timestamps, values)]
+    rows[3]["humidity"] = ""
+    rows[11]["pressure"] = ""
+    csv_path = tmp_path / "sensor_data.csv"
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["timestamp", *METRICS])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    state = RunningStats()
+    for row in rows:
+        state.update(row)
+    snapshot = tmp_path / "analytics.json"
+    state.save(str(snapshot))
+
+    processor = DataProcessor(str(csv_path), snapshot=str(snapshot))
+    options = parse_forecast_options({})
+    incremental = processor.process_incremental(options)["data_quality"]
+    full = processor.process_full(options)["data_quality"]
+    assert incremental["total_records"] == full["total_records"] == 20
+    assert incremental["missing_rate"] == full["missing_rate"] == 10.0
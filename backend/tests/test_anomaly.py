@@ -0,0 +1,135 @@
+import json
+import os
+
+import pytest
+
+from anomaly import AlertLog, AnomalyDetector
+
+KEY = ("S1", "temperature")
+
+
+def _sample(value, ts="2024-01-01T00:00:00", sensor_id="S1"):
+    return {"timestamp": ts, "sensor_id": sensor_id, "temperature": value}
+
+
+def _train(detector, n=40):
+    # 均值 10、标准差约 1
+    for i in range(n):
+        assert detector.update(_sample(9.0 if i % 2 else 11.0)) == []
+
+
+def test_no_alerts_during_warmup():
+    detector = AnomalyDetector(alpha=0.1, threshold=3, warmup=10)
+    for value in (10.0, 10.5, 9.5, 10.0):
+        detector.update(_sample(value))
+    assert detector.update(_sample(1000.0)) == []
+    assert detector.stats()["alerts"] == 0
+
+
+def test_enter_and_leave_anomaly_state():
+    detector = AnomalyDetector(alpha=0.05, threshold=4, warmup=20)
+    _train(detector)
+
+    events = detector.update(_sample(30.0, ts="t1"))
+    assert len(events) == 1
+    event = events[0]
+    assert event["state"] == "anomaly" and event["metric"] == "temperature"
+    assert event["sensor_id"] == "S1" and event["timestamp"] == "t1"
+    assert event["z"] > 4 and event["value"] == 30.0
+    assert event["lower"] < 10 < event["upper"] < 30
+    assert detector.stats()["active"] == ["S1/temperature"]
+
+    # 持续异常不重复告警
+    assert detector.update(_sample(31.0)) == []
+
+    events = detector.update(_sample(10.0))
+    assert [e["state"] for e in events] == ["recovered"]
+    assert detector.stats()["active"] == []
+    assert detector.stats()["alerts"] == 1
+
+
+def test_spike_is_clamped_to_control_limit():
+    detector = AnomalyDetector(alpha=0.05, threshold=4, warmup=20)
+    _train(detector)
+    _, mean, var, _ = detector.state[KEY]
+    std = var ** 0.5
+
+    detector.update(_sample(1000.0))
+    # 按控制限（均值 + 4σ）更新，而不是按 1000 更新
+    assert detector.state[KEY][1] == pytest.approx(mean + 0.05 * 4 * std)
+
+
+def test_constant_signal_and_invalid_values():
+    detector = AnomalyDetector(alpha=0.1, threshold=4, warmup=5)
+    for _ in range(10):
+        assert detector.update(_sample(5.0)) == []
+    assert detector.update(_sample(None)) == []
+    assert detector.update(_sample("nan")) == []
+    # 方差为 0 时标准差取下限，任何偏离都会告警
+    assert [e["state"] for e in detector.update(_sample(5.1))] == ["anomaly"]
+
+
+def test_sensors_are_tracked_separately_and_emit_false_only_learns():
+    detector = AnomalyDetector(alpha=0.05, threshold=4, warmup=20)
+    _train(detector)
+    assert detector.update(_sample(30.0, sensor_id="S2")) == []
+    assert detector.update(_sample(30.0), emit=False) == []
+    assert detector.stats()["series"] == 2
+    assert detector.stats()["alerts"] == 0
+
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        AnomalyDetector(alpha=1.5)
+    with pytest.raises(ValueError):
+        AnomalyDetector(threshold=0)
+
+
+# ========================
+# 告警日志
+# ========================
+def _event(i, state="anomaly", sensor_id="S1"):
+    return {"type": "alert", "state": state, "timestamp": f"2024-01-01T00:00:{i:02d}",
+            "sensor_id": sensor_id, "metric": "temperature", "value": float(i)}
+
+
+def test_alert_log_reloads_tail_of_file(tmp_path):
+    path = str(tmp_path / "alerts.jsonl")
+    log = AlertLog(path, size=3, max_bytes=0)
+    for i in range(5):
+        log.append(_event(i))
+    # 崩溃时留下的不完整行被跳过
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"type": "al')
+
+    reloaded = AlertLog(path, size=4, max_bytes=0)
+    assert [e["value"] for e in reloaded.query()] == [2.0, 3.0, 4.0]
+
+
+def test_alert_log_rotates_at_max_bytes(tmp_path):
+    path = str(tmp_path / "alerts.jsonl")
+    line = len(json.dumps(_event(0), ensure_ascii=False)) + 1
+    log = AlertLog(path, size=100, max_bytes=3 * line)
+    for i in range(5):
+        log.append(_event(i))
+
+    with open(path + ".1", encoding="utf-8") as f:
+        assert [json.loads(x)["value"] for x in f] == [0.0, 1.0, 2.0]
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(x)["value"] for x in f] == [3.0, 4.0]
+    # 内存中仍保留全部告警，重启后只从当前文件恢复
+    assert len(log) == 5
+    assert len(AlertLog(path, size=100)) == 2
+    assert os.path.getsize(path) < 3 * line
+
+
+def test_alert_log_query_filters():
+    log = AlertLog(size=10)
+    log.append(_event(1))
+    log.append(_event(2, state="recovered"))
+    log.append(_event(3, sensor_id="S2"))
+    assert [e["value"] for e in log.query(limit=2)] == [2.0, 3.0]
+    assert [e["value"] for e in log.query(state="recovered")] == [2.0]
+    assert [e["value"] for e in log.query(sensor_id="S2")] == [3.0]
+    assert [e["value"] for e in log.query(since="2024-01-01T00:00:01")] == [2.0, 3.0]
+    assert log.query(metric="humidity") == []
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+
+import app as app_module
+import data_address
+from app import LazyView, create_app
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_lazy_app_defers_heavy_imports(tmp_path):
+    code = textwrap.dedent("""
+        import sys
+        import app
+
+        heavy = ("numpy", "pandas", "data_address")
+        assert not [m for m in heavy if m in sys.modules], [m for m in heavy if m in sys.modules]
+        client = app.create_app(lazy=True, warmup_in_background=False).test_client()
+        assert client.get("/ping").status_code == 200
+        assert "data_address" not in sys.modules
+
+        response = client.get("/api/analyze/cache")
+        assert response.status_code == 200, response.status_code
+        assert "entries" in response.get_json()
+        assert "data_address" in sys.modules and "pandas" in sys.modules
+    """)
+    env = dict(os.environ,
+               STORAGE_DIR=str(tmp_path / "segments"),
+               ANALYTICS_SNAPSHOT=str(tmp_path / "analytics.json"),
+               ANALYTICS_SENSOR_DIR=str(tmp_path / "analytics"),
+               ROLLUP_DIR=str(tmp_path / "rollups"),
+               ANOMALY_LOG=str(tmp_path / "alerts.jsonl"),
+               LOG_LEVEL="WARNING")
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_lazy_routes_match_data_blueprint():
+    def routes(app):
+        return {(rule.rule, rule.endpoint) for rule in app.url_map.iter_rules()
+                if rule.endpoint.startswith("data.")}
+
+    lazy = routes(create_app(lazy=True, warmup_in_background=False))
+    eager = routes(create_app(lazy=False, warmup_in_background=False))
+    assert lazy == eager and len(lazy) == len(app_module.DATA_ROUTES)
+
+
+def test_lazy_view_imports_once():
+    view = LazyView("json.dumps")
+    assert view.__name__ == "dumps"
+    assert view._view is None
+    assert view({"a": 1}) == '{"a": 1}'
+    resolved = view._view
+    view([1])
+    assert view._view is resolved
+
+
+def test_warmup_runs_in_background_and_records_time(monkeypatch):
+    done = threading.Event()
+
+    def fake_warmup():
+        done.set()
+        return 0.01
+
+    monkeypatch.setattr(data_address, "warmup", fake_warmup)
+    app_module.WARMUP_SECONDS.set(0)
+    create_app(lazy=True, warmup_in_background=True)
+    assert done.wait(2)
+    for thread in threading.enumerate():
+        if thread.name == "warmup":
+            thread.join(2)
+    assert app_module.WARMUP_SECONDS.samples()[0][2] > 0
+
+
+def test_failed_warmup_does_not_record_time(monkeypatch):
+    def broken():
+        raise RuntimeError("store unavailable")
+
+    monkeypatch.setattr(data_address, "warmup", broken)
+    app_module.WARMUP_SECONDS.set(0)
+    app_module.warmup()
+    assert app_module.WARMUP_SECONDS.samples()[0][2] == 0
@@ -0,0 +1,157 @@
+import struct
+import asyncio
+
+import pytest
+
+from aio_mqtt import AsyncMQTTClient
+from broker import (LocalBroker, _Session, encode_length, encode_string, packet, read_packet,
+                    read_string, CONNECT, CONNACK, PUBLISH, PUBACK)
+
+
+def parse(data):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_packet(reader)
+    return asyncio.run(read())
+
+
+@pytest.mark.parametrize("n, encoded", [
+    (0, b"\x00"), (127, b"\x7f"), (128, b"\x80\x01"), (16383, b"\xff\x7f"),
+    (16384, b"\x80\x80\x01"), (268435455, b"\xff\xff\xff\x7f"),
+])
+def test_encode_length(n, encoded):
+    assert encode_length(n) == encoded
+
+
+def test_packet_round_trip():
+    body = encode_string("iot/温度") + bytes(300)
+    assert parse(packet(PUBLISH, body, flags=0x02)) == (PUBLISH, 0x02, body)
+    assert parse(packet(CONNACK, b"\x00\x00")) == (CONNACK, 0, b"\x00\x00")
+
+
+def test_read_string_returns_next_offset():
+    data = encode_string("a/b") + encode_string("") + encode_string("传感器")
+    value, offset = read_string(data, 0)
+    assert (value, offset) == ("a/b", 5)
+    value, offset = read_string(data, offset)
+    assert (value, offset) == ("", 7)
+    assert read_string(data, offset) == ("传感器", len(data))
+
+
+def test_truncated_packet_raises():
+    with pytest.raises(asyncio.IncompleteReadError):
+        parse(packet(PUBLISH, b"abcdef")[:-2])
+
+
+def test_shared_group_round_robin():
+    broker = LocalBroker(port=0)
+    a, b, plain = _Session(None), _Session(None), _Session(None)
+    broker._subscribe(a, "$share/g/iot/+/data")
+    broker._subscribe(b, "$share/g/iot/+/data")
+    broker._subscribe(plain, "iot/#")
+
+    picks = [broker._targets("iot/s1/data") for _ in range(4)]
+    assert all(plain in t and len(t) == 2 for t in picks)
+    assert [a in t for t in picks] == [True, False, True, False]
+    assert broker._targets("other/s1/data") == set()
+
+    broker._unsubscribe(a, "$share/g/iot/+/data")
+    broker._unsubscribe(b, "$share/g/iot/+/data")
+    assert broker.shared == {}
+
+
+async def publish(port, topic, payloads):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = encode_string("MQTT") + bytes([4, 0x02]) + struct.pack("!H", 0)
+    writer.write(packet(CONNECT, body + encode_string("publisher")))
+    assert (await read_packet(reader))[0] == CONNACK
+    for i, payload in enumerate(payloads, 1):
+        writer.write(packet(PUBLISH, encode_string(topic) + struct.pack("!H", i) + payload,
+                            flags=0x02))
+        kind, _, ack = await read_packet(reader)
+        assert (kind, ack) == (PUBACK, struct.pack("!H", i))
+    writer.close()
+
+
+def test_clients_share_messages_through_broker():
+    broker = LocalBroker(port=0)
+    port = broker.start()
+    try:
+        async def scenario():
+            received = {"w1": [], "w2": []}
+            clients = [
+                AsyncMQTTClient("127.0.0.1", port, ["$share/workers/iot/+/data"],
+                                lambda t, p, name=name: received[name].append((t, p)),
+                                client_id=name, keepalive=0, reconnect_delay=0.05)
+                for name in received
+            ]
+            for client in clients:
+                client.start()
+            for _ in range(100):
+                if all(c.connected for c in clients) and \
+                        broker.stats()["shared_groups"].get("workers/iot/+/data") == 2:
+                    break
+                await asyncio.sleep(0.02)
+
+            payloads = [str(i).encode() for i in range(10)]
+            await publish(port, "iot/s1/data", payloads)
+            for _ in range(100):
+                if sum(len(v) for v in received.values()) == len(payloads):
+                    break
+                await asyncio.sleep(0.02)
+            for client in clients:
+                await client.stop()
+            return received
+
+        received = asyncio.run(scenario())
+    finally:
+        broker.stop()
+
+    assert len(received["w1"]) == len(received["w2"]) == 5
+    got = sorted(received["w1"] + received["w2"], key=lambda m: int(m[1]))
+    assert got == [("iot/s1/data", str(i).encode()) for i in range(10)]
+
+
+def test_paused_client_holds_messages_until_resume():
+    broker = LocalBroker(port=0)
+    port = broker.start()
+    try:
+        async def scenario():
+            received = []
+            client = AsyncMQTTClient("127.0.0.1", port, ["iot/#"],
+                                     lambda t, p: received.append(p),
+                                     keepalive=0, reconnect_delay=0.05)
+            client.start()
+            for _ in range(100):
+                if client.connected and broker.stats()["subscriptions"]:
+                    break
+                await asyncio.sleep(0.02)
+
+            client.pause()
+            client.pause()
+            await publish(port, "iot/s1/data", [b"1", b"2", b"3"])
+            await asyncio.sleep(0.1)
+            held = list(received)
+            client.resume()
+            await asyncio.sleep(0.1)
+            # 嵌套暂停：全部 resume 之后才恢复
+            still_held = list(received)
+            client.resume()
+            for _ in range(100):
+                if len(received) == 3:
+                    break
+                await asyncio.sleep(0.02)
+            stats = client.stats()
+            await client.stop()
+            return held, still_held, received, stats
+
+        held, still_held, received, stats = asyncio.run(scenario())
+    finally:
+        broker.stop()
+
+    assert held == still_held == []
+    assert received == [b"1", b"2", b"3"]
+    assert stats["paused"] is False
+    assert stats["paused_seconds"] > 0
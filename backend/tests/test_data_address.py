@@ -0,0 +1,89 @@
+import pytest
+from flask import Flask
+
+import data_address
+
+
+class FakeProcessor:
+    def __init__(self):
+        self.lookups = 0
+        self.version = 1
+
+    def has_sensor(self, sensor_id):
+        self.lookups += 1
+        return sensor_id == "S1"
+
+    def data_version(self, mode=None, sensor_id=None):
+        return (mode, sensor_id, self.version)
+
+    def process(self, mode=None, options=None, sensor_id=None):
+        return {"sensor_id": sensor_id}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    processor = FakeProcessor()
+    monkeypatch.setattr(data_address, "get_processor", lambda: processor)
+    monkeypatch.setattr(data_address, "analyze_cache", data_address.ResultCache(16))
+    monkeypatch.setattr(data_address.Config, "ANALYZE_CACHE", True)
+    app = Flask(__name__)
+    app.register_blueprint(data_address.data_bp)
+    return app.test_client(), processor
+
+
+def test_sensor_lookup_only_on_cache_miss(client):
+    http, processor = client
+    for _ in range(3):
+        response = http.get("/api/analyze?sensor_id=S1")
+        assert response.status_code == 200
+    assert processor.lookups == 1
+    assert response.headers["X-Cache"] == "hit"
+
+
+def test_unknown_sensor_404_is_cached_per_version(client):
+    http, processor = client
+    assert http.get("/api/analyze?sensor_id=nope").status_code == 404
+    assert http.get("/api/analyze?sensor_id=nope").status_code == 404
+    assert processor.lookups == 1
+    # 数据版本变化（例如该传感器开始上报）后重新检查
+    processor.version = 2
+    http.get("/api/analyze?sensor_id=nope")
+    assert processor.lookups == 2
+
+
+def test_etag_revalidation(client):
+    http, processor = client
+    first = http.get("/api/analyze?sensor_id=S1")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    again = http.get("/api/analyze?sensor_id=S1", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"] == etag
+
+    # 数据版本变化后旧的 ETag 不再匹配
+    processor.version = 2
+    changed = http.get("/api/analyze?sensor_id=S1", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_etag_of_other_variant_is_not_a_match(client):
+    http, _ = client
+    app = Flask(__name__)
+    with app.test_request_context():
+        a = data_address.cached_response("a", 1, lambda: ({"variant": "a"}, 200))
+    with app.test_request_context(headers={"If-None-Match": a.headers["ETag"]}):
+        b = data_address.cached_response("b", 1, lambda: ({"variant": "b"}, 200))
+        assert b.status_code == 200
+        assert b.get_json() == {"variant": "b"}
+        same = data_address.cached_response("a", 1, lambda: ({"variant": "a"}, 200))
+        assert same.status_code == 304
+
+
+def test_error_responses_have_no_etag(client):
+    http, _ = client
+    response = http.get("/api/analyze?sensor_id=nope")
+    assert response.status_code == 404
+    assert "ETag" not in response.headers
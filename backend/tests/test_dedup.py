@@ -0,0 +1,95 @@
+from dedup import KEY_SCALE, MERGE_MIN, TimestampIndex, dedup_key
+from segments import parse_epoch
+
+
+def test_same_second_readings_are_distinct():
+    index = TimestampIndex()
+    a = dedup_key(parse_epoch("2014-02-13T06:00:00.100"))
+    b = dedup_key(parse_epoch("2014-02-13T06:00:00.600"))
+    assert a != b
+    assert index.add("S1", a) == "new"
+    assert index.add("S1", b) == "new"
+    assert index.add("S1", a) == "duplicate"
+    # 不同传感器的同一时间戳互不影响
+    assert index.add("S2", a) == "new"
+
+
+def test_key_is_stable_across_formats():
+    seconds = parse_epoch("2014-02-13T06:00:00")
+    assert dedup_key(seconds) == dedup_key(parse_epoch(str(int(seconds))))
+    assert dedup_key(seconds) == int(seconds) * KEY_SCALE
+
+
+def test_late_and_stats():
+    index = TimestampIndex()
+    assert index.add("S1", 20) == "new"
+    assert index.add("S1", 10) == "late"
+    assert index.add("S1", 10) == "duplicate"
+    stats = index.stats()
+    assert (stats["accepted"], stats["duplicates"], stats["late"]) == (2, 1, 1)
+
+
+def test_discard_allows_redelivery():
+    index = TimestampIndex()
+    index.add("S1", 5)
+    assert index.discard("S1", 5)
+    assert not index.discard("S1", 5)
+    assert index.add("S1", 5) == "new"
+    assert index.stats()["discarded"] == 1
+
+
+def test_discard_after_merge_into_sorted():
+    index = TimestampIndex()
+    for ts in range(MERGE_MIN + 1):
+        index.add("S1", ts)
+    assert len(index.sensors["S1"].sorted) == MERGE_MIN
+    assert index.discard("S1", 7)
+    # 早于最新时间戳，撤销后重发按迟到数据接收
+    assert index.add("S1", 7) == "late"
+    assert index.add("S1", 8) == "duplicate"
+
+
+def test_load_existing_keys():
+    index = TimestampIndex()
+    index.load(["S1", "S1", "S2"], [10, 30, 10])
+    assert index.add("S1", 30) == "duplicate"
+    assert index.add("S1", 20) == "late"
+    assert index.add("S2", 40) == "new"
+
+
+def test_index_rebuilt_from_store_matches_live_keys(tmp_path, monkeypatch):
+    import subscribe
+    from segments import ShardedStore, iso_timestamp
+
+    store = ShardedStore(str(tmp_path / "store"), retention_days=0)
+    live = TimestampIndex()
+    received = ["2014-02-13T06:00:00.100", "2014-02-13T06:00:00.600",
+                "1392271201.1234567", "2014-02-13T14:00:02.999999+08:00",
+                "2014-02-13T06:00:03"]
+    rows = []
+    for i, value in enumerate(received):
+        # 与 decode_message 相同：先统一为 UTC ISO 时间，再按其登记
+        timestamp = iso_timestamp(parse_epoch(value))
+        sensor = "S1" if i % 2 else "S2"
+        assert live.add(sensor, dedup_key(parse_epoch(timestamp))) == "new"
+        rows.append({"timestamp": timestamp, "sensor_id": sensor, "temperature": float(i)})
+    store.write(rows)
+    store.close()
+
+    # 重启：从存储重建索引后，发布端回放的同一批数据全部判为重复
+    rebuilt = TimestampIndex()
+    monkeypatch.setattr(subscribe, "segment_store", ShardedStore(str(tmp_path / "store")))
+    monkeypatch.setattr(subscribe, "seen_timestamps", rebuilt)
+    assert subscribe.build_dedup_index() == len(received)
+    for row in rows:
+        key = dedup_key(parse_epoch(row["timestamp"]))
+        assert rebuilt.add(row["sensor_id"], key) == "duplicate", row
+    # 同一秒内的新读数不受影响
+    assert rebuilt.add("S2", dedup_key(parse_epoch("2014-02-13T06:00:00.200"))) == "late"
+    assert rebuilt.stats()["duplicates"] == len(received)
+
+
+def test_dedup_keys_match_dedup_key():
+    from dedup import dedup_keys
+    seconds = [1392271200.1, 1392271200.123457, 1392271200.9999995, 0.000001, 4102444799.999999]
+    assert dedup_keys(seconds).tolist() == [dedup_key(s) for s in seconds]
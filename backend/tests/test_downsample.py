@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from downsample import downsample, lttb, minmax, select
+
+
+def _series(size=1000):
+    x = np.arange(size, dtype=np.int64) * 60
+    y = np.sin(np.arange(size) / 50.0)
+    return x, y
+
+
+def test_lttb_keeps_endpoints_and_size():
+    x, y = _series()
+    index = lttb(x, y, 100)
+    assert len(index) == 100
+    assert index[0] == 0 and index[-1] == len(x) - 1
+    assert np.all(np.diff(index) > 0)
+
+
+def test_lttb_keeps_spike():
+    x, y = _series()
+    y[537] = 50.0
+    assert 537 in lttb(x, y, 50)
+
+
+def test_lttb_small_n_and_short_input():
+    x, y = _series(10)
+    assert list(lttb(x, y, 20)) == list(range(10))
+    assert list(lttb(x, y, 2)) == [0, 9]
+
+
+def test_minmax_keeps_extremes_in_time_order():
+    x, y = _series()
+    y[123], y[777] = -9.0, 9.0
+    index = minmax(x, y, 40)
+    assert len(index) <= 40
+    assert 123 in index and 777 in index
+    assert np.all(np.diff(index) > 0)
+
+
+def test_select_skips_nan():
+    x, y = _series(200)
+    y[::3] = np.nan
+    for method in ("lttb", "minmax"):
+        index = select(x, y, 20, method)
+        assert len(index) <= 20
+        assert not np.isnan(y[index]).any()
+
+
+def test_select_returns_all_valid_when_short():
+    x = np.arange(5)
+    y = np.array([1.0, np.nan, 3.0, 4.0, np.nan])
+    assert list(select(x, y, 10)) == [0, 2, 3]
+    xs, ys = downsample(x, y, 10)
+    assert list(xs) == [0, 2, 3] and list(ys) == [1.0, 3.0, 4.0]
+
+
+def test_select_rejects_unknown_method():
+    x, y = _series(10)
+    with pytest.raises(ValueError):
+        select(x, y, 5, "mean")
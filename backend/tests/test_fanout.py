@@ -0,0 +1,138 @@
+import os
+import subprocess
+import sys
+import threading
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+import pytest
+
+import fanout
+import publish
+import publish_common
+from sources import StreamingSeries
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QOS0 = {"qos": 0, "window": 10, "ack_timeout": 1.0}
+ROWS = [(f"2024-01-01T00:00:{i:02d}", 20.0 + i, 50.0, 1013.0) for i in range(5)]
+
+
+class FakeClient:
+    clients = []
+
+    def __init__(self, client_id=""):
+        self.client_id = client_id
+        self.sent = []
+        FakeClient.clients.append(self)
+
+    def connect(self, host, port, keepalive):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def publish(self, topic, payload, qos=0):
+        self.sent.append((topic, payload))
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=len(self.sent))
+
+
+@pytest.fixture(autouse=True)
+def fake_mqtt(monkeypatch):
+    FakeClient.clients = []
+    monkeypatch.setattr(publish_common, "create_client", FakeClient)
+    monkeypatch.setattr(fanout, "CONNECT_WAIT", 0.2)
+    return FakeClient
+
+
+def _run(**kw):
+    options = dict(sensors=6, connections=3, executor="thread", jitter=0,
+                   replay_params={"mode": "max"}, qos_options=QOS0)
+    options.update(kw)
+    return fanout.FanoutRun(**options)
+
+
+def _streaming(late=0):
+    calls = []
+
+    def factory(stats):
+        calls.append(threading.current_thread().name)
+        if late:
+            stats["late"] = late
+        return iter(ROWS)
+    return StreamingSeries(factory), calls
+
+
+def test_importing_fanout_does_not_import_publish():
+    code = "import sys, fanout; assert 'publish' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], cwd=BACKEND, check=True)
+
+
+def test_thread_fanout_sends_every_row_for_every_sensor():
+    run = _run()
+    assert run.run(ROWS) == []
+    assert run.total_count() == len(ROWS) * 6
+    stats = run.stats()
+    assert all(s["count"] == len(ROWS) for s in stats["per_sensor"].values())
+    assert len(FakeClient.clients) == 3
+    topics = {topic for client in FakeClient.clients for topic, _ in client.sent}
+    assert topics == {s["topic"] for s in stats["per_sensor"].values()}
+
+
+def test_elapsed_excludes_connect_wait():
+    run = _run()
+    assert run.stats()["elapsed"] == 0.0
+    run.run(ROWS)
+    # 发送 30 条消息远快于连接等待（0.2 秒）
+    assert run.stats()["elapsed"] < fanout.CONNECT_WAIT
+    assert run.stats()["aggregate"]["rate"] > run.total_count() / fanout.CONNECT_WAIT
+
+
+def test_streaming_source_is_parsed_once_for_all_threads():
+    rows, calls = _streaming(late=3)
+    run = _run()
+    assert run.run(rows) == []
+    assert len(calls) == 1
+    assert run.late == 3
+    assert run.total_count() == len(ROWS) * 6
+
+
+def test_publish_fanout_resets_late_between_runs(monkeypatch):
+    monkeypatch.setattr(publish, "fanout_run", None)
+    monkeypatch.setitem(publish.publish_status, "late", 0)
+    monkeypatch.setitem(publish.publish_status, "count", 0)
+    monkeypatch.setitem(publish.publish_status, "total", 0)
+    monkeypatch.setitem(publish.publish_status, "error", None)
+
+    rows, _ = _streaming(late=2)
+    monkeypatch.setattr(publish, "load_series", lambda source=None: rows)
+    publish.publish_fanout(_run())
+    assert publish.publish_status["late"] == 2
+    assert publish.publish_status["total"] is None
+
+    monkeypatch.setattr(publish, "load_series", lambda source=None: ROWS)
+    publish.publish_fanout(_run())
+    assert publish.publish_status["late"] == 0
+    assert publish.publish_status["count"] == len(ROWS) * 6
+    assert publish.publish_status["total"] == len(ROWS) * 6
+    assert publish.publish_status["error"] is None
+    assert not publish.publish_status["running"]
+
+
+def test_fanout_options():
+    assert fanout.parse_fanout_options({"sensors": 1}, QOS0) is None
+    run = fanout.parse_fanout_options({"sensors": 8, "connections": 2, "mode": "rate",
+                                       "rate": 100}, QOS0)
+    assert run.connections == 2
+    # 总速率平均分给各个连接
+    assert run.replay_params["rate"] == 50
+    assert fanout.parse_fanout_options({"sensors": 3, "connections": 10}, QOS0).connections == 3
+    with pytest.raises(ValueError):
+        fanout.parse_fanout_options({"sensors": "x"}, QOS0)
+    with pytest.raises(ValueError):
+        fanout.parse_fanout_options({"sensors": 2, "executor": "fork"}, QOS0)
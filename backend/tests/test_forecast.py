@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from forecast import MODELS, ewma, forecast, holt, holt_winters, linear, parse_forecast_options
+
+
+def _noisy(n=60, k=3, seed=7):
+    rng = np.random.default_rng(seed)
+    x = np.arange(n, dtype=np.float64)
+    slopes = np.array([0.5, -1.2, 0.03])[:k]
+    return 10 + np.outer(x, slopes) + rng.normal(scale=2.0, size=(n, k))
+
+
+def test_linear_matches_polyfit():
+    Y = _noisy()
+    fitted, future = linear(Y, 5)
+    x = np.arange(len(Y))
+    for j in range(Y.shape[1]):
+        coef = np.polyfit(x, Y[:, j], 1)
+        np.testing.assert_allclose(fitted[:, j], np.polyval(coef, x), rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(future[:, j], np.polyval(coef, np.arange(60, 65)),
+                                   rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("model", MODELS)
+def test_shapes(model):
+    Y = _noisy(30)
+    fitted, future = forecast(Y, model=model, horizon=7)
+    assert fitted.shape == (30, 3)
+    assert future.shape == (7, 3)
+    assert np.all(np.isfinite(fitted)) and np.all(np.isfinite(future))
+
+
+@pytest.mark.parametrize("model", MODELS)
+def test_constant_input_forecasts_constant(model):
+    Y = np.full((30, 2), 21.5)
+    fitted, future = forecast(Y, model=model, horizon=4)
+    np.testing.assert_allclose(fitted, 21.5)
+    np.testing.assert_allclose(future, 21.5)
+
+
+@pytest.mark.parametrize("model", MODELS)
+def test_too_few_points_and_1d_input(model):
+    fitted, future = forecast([1.0], model=model, horizon=3)
+    assert fitted.shape == (0, 1) and future.shape == (0, 1)
+    fitted, future = forecast(np.arange(5.0), model=model, horizon=3)
+    assert fitted.shape == (5, 1) and future.shape == (3, 1)
+
+
+def test_ewma_forecast_is_last_level():
+    Y = _noisy(20, 1)
+    fitted, future = ewma(Y, 3, alpha=0.3)
+    level = Y[0, 0]
+    for y in Y[:, 0]:
+        level = 0.3 * y + 0.7 * level
+    assert fitted[-1, 0] == pytest.approx(level)
+    np.testing.assert_allclose(future[:, 0], level)
+
+
+def test_holt_follows_linear_trend():
+    Y = np.arange(40, dtype=np.float64)[:, None] * 2 + 5
+    fitted, future = holt(Y, 3, alpha=0.5, beta=0.3)
+    np.testing.assert_allclose(fitted, Y)
+    np.testing.assert_allclose(future[:, 0], [85, 87, 89])
+
+
+def test_holt_winters_short_window_falls_back_to_holt():
+    # 不足两个周期
+    Y = _noisy(15)
+    np.testing.assert_array_equal(holt_winters(Y, 4, season=8)[1], holt(Y, 4)[1])
+    np.testing.assert_array_equal(holt_winters(Y, 4, season=1)[1], holt(Y, 4)[1])
+
+
+def test_holt_winters_repeats_seasonal_pattern():
+    season = 6
+    pattern = np.array([0.0, 2.0, 5.0, 3.0, -1.0, -3.0])
+    Y = np.tile(pattern, 8)[:, None] + 20
+    _, future = holt_winters(Y, 2 * season, season=season, alpha=0.3, beta=0.1, gamma=0.3)
+    np.testing.assert_allclose(future[:, 0], np.tile(pattern, 2) + 20, atol=1e-6)
+
+
+def test_input_is_not_modified():
+    Y = _noisy(30)
+    before = Y.copy()
+    for model in MODELS:
+        forecast(Y, model=model, horizon=3)
+    np.testing.assert_array_equal(Y, before)
+
+
+def test_parse_forecast_options():
+    options = parse_forecast_options({"model": "holt", "horizon": "3", "window": "10"})
+    assert options == {"model": "holt", "horizon": 3, "window": 10}
+    for params in ({"model": "arima"}, {"horizon": "0"}, {"window": "1"}, {"horizon": "x"}):
+        with pytest.raises(ValueError):
+            parse_forecast_options(params)
+    with pytest.raises(ValueError):
+        forecast(np.zeros((3, 1)), model="arima")
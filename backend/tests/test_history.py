@@ -0,0 +1,117 @@
+import csv
+
+import pytest
+
+import history
+from history import HistoryRing, read_csv_tail
+
+
+def _row(second, value=1.0):
+    return {"timestamp": f"2024-01-01T00:00:{second:02d}", "temperature": value}
+
+
+def _timestamps(rows):
+    return [int(r["timestamp"][-2:]) for r in rows]
+
+
+def _write_csv(path, rows, fields=("timestamp", "temperature", "humidity", "pressure")):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# ========================
+# 环形缓冲
+# ========================
+def test_append_keeps_time_order_for_late_rows():
+    ring = HistoryRing(size=10)
+    for second in (1, 3, 5, 4, 0, 5, 2):
+        ring.append(_row(second))
+    assert _timestamps(ring.query(limit=10)) == [0, 1, 2, 3, 4, 5, 5]
+
+
+def test_append_evicts_oldest_when_full():
+    ring = HistoryRing(size=3)
+    for second in (1, 2, 3, 4):
+        ring.append(_row(second))
+    assert _timestamps(ring.query()) == [2, 3, 4]
+
+    # 迟到数据插入到中间，同时挤掉最旧的一条
+    ring.append(_row(3, value=9.0))
+    assert _timestamps(ring.query()) == [3, 3, 4]
+    # 比缓冲中所有数据都旧，直接丢弃
+    ring.append(_row(0))
+    assert _timestamps(ring.query()) == [3, 3, 4]
+    assert len(ring) == 3
+
+
+def test_query_limit_and_since():
+    ring = HistoryRing(size=10)
+    for second in range(6):
+        ring.append(_row(second))
+    assert _timestamps(ring.query(limit=2)) == [4, 5]
+    assert _timestamps(ring.query(since="2024-01-01T00:00:03")) == [4, 5]
+    assert _timestamps(ring.query(limit=1, since="2024-01-01T00:00:01")) == [5]
+    assert ring.query(since="2024-01-01T00:00:05") == []
+
+
+def test_load_puts_warm_rows_before_live_rows():
+    ring = HistoryRing(size=4)
+    ring.append(_row(9))
+    assert ring.load([_row(s) for s in range(5)]) == 4
+    assert _timestamps(ring.query()) == [2, 3, 4, 9]
+
+
+# ========================
+# CSV 尾部读取
+# ========================
+@pytest.mark.parametrize("block", [7, 16, 41, 64 * 1024])
+def test_read_csv_tail_across_block_boundaries(tmp_path, monkeypatch, block):
+    monkeypatch.setattr(history, "TAIL_BLOCK", block)
+    rows = [{"timestamp": f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}",
+             "temperature": i, "humidity": "", "pressure": 1000 + i} for i in range(100)]
+    path = tmp_path / "data.csv"
+    _write_csv(path, rows)
+
+    for n in (1, 5, 37, 100, 500):
+        tail = read_csv_tail(str(path), n)
+        assert [r["timestamp"] for r in tail] == [r["timestamp"] for r in rows[-n:]]
+    last = read_csv_tail(str(path), 1)[0]
+    assert last["temperature"] == 99.0 and last["pressure"] == 1099.0
+    assert last["humidity"] == ""
+
+
+def test_read_csv_tail_with_header_longer_than_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "TAIL_BLOCK", 16)
+    fields = ("timestamp", "temperature", "humidity", "pressure",
+              "sensor_id_with_a_very_long_column_name")
+    rows = [{"timestamp": f"t{i}", "temperature": i, "humidity": 2, "pressure": 3,
+             fields[-1]: "S1"} for i in range(3)]
+    path = tmp_path / "data.csv"
+    _write_csv(path, rows, fields)
+    assert len(fields[-1]) > history.TAIL_BLOCK
+
+    tail = read_csv_tail(str(path), 2)
+    assert [r["timestamp"] for r in tail] == ["t1", "t2"]
+    assert tail[-1][fields[-1]] == "S1"
+    assert [r["timestamp"] for r in read_csv_tail(str(path), 10)] == ["t0", "t1", "t2"]
+
+
+def test_read_csv_tail_empty_files(tmp_path):
+    empty = tmp_path / "empty.csv"
+    empty.write_text("")
+    assert read_csv_tail(str(empty), 5) == []
+    header_only = tmp_path / "header.csv"
+    header_only.write_text("timestamp,temperature\n")
+    assert read_csv_tail(str(header_only), 5) == []
+
+
+def test_warm_reads_tail_only(tmp_path):
+    path = tmp_path / "data.csv"
+    _write_csv(path, [{"timestamp": f"2024-01-01T00:00:{i:02d}", "temperature": i,
+                       "humidity": 1, "pressure": 1} for i in range(20)])
+    ring = HistoryRing(size=5)
+    assert ring.warm(str(path)) == 5
+    assert _timestamps(ring.query()) == [15, 16, 17, 18, 19]
+    assert HistoryRing(size=5).warm(str(tmp_path / "missing.csv")) == 0
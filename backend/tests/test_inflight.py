@@ -0,0 +1,95 @@
+import time
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+
+from inflight import InflightWindow, percentile
+
+
+class FakeClient:
+    """按顺序分配 mid（65535 后回绕），不自动确认"""
+
+    def __init__(self, start_mid=1):
+        self.next_mid = start_mid
+        self.sent = []
+
+    def max_inflight_messages_set(self, n):
+        pass
+
+    def publish(self, topic, payload, qos=0):
+        mid = self.next_mid
+        self.next_mid = self.next_mid % 65535 + 1
+        self.sent.append((mid, payload))
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=mid)
+
+    def force_mid(self, mid):
+        self.next_mid = mid
+
+
+def test_percentile_nearest_rank():
+    assert percentile([], 50) is None
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 100) == 4
+
+
+def test_ack_releases_window():
+    client = FakeClient()
+    window = InflightWindow(client, window=2, timeout=5, max_retries=1)
+    assert window.publish("t", b"a")
+    assert window.publish("t", b"b")
+    window.on_publish(client, None, 1)
+    window.on_publish(client, None, 2)
+    stats = window.stats()
+    assert stats["acked"] == 2 and stats["inflight"] == 0
+
+
+def test_early_ack_is_claimed_on_register():
+    client = FakeClient()
+    window = InflightWindow(client, window=4, timeout=5, max_retries=1)
+    # PUBACK 先于 publish() 登记到达
+    window.on_publish(client, None, 1)
+    assert window.publish("t", b"a")
+    assert window.stats()["acked"] == 1
+    assert window.stats()["inflight"] == 0
+
+
+def test_late_ack_for_retried_mid_does_not_ack_reused_mid():
+    client = FakeClient(start_mid=65535)
+    window = InflightWindow(client, window=4, timeout=0.01, max_retries=1)
+    assert window.publish("t", b"a")            # mid 65535
+    time.sleep(0.02)
+    window.check_timeouts()                      # 以 mid 1 重新发布
+    assert window.stats()["retried"] == 1
+
+    # 旧 mid 的 PUBACK 迟到：应丢弃，而不是暂存为“先到的确认”
+    window.on_publish(client, None, 65535)
+    assert window.stats()["stale_acks"] == 1
+    assert window.stats()["acked"] == 0
+
+    # mid 回绕后被新消息复用，新消息不能被立即确认
+    window.on_publish(client, None, 1)
+    client.force_mid(65535)
+    assert window.publish("t", b"b")
+    stats = window.stats()
+    assert stats["acked"] == 1 and stats["inflight"] == 1
+
+
+def test_failed_mid_is_retired():
+    client = FakeClient()
+    window = InflightWindow(client, window=4, timeout=0.01, max_retries=0)
+    assert window.publish("t", b"a")
+    time.sleep(0.02)
+    window.check_timeouts()
+    assert window.stats()["failed"] == 1
+    window.on_publish(client, None, 1)
+    assert window.stats()["stale_acks"] == 1
+    assert not window._early_acks
+
+
+def test_unclaimed_early_acks_are_pruned():
+    client = FakeClient()
+    window = InflightWindow(client, window=4, timeout=0.01, max_retries=1)
+    window.on_publish(client, None, 42)
+    time.sleep(0.02)
+    window.check_timeouts()
+    assert not window._early_acks
@@ -0,0 +1,104 @@
+import math
+
+import pytest
+from flask import Flask
+
+import metrics
+from bench import parse_metrics
+from metrics import Registry
+
+
+def _lines(text):
+    return [line for line in text.splitlines() if line and not line.startswith("#")]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("t_latency_seconds", "时延", ("stage",), buckets=(0.1, 0.5, 1))
+    for value in (0.05, 0.1, 0.3, 0.7, 5.0):
+        latency.observe(value, stage="ingest")
+
+    samples = {(name, labels.get("le")): value for name, labels, value in latency.samples()}
+    # 等于上界的值计入该桶（le）
+    assert samples[("t_latency_seconds_bucket", "0.1")] == 2
+    assert samples[("t_latency_seconds_bucket", "0.5")] == 3
+    assert samples[("t_latency_seconds_bucket", "1")] == 4
+    assert samples[("t_latency_seconds_bucket", "+Inf")] == 5
+    assert samples[("t_latency_seconds_count", None)] == 5
+    assert samples[("t_latency_seconds_sum", None)] == pytest.approx(6.15)
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    registry.counter("t_messages_total", "消息数", ("result",)).inc(3, result="ok")
+    registry.gauge("t_depth", "队列深度\n第二行").set(2.5)
+    registry.histogram("t_seconds", "用时", buckets=(1,)).observe(0.5)
+
+    text = registry.render()
+    assert text.endswith("\n")
+    assert "# HELP t_messages_total 消息数" in text
+    assert "# TYPE t_messages_total counter" in text
+    assert "# HELP t_depth 队列深度\\n第二行" in text
+    assert "# TYPE t_seconds histogram" in text
+    assert _lines(text) == [
+        't_messages_total{result="ok"} 3',
+        "t_depth 2.5",
+        't_seconds_bucket{le="1"} 1',
+        't_seconds_bucket{le="+Inf"} 1',
+        "t_seconds_sum 0.5",
+        "t_seconds_count 1",
+    ]
+    # 与基准脚本的解析器互为往返
+    parsed = parse_metrics(text)
+    assert ("t_messages_total", {"result": "ok"}, 3.0) in parsed
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("t_total", "x", ("topic",)).inc(topic='a"b\\c')
+    assert _lines(registry.render()) == ['t_total{topic="a\\"b\\\\c"} 1']
+
+
+def test_labels_must_match_declaration():
+    registry = Registry()
+    counter = registry.counter("t_total", "x", ("result",))
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        counter.inc(result="ok", extra="1")
+    # 同名指标重复注册返回同一个对象，类型不同则报错
+    assert registry.counter("t_total", "x", ("result",)) is counter
+    with pytest.raises(ValueError):
+        registry.gauge("t_total", "x")
+
+
+def test_collectors_and_sources_are_merged():
+    registry = Registry()
+    registry.counter("t_total", "x").inc(2)
+    registry.collector(lambda: [("t_queue_depth", "gauge", "深度", [({"stage": "a"}, 4)])])
+    worker = Registry()
+    worker.counter("t_total", "x").inc(5)
+    registry.source(lambda: [(worker.snapshot(), {"worker": "1"})])
+
+    lines = _lines(registry.render())
+    assert lines == ["t_total 2", 't_total{worker="1"} 5', 't_queue_depth{stage="a"} 4']
+    # 多个来源的同名指标只输出一次 HELP / TYPE
+    assert registry.render().count("# TYPE t_total counter") == 1
+
+
+def test_format_values():
+    assert metrics._format(None) == "NaN"
+    assert metrics._format(math.inf) == "+Inf"
+    assert metrics._format(-math.inf) == "-Inf"
+    assert metrics._format(3.0) == "3"
+    assert metrics._format(0.25) == "0.25"
+
+
+def test_metrics_endpoint():
+    metrics.counter("t_endpoint_total", "接口测试").inc()
+    app = Flask(__name__)
+    app.register_blueprint(metrics.metrics_bp)
+    response = app.test_client().get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    assert "t_endpoint_total 1" in response.get_data(as_text=True)
@@ -0,0 +1,155 @@
+import threading
+import time
+
+import pytest
+
+from pipeline import Stage
+
+
+class Recorder:
+    """记录处理过的数据；gate 未打开时阻塞在处理函数中"""
+
+    def __init__(self, blocked=False):
+        self.items = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        if not blocked:
+            self.gate.set()
+
+    def __call__(self, item):
+        self.started.set()
+        self.gate.wait(5)
+        if item == "boom":
+            raise RuntimeError("bad item")
+        self.items.append(item)
+
+
+def _wait(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert predicate()
+
+
+def test_block_policy_waits_then_drops():
+    handler = Recorder(blocked=True)
+    stage = Stage("t", handler, queue_size=1, policy="block", put_timeout=0.05)
+    stage.start()
+    assert stage.submit("a")
+    assert handler.started.wait(1)
+    assert stage.submit("b")
+    started = time.monotonic()
+    assert not stage.submit("c")
+    assert time.monotonic() - started >= 0.05
+
+    handler.gate.set()
+    assert stage.drain()
+    stage.stop()
+    assert handler.items == ["a", "b"]
+    stats = stage.stats()
+    assert (stats["received"], stats["processed"], stats["dropped"]) == (3, 2, 1)
+
+
+def test_drop_newest_keeps_queued_items():
+    handler = Recorder()
+    stage = Stage("t", handler, queue_size=2, policy="drop_newest")
+    assert [stage.submit(i) for i in range(4)] == [True, True, False, False]
+    stage.start()
+    stage.stop()
+    assert handler.items == [0, 1]
+    assert stage.stats()["dropped"] == 2
+
+
+def test_drop_oldest_keeps_newest_items():
+    handler = Recorder()
+    stage = Stage("t", handler, queue_size=2, policy="drop_oldest")
+    assert all(stage.submit(i) for i in range(5))
+    stage.start()
+    stage.stop()
+    assert handler.items == [3, 4]
+    assert stage.stats()["dropped"] == 3
+
+
+def test_stop_processes_queued_items_and_joins_workers():
+    handler = Recorder()
+    stage = Stage("t", handler, queue_size=100, policy="block", workers=3)
+    for i in range(50):
+        stage.submit(i)
+    stage.start()
+    threads = list(stage._threads)
+    stage.stop()
+    assert sorted(handler.items) == list(range(50))
+    assert not any(t.is_alive() for t in threads)
+    # 停止后可以重新启动
+    stage.start()
+    stage.submit(50)
+    stage.stop()
+    assert handler.items[-1] == 50
+
+
+def test_drain_times_out_while_handler_is_busy():
+    handler = Recorder(blocked=True)
+    stage = Stage("t", handler, queue_size=4, policy="block")
+    stage.start()
+    stage.submit("a")
+    assert not stage.drain(timeout=0.05)
+    handler.gate.set()
+    assert stage.drain()
+    stage.stop()
+
+
+def test_drop_oldest_never_drops_stop_marker():
+    handler = Recorder(blocked=True)
+    stage = Stage("t", handler, queue_size=2, policy="drop_oldest")
+    stage.start()
+    thread = stage._threads[0]
+    stage.submit("a")
+    assert handler.started.wait(1)
+    stage.submit("b")
+    stopper = threading.Thread(target=stage.stop)
+    stopper.start()
+    _wait(lambda: stage.queue.qsize() == 2)
+
+    assert stage.submit("c")        # 挤掉 b
+    assert not stage.submit("d")    # 队首是停止标记，丢弃新数据
+    handler.gate.set()
+    stopper.join(5)
+    assert not thread.is_alive()
+    assert handler.items == ["a", "c"]
+    assert stage.stats()["dropped"] == 2
+
+
+def test_errors_are_counted_and_call_bypasses_queue():
+    handler = Recorder()
+    stage = Stage("t", handler, queue_size=2, policy="block")
+    stage.call("x")
+    stage.call("boom")
+    stats = stage.stats()
+    assert handler.items == ["x"]
+    assert (stats["received"], stats["processed"], stats["errors"]) == (2, 2, 1)
+    assert stats["last_error"] == "bad item"
+    assert stats["queue_depth"] == 0
+
+
+def test_counters_are_consistent_under_concurrency():
+    stage = Stage("t", lambda item: None, queue_size=8, policy="drop_newest", workers=2)
+    stage.start()
+
+    def produce():
+        for i in range(2000):
+            stage.submit(i)
+
+    producers = [threading.Thread(target=produce) for _ in range(8)]
+    for t in producers:
+        t.start()
+    for t in producers:
+        t.join()
+    stage.stop()
+    stats = stage.stats()
+    assert stats["received"] == 16000
+    assert stats["processed"] + stats["dropped"] == 16000
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        Stage("t", print, policy="drop_random")
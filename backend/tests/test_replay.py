@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from replay import ReplayScheduler, TokenBucket, parse_replay_options
+
+
+def test_token_bucket_paces_to_rate():
+    bucket = TokenBucket(200)
+    start = time.monotonic()
+    for _ in range(21):
+        assert bucket.acquire()
+    # 首个令牌立即可用，其余 20 个按 200 条/秒补充
+    assert time.monotonic() - start >= 0.09
+
+
+def test_parse_replay_options_rejects_invalid():
+    with pytest.raises(ValueError):
+        parse_replay_options({"mode": "bogus"})
+    with pytest.raises(ValueError):
+        parse_replay_options({"mode": "rate", "rate": "abc"})
+    with pytest.raises(ValueError):
+        parse_replay_options({"mode": "rate", "rate": "0"})
+
+
+def test_speedup_aligns_to_timestamps():
+    scheduler = ReplayScheduler(mode="speedup", speedup=100)
+    start = time.monotonic()
+    assert scheduler.wait("2024-01-01T00:00:00")
+    assert scheduler.wait("2024-01-01T00:00:10")
+    # 10 秒的间隔按 100 倍加速为 0.1 秒
+    assert time.monotonic() - start >= 0.09
+
+
+def test_stats_freeze_after_finish():
+    scheduler = ReplayScheduler(mode="max")
+    for _ in range(10):
+        scheduler.wait()
+        scheduler.mark_sent()
+    scheduler.finish()
+    first = scheduler.stats()
+    time.sleep(0.05)
+    second = scheduler.stats()
+    assert first["elapsed"] == second["elapsed"]
+    assert first["actual_rate"] == second["actual_rate"]
+    assert first["actual_rate"] > 0
+
+
+def test_current_rate_expires_without_sends(monkeypatch):
+    scheduler = ReplayScheduler(mode="max")
+    scheduler.wait()
+    for _ in range(5):
+        scheduler.mark_sent()
+    assert scheduler.stats()["current_rate"] == 5
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 2.0)
+    assert scheduler.stats()["current_rate"] == 0
@@ -0,0 +1,115 @@
+import threading
+
+import pytest
+
+from result_cache import ResultCache
+
+
+def test_hit_until_version_changes():
+    cache = ResultCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"n": len(calls)}, 200
+
+    entry, source = cache.get("k", 1, compute)
+    assert (entry.body, source) == ('{"n": 1}', "miss")
+    entry, source = cache.get("k", 1, compute)
+    assert (entry.body, source) == ('{"n": 1}', "hit")
+    entry, source = cache.get("k", 2, compute)
+    assert (entry.body, source) == ('{"n": 2}', "miss")
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 2, "shared": 0}
+
+
+def test_etag_depends_on_key_and_version():
+    cache = ResultCache()
+    a, _ = cache.get("series?max_points=10", 1, lambda: ({}, 200))
+    b, _ = cache.get("series?max_points=20", 1, lambda: ({}, 200))
+    c, _ = cache.get("series?max_points=10", 2, lambda: ({}, 200))
+    assert len({a.etag, b.etag, c.etag}) == 3
+
+
+def test_evicts_least_recently_used():
+    cache = ResultCache(max_entries=2)
+    cache.get("a", 1, lambda: ({}, 200))
+    cache.get("b", 1, lambda: ({}, 200))
+    cache.get("a", 1, lambda: ({}, 200))
+    cache.get("c", 1, lambda: ({}, 200))
+    assert cache.get("a", 1, lambda: ({}, 200))[1] == "hit"
+    assert cache.get("b", 1, lambda: ({}, 200))[1] == "miss"
+
+
+def _concurrent(cache, compute, n=8):
+    started = threading.Barrier(n)
+    results = [None] * n
+
+    def worker(i):
+        started.wait()
+        try:
+            results[i] = cache.get("k", 1, compute)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def test_concurrent_requests_compute_once():
+    cache = ResultCache()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"ok": True}, 200
+
+    threads, results = _concurrent(cache, compute)
+    # 等其他请求都排到这次计算之后再放行
+    while cache.stats()["misses"] + cache.stats()["shared"] < len(threads):
+        threading.Event().wait(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert sorted(source for _, source in results) == ["miss"] + ["shared"] * 7
+    assert len({id(entry) for entry, _ in results}) == 1
+
+
+def test_failed_compute_is_raised_to_waiters_and_not_cached():
+    cache = ResultCache()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    threads, results = _concurrent(cache, compute, n=4)
+    while cache.stats()["misses"] + cache.stats()["shared"] < len(threads):
+        threading.Event().wait(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    # 失败不缓存，下一次请求重新计算
+    entry, source = cache.get("k", 1, lambda: ({"ok": True}, 200))
+    assert source == "miss"
+
+
+def test_failed_compute_without_waiters_raises():
+    cache = ResultCache()
+
+    def compute():
+        raise ValueError("bad")
+
+    with pytest.raises(ValueError):
+        cache.get("k", 1, compute)
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,160 @@
+import threading
+
+import numpy as np
+import pytest
+
+from rollups import RollupGroup, RollupStore, choose_tier, cover, merge_rows, summarize
+
+T0 = 1392249600          # 2014-02-13T00:00:00Z，按天对齐
+
+
+def _store(tmp_path, name="r"):
+    return RollupStore(str(tmp_path / name), compact_min_rows=1000)
+
+
+def test_cover_aligns_to_tier_boundaries():
+    end = T0 + 86400 + 3600 + 90
+    assert cover(T0 + 30, end) == [
+        ("raw", T0 + 30, T0 + 60),
+        ("1m", T0 + 60, T0 + 3600),
+        ("1h", T0 + 3600, T0 + 86400 + 3600),
+        ("1m", T0 + 86400 + 3600, T0 + 86400 + 3660),
+        ("raw", T0 + 86400 + 3660, end),
+    ]
+    assert cover(T0, T0 + 2 * 86400) == [("1d", T0, T0 + 2 * 86400)]
+    assert cover(T0, T0) == []
+
+
+def test_choose_tier():
+    assert choose_tier(T0, T0 + 600, 1000) is None
+    assert choose_tier(T0, T0 + 86400, 100) == "1m"
+    assert choose_tier(T0, T0 + 365 * 86400, 100) == "1d"
+
+
+def test_late_rows_merge_across_flushes(tmp_path):
+    store = _store(tmp_path)
+    store.update(T0 + 10, "A", [1.0, 50.0, None])
+    store.update(T0 + 20, "A", [3.0, 40.0, None])
+    store.flush()
+    # 迟到数据落在已写出的桶中，读取时合并
+    store.update(T0 + 5, "A", [-2.0, 60.0, None])
+    store.flush()
+    assert store.stats()["tiers"]["1m"]["rows"] == 2
+
+    data = store.read("1m", sensor_id="A")
+    assert list(data["bucket"]) == [T0]
+    assert data["temperature_count"][0] == 3
+    assert data["temperature_sum"][0] == 2.0
+    assert data["temperature_min"][0] == -2.0
+    assert data["temperature_max"][0] == 3.0
+    # last 取时间最晚的样本，而不是最后到达的
+    assert data["temperature_last"][0] == 3.0
+    assert data["temperature_last_ts"][0] == T0 + 20
+    assert data["pressure_count"][0] == 0
+
+
+def test_compact_preserves_aggregates(tmp_path):
+    store = _store(tmp_path)
+    for i in range(10):
+        store.update(T0 + i * 30, "A", [float(i), 1.0, 2.0])
+        store.flush()
+    before = store.read("1m", sensor_id="A")
+    store.compact("1m")
+    after = store.read("1m", sensor_id="A")
+    assert store.stats()["tiers"]["1m"]["sorted_rows"] == 5
+    for col in before:
+        assert np.array_equal(before[col], after[col])
+
+
+def test_ingest_arrays_matches_update(tmp_path):
+    ts = np.array([T0 + 1, T0 + 61, T0 + 62, T0 + 3700])
+    sensors = np.array(["A", "B", "A", "A"], dtype=object)
+    values = np.array([[1.0, 2.0, 3.0], [4.0, np.nan, 6.0],
+                       [7.0, 8.0, 9.0], [10.0, 11.0, 12.0]])
+    bulk = _store(tmp_path, "bulk")
+    bulk.ingest_arrays(ts, sensors, values)
+    live = _store(tmp_path, "live")
+    for t, s, v in zip(ts, sensors, values):
+        live.update(int(t), s, list(v))
+    live.flush()
+    for tier in ("1m", "1h", "1d"):
+        a, b = bulk.read(tier), live.read(tier)
+        for col in a:
+            assert np.array_equal(a[col], b[col], equal_nan=True), (tier, col)
+
+
+def test_merge_rows_across_sensors_and_summarize(tmp_path):
+    store = _store(tmp_path)
+    store.update(T0, "A", [1.0, None, None])
+    store.update(T0 + 1, "B", [5.0, None, None])
+    store.flush()
+    merged = store.read("1h")
+    assert len(merged["bucket"]) == 1
+    summary = summarize(merged)
+    assert summary["temperature"] == {"count": 2, "min": 1.0, "max": 5.0, "avg": 3.0}
+    assert summary["humidity"]["count"] == 0
+    assert len(merge_rows({k: v[:0] for k, v in merged.items()})["bucket"]) == 0
+
+
+def test_group_merges_workers(tmp_path):
+    root = str(tmp_path)
+    group = RollupGroup(root, [0, 1])
+    group.stores[0].update(T0, "A", [1.0, 1.0, 1.0])
+    group.stores[1].update(T0 + 5, "B", [3.0, 3.0, 3.0])
+    for store in group.stores:
+        store.flush()
+    data = group.read("1m")
+    assert list(data["bucket"]) == [T0]
+    assert data["temperature_count"][0] == 2
+    assert data["temperature_last"][0] == 3.0
+
+
+def test_update_does_not_wait_for_flush_io(tmp_path):
+    store = _store(tmp_path)
+    store.update(T0, "A", [1.0, 1.0, 1.0])
+    writing, release = threading.Event(), threading.Event()
+    append = store._append
+
+    def slow_append(name, columns):
+        writing.set()
+        release.wait(5)
+        append(name, columns)
+
+    store._append = slow_append
+    flusher = threading.Thread(target=store.flush)
+    flusher.start()
+    assert writing.wait(5)
+    # 写盘进行中，update 不被阻塞，新数据进入下一批
+    done = threading.Thread(target=store.update, args=(T0 + 1, "A", [3.0, 3.0, 3.0]))
+    done.start()
+    done.join(1)
+    assert not done.is_alive()
+    release.set()
+    flusher.join()
+    store._append = append
+    store.flush()
+    data = store.read("1m", sensor_id="A")
+    assert data["temperature_count"][0] == 2
+    assert data["temperature_last"][0] == 3.0
+
+
+def test_failed_flush_keeps_buckets(tmp_path):
+    store = _store(tmp_path)
+    store.update(T0 + 10, "A", [1.0, None, None])
+    append = store._append
+
+    def failing_append(name, columns):
+        # 写盘期间到达的同一个桶，失败后与放回的合并
+        store.update(T0 + 20, "A", [5.0, None, None])
+        raise OSError("disk full")
+
+    store._append = failing_append
+    with pytest.raises(OSError):
+        store.flush()
+    store._append = append
+    store.flush()
+    data = store.read("1m", sensor_id="A")
+    assert data["temperature_count"][0] == 2
+    assert data["temperature_sum"][0] == 6.0
+    assert data["temperature_last"][0] == 5.0
+    assert data["temperature_last_ts"][0] == T0 + 20
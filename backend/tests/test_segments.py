@@ -0,0 +1,200 @@
+import csv
+
+import numpy as np
+import pytest
+
+from segments import (SegmentStore, format_ts, iso_timestamp, migrate_csv, parse_epoch,
+                      to_epoch_seconds)
+
+T0 = 1392271200          # 2014-02-13T06:00:00Z
+
+
+@pytest.mark.parametrize("value", [None, "", "   ", "bogus", "NaT", "nan", "inf",
+                                   True, -1, "1e20", "2200-01-01T00:00:00"])
+def test_invalid_timestamps_are_none(value):
+    assert parse_epoch(value) is None
+    assert to_epoch_seconds([value]) == [None]
+
+
+def test_numeric_epochs_are_seconds_not_years():
+    assert to_epoch_seconds([T0, str(T0), float(T0), np.int64(T0)]) == [T0] * 4
+    assert to_epoch_seconds(["1700000000"]) == [1700000000]
+
+
+def test_iso_offsets_are_normalized_to_utc():
+    assert to_epoch_seconds(["2014-02-13T06:00:00",
+                             "2014-02-13T14:00:00+08:00",
+                             "2014-02-13T06:00:00Z"]) == [T0] * 3
+
+
+def test_sub_second_precision():
+    assert parse_epoch("2014-02-13T06:00:00.250") == T0 + 0.25
+    assert parse_epoch(f"{T0}.75") == T0 + 0.75
+    # 查询参数与预聚合按秒取整
+    assert to_epoch_seconds(["2014-02-13T06:00:00.999"]) == [T0]
+    assert iso_timestamp(T0 + 0.5) == "2014-02-13T06:00:00.500000"
+    assert iso_timestamp(T0) == "2014-02-13T06:00:00"
+
+
+def _write_csv(path, timestamps):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["timestamp", "sensor_id", "temperature",
+                                               "humidity", "pressure"])
+        writer.writeheader()
+        for ts in timestamps:
+            writer.writerow({"timestamp": ts, "sensor_id": "S1", "temperature": 1,
+                             "humidity": 2, "pressure": 3})
+
+
+def test_migrate_skips_empty_and_out_of_range_timestamps(tmp_path):
+    path = tmp_path / "sensor_data.csv"
+    _write_csv(path, ["2014-02-13T06:00:00", "", "bogus", "99999999999999",
+                      str(T0 + 3600), "2014-02-13T06:00:00"])
+    store = SegmentStore(str(tmp_path / "store"), partition="hour", retention_days=0)
+    # 第二次出现的同一时间戳视为重复
+    assert migrate_csv(str(path), store) == 2
+
+    store._load()
+    assert sorted(store.index["segments"]) == ["2014021306", "2014021307"]
+    assert max(seg["max_ts"] for seg in store.index["segments"].values()) == T0 + 3600
+    store.close()
+
+
+def test_write_skips_invalid_rows(tmp_path):
+    store = SegmentStore(str(tmp_path / "store"), partition="day", retention_days=0)
+    store.write([{"timestamp": "", "sensor_id": "S1", "temperature": 1},
+                 {"timestamp": T0, "sensor_id": "S1", "temperature": 2}])
+    data, sensors = store.read(metrics=("temperature",))
+    assert list(data["ts"]) == [T0]
+    assert list(data["temperature"]) == [2.0]
+    store.close()
+
+
+def _open_fds():
+    import os
+    return len(os.listdir("/proc/self/fd"))
+
+
+def _rows(sensors, ts=T0):
+    return [{"timestamp": ts, "sensor_id": s, "temperature": 1.0, "humidity": 2.0,
+             "pressure": 3.0} for s in sensors]
+
+
+def test_sharded_write_keeps_open_shards_bounded(tmp_path, monkeypatch):
+    from segments import ShardedStore
+    store = ShardedStore(str(tmp_path / "store"), max_open_shards=4, retention_days=0)
+    peak = 0
+    original = SegmentStore.write
+
+    def write(self, rows):
+        nonlocal peak
+        original(self, rows)
+        peak = max(peak, _open_fds())
+
+    monkeypatch.setattr(SegmentStore, "write", write)
+    baseline = _open_fds()
+    store.write(_rows([f"S{i}" for i in range(50)]))
+    # 每个分片每段 5 个列文件，最多同时打开 4 个分片
+    assert peak - baseline <= 4 * 5
+    assert store.stats()["open_shards"] == 4
+    assert store.count() == 50
+    store.close()
+    assert _open_fds() == baseline
+
+
+def test_sharded_read_maps_sensor_codes(tmp_path):
+    from segments import ShardedStore
+    store = ShardedStore(str(tmp_path / "store"), max_open_shards=2, retention_days=0)
+    store.write(_rows(["A", "B", "C"]))
+    store.write(_rows(["C"], T0 + 1))
+    data, sensors = store.read()
+    assert sorted(sensors) == ["A", "B", "C"]
+    assert [sensors[c] for c in data["sensor"]].count("C") == 2
+    data, _ = store.read(sensor_id="B")
+    assert len(data["ts"]) == 1
+    store.close()
+
+
+def test_sensor_limit(tmp_path, monkeypatch):
+    import segments
+    monkeypatch.setattr(segments, "MAX_SENSORS", 2)
+    store = segments.ShardedStore(str(tmp_path / "store"), retention_days=0)
+    store.write(_rows(["A", "B", "C"]))
+    assert sorted(store.registry()) == ["A", "B"]
+    assert store.stats()["rejected"] == 1
+    store.close()
+
+    single = SegmentStore(str(tmp_path / "single"), retention_days=0)
+    with pytest.raises(ValueError):
+        single.write(_rows(["A", "B", "C"]))
+    single.close()
+
+
+def test_store_keeps_sub_second_timestamps(tmp_path):
+    received = ["2014-02-13T06:00:00.250000", "2014-02-13T06:00:00.750000",
+                "2014-02-13T06:00:00", "2014-02-13T06:00:01.000001"]
+    store = SegmentStore(str(tmp_path / "store"), partition="hour", retention_days=0)
+    store.write([{"timestamp": ts, "sensor_id": "S1", "temperature": float(i)}
+                 for i, ts in enumerate(received)])
+    data, _ = store.read(metrics=("temperature",))
+    assert list(format_ts(data["ts"])) == sorted(received)
+    assert [iso_timestamp(v) for v in data["ts"]] == sorted(received)
+    # 同一秒内的两条读数仍是两行
+    assert list(data["temperature"]) == [2.0, 0.0, 1.0, 3.0]
+    assert [row["timestamp"] for row in store.tail(4)] == sorted(received)
+    data, _ = store.read(T0 + 0.5, T0 + 1, metrics=())
+    assert list(data["ts"]) == [T0 + 0.75]
+    store.close()
+
+
+def test_migrate_keeps_sub_second_timestamps(tmp_path):
+    path = tmp_path / "sensor_data.csv"
+    _write_csv(path, ["2014-02-13T06:00:00.100", "2014-02-13T06:00:00.200",
+                      "2014-02-13T06:00:00.100"])
+    store = SegmentStore(str(tmp_path / "store"), partition="hour", retention_days=0)
+    assert migrate_csv(str(path), store) == 2
+    data, _ = store.read(metrics=())
+    assert list(format_ts(data["ts"])) == ["2014-02-13T06:00:00.100000",
+                                           "2014-02-13T06:00:00.200000"]
+
+
+def test_version_1_segments_are_read_and_upgraded(tmp_path):
+    import json
+    import os
+    root = tmp_path / "store"
+    key = root / "2014021306"
+    os.makedirs(key)
+    np.array([T0, T0 + 2], dtype=np.int64).tofile(key / "ts.i8")
+    np.array([0, 0], dtype=np.uint16).tofile(key / "sensor.u2")
+    for m, v in (("temperature", 1.0), ("humidity", 2.0), ("pressure", 3.0)):
+        np.array([v, v], dtype=np.float64).tofile(key / f"{m}.f8")
+    with open(root / "index.json", "w") as f:
+        json.dump({"version": 1, "sensors": ["S1"], "segments": {"2014021306": {
+            "span": "hour", "rows": 2, "min_ts": T0, "max_ts": T0 + 2, "sorted": True}}}, f)
+
+    store = SegmentStore(str(root), partition="hour", retention_days=0)
+    data, sensors = store.read(metrics=("temperature",))
+    assert data["ts"].dtype == np.float64
+    assert list(data["ts"]) == [T0, T0 + 2] and sensors == ["S1"]
+
+    # 写入前整段转换为 ts.f8，迟到的数据归并到正确位置
+    store.write([{"timestamp": T0 + 1.5, "sensor_id": "S1", "temperature": 9.0}])
+    data, _ = store.read(metrics=("temperature",))
+    assert list(data["ts"]) == [T0, T0 + 1.5, T0 + 2]
+    assert list(data["temperature"]) == [1.0, 9.0, 1.0]
+    assert sorted(os.listdir(key)) == ["humidity.f8", "pressure.f8", "sensor.u2",
+                                       "temperature.f8", "ts.f8"]
+    store.close()
+    with open(root / "index.json") as f:
+        assert json.load(f)["version"] == 2
+
+
+def test_dedup_compares_sub_second_timestamps(tmp_path):
+    store = SegmentStore(str(tmp_path / "store"), partition="hour", retention_days=0)
+    store.write([{"timestamp": T0 + 0.5, "sensor_id": "S1", "temperature": 1.0},
+                 {"timestamp": T0 + 0.5, "sensor_id": "S1", "temperature": 2.0},
+                 {"timestamp": T0 + 0.6, "sensor_id": "S1", "temperature": 3.0}])
+    assert store.dedup() == 1
+    data, _ = store.read(metrics=("temperature",))
+    assert list(data["temperature"]) == [1.0, 3.0]
+    store.close()
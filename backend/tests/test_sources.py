@@ -0,0 +1,134 @@
+from source_cache import load_cached_series
+from sources import (StreamingSeries, iter_json_pairs, merge_metrics, reorder,
+                     sort_metric, stream_metric_files)
+
+
+def test_reorder_within_window_is_sorted():
+    pairs = [("03", 3.0), ("01", 1.0), ("02", 2.0), ("05", 5.0), ("04", 4.0)]
+    stats = {}
+    assert list(reorder(pairs, window=2, stats=stats)) == \
+        [("01", 1.0), ("02", 2.0), ("03", 3.0), ("04", 4.0), ("05", 5.0)]
+    assert stats.get("late", 0) == 0
+
+
+def test_reorder_counts_late_samples():
+    # "01" 落后了 4 条，窗口为 2 时已无法排入
+    pairs = [("02", 2.0), ("03", 3.0), ("04", 4.0), ("05", 5.0), ("01", 1.0)]
+    stats = {}
+    out = list(reorder(pairs, window=2, stats=stats))
+    assert [ts for ts, _ in out] == ["02", "03", "04", "05"]
+    assert stats["late"] == 1
+
+
+def test_reorder_keeps_last_duplicate():
+    pairs = [("01", 1.0), ("01", 9.0), ("02", 2.0)]
+    assert list(reorder(pairs, window=10)) == [("01", 9.0), ("02", 2.0)]
+
+
+def test_sort_metric_is_lossless():
+    pairs = [("02", 2.0), ("03", 3.0), ("04", 4.0), ("05", 5.0), ("01", 1.0), ("03", 7.0)]
+    assert list(sort_metric(pairs)) == \
+        [("01", 1.0), ("02", 2.0), ("03", 7.0), ("04", 4.0), ("05", 5.0)]
+
+
+def test_merge_metrics_joins_common_timestamps():
+    a = [("01", 1.0), ("02", 2.0), ("03", 3.0)]
+    b = [("02", 20.0), ("03", 30.0), ("04", 40.0)]
+    assert list(merge_metrics(a, b)) == [("02", 2.0, 20.0), ("03", 3.0, 30.0)]
+
+
+def test_iter_json_pairs_single_large_object(tmp_path):
+    path = tmp_path / "t.txt"
+    path.write_text("{" + ", ".join(f'"2024-01-01T00:00:{i:02d}": {i}' for i in range(60)) + "}")
+    pairs = list(iter_json_pairs(str(path)))
+    assert len(pairs) == 60
+    assert pairs[-1] == ("2024-01-01T00:00:59", 59.0)
+
+
+def _write_metric(path, order):
+    path.write_text("\n".join(f'{{"2024-01-01T00:00:{i:02d}": {i}}}' for i in order))
+
+
+def test_cache_falls_back_to_full_sort_on_late_samples(tmp_path):
+    order = list(range(1, 40)) + [0]
+    paths = []
+    for name in ("temperature", "humidity", "pressure"):
+        path = tmp_path / f"{name}.txt"
+        _write_metric(path, order)
+        paths.append(str(path))
+
+    def stream(exact=False):
+        return stream_metric_files(*paths, window=4, exact=exact)
+
+    streamed = stream()
+    assert len(list(streamed)) == 39
+    assert streamed.stats["late"] == 3
+
+    series = load_cached_series(str(tmp_path / "cache" / "series"), paths, stream,
+                                lambda: stream(exact=True))
+    rows = list(series)
+    assert len(rows) == 40
+    assert rows[0] == ("2024-01-01T00:00:00", 0.0, 0.0, 0.0)
+
+
+def test_cache_refuses_lossy_stream_without_fallback(tmp_path):
+    path = tmp_path / "temperature.txt"
+    _write_metric(path, [1, 2, 3, 0])
+    paths = [str(path)] * 3
+    try:
+        load_cached_series(str(tmp_path / "cache" / "series"), paths,
+                           lambda: stream_metric_files(*paths, window=1))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("丢了数据的缓存不应被写入")
+    assert not (tmp_path / "cache" / "series").exists()
+
+
+def test_streaming_series_resets_stats():
+    def factory(stats):
+        stats["late"] = stats.get("late", 0) + 1
+        return iter([])
+
+    series = StreamingSeries(factory)
+    list(series)
+    list(series)
+    assert series.stats == {"late": 1}
+
+
+def test_cache_round_trip_keeps_timestamps_verbatim(tmp_path):
+    stamps = ["2014-02-13T06:00:00", "2014-02-13T06:00:00.250", "2014-02-13T14:00:01+08:00",
+              "2014-02-13T06:00:02Z", "2014-02-13 06:00:03", "1392271204.5"]
+    paths = []
+    for i, name in enumerate(("temperature", "humidity", "pressure")):
+        path = tmp_path / f"{name}.txt"
+        path.write_text("\n".join(f'{{"{ts}": {j + i * 0.5}}}' for j, ts in enumerate(stamps)))
+        paths.append(str(path))
+
+    def stream():
+        return stream_metric_files(*paths, exact=True)
+
+    expected = list(stream())
+    assert sorted(ts for ts, *_ in expected) == sorted(stamps)
+    cache_dir = str(tmp_path / "cache" / "series")
+    compiled = load_cached_series(cache_dir, paths, stream)
+    assert list(compiled) == expected
+    # 第二次直接读取已编译的缓存
+    reloaded = load_cached_series(cache_dir, paths, lambda: iter(()))
+    assert len(reloaded) == len(expected)
+    assert list(reloaded) == expected
+
+
+def test_cache_round_trip_across_chunks_and_non_ascii(tmp_path, monkeypatch):
+    import source_cache
+    monkeypatch.setattr(source_cache, "CHUNK_SIZE", 3)
+    path = tmp_path / "temperature.txt"
+    path.write_text("{}")
+    rows = [(f"第{i}条 2014-02-13T06:00:{i:02d}.{i}", float(i), float(-i), float(i) / 2)
+            for i in range(10)]
+    series = load_cached_series(str(tmp_path / "cache"), [str(path)], lambda: iter(rows))
+    assert list(series) == rows
+    assert series.timestamps(4, 6) == [rows[4][0], rows[5][0]]
+
+    empty = load_cached_series(str(tmp_path / "empty"), [str(path)], lambda: iter(()))
+    assert len(empty) == 0 and list(empty) == []
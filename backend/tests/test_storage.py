@@ -0,0 +1,88 @@
+import csv
+import threading
+
+from storage import BatchWriter, CsvSink
+
+
+class FlakySink:
+    def __init__(self, fail_batches=()):
+        self.fail_batches = set(fail_batches)
+        self.calls = 0
+        self.rows = []
+
+    def write(self, rows):
+        self.calls += 1
+        if self.calls in self.fail_batches:
+            raise OSError("disk full")
+        self.rows.extend(rows)
+
+    def sync(self):
+        pass
+
+    def close(self, sync=True):
+        pass
+
+    def stats(self):
+        return {"engine": "fake"}
+
+
+def test_failed_batch_is_counted_as_lost():
+    sink = FlakySink(fail_batches={1})
+    writer = BatchWriter(sink, batch_size=3, flush_interval=10, fsync_policy="never")
+    writer.start()
+    for i in range(6):
+        assert writer.submit({"i": i})
+    assert writer.flush()
+    stats = writer.stats()
+    assert stats["lost"] == 3
+    assert stats["written"] == 3
+    assert stats["errors"] == 1
+    assert stats["last_error"] == "disk full"
+    assert [r["i"] for r in sink.rows] == [3, 4, 5]
+    writer.close()
+
+
+def test_dropped_count_is_exact_under_contention():
+    writer = BatchWriter(FlakySink(), queue_size=1, fsync_policy="never")
+    # 不启动写线程：队列满后所有 submit 都会被丢弃
+    assert writer.submit({"i": 0})
+
+    def producer():
+        for _ in range(500):
+            writer.submit({"i": 1}, timeout=0)
+
+    threads = [threading.Thread(target=producer) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert writer.stats()["dropped"] == 2000
+
+
+def test_csv_sink_writes_header_once(tmp_path):
+    path = str(tmp_path / "out.csv")
+    for value in ("1", "2"):
+        writer = BatchWriter(CsvSink(path, ["timestamp", "value"]), fsync_policy="never")
+        writer.start()
+        writer.submit({"timestamp": "2024-01-01T00:00:00", "value": value})
+        writer.close()
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [r["value"] for r in rows] == ["1", "2"]
+
+
+def test_lost_rows_are_reported_to_callback():
+    lost = []
+    writer = BatchWriter(FlakySink(fail_batches={1}), batch_size=2, flush_interval=10,
+                         fsync_policy="never", queue_size=10, on_lost=lost.extend)
+    writer.start()
+    for i in range(4):
+        writer.submit({"i": i})
+    assert writer.flush()
+    writer.close()
+    assert [d["i"] for d in lost] == [0, 1]
+
+    full = BatchWriter(FlakySink(), queue_size=1, fsync_policy="never", on_lost=lost.extend)
+    full.submit({"i": 9})
+    assert not full.submit({"i": 10}, timeout=0)
+    assert lost[-1] == {"i": 10}
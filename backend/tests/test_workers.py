@@ -0,0 +1,51 @@
+import queue
+import threading
+
+import workers
+from workers import Outbox
+
+
+def dropped_total(kind):
+    for _, labels, value in workers.OUTBOX_DROPPED.samples():
+        if labels == {"kind": kind}:
+            return value
+    return 0
+
+
+def test_batches_keep_order_under_concurrent_flush():
+    target = queue.Queue()
+    outbox = Outbox(target, batch=7, interval=60, put_timeout=1)
+    stop = threading.Event()
+
+    def flusher():
+        while not stop.is_set():
+            outbox.flush()
+
+    thread = threading.Thread(target=flusher)
+    thread.start()
+    for i in range(5000):
+        outbox.put(i)
+    stop.set()
+    thread.join()
+    outbox.flush()
+
+    received = []
+    while not target.empty():
+        received.extend(target.get())
+    assert received == list(range(5000))
+    assert outbox.stats()["sent"] == 5000
+    assert outbox.stats()["pending"] == 0
+
+
+def test_full_target_drops_are_counted_and_exported():
+    target = queue.Queue(maxsize=1)
+    outbox = Outbox(target, kind="messages", batch=2, interval=60, put_timeout=0.01)
+    before = dropped_total("messages")
+
+    for i in range(6):
+        outbox.put(i)
+
+    assert target.get() == ("messages", [0, 1])
+    stats = outbox.stats()
+    assert stats == {"sent": 2, "batches": 1, "dropped": 4, "pending": 0}
+    assert dropped_total("messages") - before == 4
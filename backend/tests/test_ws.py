@@ -0,0 +1,303 @@
+import json
+import math
+import struct
+import asyncio
+
+import pytest
+
+import ws_codec
+from config import Config
+from ws_fanout import Subscription, WSClient, WSHub
+
+
+# ========================
+# ws_codec
+# ========================
+def test_to_epoch_naive_is_utc():
+    assert ws_codec.to_epoch("1970-01-01T00:01:00") == 60.0
+    assert ws_codec.to_epoch("1970-01-01T01:00:00+01:00") == 0.0
+    assert ws_codec.to_epoch(12.5) == 12.5
+    assert math.isnan(ws_codec.to_epoch("bogus"))
+
+
+def test_struct_batch_round_trip():
+    metrics = ("temperature", "pressure")
+    samples = [["1970-01-01T00:00:10", "A", 21.5, 1000.0],
+               ["1970-01-01T00:00:11", "B", None, 1001.0]]
+    frame = ws_codec.encode_batch("struct", metrics, samples, {"A": 0, "B": 1})
+
+    magic, version, n = struct.unpack_from(ws_codec.STRUCT_HEADER, frame)
+    assert (magic, version, n) == (ws_codec.STRUCT_MAGIC, ws_codec.STRUCT_VERSION, 2)
+    fmt = "<" + ws_codec.struct_sample_format(metrics)
+    size = struct.calcsize(fmt)
+    offset = struct.calcsize(ws_codec.STRUCT_HEADER)
+    first = struct.unpack_from(fmt, frame, offset)
+    second = struct.unpack_from(fmt, frame, offset + size)
+    assert first == (10.0, 0, 21.5, 1000.0)
+    assert second[:2] == (11.0, 1) and math.isnan(second[2])
+    assert len(frame) == offset + 2 * size
+
+
+def test_schema_frame_describes_struct_layout():
+    schema = json.loads(ws_codec.schema_frame("struct", ("humidity",)))
+    assert schema["fields"] == ["timestamp", "sensor_id", "humidity"]
+    assert schema["layout"]["sample"] == "<dHf"
+    assert schema["units"] == {"humidity": "RH%"}
+
+
+def test_json_batch_and_unknown_encoding():
+    frame = json.loads(ws_codec.encode_batch("json", ("temperature",), [["t", "A", 1.0]]))
+    assert frame == {"type": "batch", "fields": ["timestamp", "sensor_id", "temperature"],
+                     "samples": [["t", "A", 1.0]]}
+    with pytest.raises(ValueError):
+        ws_codec.check_encoding("xml")
+
+
+# ========================
+# 控制帧与丢弃策略
+# ========================
+class FakeWS:
+    remote_address = ("127.0.0.1", 9999)
+
+    def __init__(self):
+        self.frames = []
+        self.closed = None
+
+    async def send(self, frame):
+        self.frames.append(frame)
+
+    async def close(self, code, reason):
+        self.closed = (code, reason)
+
+
+def test_control_frames_survive_drop_oldest():
+    async def scenario():
+        ws = FakeWS()
+        client = WSClient(ws, queue_size=2, policy="drop_oldest")
+        client.enqueue("schema", control=True)
+        for i in range(5):
+            client.enqueue(f"data{i}")
+        client.enqueue("sensors", control=True)
+        assert client.dropped == 3
+
+        client.task = asyncio.ensure_future(client.sender())
+        await asyncio.sleep(0.01)
+        client.task.cancel()
+        return ws.frames
+
+    # 控制帧不会被挤掉，并先于排队中的数据帧发出
+    assert asyncio.run(scenario()) == ["schema", "sensors", "data3", "data4"]
+
+
+def test_sender_wakes_for_control_frame():
+    async def scenario():
+        ws = FakeWS()
+        client = WSClient(ws, queue_size=2, policy="drop_oldest")
+        client.task = asyncio.ensure_future(client.sender())
+        await asyncio.sleep(0)
+        client.enqueue("schema", control=True)
+        await asyncio.sleep(0.01)
+        client.enqueue("data")
+        await asyncio.sleep(0.01)
+        client.task.cancel()
+        return ws.frames
+
+    assert asyncio.run(scenario()) == ["schema", "data"]
+
+
+def test_disconnect_policy_closes_slow_client():
+    async def scenario():
+        ws = FakeWS()
+        client = WSClient(ws, queue_size=1, policy="disconnect")
+        assert client.enqueue("a")
+        assert not client.enqueue("b")
+        await asyncio.sleep(0)
+        return client, ws
+
+    client, ws = asyncio.run(scenario())
+    assert client.slow and ws.closed == (1008, "slow consumer")
+
+
+
+class StalledWS(FakeWS):
+    """send 永不返回，模拟网络阻塞的客户端"""
+
+    async def send(self, frame):
+        await asyncio.Event().wait()
+
+
+def test_broadcast_does_not_wait_for_slow_client():
+    async def scenario():
+        hub = WSHub(queue_size=2, policy="drop_oldest")
+        fast, slow = FakeWS(), StalledWS()
+        hub.register(fast)
+        hub.register(slow)
+        for i in range(5):
+            hub.publish({"timestamp": f"t{i}", "temperature": float(i)})
+            await asyncio.sleep(0.005)
+        stats = hub.stats()
+        for ws in (fast, slow):
+            hub.unregister(ws)
+        return hub, fast, stats
+
+    hub, fast, stats = asyncio.run(scenario())
+    # 每条数据只序列化一次；慢客户端只丢自己队列中的旧数据
+    assert stats["serializations"] == 5 and stats["clients"] == 2
+    assert [json.loads(f)["timestamp"] for f in fast.frames] == [f"t{i}" for i in range(5)]
+    assert stats["dropped"] == 2
+    # 断开后的累计统计保留在 hub 中
+    assert hub.stats()["clients"] == 0
+    assert hub.stats()["sent"] == 5 and hub.stats()["dropped"] == 2
+
+
+def test_disconnected_slow_clients_are_counted():
+    async def scenario():
+        hub = WSHub(queue_size=1, policy="disconnect")
+        ws = StalledWS()
+        hub.register(ws)
+        for i in range(4):
+            hub.publish({"timestamp": f"t{i}"})
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        hub.unregister(ws)
+        return hub, ws
+
+    hub, ws = asyncio.run(scenario())
+    assert ws.closed == (1008, "slow consumer")
+    assert hub.stats()["disconnected_slow"] == 1
+
+
+def test_invalid_overflow_policy():
+    with pytest.raises(ValueError):
+        WSHub(policy="block")
+
+
+def test_binary_channel_sensor_mapping_not_lost_under_backpressure():
+    async def scenario():
+        hub = WSHub(queue_size=1, policy="drop_oldest")
+        ws = FakeWS()
+        client = hub.register(ws)
+        client.task.cancel()
+        hub.subscribe(ws, Subscription(encoding="struct", max_fps=1000))
+        channel = client.channel
+        for i in range(3):
+            hub.publish({"timestamp": "1970-01-01T00:00:01", "sensor_id": f"S{i}",
+                         "temperature": 1.0, "humidity": 2.0, "pressure": 3.0})
+            # 等频道按帧率（最高 WS_MAX_FPS）发出这一批
+            await asyncio.sleep(0.05)
+        channel.task.cancel()
+        return client
+
+    client = asyncio.run(scenario())
+    control = [json.loads(entry[1]) for entry in client.control]
+    assert control[0]["type"] == "schema"
+    mapping = {}
+    for frame in control[1:]:
+        assert frame["type"] == "sensors"
+        mapping.update(frame["sensors"])
+    assert mapping == {"S0": 0, "S1": 1, "S2": 2}
+    assert client.dropped >= 2
+
+
+def test_alerts_use_control_path_for_legacy_and_matching_subscribers():
+    async def scenario():
+        hub = WSHub(queue_size=1, policy="drop_oldest")
+        legacy, matching, other, muted = FakeWS(), FakeWS(), FakeWS(), FakeWS()
+        clients = {ws: hub.register(ws) for ws in (legacy, matching, other, muted)}
+        for client in clients.values():
+            client.task.cancel()
+        hub.subscribe(matching, Subscription(metrics=["temperature"], sensors=["S1"]))
+        hub.subscribe(other, Subscription(sensors=["S2"]))
+        hub.subscribe(muted, Subscription(alerts=False))
+        # 未订阅客户端的数据队列已满
+        for i in range(3):
+            hub.publish({"timestamp": f"t{i}", "sensor_id": "S1", "temperature": 1.0})
+        hub.alert({"type": "alert", "state": "anomaly", "sensor_id": "S1",
+                   "metric": "temperature", "value": 80.0})
+        for channel in hub.channels.values():
+            channel.task.cancel()
+        return clients
+
+    clients = asyncio.run(scenario())
+    alerts = {ws: [json.loads(entry[1]) for entry in client.control]
+              for ws, client in clients.items()}
+    legacy, matching, other, muted = clients
+    assert [a["value"] for a in alerts[legacy]] == [80.0]
+    assert clients[legacy].dropped == 2
+    assert alerts[matching][-1]["type"] == "alert"
+    assert not any(a.get("type") == "alert" for a in alerts[other] + alerts[muted])
+
+
+# ========================
+# 订阅与合并发送
+# ========================
+def test_subscription_validation():
+    sub = Subscription(metrics=["pressure", "temperature"], sensors=["S1", 2], max_fps=1e6)
+    # 指标按固定顺序排列，帧率不超过上限
+    assert sub.metrics == ("temperature", "pressure")
+    assert sub.sensors == {"S1", "2"}
+    assert sub.max_fps == Config.WS_MAX_FPS
+    assert sub.fields == ("timestamp", "sensor_id", "temperature", "pressure")
+    assert Subscription(sensors=["B", "A"]).key() == Subscription(sensors=["A", "B"]).key()
+    for msg in ({"metrics": "temperature"}, {"sensors": "S1"}, {"metrics": ["wind"]},
+                {"max_fps": 0}, {"max_fps": "fast"}, {"encoding": "xml"}):
+        with pytest.raises(ValueError):
+            Subscription.from_message(msg)
+
+
+def test_subscribers_with_same_filter_share_one_coalesced_frame():
+    async def scenario():
+        hub = WSHub()
+        a, b, legacy = FakeWS(), FakeWS(), FakeWS()
+        for ws in (a, b, legacy):
+            hub.register(ws)
+        for ws in (a, b):
+            hub.handle_message(ws, json.dumps({"type": "subscribe", "metrics": ["temperature"],
+                                               "sensors": ["S1"], "max_fps": 20}))
+        await asyncio.sleep(0.01)
+        for i in range(4):
+            hub.publish({"timestamp": f"t{i}", "sensor_id": "S1" if i != 2 else "S2",
+                         "temperature": float(i), "humidity": 50.0})
+        await asyncio.sleep(0.15)
+        channels = len(hub.channels)
+        for ws in (a, b, legacy):
+            hub.unregister(ws)
+        return hub, a, b, legacy, channels
+
+    hub, a, b, legacy, channels = asyncio.run(scenario())
+    assert channels == 1 and not hub.channels
+    assert json.loads(a.frames[0])["type"] == "subscribed"
+    assert a.frames == b.frames
+    batches = [json.loads(f) for f in a.frames[1:]]
+    assert len(batches) == 1
+    assert batches[0] == {"type": "batch", "fields": ["timestamp", "sensor_id", "temperature"],
+                          "samples": [["t0", "S1", 0.0], ["t1", "S1", 1.0], ["t3", "S1", 3.0]]}
+    # 未订阅的客户端仍逐条收到完整数据
+    assert [json.loads(f)["timestamp"] for f in legacy.frames] == ["t0", "t1", "t2", "t3"]
+    # 4 条逐条推送 + 1 个合并帧
+    assert hub.stats()["serializations"] == 5
+
+
+def test_unsubscribe_and_invalid_messages():
+    async def scenario():
+        hub = WSHub()
+        ws = FakeWS()
+        client = hub.register(ws)
+        hub.handle_message(ws, "not json")
+        hub.handle_message(ws, "[1, 2]")
+        hub.handle_message(ws, json.dumps({"type": "subscribe", "metrics": ["wind"]}))
+        hub.handle_message(ws, json.dumps({"type": "subscribe"}))
+        channel = client.channel
+        hub.handle_message(ws, json.dumps({"type": "unsubscribe"}))
+        await asyncio.sleep(0.01)
+        hub.unregister(ws)
+        return hub, ws, client, channel
+
+    hub, ws, client, channel = asyncio.run(scenario())
+    replies = [json.loads(f) for f in ws.frames]
+    assert [r["type"] for r in replies] == ["error", "error", "error", "subscribed", "unsubscribed"]
+    assert replies[0]["error"] == "invalid json"
+    assert "wind" in replies[2]["error"]
+    # 最后一个客户端离开后频道及其发送任务被清理
+    assert client.channel is None and not hub.channels
+    assert channel.task.cancelled()
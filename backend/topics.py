@@ -0,0 +1,84 @@
+"""
+订阅主题模式与传感器 ID 提取
+
+模式按 MQTT 主题层级书写：+ 匹配任意一级，# 匹配其余所有层级（只能在末尾），
+{sensor_id} 匹配一级并把该级作为传感器 ID，例如：
+    iot/{sensor_id}/environment         ->  订阅 iot/+/environment
+    iot/area1/environment/{sensor_id}   ->  订阅 iot/area1/environment/+
+消息中自带的 sensor_id 优先；都没有时使用 DEFAULT_SENSOR_ID。
+"""
+from config import Config
+
+SENSOR_PLACEHOLDER = "{sensor_id}"
+# 传感器 ID 的最大长度（ID 会出现在注册表、文件名和统计中）
+MAX_SENSOR_ID_LENGTH = 128
+
+
+def topic_patterns(spec=None):
+    """解析 MQTT_TOPICS；为空时为 MQTT_TOPIC 及其下一级"""
+    spec = Config.MQTT_TOPICS if spec is None else spec
+    patterns = [p.strip() for p in spec.split(",") if p.strip()]
+    if not patterns:
+        patterns = [Config.MQTT_TOPIC, Config.MQTT_TOPIC.rstrip("/") + "/" + SENSOR_PLACEHOLDER]
+    for pattern in patterns:
+        levels = pattern.split("/")
+        if "#" in levels[:-1]:
+            raise ValueError(f"# 只能出现在主题模式末尾: {pattern}")
+        if levels.count(SENSOR_PLACEHOLDER) > 1:
+            raise ValueError(f"主题模式中 {SENSOR_PLACEHOLDER} 最多出现一次: {pattern}")
+    return patterns
+
+
+def subscription_filter(pattern):
+    """模式对应的 MQTT 订阅过滤器"""
+    return "/".join("+" if level == SENSOR_PLACEHOLDER else level
+                    for level in pattern.split("/"))
+
+
+def match(pattern, topic):
+    """
+    主题匹配模式时返回 (True, 传感器 ID 或 None)，否则返回 (False, None)
+    """
+    levels = topic.split("/")
+    sensor_id = None
+    parts = pattern.split("/")
+    for i, part in enumerate(parts):
+        if part == "#":
+            return True, sensor_id
+        if i >= len(levels):
+            return False, None
+        if part == SENSOR_PLACEHOLDER:
+            if not levels[i]:
+                return False, None
+            sensor_id = levels[i]
+        elif part != "+" and part != levels[i]:
+            return False, None
+    if len(levels) != len(parts):
+        return False, None
+    return True, sensor_id
+
+
+class TopicRouter:
+    def __init__(self, patterns=None):
+        self.patterns = topic_patterns() if patterns is None else list(patterns)
+
+    def filters(self, shared_group=None):
+        """订阅过滤器；指定 shared_group 时为共享订阅 $share/<组>/<过滤器>，由 broker 在组内分摊消息"""
+        filters = [subscription_filter(p) for p in self.patterns]
+        if shared_group:
+            filters = [f"$share/{shared_group}/{f}" for f in filters]
+        return filters
+
+    def sensor_id(self, topic, payload=None):
+        """消息中的 sensor_id 优先，其次是主题中 {sensor_id} 对应的一级，最后为默认传感器"""
+        sensor_id = payload.get("sensor_id") if payload else None
+        if not sensor_id:
+            for pattern in self.patterns:
+                matched, from_topic = match(pattern, topic)
+                if matched:
+                    sensor_id = from_topic
+                    break
+        sensor_id = str(sensor_id or Config.DEFAULT_SENSOR_ID)
+        if len(sensor_id) > MAX_SENSOR_ID_LENGTH:
+            raise ValueError(f"sensor_id 过长（超过 {MAX_SENSOR_ID_LENGTH} 个字符）: {topic}")
+        return sensor_id
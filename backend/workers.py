@@ -0,0 +1,189 @@
+"""
+多进程订阅：N 个 worker 进程各自连接 MQTT，用共享订阅 $share/<组>/<过滤器> 由 broker 分摊消息
+
+- 每个传感器按稳定哈希归属一个 worker（segments.partition），只有它写该传感器的分片、
+  分析快照与预聚合，并维护该传感器的去重索引和异常检测状态；
+  worker 收到不归属自己的传感器的数据时，解码后转发给所属的 worker
+- worker 把接收的数据、告警和运行状态发给协调进程（主进程），由协调进程统一做
+  WebSocket 推送、历史缓冲和 REST API，客户端仍只连接一个端口
+- 进程间用 multiprocessing 队列通信，每个队列元素是一批消息（Outbox 攒批），摊薄序列化开销
+
+worker 收件箱中的元素为 (类型, 数据)：
+    ("messages", [(topic, payload, received_at), ...])   其他 worker 转发的已解码数据
+    ("connect" / "disconnect" / "stop", None)            协调进程下发的控制命令
+协调进程事件队列中的元素为一批 (类型, ...)：
+    ("sample", payload, topic, received_at) / ("alert", event) / ("stats", worker, stats, 指标快照)
+"""
+import time
+import queue
+import threading
+import multiprocessing
+
+from config import Config
+from logs import get_logger
+import metrics
+
+COMMANDS = ("connect", "disconnect", "stop")
+
+log = get_logger("workers")
+OUTBOX_DROPPED = metrics.counter(
+    "iot_worker_outbox_dropped_total", "进程间队列满而丢弃的条数（kind: messages 转发 / events 上报）",
+    ("kind",))
+
+
+class Outbox:
+    """
+    把逐条消息攒成批放入进程间队列：满 batch 条或距上次发送超过 interval 秒时发送。
+    取出与发送在同一把锁内完成，攒批线程与定时线程发出的批次不会乱序；
+    对端队列满时丢弃这一批，记录日志并计入 iot_worker_outbox_dropped_total
+    """
+
+    def __init__(self, target, kind=None, batch=None, interval=None, put_timeout=None):
+        self.target = target
+        # 为 None 时直接发送列表，否则发送 (kind, 列表)
+        self.kind = kind
+        self.batch = int(batch or Config.SUBSCRIBE_WORKER_BATCH)
+        self.interval = float(interval if interval is not None
+                              else Config.SUBSCRIBE_WORKER_FLUSH_INTERVAL)
+        self.put_timeout = float(put_timeout if put_timeout is not None
+                                 else Config.PIPELINE_PUT_TIMEOUT)
+        self.items = []
+        self._lock = threading.Lock()
+        # 串行化发送，同时保护计数
+        self._send_lock = threading.Lock()
+        self._thread = None
+
+        self.sent = 0
+        self.batches = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="outbox")
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def put(self, item):
+        with self._lock:
+            self.items.append(item)
+            if len(self.items) < self.batch:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._send_lock:
+            with self._lock:
+                items, self.items = self.items, []
+            if items:
+                self._send(items)
+
+    def _send(self, items):
+        # 调用方需持有 self._send_lock
+        try:
+            self.target.put(items if self.kind is None else (self.kind, items),
+                            timeout=self.put_timeout)
+        except queue.Full:
+            # 对端处理不过来时丢弃这一批，不让两个 worker 互相等待
+            self.dropped += len(items)
+            OUTBOX_DROPPED.inc(len(items), kind=self.kind or "events")
+            log.warning("进程间队列已满，丢弃 %d 条%s（累计 %d 条）", len(items),
+                        "转发数据" if self.kind == "messages" else "事件", self.dropped)
+            return
+        self.sent += len(items)
+        self.batches += 1
+
+    def stats(self):
+        with self._lock:
+            pending = len(self.items)
+        return {"sent": self.sent, "batches": self.batches, "dropped": self.dropped,
+                "pending": pending}
+
+
+class WorkerPool:
+    """协调进程持有的 worker 进程组：每个 worker 一个收件箱，所有 worker 共用一个事件队列"""
+
+    def __init__(self, workers, target):
+        self.workers = int(workers)
+        if self.workers < 2:
+            raise ValueError("多进程订阅至少需要 2 个 worker")
+        self.target = target
+        # spawn 避免在多线程的进程中 fork
+        self._ctx = multiprocessing.get_context("spawn")
+        size = Config.SUBSCRIBE_WORKER_QUEUE_SIZE
+        self.inboxes = [self._ctx.Queue(maxsize=size) for _ in range(self.workers)]
+        self.events = self._ctx.Queue(maxsize=size)
+        self.processes = []
+        self._thread = None
+
+        self.received = 0
+        self.batches = 0
+
+    def start(self):
+        for i in range(self.workers):
+            process = self._ctx.Process(
+                target=self.target, args=(i, self.workers, self.inboxes, self.events),
+                name=f"subscribe-worker-{i}", daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    def consume(self, handler):
+        """后台线程逐批读取事件队列，交给 handler(批) 处理"""
+        def run():
+            while True:
+                try:
+                    batch = self.events.get()
+                except (EOFError, OSError):
+                    # 进程退出时队列已关闭
+                    return
+                if batch is None:
+                    return
+                self.received += len(batch)
+                self.batches += 1
+                try:
+                    handler(batch)
+                except Exception as e:
+                    log.error("处理 worker 事件失败: %s", e)
+
+        self._thread = threading.Thread(target=run, daemon=True, name="worker-events")
+        self._thread.start()
+
+    def command(self, name):
+        if name not in COMMANDS:
+            raise ValueError(f"命令必须是 {', '.join(COMMANDS)} 之一")
+        for inbox in self.inboxes:
+            inbox.put((name, None))
+
+    def stop(self, timeout=10.0):
+        """先让各 worker 断开 MQTT，再通知它们处理完已接收的数据后退出，超时仍未退出的强制结束"""
+        for name in ("disconnect", "stop"):
+            for i, process in enumerate(self.processes):
+                if process.is_alive():
+                    try:
+                        self.inboxes[i].put((name, None), timeout=1.0)
+                    except queue.Full:
+                        pass
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join(1.0)
+        try:
+            self.events.put(None, timeout=1.0)
+        except queue.Full:
+            pass
+        if self._thread is not None:
+            self._thread.join(2.0)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "alive": [p.is_alive() for p in self.processes],
+            "pids": [p.pid for p in self.processes],
+            "received": self.received,
+            "batches": self.batches
+        }
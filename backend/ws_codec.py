@@ -0,0 +1,122 @@
+"""
+WebSocket 批量帧编码
+
+- json:    {"type": "batch", "fields": [...], "samples": [[...], ...]}（文本帧）
+- struct:  固定布局的二进制帧，每个样本 8 字节时间戳 + 2 字节传感器序号 + 每个指标 4 字节
+- msgpack: 列式 MessagePack 二进制帧（需要安装 msgpack）
+
+二进制编码下，字段、单位和布局只在订阅时通过 schema 文本帧发送一次，
+传感器 ID 映射为序号，新出现的传感器通过 sensors 文本帧增量告知。
+"""
+import json
+import math
+import struct
+from datetime import datetime, timezone
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ENCODINGS = ("json", "struct", "msgpack")
+
+UNITS = {"temperature": "C", "humidity": "RH%", "pressure": "hPa"}
+
+# 帧头：魔数、版本、样本数
+STRUCT_MAGIC = 0xA5
+STRUCT_VERSION = 1
+STRUCT_HEADER = "<BBH"
+STRUCT_MAX_SAMPLES = 0xFFFF
+
+
+def available_encodings():
+    return [e for e in ENCODINGS if e != "msgpack" or msgpack is not None]
+
+
+def check_encoding(encoding):
+    if encoding not in ENCODINGS:
+        raise ValueError(f"encoding 必须是 {', '.join(ENCODINGS)} 之一")
+    if encoding == "msgpack" and msgpack is None:
+        raise ValueError("服务端未安装 msgpack，无法使用 msgpack 编码")
+
+
+def to_epoch(ts):
+    """ISO 时间戳转为 Unix 秒；不带时区的时间按 UTC 处理"""
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    try:
+        dt = datetime.fromisoformat(str(ts))
+    except ValueError:
+        return math.nan
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _num(value):
+    return math.nan if value is None else float(value)
+
+
+def struct_sample_format(metrics):
+    return "dH" + "f" * len(metrics)
+
+
+def schema_frame(encoding, metrics):
+    schema = {
+        "type": "schema",
+        "encoding": encoding,
+        "fields": ["timestamp", "sensor_id"] + list(metrics),
+        "units": {m: UNITS[m] for m in metrics}
+    }
+    if encoding == "struct":
+        schema["layout"] = {
+            "byte_order": "little",
+            "header": STRUCT_HEADER,
+            "magic": STRUCT_MAGIC,
+            "version": STRUCT_VERSION,
+            "sample": "<" + struct_sample_format(metrics),
+            "timestamp": "unix seconds, naive timestamps as UTC",
+            "sensor_id": "index into sensors table",
+            "missing": "NaN"
+        }
+    elif encoding == "msgpack":
+        schema["layout"] = {
+            "columns": ["t", "s"] + list(metrics),
+            "timestamp": "unix seconds, naive timestamps as UTC",
+            "sensor_id": "index into sensors table"
+        }
+    return json.dumps(schema)
+
+
+def sensors_frame(sensors):
+    """sensors: {sensor_id: 序号}"""
+    return json.dumps({"type": "sensors", "sensors": sensors}, ensure_ascii=False)
+
+
+def encode_batch(encoding, metrics, samples, sensor_index=None):
+    """
+    samples: [[timestamp, sensor_id, m1, m2, ...], ...]
+    sensor_index: 二进制编码时使用的 {sensor_id: 序号}
+    """
+    if encoding == "json":
+        return json.dumps({"type": "batch",
+                           "fields": ["timestamp", "sensor_id"] + list(metrics),
+                           "samples": samples}, ensure_ascii=False)
+
+    if encoding == "struct":
+        samples = samples[-STRUCT_MAX_SAMPLES:]
+        values = [STRUCT_MAGIC, STRUCT_VERSION, len(samples)]
+        for sample in samples:
+            values.append(to_epoch(sample[0]))
+            values.append(sensor_index[sample[1]])
+            values.extend(_num(v) for v in sample[2:])
+        fmt = STRUCT_HEADER + struct_sample_format(metrics) * len(samples)
+        return struct.pack(fmt, *values)
+
+    columns = {
+        "t": [to_epoch(s[0]) for s in samples],
+        "s": [sensor_index[s[1]] for s in samples]
+    }
+    for i, m in enumerate(metrics):
+        columns[m] = [s[2 + i] for s in samples]
+    return msgpack.packb(columns)
@@ -0,0 +1,421 @@
+"""
+WebSocket 非阻塞扇出：每个连接拥有独立的有界发送队列和发送任务
+
+- 广播时消息只序列化一次，然后放入各连接的队列，不等待任何一个客户端
+- 队列满（客户端太慢）时的策略：
+  - drop_oldest: 丢弃该客户端队列中最旧的一帧
+  - disconnect:  断开这个慢消费者，避免其占用内存
+  控制帧（schema、sensors 映射、订阅回复）走单独的优先队列，不受丢弃策略影响，
+  并先于数据帧发送，客户端总能解码二进制帧中的传感器序号
+- 统计每个连接的已发送帧数、丢弃帧数、队列深度和发送时延，
+  以及从订阅端收到数据到发给客户端的时延（/metrics；合并帧按其中最早的一条计算）
+
+客户端可以在连接后发送订阅消息，只接收需要的指标和传感器，并限定最大帧率：
+    {"type": "subscribe", "metrics": ["temperature"], "sensors": ["ENV_SENSOR_001"], "max_fps": 5}
+服务端按该帧率把多条样本合并成一帧批量发送：
+    {"type": "batch", "fields": ["timestamp", "sensor_id", "temperature"], "samples": [[...], ...]}
+订阅条件相同的客户端共用一个频道，每帧只序列化一次。未订阅的客户端保持原有的逐条推送。
+订阅时可指定 "encoding": "struct" / "msgpack" 使用二进制帧，见 ws_codec。
+异常告警作为控制帧立即发送（JSON 文本帧，不受丢弃策略影响）：未订阅的客户端收到全部告警，
+已订阅的客户端只收到所订阅传感器、指标的告警（"alerts": false 关闭）：
+    {"type": "alert", "state": "anomaly", "sensor_id": "...", "metric": "temperature", "value": ..., "z": ...}
+"""
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+
+from config import Config
+import ws_codec
+import metrics
+
+OVERFLOW_POLICIES = ("drop_oldest", "disconnect")
+METRICS = ("temperature", "humidity", "pressure")
+
+SEND_LATENCY = metrics.histogram(
+    "iot_ws_send_latency_seconds", "订阅端从收到消息到发给 WebSocket 客户端的时延")
+
+
+class Subscription:
+    def __init__(self, metrics=None, sensors=None, max_fps=None, encoding=None, alerts=None):
+        self.encoding = encoding or "json"
+        self.alerts = True if alerts is None else bool(alerts)
+        ws_codec.check_encoding(self.encoding)
+        if metrics is not None:
+            unknown = [m for m in metrics if m not in METRICS]
+            if unknown:
+                raise ValueError(f"未知指标: {', '.join(map(str, unknown))}")
+            metrics = tuple(m for m in METRICS if m in metrics)
+        self.metrics = metrics or METRICS
+        self.sensors = frozenset(str(x) for x in sensors) if sensors else None
+
+        fps = Config.WS_DEFAULT_FPS if max_fps is None else float(max_fps)
+        if fps <= 0:
+            raise ValueError("max_fps 必须大于 0")
+        self.max_fps = min(fps, Config.WS_MAX_FPS)
+        self.fields = ("timestamp", "sensor_id") + self.metrics
+
+    @classmethod
+    def from_message(cls, msg):
+        metrics = msg.get("metrics")
+        sensors = msg.get("sensors")
+        if metrics is not None and not isinstance(metrics, list):
+            raise ValueError("metrics 必须是列表")
+        if sensors is not None and not isinstance(sensors, list):
+            raise ValueError("sensors 必须是列表")
+        try:
+            return cls(metrics, sensors, msg.get("max_fps"), msg.get("encoding"),
+                       msg.get("alerts"))
+        except (TypeError, ValueError) as e:
+            raise ValueError(str(e))
+
+    def key(self):
+        sensors = tuple(sorted(self.sensors)) if self.sensors else None
+        return (self.metrics, sensors, self.max_fps, self.encoding, self.alerts)
+
+    def describe(self):
+        return {
+            "encoding": self.encoding,
+            "metrics": list(self.metrics),
+            "sensors": sorted(self.sensors) if self.sensors else None,
+            "max_fps": self.max_fps,
+            "alerts": self.alerts
+        }
+
+
+def sensor_of(data):
+    return str(data.get("sensor_id") or Config.DEFAULT_SENSOR_ID)
+
+
+class Channel:
+    """一组订阅条件相同的客户端：共享样本缓冲，按帧率合并发送"""
+
+    def __init__(self, subscription, hub):
+        self.sub = subscription
+        self.hub = hub
+        self.clients = set()
+        self.buffer = deque(maxlen=Config.WS_MAX_BATCH)
+        self.task = None
+        self.overflow = 0
+        # 二进制编码下 sensor_id 映射为序号
+        self.sensor_index = {}
+        self.new_sensors = {}
+        # 缓冲中最早一条数据的接收时间
+        self.received_at = None
+
+    def add(self, data, sensor_id, received_at=None):
+        if self.sub.sensors is not None and sensor_id not in self.sub.sensors:
+            return
+        if self.sub.encoding != "json" and sensor_id not in self.sensor_index:
+            index = len(self.sensor_index)
+            self.sensor_index[sensor_id] = index
+            self.new_sensors[sensor_id] = index
+        if len(self.buffer) == self.buffer.maxlen:
+            self.overflow += 1
+        self.buffer.append([data.get("timestamp"), sensor_id] +
+                           [data.get(m) for m in self.sub.metrics])
+        if received_at is not None and self.received_at is None:
+            self.received_at = received_at
+
+    def join(self, client):
+        self.clients.add(client)
+        if self.sub.encoding != "json":
+            # 字段、单位和布局每个订阅只发送一次
+            client.enqueue(ws_codec.schema_frame(self.sub.encoding, self.sub.metrics),
+                           control=True)
+            if self.sensor_index:
+                client.enqueue(ws_codec.sensors_frame(self.sensor_index), control=True)
+
+    def _send_all(self, frame, received_at=None, control=False):
+        for client in list(self.clients):
+            client.enqueue(frame, received_at, control)
+
+    async def run(self):
+        interval = 1.0 / self.sub.max_fps
+        while True:
+            await asyncio.sleep(interval)
+            if not self.buffer or not self.clients:
+                continue
+            if self.new_sensors:
+                self._send_all(ws_codec.sensors_frame(self.new_sensors), control=True)
+                self.new_sensors = {}
+
+            samples = list(self.buffer)
+            self.buffer.clear()
+            received_at, self.received_at = self.received_at, None
+            frame = ws_codec.encode_batch(self.sub.encoding, self.sub.metrics,
+                                          samples, self.sensor_index)
+            self.hub.serializations += 1
+            self.hub.frames += 1
+            self._send_all(frame, received_at)
+
+
+class WSClient:
+    def __init__(self, ws, queue_size=None, policy=None):
+        self.ws = ws
+        self.policy = policy or Config.WS_OVERFLOW_POLICY
+        self.queue = asyncio.Queue(maxsize=int(queue_size or Config.WS_CLIENT_QUEUE_SIZE))
+        # 控制帧不计入队列上限、不会被丢弃，发送时优先于数据帧
+        self.control = deque()
+        self._ready = asyncio.Event()
+        self.task = None
+        self.channel = None
+        self.closing = False
+        self.slow = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+
+        remote = getattr(ws, "remote_address", None)
+        self.remote = f"{remote[0]}:{remote[1]}" if remote else "unknown"
+        self.connected_at = time.time()
+
+    def enqueue(self, frame, received_at=None, control=False):
+        """必须在事件循环线程中调用；从不阻塞"""
+        if self.closing:
+            return False
+
+        entry = (time.monotonic(), frame, received_at)
+        if control:
+            self.control.append(entry)
+            self._ready.set()
+            return True
+        try:
+            self.queue.put_nowait(entry)
+            self._ready.set()
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == "disconnect":
+            self.closing = True
+            self.slow = True
+            self.dropped += self.queue.qsize() + 1
+            # 1008: policy violation，客户端消费太慢
+            asyncio.ensure_future(self.ws.close(1008, "slow consumer"))
+            return False
+
+        self.queue.get_nowait()
+        self.dropped += 1
+        self.queue.put_nowait(entry)
+        return True
+
+    def _next(self):
+        if self.control:
+            return self.control.popleft()
+        if not self.queue.empty():
+            return self.queue.get_nowait()
+        return None
+
+    async def sender(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            enqueued_at, frame, received_at = entry
+            try:
+                await self.ws.send(frame)
+            except Exception:
+                # 连接已断开，由 ws_handler 负责注销
+                self.closing = True
+                return
+            if received_at is not None:
+                SEND_LATENCY.observe(time.time() - received_at)
+            lag = time.monotonic() - enqueued_at
+            self.lag_last = lag
+            self.lag_max = max(self.lag_max, lag)
+            self.sent += 1
+
+    def stats(self):
+        return {
+            "remote": self.remote,
+            "connected_at": self.connected_at,
+            "subscription": self.channel.sub.describe() if self.channel else None,
+            "queue_depth": self.queue.qsize() + len(self.control),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "lag_ms": {
+                "last": round(self.lag_last * 1000, 3),
+                "max": round(self.lag_max * 1000, 3)
+            }
+        }
+
+
+class WSHub:
+    def __init__(self, queue_size=None, policy=None):
+        self.queue_size = queue_size
+        self.policy = policy or Config.WS_OVERFLOW_POLICY
+        if self.policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"溢出策略必须是 {', '.join(OVERFLOW_POLICIES)} 之一")
+
+        self.clients = {}
+        self.channels = {}
+        # 注册/注销在事件循环中进行，统计接口在 Flask 线程中读取
+        self._lock = threading.Lock()
+        self.samples = 0
+        self.alerts = 0
+        self.frames = 0
+        self.serializations = 0
+        self.disconnected_slow = 0
+        # 已断开连接的累计发送/丢弃数
+        self.closed_sent = 0
+        self.closed_dropped = 0
+
+    def register(self, ws):
+        client = WSClient(ws, self.queue_size, self.policy)
+        client.task = asyncio.ensure_future(client.sender())
+        with self._lock:
+            self.clients[ws] = client
+        return client
+
+    def unregister(self, ws):
+        with self._lock:
+            client = self.clients.pop(ws, None)
+        if client is None:
+            return
+        self.closed_sent += client.sent
+        self.closed_dropped += client.dropped
+        if client.slow:
+            self.disconnected_slow += 1
+        self._leave_channel(client)
+        if client.task is not None:
+            client.task.cancel()
+
+    # ========================
+    # 订阅
+    # ========================
+    def _leave_channel(self, client):
+        channel = client.channel
+        if channel is None:
+            return
+        client.channel = None
+        channel.clients.discard(client)
+        if not channel.clients:
+            self.channels.pop(channel.sub.key(), None)
+            channel.task.cancel()
+
+    def subscribe(self, ws, subscription):
+        client = self.clients.get(ws)
+        if client is None:
+            return
+        self._leave_channel(client)
+
+        key = subscription.key()
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = Channel(subscription, self)
+            channel.task = asyncio.ensure_future(channel.run())
+            self.channels[key] = channel
+        client.channel = channel
+        channel.join(client)
+
+    def handle_message(self, ws, message):
+        """处理客户端发来的控制消息，回复通过该客户端的发送队列发出"""
+        def _reply(obj):
+            self.send_to(ws, json.dumps(obj, ensure_ascii=False))
+
+        try:
+            msg = json.loads(message)
+        except (TypeError, ValueError):
+            return _reply({"type": "error", "error": "invalid json"})
+        if not isinstance(msg, dict):
+            return _reply({"type": "error", "error": "invalid message"})
+
+        if msg.get("type") == "subscribe":
+            try:
+                subscription = Subscription.from_message(msg)
+            except ValueError as e:
+                return _reply({"type": "error", "error": str(e)})
+            _reply({"type": "subscribed", **subscription.describe()})
+            self.subscribe(ws, subscription)
+            return
+
+        if msg.get("type") == "unsubscribe":
+            client = self.clients.get(ws)
+            if client is not None:
+                self._leave_channel(client)
+            return _reply({"type": "unsubscribed"})
+
+    # ========================
+    # 广播
+    # ========================
+    def send_to(self, ws, frame):
+        """通过该客户端自己的发送队列发送（回复属于控制帧），保证每个连接只有一个写者"""
+        client = self.clients.get(ws)
+        if client is not None:
+            client.enqueue(frame, control=True)
+
+    def broadcast(self, frame):
+        """在事件循环线程中调用：把同一帧放入每个客户端的队列"""
+        self.frames += 1
+        for client in list(self.clients.values()):
+            client.enqueue(frame)
+
+    def publish(self, data, received_at=None):
+        """
+        在事件循环线程中调用：未订阅的客户端逐条收到完整数据，
+        已订阅的客户端由各自频道按帧率合并发送；received_at 为订阅端收到该数据的时间
+        """
+        self.samples += 1
+        legacy = [c for c in self.clients.values() if c.channel is None]
+        if legacy:
+            frame = json.dumps(data, ensure_ascii=False)
+            self.serializations += 1
+            self.frames += 1
+            for client in legacy:
+                client.enqueue(frame, received_at)
+
+        if self.channels:
+            sensor_id = sensor_of(data)
+            for channel in list(self.channels.values()):
+                channel.add(data, sensor_id, received_at)
+
+    def alert(self, event):
+        """
+        在事件循环线程中调用：告警不等帧率合并，作为控制帧立即发出，慢客户端也不会丢失告警；
+        未订阅的客户端收到全部告警，已订阅的只收到所订阅传感器和指标的告警
+        """
+        self.alerts += 1
+        frame = json.dumps(event, ensure_ascii=False)
+        self.serializations += 1
+
+        legacy = [c for c in self.clients.values() if c.channel is None]
+        if legacy:
+            self.frames += 1
+            for client in legacy:
+                client.enqueue(frame, control=True)
+
+        sensor_id = sensor_of(event)
+        for channel in list(self.channels.values()):
+            sub = channel.sub
+            if not sub.alerts or event.get("metric") not in sub.metrics:
+                continue
+            if sub.sensors is not None and sensor_id not in sub.sensors:
+                continue
+            self.frames += 1
+            channel._send_all(frame, control=True)
+
+    def stats(self):
+        with self._lock:
+            clients = list(self.clients.values())
+        per_client = [c.stats() for c in clients]
+        return {
+            "clients": len(per_client),
+            "policy": self.policy,
+            "encodings": ws_codec.available_encodings(),
+            "channels": len(self.channels),
+            "samples": self.samples,
+            "alerts": self.alerts,
+            "frames": self.frames,
+            "serializations": self.serializations,
+            "sent": self.closed_sent + sum(c["sent"] for c in per_client),
+            "dropped": self.closed_dropped + sum(c["dropped"] for c in per_client),
+            "disconnected_slow": self.disconnected_slow,
+            "max_lag_ms": max((c["lag_ms"]["max"] for c in per_client), default=0.0),
+            "per_client": per_client
+        }